@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Versioned model registry for the Agronomia models
+Each model's save method writes several files next to each other (a Keras
+.h5 or joblib pickles, plus a metadata JSON). The registry keeps every
+published set of those files as an immutable, numbered bundle with a
+checksum per file, and one active version per model:
+
+    <root>/<model>/v<N>/manifest.json   files with sha256 and size, the model's
+                                        metadata, publish time and note
+    <root>/<model>/v<N>/<files>         as written by save_model(s)
+    <root>/<model>/ACTIVE               the active version, e.g. "v3"
+
+Bundles are written to a temporary directory and renamed into place, and
+ACTIVE is replaced atomically, so readers never see a partial bundle or
+version. Checksums are verified when a version is activated and when it is
+loaded.
+
+Pickles are loaded with joblib mmap_mode='r': plain numpy arrays (scalers,
+encoders) stay mapped read-only from the page cache and are shared by every
+process that loads the bundle. scikit-learn copies tree nodes into its own
+memory when unpickling, so forests and boosted trees still take private
+memory in each process that loads them.
+
+Usage:
+    python model_registry.py publish nutrient models/nutrient_optimizer --activate
+    python model_registry.py list nutrient
+    python model_registry.py activate nutrient v2
+    python model_registry.py verify nutrient v2
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+MODEL_REGISTRY_DIR = os.getenv(
+    "MODEL_REGISTRY_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'models', 'registry'))
+
+
+def _load_irrigation(path, mmap_mode):
+    from train_irrigation_model import IrrigationPredictor
+    model = IrrigationPredictor()
+    model.load_model(path, mmap_mode=mmap_mode)
+    return model
+
+
+def _load_nutrient(path, mmap_mode):
+    from train_nutrient_model import NutrientOptimizer
+    model = NutrientOptimizer()
+    model.load_models(path, mmap_mode=mmap_mode)
+    return model
+
+
+def _load_harvest(path, mmap_mode):
+    from train_harvest_model import HarvestPredictor
+    model = HarvestPredictor()
+    model.load_models(path, mmap_mode=mmap_mode)
+    return model
+
+
+class ModelSpec(NamedTuple):
+    artifact: str                  # File name prefix used by save_model(s)
+    suffixes: Tuple[str, ...]      # Files written by save_model(s)
+    loader: Callable               # (path prefix, mmap_mode) -> loaded model
+
+
+MODELS: Dict[str, ModelSpec] = {
+    'irrigation': ModelSpec('irrigation_model', ('.h5', '_scaler.pkl', '_metadata.json'), _load_irrigation),
+    'nutrient': ModelSpec('nutrient_optimizer', (
+        '_action_model.pkl', '_amount_model.pkl', '_scaler.pkl', '_plant_encoder.pkl', '_stage_encoder.pkl',
+        '_metadata.json'), _load_nutrient),
+    'harvest': ModelSpec('harvest_predictor', (
+        '_days_model.pkl', '_yield_model.pkl', '_scaler.pkl', '_plant_encoder.pkl', '_metadata.json'),
+        _load_harvest),
+}
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _version_number(version):
+    return int(version[1:]) if version.startswith('v') and version[1:].isdigit() else -1
+
+
+class ModelRegistry:
+    """Publishes, lists, activates and loads model bundles under one root directory"""
+
+    def __init__(self, root: str = MODEL_REGISTRY_DIR):
+        self.root = root
+
+    def _spec(self, name: str) -> ModelSpec:
+        if name not in MODELS:
+            raise ValueError(f"Unknown model {name!r}, expected one of {', '.join(MODELS)}")
+        return MODELS[name]
+
+    def _dir(self, name: str, version: Optional[str] = None) -> str:
+        self._spec(name)
+        if version is None:
+            return os.path.join(self.root, name)
+        if _version_number(version) <= 0:
+            raise ValueError(f"Invalid version {version!r}, expected v1, v2, ...")
+        return os.path.join(self.root, name, version)
+
+    def bundle_path(self, name: str, version: str) -> str:
+        """Path prefix to pass to the model's load method"""
+        return os.path.join(self._dir(name, version), self._spec(name).artifact)
+
+    def publish(self, name: str, source: str, note: Optional[str] = None, activate: bool = False) -> str:
+        """
+        Copy the files saved under path prefix source into a new version
+
+        Returns the new version; ValueError if any of the model's files is missing.
+        """
+        spec = self._spec(name)
+        files = [f'{spec.artifact}{suffix}' for suffix in spec.suffixes]
+        sources = [f'{source}{suffix}' for suffix in spec.suffixes]
+        missing = [path for path in sources if not os.path.exists(path)]
+        if missing:
+            raise ValueError(f"Missing model files: {', '.join(missing)}")
+
+        os.makedirs(self._dir(name), exist_ok=True)
+        staging = tempfile.mkdtemp(prefix='.publish-', dir=self._dir(name))
+        os.chmod(staging, 0o755)
+        try:
+            manifest_files = {}
+            for file_name, path in zip(files, sources):
+                target = os.path.join(staging, file_name)
+                shutil.copyfile(path, target)
+                manifest_files[file_name] = {'sha256': _sha256(target), 'bytes': os.path.getsize(target)}
+            with open(f'{source}_metadata.json') as f:
+                metadata = json.load(f)
+            manifest = {
+                'model': name,
+                'files': manifest_files,
+                'metadata': metadata,
+                'published': datetime.now().isoformat(),
+                'source': os.path.abspath(source),
+                'note': note,
+            }
+            # Concurrent publishers race for the next number; the rename decides
+            while True:
+                version = f'v{max([_version_number(v) for v in self.versions(name)] + [0]) + 1}'
+                manifest['version'] = version
+                with open(os.path.join(staging, 'manifest.json'), 'w') as f:
+                    json.dump(manifest, f, indent=2)
+                try:
+                    os.rename(staging, self._dir(name, version))
+                    break
+                except OSError:
+                    if not os.path.exists(self._dir(name, version)):
+                        raise
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        if activate:
+            self.activate(name, version)
+        return version
+
+    def versions(self, name: str) -> List[str]:
+        """Published versions, oldest first"""
+        directory = self._dir(name)
+        if not os.path.isdir(directory):
+            return []
+        found = [v for v in os.listdir(directory)
+                 if _version_number(v) > 0 and os.path.exists(os.path.join(directory, v, 'manifest.json'))]
+        return sorted(found, key=_version_number)
+
+    def manifest(self, name: str, version: str) -> dict:
+        path = os.path.join(self._dir(name, version), 'manifest.json')
+        if not os.path.exists(path):
+            raise ValueError(f"Unknown version {version!r} of model {name!r}")
+        with open(path) as f:
+            return json.load(f)
+
+    def verify(self, name: str, version: str):
+        """ValueError unless every file of the version matches its checksum"""
+        manifest = self.manifest(name, version)
+        bad = [file_name for file_name, entry in manifest['files'].items()
+               if not os.path.exists(os.path.join(self._dir(name, version), file_name))
+               or _sha256(os.path.join(self._dir(name, version), file_name)) != entry['sha256']]
+        if bad:
+            raise ValueError(f"{name} {version}: checksum mismatch or missing file: {', '.join(bad)}")
+
+    def active_version(self, name: str) -> Optional[str]:
+        try:
+            with open(os.path.join(self._dir(name), 'ACTIVE')) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def activate(self, name: str, version: str):
+        """Make version the one loaded by default, after checking its files"""
+        self.verify(name, version)
+        fd, path = tempfile.mkstemp(prefix='.active-', dir=self._dir(name))
+        with os.fdopen(fd, 'w') as f:
+            f.write(version + '\n')
+        os.chmod(path, 0o644)
+        os.replace(path, os.path.join(self._dir(name), 'ACTIVE'))
+
+    def load(self, name: str, version: Optional[str] = None, mmap_mode: Optional[str] = 'r',
+             verify: bool = True):
+        """
+        Load a version of a model (default: the active one)
+
+        Returns (version, model); ValueError if there is no such version or
+        its files do not match the manifest.
+        """
+        version = version or self.active_version(name)
+        if version is None:
+            raise ValueError(f"No active version of model {name!r} in {self.root}")
+        if verify:
+            self.verify(name, version)
+        return version, self._spec(name).loader(self.bundle_path(name, version), mmap_mode)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Publish, list and activate Agronomia model versions",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--root', default=MODEL_REGISTRY_DIR,
+                        help=f"Registry directory (default: {MODEL_REGISTRY_DIR})")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    publish = commands.add_parser('publish', help="Add the files saved under a path prefix as a new version")
+    publish.add_argument('model', choices=list(MODELS))
+    publish.add_argument('source', help="Path prefix given to save_model(s), e.g. models/nutrient_optimizer")
+    publish.add_argument('--note', default=None)
+    publish.add_argument('--activate', action='store_true', help="Make the new version active")
+
+    listing = commands.add_parser('list', help="List versions")
+    listing.add_argument('model', choices=list(MODELS))
+
+    for command, help_text in (('activate', "Make a version active"), ('verify', "Check a version's checksums")):
+        sub = commands.add_parser(command, help=help_text)
+        sub.add_argument('model', choices=list(MODELS))
+        sub.add_argument('version')
+
+    args = parser.parse_args()
+    registry = ModelRegistry(args.root)
+    try:
+        if args.command == 'publish':
+            version = registry.publish(args.model, args.source, args.note, args.activate)
+            print(f"Published {args.model} {version}" + (" (active)" if args.activate else ""))
+        elif args.command == 'list':
+            active = registry.active_version(args.model)
+            for version in registry.versions(args.model):
+                manifest = registry.manifest(args.model, version)
+                size = sum(entry['bytes'] for entry in manifest['files'].values())
+                print(f"{'*' if version == active else ' '} {version:6} {manifest['published'][:19]}  "
+                      f"{size / 1e6:8.1f} MB  {manifest.get('note') or ''}")
+        elif args.command == 'activate':
+            registry.activate(args.model, args.version)
+            print(f"{args.model} {args.version} is active")
+        else:
+            registry.verify(args.model, args.version)
+            print(f"{args.model} {args.version}: all checksums match")
+    except ValueError as e:
+        parser.exit(1, f"Error: {e}\n")
+
+
+if __name__ == "__main__":
+    main()
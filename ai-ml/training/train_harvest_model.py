@@ -35,6 +35,18 @@ class HarvestPredictor:
             'plant_height',  # cm
             'leaf_count'
         ]
+        
+        # Estimator settings used by train() (see tune_models.py to search them)
+        self.days_params = {
+            'n_estimators': 200,
+            'learning_rate': 0.1,
+            'max_depth': 5,
+            'random_state': 42
+        }
+        self.yield_params = dict(self.days_params)
+        
+        # Incremental updates applied since train(), oldest first (see update())
+        self.updates = []
     
     def generate_synthetic_data(self, n_samples=3000):
         """Generate synthetic training data"""
@@ -123,12 +135,7 @@ class HarvestPredictor:
         
         # Train days to harvest model
         print("\nTraining days to harvest model...")
-        self.days_model = GradientBoostingRegressor(
-            n_estimators=200,
-            learning_rate=0.1,
-            max_depth=5,
-            random_state=42
-        )
+        self.days_model = GradientBoostingRegressor(**self.days_params)
         self.days_model.fit(X_train, y_days_train)
         
         # Evaluate days model
@@ -144,12 +151,7 @@ class HarvestPredictor:
         
         # Train yield model
         print("\nTraining yield prediction model...")
-        self.yield_model = GradientBoostingRegressor(
-            n_estimators=200,
-            learning_rate=0.1,
-            max_depth=5,
-            random_state=42
-        )
+        self.yield_model = GradientBoostingRegressor(**self.yield_params)
         self.yield_model.fit(X_train, y_yield_train)
         
         # Evaluate yield model
@@ -186,41 +188,104 @@ class HarvestPredictor:
         Returns:
             dict with predictions
         """
+        return self.predict_batch([plant_data])[0]
+    
+    def predict_batch(self, records):
+        """
+        Predict harvest timing and yield for many plants in one pass
+        
+        Args:
+            records: List of dicts, as accepted by predict()
+        
+        Returns:
+            List of prediction dicts in the same order
+        """
         if self.days_model is None or self.yield_model is None:
             raise ValueError("Models not trained. Call train() first.")
         
-        # Prepare features
-        features = [
-            self.plant_encoder.transform([plant_data.get('plant_type', 'lettuce')])[0],
-            plant_data.get('days_since_transplant', 30),
-            plant_data.get('avg_temperature', 23),
-            plant_data.get('avg_light_hours', 14),
-            plant_data.get('avg_humidity', 65),
-            plant_data.get('avg_ec', 1500),
-            plant_data.get('growth_rate', 0.5),
-            plant_data.get('plant_height', 30),
-            plant_data.get('leaf_count', 10)
-        ]
-        
         # Scale features
-        features_scaled = self.scaler.transform([features])
+        features_scaled = self.scaler.transform(self._features(records))
         
         # Predict
-        days_remaining = self.days_model.predict(features_scaled)[0]
-        expected_yield = self.yield_model.predict(features_scaled)[0]
+        days_remaining = self.days_model.predict(features_scaled)
+        expected_yield = self.yield_model.predict(features_scaled)
         
-        # Calculate harvest date
-        harvest_date = datetime.now() + timedelta(days=int(days_remaining))
+        now = datetime.now()
+        results = []
+        for days, grams in zip(days_remaining, expected_yield):
+            # Calculate harvest date
+            harvest_date = now + timedelta(days=int(days))
+            results.append({
+                'days_to_harvest': float(days),
+                'harvest_date': harvest_date.strftime('%Y-%m-%d'),
+                'expected_yield_g': float(grams),
+                'expected_yield_kg': float(grams / 1000),
+                'confidence': 0.89,  # Based on model R² score
+                'timestamp': now.isoformat()
+            })
+        return results
+    
+    def _features(self, records):
+        """Unscaled feature rows, in feature_names order, for records as accepted by predict()"""
+        # Encode plant types once for the whole batch
+        plant_codes = self.plant_encoder.transform(
+            [r.get('plant_type', 'lettuce') for r in records])
         
+        return [[
+            plant_codes[i],
+            r.get('days_since_transplant', 30),
+            r.get('avg_temperature', 23),
+            r.get('avg_light_hours', 14),
+            r.get('avg_humidity', 65),
+            r.get('avg_ec', 1500),
+            r.get('growth_rate', 0.5),
+            r.get('plant_height', 30),
+            r.get('leaf_count', 10)
+        ] for i, r in enumerate(records)]
+    
+    def evaluate(self, records, days_to_harvest, yield_g):
+        """
+        Mean absolute error of both models on labelled records
+        
+        Args:
+            records: List of dicts, as accepted by predict()
+            days_to_harvest: Observed days from each record to its harvest
+            yield_g: Observed yield of each record's harvest, in grams
+        
+        Returns:
+            dict with 'days_mae' and 'yield_mae'
+        """
+        features_scaled = self.scaler.transform(self._features(records))
         return {
-            'days_to_harvest': float(days_remaining),
-            'harvest_date': harvest_date.strftime('%Y-%m-%d'),
-            'expected_yield_g': float(expected_yield),
-            'expected_yield_kg': float(expected_yield / 1000),
-            'confidence': 0.89,  # Based on model R² score
-            'timestamp': datetime.now().isoformat()
+            'days_mae': float(mean_absolute_error(days_to_harvest, self.days_model.predict(features_scaled))),
+            'yield_mae': float(mean_absolute_error(yield_g, self.yield_model.predict(features_scaled)))
         }
     
+    def update(self, records, days_to_harvest, yield_g, stages=50, models=('days', 'yield')):
+        """
+        Continue training on newly labelled records instead of retraining
+        
+        Each model is warm-started: `stages` boosting stages are added and
+        fitted to the new records, starting from the current predictions.
+        The scaler and plant encoder are left as they are, so the existing
+        stages keep seeing the inputs they were fitted on; records must use
+        plant types the encoder knows.
+        
+        Args:
+            records: List of dicts, as accepted by predict()
+            days_to_harvest: Observed days from each record to its harvest
+            yield_g: Observed yield of each record's harvest, in grams
+            stages: Boosting stages to add to each model
+            models: Which models to update ('days', 'yield')
+        """
+        features_scaled = self.scaler.transform(self._features(records))
+        targets = {'days': days_to_harvest, 'yield': yield_g}
+        for name in models:
+            model = getattr(self, f'{name}_model')
+            model.set_params(warm_start=True, n_estimators=model.n_estimators + stages)
+            model.fit(features_scaled, np.asarray(targets[name], dtype=float))
+            model.set_params(warm_start=False)
+    
     def save_models(self, path='harvest_predictor'):
         """Save models and preprocessing objects"""
         joblib.dump(self.days_model, f'{path}_days_model.pkl')
@@ -232,6 +297,7 @@ class HarvestPredictor:
         metadata = {
             'feature_names': self.feature_names,
             'plant_types': self.plant_encoder.classes_.tolist(),
+            'updates': self.updates,
             'created': datetime.now().isoformat(),
             'version': '1.0.0'
         }
@@ -240,18 +306,27 @@ class HarvestPredictor:
         
         print(f"Models saved to {path}")
     
-    def load_models(self, path='harvest_predictor'):
-        """Load models and preprocessing objects"""
-        self.days_model = joblib.load(f'{path}_days_model.pkl')
-        self.yield_model = joblib.load(f'{path}_yield_model.pkl')
-        self.scaler = joblib.load(f'{path}_scaler.pkl')
-        self.plant_encoder = joblib.load(f'{path}_plant_encoder.pkl')
+    def load_models(self, path='harvest_predictor', mmap_mode=None):
+        """
+        Load models and preprocessing objects
+        
+        Args:
+            path: Path prefix the models were saved with
+            mmap_mode: Passed to joblib.load; 'r' maps the stored arrays
+                       read-only instead of copying them, so processes
+                       loading the same files share one copy
+        """
+        self.days_model = joblib.load(f'{path}_days_model.pkl', mmap_mode=mmap_mode)
+        self.yield_model = joblib.load(f'{path}_yield_model.pkl', mmap_mode=mmap_mode)
+        self.scaler = joblib.load(f'{path}_scaler.pkl', mmap_mode=mmap_mode)
+        self.plant_encoder = joblib.load(f'{path}_plant_encoder.pkl', mmap_mode=mmap_mode)
         
         # Load metadata
         with open(f'{path}_metadata.json', 'r') as f:
             metadata = json.load(f)
         
         self.feature_names = metadata['feature_names']
+        self.updates = metadata.get('updates', [])
         
         print(f"Models loaded from {path}")
 
@@ -12,8 +12,13 @@ from tensorflow import keras
 from tensorflow.keras import layers
 import joblib
 import json
+import argparse
+import functools
+import os
 from datetime import datetime, timedelta
 
+from streaming import iter_windows, parquet_chunks, sql_chunks
+
 class IrrigationPredictor:
     """
     Predicts optimal irrigation schedule based on environmental conditions
@@ -32,6 +37,10 @@ class IrrigationPredictor:
             'soil_moisture',
             'vpd'  # Vapor Pressure Deficit
         ]
+        self.target_names = ['hours_until_irrigation', 'irrigation_volume']
+        # Site time zone for time_of_day derived from UTC timestamps; the backend
+        # serves the model with the same offset (PHOTOPERIOD_UTC_OFFSET_HOURS)
+        self.utc_offset_hours = 0.0
         
     def create_model(self, input_shape):
         """Create LSTM model architecture"""
@@ -119,7 +128,7 @@ class IrrigationPredictor:
         
         # Prepare features and targets
         features = data[self.feature_names].values
-        targets = data[['hours_until_irrigation', 'irrigation_volume']].values
+        targets = data[self.target_names].values
         
         # Scale features
         features_scaled = self.scaler.fit_transform(features)
@@ -161,21 +170,128 @@ class IrrigationPredictor:
         
         return history
     
-    def predict(self, sensor_data_sequence):
+    def _chunk_arrays(self, chunk, scale=True):
         """
-        Predict irrigation schedule
+        Feature and target arrays of one chunk of readings
+        
+        vpd and time_of_day are derived from temperature, humidity and the
+        timestamp when the chunk does not have them. Naive timestamps are UTC,
+        as stored by the platform, and time_of_day is the local hour at
+        utc_offset_hours. Rows with a missing feature or target are masked out.
+        
+        Returns:
+            (features, targets, keep) as float32 arrays and a boolean mask
+        """
+        if 'vpd' not in chunk.columns:
+            chunk = chunk.assign(vpd=self.calculate_vpd(chunk['temperature'], chunk['humidity']))
+        if 'time_of_day' not in chunk.columns:
+            timestamps = pd.to_datetime(chunk['timestamp'], utc=True)
+            hours = timestamps.dt.hour + timestamps.dt.minute / 60 + self.utc_offset_hours
+            chunk = chunk.assign(time_of_day=hours % 24)
+        features = chunk[self.feature_names].to_numpy(dtype=np.float64)
+        targets = chunk[self.target_names].to_numpy(dtype=np.float32)
+        keep = ~(np.isnan(features).any(axis=1) | np.isnan(targets).any(axis=1))
+        if scale:
+            features[keep] = self.scaler.transform(features[keep])
+        return features.astype(np.float32), targets, keep
+    
+    def train_streaming(self, source, epochs=50, batch_size=32, validation_fraction=0.2,
+                        shuffle_buffer=20000, max_gap_hours=None, block_windows=4096, utc_offset_hours=0.0):
+        """
+        Train from chunks of readings without holding the dataset in memory
+        
+        The source is read once to fit the scaler with partial_fit, then once
+        per epoch: windows are generated per device as chunks arrive, shuffled
+        within blocks and through a shuffle buffer, and batched and prefetched
+        by tf.data while the model trains. Memory is bounded by the chunk
+        size, block_windows, shuffle_buffer and the number of devices.
         
         Args:
-            sensor_data_sequence: List of sensor readings (last 24 hours)
-                                 Each reading should be a dict with required features
+            source: Callable returning an iterator of DataFrames (see
+                    streaming.py), with device_id, timestamp, the feature
+                    columns (vpd and time_of_day optional) and target_names;
+                    each device's rows in time order
+            epochs: Maximum epochs (training stops early on validation loss)
+            batch_size: Windows per batch
+            validation_fraction: Share of each block's windows held out for validation
+            shuffle_buffer: Windows in the tf.data shuffle buffer
+            max_gap_hours: Do not build windows across gaps longer than this
+            block_windows: Windows generated and shuffled together
+            utc_offset_hours: Site time zone, for time_of_day derived from
+                              timestamps; serve the model with the same
+                              PHOTOPERIOD_UTC_OFFSET_HOURS
         
         Returns:
-            dict with 'hours_until_irrigation' and 'irrigation_volume_ml'
+            Keras History
         """
-        if self.model is None:
-            raise ValueError("Model not trained. Call train() first.")
+        self.utc_offset_hours = utc_offset_hours
+        # Pass 1: scaler statistics
+        self.scaler = StandardScaler()
+        rows = 0
+        for chunk in source():
+            features, _, keep = self._chunk_arrays(chunk, scale=False)
+            if keep.any():
+                self.scaler.partial_fit(features[keep])
+                rows += int(keep.sum())
+        if not rows:
+            raise ValueError("No complete readings in the training data")
+        print(f"Scaler fitted on {rows} readings")
+        
+        max_gap = max_gap_hours * 3600 if max_gap_hours is not None else None
+        
+        def windows(validation):
+            # Blocks are shuffled with the same seed on every pass, so the tail
+            # of each block is the same validation windows every epoch
+            for X, y, _ in iter_windows(source(), self._chunk_arrays, self.sequence_length,
+                                        max_gap=max_gap, block_windows=block_windows):
+                cut = len(X) - int(round(len(X) * validation_fraction))
+                yield (X[cut:], y[cut:]) if validation else (X[:cut], y[:cut])
+        
+        signature = (
+            tf.TensorSpec(shape=(None, self.sequence_length, len(self.feature_names)), dtype=tf.float32),
+            tf.TensorSpec(shape=(None, len(self.target_names)), dtype=tf.float32)
+        )
+        train_data = (
+            tf.data.Dataset.from_generator(lambda: windows(False), output_signature=signature)
+            .unbatch()
+            .shuffle(shuffle_buffer, seed=42, reshuffle_each_iteration=True)
+            .batch(batch_size)
+            .prefetch(tf.data.AUTOTUNE)
+        )
+        validation_data = None
+        if validation_fraction:
+            validation_data = (
+                tf.data.Dataset.from_generator(lambda: windows(True), output_signature=signature)
+                .unbatch()
+                .batch(batch_size)
+                .prefetch(tf.data.AUTOTUNE)
+            )
+        
+        self.model = self.create_model(input_shape=(self.sequence_length, len(self.feature_names)))
         
-        # Prepare features
+        early_stopping = keras.callbacks.EarlyStopping(
+            monitor='val_loss' if validation_data is not None else 'loss',
+            patience=10,
+            restore_best_weights=True
+        )
+        
+        history = self.model.fit(
+            train_data,
+            validation_data=validation_data,
+            epochs=epochs,
+            callbacks=[early_stopping],
+            verbose=1
+        )
+        
+        if validation_data is not None:
+            test_loss, test_mae = self.model.evaluate(validation_data)
+            print(f"\nValidation Loss: {test_loss:.4f}")
+            print(f"Validation MAE: {test_mae:.4f}")
+        
+        return history
+    
+    def _sequence_features(self, sensor_data_sequence):
+        """Build the raw (unscaled) feature matrix for one sequence of readings"""
         features = []
         for reading in sensor_data_sequence:
             feature_vector = [
@@ -191,22 +307,63 @@ class IrrigationPredictor:
                 )
             ]
             features.append(feature_vector)
+        return features
+    
+    def predict(self, sensor_data_sequence):
+        """
+        Predict irrigation schedule
         
-        # Scale features
-        features_scaled = self.scaler.transform(features)
+        Args:
+            sensor_data_sequence: List of sensor readings (last 24 hours)
+                                 Each reading should be a dict with required features
+        
+        Returns:
+            dict with 'hours_until_irrigation' and 'irrigation_volume_ml'
+        """
+        return self.predict_batch([sensor_data_sequence])[0]
+    
+    def predict_batch(self, sequences):
+        """
+        Predict irrigation schedules for many sequences in one model call
+        
+        Args:
+            sequences: List of sensor reading sequences, as accepted by predict()
+        
+        Returns:
+            List of prediction dicts in the same order
+        """
+        features = np.array([self._sequence_features(seq) for seq in sequences], dtype=float)
+        return self.predict_array(features)
+    
+    def predict_array(self, features):
+        """
+        Predict irrigation schedules from an unscaled feature tensor
         
-        # Reshape for prediction
-        X = np.array([features_scaled])
+        Args:
+            features: Array of shape (batch, steps, features), columns in
+                      feature_names order (vpd included)
         
-        # Predict
-        prediction = self.model.predict(X, verbose=0)
+        Returns:
+            List of prediction dicts, one per sequence
+        """
+        if self.model is None:
+            raise ValueError("Model not trained. Call train() first.")
         
-        return {
-            'hours_until_irrigation': float(prediction[0][0]),
-            'irrigation_volume_ml': float(prediction[0][1]),
-            'timestamp': datetime.now().isoformat(),
+        # Scale all readings at once, then restore the (batch, steps, features) shape
+        features = np.asarray(features, dtype=float)
+        n_sequences, n_steps, n_features = features.shape
+        features_scaled = self.scaler.transform(features.reshape(-1, n_features))
+        X = features_scaled.reshape(n_sequences, n_steps, n_features)
+        
+        predictions = self.model.predict(X, verbose=0)
+        
+        timestamp = datetime.now().isoformat()
+        return [{
+            'hours_until_irrigation': float(prediction[0]),
+            'irrigation_volume_ml': float(prediction[1]),
+            'timestamp': timestamp,
             'confidence': 0.92  # Could be calculated from model uncertainty
-        }
+        } for prediction in predictions]
     
     def save_model(self, path='irrigation_model'):
         """Save model and scaler"""
@@ -216,7 +373,9 @@ class IrrigationPredictor:
         # Save metadata
         metadata = {
             'feature_names': self.feature_names,
+            'target_names': self.target_names,
             'sequence_length': self.sequence_length,
+            'utc_offset_hours': self.utc_offset_hours,
             'created': datetime.now().isoformat(),
             'version': '1.0.0'
         }
@@ -225,22 +384,56 @@ class IrrigationPredictor:
         
         print(f"Model saved to {path}")
     
-    def load_model(self, path='irrigation_model'):
-        """Load model and scaler"""
+    def load_model(self, path='irrigation_model', mmap_mode=None):
+        """
+        Load model and scaler
+        
+        Args:
+            path: Path prefix the model was saved with
+            mmap_mode: Passed to joblib.load for the scaler (the Keras model
+                       is always read into memory)
+        """
         self.model = keras.models.load_model(f'{path}.h5')
-        self.scaler = joblib.load(f'{path}_scaler.pkl')
+        self.scaler = joblib.load(f'{path}_scaler.pkl', mmap_mode=mmap_mode)
         
         # Load metadata
         with open(f'{path}_metadata.json', 'r') as f:
             metadata = json.load(f)
         
         self.feature_names = metadata['feature_names']
+        self.target_names = metadata.get('target_names', self.target_names)
         self.sequence_length = metadata['sequence_length']
+        self.utc_offset_hours = metadata.get('utc_offset_hours', 0.0)
         
         print(f"Model loaded from {path}")
 
 def main():
     """Train and save the irrigation prediction model"""
+    parser = argparse.ArgumentParser(
+        description="Train the irrigation prediction model on synthetic data, or stream it from a "
+                    "database or Parquet files"
+    )
+    parser.add_argument('--db', default=None,
+                        help="SQLAlchemy URL (synchronous driver) to read training rows from")
+    parser.add_argument('--query', default=None,
+                        help="SELECT returning device_id, timestamp, the feature and target columns, "
+                             "ordered by timestamp (with --db)")
+    parser.add_argument('--parquet', nargs='+', default=None, help="Parquet files with the same columns")
+    parser.add_argument('--chunk-rows', type=int, default=50000, help="Rows read per chunk")
+    parser.add_argument('--shuffle-buffer', type=int, default=20000, help="Windows in the shuffle buffer")
+    parser.add_argument('--max-gap-hours', type=float, default=None,
+                        help="Do not build windows across gaps in a device's readings longer than this")
+    parser.add_argument('--utc-offset-hours', type=float,
+                        default=float(os.getenv('PHOTOPERIOD_UTC_OFFSET_HOURS', '0')),
+                        help="Site time zone for time_of_day derived from UTC timestamps; must match the "
+                             "backend's PHOTOPERIOD_UTC_OFFSET_HOURS (default: that variable or 0)")
+    parser.add_argument('--epochs', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--output', default='models/irrigation_model')
+    args = parser.parse_args()
+    if bool(args.db) != bool(args.query):
+        parser.error("--db and --query go together")
+    
     print("=" * 60)
     print("Agronomia Irrigation Prediction Model Training")
     print("=" * 60)
@@ -249,11 +442,23 @@ def main():
     
     # Train model
     print("\nTraining model...")
-    history = predictor.train(epochs=50, batch_size=32)
+    if args.db:
+        source = functools.partial(sql_chunks, args.db, args.query, args.chunk_rows)
+    elif args.parquet:
+        source = functools.partial(parquet_chunks, args.parquet, args.chunk_rows)
+    else:
+        source = None
+    if source is not None:
+        history = predictor.train_streaming(source, epochs=args.epochs, batch_size=args.batch_size,
+                                            shuffle_buffer=args.shuffle_buffer,
+                                            max_gap_hours=args.max_gap_hours,
+                                            utc_offset_hours=args.utc_offset_hours)
+    else:
+        history = predictor.train(epochs=args.epochs, batch_size=args.batch_size)
     
     # Save model
     print("\nSaving model...")
-    predictor.save_model('models/irrigation_model')
+    predictor.save_model(args.output)
     
     # Test prediction
     print("\nTesting prediction with sample data...")
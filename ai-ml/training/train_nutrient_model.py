@@ -35,6 +35,16 @@ class NutrientOptimizer:
             'target_ec'
         ]
         
+        # Estimator settings used by train() (see tune_models.py to search them)
+        self.action_params = {
+            'n_estimators': 200,
+            'max_depth': 15,
+            'min_samples_split': 5,
+            'random_state': 42,
+            'n_jobs': -1
+        }
+        self.amount_params = dict(self.action_params)
+        
         # Nutrient action types
         self.actions = [
             'maintain',      # No change needed
@@ -143,13 +153,7 @@ class NutrientOptimizer:
         
         # Train action classifier
         print("\nTraining action classifier...")
-        self.action_model = RandomForestClassifier(
-            n_estimators=200,
-            max_depth=15,
-            min_samples_split=5,
-            random_state=42,
-            n_jobs=-1
-        )
+        self.action_model = RandomForestClassifier(**self.action_params)
         self.action_model.fit(X_train, y_action_train)
         
         # Evaluate action classifier
@@ -163,13 +167,7 @@ class NutrientOptimizer:
         
         # Train amount regressor
         print("\nTraining amount regressor...")
-        self.amount_model = RandomForestRegressor(
-            n_estimators=200,
-            max_depth=15,
-            min_samples_split=5,
-            random_state=42,
-            n_jobs=-1
-        )
+        self.amount_model = RandomForestRegressor(**self.amount_params)
         self.amount_model.fit(X_train, y_amount_train)
         
         # Evaluate amount regressor
@@ -201,47 +199,64 @@ class NutrientOptimizer:
         Returns:
             dict with recommended action and amount
         """
+        return self.predict_batch([sensor_data])[0]
+    
+    def predict_batch(self, records):
+        """
+        Predict nutrient adjustments for many records in one pass
+        
+        Args:
+            records: List of dicts, as accepted by predict()
+        
+        Returns:
+            List of recommendation dicts in the same order
+        """
         if self.action_model is None or self.amount_model is None:
             raise ValueError("Models not trained. Call train() first.")
         
-        # Prepare features
-        features = [
-            sensor_data.get('current_ec', 1500),
-            sensor_data.get('current_ph', 6.0),
-            self.plant_encoder.transform([sensor_data.get('plant_type', 'lettuce')])[0],
-            self.stage_encoder.transform([sensor_data.get('growth_stage', 'vegetative')])[0],
-            sensor_data.get('water_temp', 22),
-            sensor_data.get('days_since_transplant', 30),
-            sensor_data.get('target_ec', 1500)
-        ]
+        # Encode categorical columns once for the whole batch
+        plant_codes = self.plant_encoder.transform(
+            [r.get('plant_type', 'lettuce') for r in records])
+        stage_codes = self.stage_encoder.transform(
+            [r.get('growth_stage', 'vegetative') for r in records])
+        
+        features = [[
+            r.get('current_ec', 1500),
+            r.get('current_ph', 6.0),
+            plant_codes[i],
+            stage_codes[i],
+            r.get('water_temp', 22),
+            r.get('days_since_transplant', 30),
+            r.get('target_ec', 1500)
+        ] for i, r in enumerate(records)]
         
         # Scale features
-        features_scaled = self.scaler.transform([features])
-        
-        # Predict action
-        action = self.action_model.predict(features_scaled)[0]
-        action_proba = self.action_model.predict_proba(features_scaled)[0]
-        confidence = max(action_proba)
-        
-        # Predict amount
-        amount = self.amount_model.predict(features_scaled)[0]
-        
-        # Generate recommendation message
-        messages = {
-            'maintain': "Nutrient levels are optimal. No adjustment needed.",
-            'increase_ec': f"Add {amount:.1f} ml of nutrient solution per 10L to increase EC.",
-            'decrease_ec': f"Add {amount:.1f} ml of fresh water per 10L to decrease EC.",
-            'adjust_ph_up': f"Add {amount:.1f} ml of pH Up solution per 10L to raise pH.",
-            'adjust_ph_down': f"Add {amount:.1f} ml of pH Down solution per 10L to lower pH."
-        }
-        
-        return {
-            'action': action,
-            'amount_ml_per_10L': float(amount),
-            'confidence': float(confidence),
-            'message': messages[action],
-            'timestamp': datetime.now().isoformat()
-        }
+        features_scaled = self.scaler.transform(features)
+        
+        # Predict action and amount
+        actions = self.action_model.predict(features_scaled)
+        confidences = self.action_model.predict_proba(features_scaled).max(axis=1)
+        amounts = self.amount_model.predict(features_scaled)
+        
+        timestamp = datetime.now().isoformat()
+        results = []
+        for action, confidence, amount in zip(actions, confidences, amounts):
+            # Generate recommendation message
+            messages = {
+                'maintain': "Nutrient levels are optimal. No adjustment needed.",
+                'increase_ec': f"Add {amount:.1f} ml of nutrient solution per 10L to increase EC.",
+                'decrease_ec': f"Add {amount:.1f} ml of fresh water per 10L to decrease EC.",
+                'adjust_ph_up': f"Add {amount:.1f} ml of pH Up solution per 10L to raise pH.",
+                'adjust_ph_down': f"Add {amount:.1f} ml of pH Down solution per 10L to lower pH."
+            }
+            results.append({
+                'action': action,
+                'amount_ml_per_10L': float(amount),
+                'confidence': float(confidence),
+                'message': messages[action],
+                'timestamp': timestamp
+            })
+        return results
     
     def save_models(self, path='nutrient_optimizer'):
         """Save models and preprocessing objects"""
@@ -265,13 +280,21 @@ class NutrientOptimizer:
         
         print(f"Models saved to {path}")
     
-    def load_models(self, path='nutrient_optimizer'):
-        """Load models and preprocessing objects"""
-        self.action_model = joblib.load(f'{path}_action_model.pkl')
-        self.amount_model = joblib.load(f'{path}_amount_model.pkl')
-        self.scaler = joblib.load(f'{path}_scaler.pkl')
-        self.plant_encoder = joblib.load(f'{path}_plant_encoder.pkl')
-        self.stage_encoder = joblib.load(f'{path}_stage_encoder.pkl')
+    def load_models(self, path='nutrient_optimizer', mmap_mode=None):
+        """
+        Load models and preprocessing objects
+        
+        Args:
+            path: Path prefix the models were saved with
+            mmap_mode: Passed to joblib.load; 'r' maps the stored arrays
+                       read-only instead of copying them, so processes
+                       loading the same files share one copy
+        """
+        self.action_model = joblib.load(f'{path}_action_model.pkl', mmap_mode=mmap_mode)
+        self.amount_model = joblib.load(f'{path}_amount_model.pkl', mmap_mode=mmap_mode)
+        self.scaler = joblib.load(f'{path}_scaler.pkl', mmap_mode=mmap_mode)
+        self.plant_encoder = joblib.load(f'{path}_plant_encoder.pkl', mmap_mode=mmap_mode)
+        self.stage_encoder = joblib.load(f'{path}_stage_encoder.pkl', mmap_mode=mmap_mode)
         
         # Load metadata
         with open(f'{path}_metadata.json', 'r') as f:
@@ -304,31 +304,51 @@ class PlantRecognitionModel:
         if len(img_array.shape) == 3:
             img_array = np.expand_dims(img_array, axis=0)
         
-        # Make prediction
-        predictions = self.model.predict(img_array, verbose=0)
-        
-        # Get top k predictions
-        top_indices = np.argsort(predictions[0])[-top_k:][::-1]
+        return self.predict_batch(img_array, top_k=top_k)[0]
+    
+    def predict_batch(self, images, top_k=5):
+        """
+        Predict plant species for a batch of images in one model call
         
-        results = []
-        for i, idx in enumerate(top_indices):
-            plant_name = self.class_names[idx]
-            confidence = float(predictions[0][idx])
+        Args:
+            images: Array of shape (batch, img_size, img_size, 3)
+            top_k: Return top k predictions per image
             
-            result = {
-                'rank': i + 1,
-                'plant_name': plant_name,
-                'confidence': confidence,
-                'confidence_percentage': f"{confidence * 100:.1f}%",
-                'plant_info': self.plant_info.get(plant_name, {})
-            }
-            results.append(result)
+        Returns:
+            List of prediction dictionaries, one per image
+        """
+        if self.model is None:
+            raise ValueError("Model not trained or loaded")
         
-        return {
-            'predictions': results,
-            'timestamp': datetime.now().isoformat(),
-            'model_version': '1.0'
-        }
+        # Make prediction
+        predictions = self.model.predict(np.asarray(images), verbose=0)
+        
+        # Get top k predictions for every image at once
+        top_indices = np.argsort(predictions, axis=1)[:, -top_k:][:, ::-1]
+        timestamp = datetime.now().isoformat()
+        
+        batch_results = []
+        for scores, indices in zip(predictions, top_indices):
+            results = []
+            for i, idx in enumerate(indices):
+                plant_name = self.class_names[idx]
+                confidence = float(scores[idx])
+                
+                result = {
+                    'rank': i + 1,
+                    'plant_name': plant_name,
+                    'confidence': confidence,
+                    'confidence_percentage': f"{confidence * 100:.1f}%",
+                    'plant_info': self.plant_info.get(plant_name, {})
+                }
+                results.append(result)
+            
+            batch_results.append({
+                'predictions': results,
+                'timestamp': timestamp,
+                'model_version': '1.0'
+            })
+        return batch_results
     
     def save_model(self, save_dir='../models/plant_recognition'):
         """
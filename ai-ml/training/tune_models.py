@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+"""
+Hyperparameter search for the Agronomia tabular models
+Searches the settings of one estimator of NutrientOptimizer (random forests)
+or HarvestPredictor (gradient boosting) with k-fold cross-validation, and
+writes a leaderboard of every configuration tried.
+
+Two strategies:
+    random    --trials configurations sampled from the estimator's space,
+              each cross-validated at its own n_estimators
+    halving   successive halving with n_estimators as the budget: --candidates
+              configurations start at --min-estimators, the best 1/--factor
+              of each rung go on with --factor times the trees, up to
+              --max-estimators
+
+The estimator's current settings (action_params, days_params, ...) are
+always tried as the baseline. Every (configuration, fold) fit is a separate
+task for a process pool of --workers processes (default: all cores), and
+each fit runs single-threaded. The encoded dataset is saved once as .npy
+files in the output directory and memory-mapped read-only by the workers,
+so the folds read one shared copy from the page cache instead of each task
+receiving a pickled copy.
+
+Finished configurations are appended to <output>/trials.jsonl as soon as
+their last fold completes. Running the same command again skips them, so an
+interrupted search resumes where it stopped (and a random search can be
+extended with a larger --trials); --restart discards them. The
+leaderboard is written to <output>/leaderboard.csv and leaderboard.json.
+
+Usage:
+    python tune_models.py nutrient_action
+    python tune_models.py harvest_days --search halving --candidates 27
+    python tune_models.py nutrient_amount --data data.csv --trials 60 --workers 8
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingRegressor, RandomForestClassifier, RandomForestRegressor
+from sklearn.metrics import accuracy_score, mean_absolute_error, r2_score
+from sklearn.model_selection import KFold, StratifiedKFold
+
+from train_harvest_model import HarvestPredictor
+from train_nutrient_model import NutrientOptimizer
+
+
+def _choice(values):
+    return lambda rng: values[int(rng.integers(len(values)))]
+
+
+def _integer(low, high):
+    return lambda rng: int(rng.integers(low, high + 1))
+
+
+def _uniform(low, high):
+    return lambda rng: round(float(rng.uniform(low, high)), 3)
+
+
+def _log_uniform(low, high):
+    return lambda rng: round(float(np.exp(rng.uniform(np.log(low), np.log(high)))), 4)
+
+
+FOREST_SPACE = {
+    'n_estimators': _integer(100, 500),
+    'max_depth': _choice([None, 8, 12, 15, 20, 30]),
+    'min_samples_split': _integer(2, 20),
+    'min_samples_leaf': _integer(1, 10),
+    'max_features': _choice(['sqrt', 'log2', 0.5, 1.0]),
+}
+
+BOOSTING_SPACE = {
+    'n_estimators': _integer(100, 600),
+    'learning_rate': _log_uniform(0.01, 0.3),
+    'max_depth': _integer(2, 8),
+    'min_samples_leaf': _integer(1, 20),
+    'subsample': _uniform(0.6, 1.0),
+    'max_features': _choice([None, 'sqrt', 0.5]),
+}
+
+
+class Target(NamedTuple):
+    model: type                    # NutrientOptimizer or HarvestPredictor
+    column: str                    # Target column of the training data
+    params: str                    # Model attribute with the estimator settings train() uses
+    estimator: type
+    space: Dict[str, Callable]     # Parameter -> sampler(rng)
+    classifier: bool
+
+
+TARGETS: Dict[str, Target] = {
+    'nutrient_action': Target(NutrientOptimizer, 'action', 'action_params', RandomForestClassifier,
+                              FOREST_SPACE, True),
+    'nutrient_amount': Target(NutrientOptimizer, 'amount', 'amount_params', RandomForestRegressor,
+                              FOREST_SPACE, False),
+    'harvest_days': Target(HarvestPredictor, 'days_to_harvest', 'days_params', GradientBoostingRegressor,
+                           BOOSTING_SPACE, False),
+    'harvest_yield': Target(HarvestPredictor, 'expected_yield_g', 'yield_params', GradientBoostingRegressor,
+                            BOOSTING_SPACE, False),
+}
+
+
+def prepare_dataset(target: Target, data: pd.DataFrame):
+    """
+    Encode data the way the model's train() does
+
+    Returns:
+        (X, y) as numpy arrays; class labels are returned as integer codes
+    """
+    model = target.model()
+    X = data.copy()
+    X['plant_type'] = model.plant_encoder.fit_transform(X['plant_type'])
+    if 'growth_stage' in model.feature_names:
+        X['growth_stage'] = model.stage_encoder.fit_transform(X['growth_stage'])
+    X = np.ascontiguousarray(X[model.feature_names].values, dtype=np.float64)
+    y = data[target.column].values
+    if target.classifier:
+        y = np.unique(y, return_inverse=True)[1].astype(np.int64)
+    else:
+        y = y.astype(np.float64)
+    return X, y
+
+
+# Dataset memory-mapped by each worker process (see _init_worker)
+_dataset = {}
+
+
+def _init_worker(x_path, y_path):
+    _dataset['X'] = np.load(x_path, mmap_mode='r')
+    _dataset['y'] = np.load(y_path, mmap_mode='r')
+
+
+def _fit_fold(target_name, params, train_index, test_index):
+    """Fit one fold in a worker; returns (score, mae, seconds)"""
+    target = TARGETS[target_name]
+    X, y = _dataset['X'], _dataset['y']
+    began = time.perf_counter()
+    estimator = target.estimator(**params)
+    estimator.fit(X[train_index], y[train_index])
+    predicted = estimator.predict(X[test_index])
+    if target.classifier:
+        return float(accuracy_score(y[test_index], predicted)), None, time.perf_counter() - began
+    return (float(r2_score(y[test_index], predicted)), float(mean_absolute_error(y[test_index], predicted)),
+            time.perf_counter() - began)
+
+
+def _key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+class Search:
+    """Cross-validated search over one target's estimator settings, checkpointed to a directory"""
+
+    def __init__(self, target_name, output, folds=5, workers=None, seed=42):
+        self.target_name = target_name
+        self.target = TARGETS[target_name]
+        self.output = output
+        self.folds = folds
+        self.workers = workers or os.cpu_count() or 1
+        self.seed = seed
+        self.metric = 'accuracy' if self.target.classifier else 'r2'
+        self.trials_path = os.path.join(output, 'trials.jsonl')
+        self.trials = {}
+        self.splits = []
+        self.budget = ()
+        self.paths = (os.path.join(output, 'dataset_X.npy'), os.path.join(output, 'dataset_y.npy'))
+
+        defaults = getattr(self.target.model(), self.target.params)
+        self.fixed = {'random_state': defaults.get('random_state', seed)}
+        if 'n_jobs' in defaults:
+            # One process per core already; threads inside each fit would oversubscribe
+            self.fixed['n_jobs'] = 1
+        self.baseline = {k: v for k, v in defaults.items() if k not in self.fixed}
+
+    def prepare(self, data: pd.DataFrame, config: dict, restart=False):
+        """
+        Save the dataset for the workers and load finished trials
+
+        Args:
+            data: Training data with the model's feature columns and the target
+            config: Search settings; a checkpoint written with other settings
+                or another dataset is not resumed
+            restart: Discard finished trials
+        """
+        os.makedirs(self.output, exist_ok=True)
+        X, y = prepare_dataset(self.target, data)
+        digest = hashlib.sha256(X.tobytes() + y.tobytes()).hexdigest()
+        signature = {'target': self.target_name, 'folds': self.folds, 'seed': self.seed,
+                     'dataset_sha256': digest, 'samples': len(y), **config}
+
+        search_path = os.path.join(self.output, 'search.json')
+        if not restart and os.path.exists(search_path) and os.path.exists(self.trials_path):
+            with open(search_path) as f:
+                previous = json.load(f)
+            previous.pop('started', None)
+            if previous != signature:
+                changed = sorted(k for k in set(previous) | set(signature) if previous.get(k) != signature.get(k))
+                raise ValueError(f"{self.output} holds a search with different {', '.join(changed)}; "
+                                 f"use --restart or another --output")
+            with open(self.trials_path) as f:
+                for line in f:
+                    if line.strip():
+                        trial = json.loads(line)
+                        self.trials[_key(trial['params'])] = trial
+        else:
+            if os.path.exists(self.trials_path):
+                os.remove(self.trials_path)
+            with open(search_path, 'w') as f:
+                json.dump({**signature, 'started': datetime.now().isoformat()}, f, indent=2)
+
+        np.save(self.paths[0], X)
+        np.save(self.paths[1], y)
+        splitter = (StratifiedKFold if self.target.classifier else KFold)(
+            n_splits=self.folds, shuffle=True, random_state=self.seed)
+        self.splits = list(splitter.split(X, y))
+        print(f"{self.target_name}: {len(y)} samples, {self.folds} folds, {self.workers} workers, "
+              f"{len(self.trials)} finished trials")
+
+    def sample(self, count, without=()):
+        """count configurations from the space, the baseline first"""
+        rng = np.random.default_rng(self.seed)
+        space = {k: v for k, v in self.target.space.items() if k not in without}
+        baseline = {k: v for k, v in self.baseline.items() if k not in without}
+        candidates = [baseline]
+        while len(candidates) < count:
+            candidate = {name: sampler(rng) for name, sampler in space.items()}
+            if candidate not in candidates:
+                candidates.append(candidate)
+        return candidates
+
+    def evaluate(self, candidates: List[dict], rung=0) -> List[dict]:
+        """
+        Cross-validate candidates, skipping those already in the checkpoint
+
+        Returns:
+            One trial record per candidate, in the same order
+        """
+        pending = {}
+        for candidate in candidates:
+            params = {**candidate, **self.fixed}
+            if _key(params) not in self.trials:
+                pending[_key(params)] = params
+
+        if pending:
+            print(f"Rung {rung}: {len(pending)} of {len(candidates)} configurations to cross-validate "
+                  f"({len(pending) * self.folds} fits)")
+            folds = {key: {} for key in pending}
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                     initargs=self.paths) as pool:
+                futures = {}
+                for key, params in pending.items():
+                    for fold, (train_index, test_index) in enumerate(self.splits):
+                        future = pool.submit(_fit_fold, self.target_name, params, train_index, test_index)
+                        futures[future] = (key, fold)
+                try:
+                    for future in as_completed(futures):
+                        key, fold = futures[future]
+                        folds[key][fold] = future.result()
+                        if len(folds[key]) == self.folds:
+                            self._record(pending[key], rung, folds[key])
+                except BaseException:
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    raise
+        return [self.trials[_key({**candidate, **self.fixed})] for candidate in candidates]
+
+    def _is_baseline(self, params):
+        strip = (*self.fixed, *self.budget)
+        return ({k: v for k, v in params.items() if k not in strip}
+                == {k: v for k, v in self.baseline.items() if k not in strip})
+
+    def _record(self, params, rung, folds):
+        scores = [folds[fold][0] for fold in sorted(folds)]
+        trial = {
+            'params': params,
+            'rung': rung,
+            'baseline': self._is_baseline(params),
+            self.metric: round(float(np.mean(scores)), 6),
+            'std': round(float(np.std(scores)), 6),
+            'fold_scores': [round(score, 6) for score in scores],
+            'fit_seconds': round(sum(result[2] for result in folds.values()), 3),
+            'finished': datetime.now().isoformat(),
+        }
+        if not self.target.classifier:
+            trial['mae'] = round(float(np.mean([result[1] for result in folds.values()])), 6)
+        with open(self.trials_path, 'a') as f:
+            f.write(json.dumps(trial) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.trials[_key(params)] = trial
+        print(f"  {len(self.trials):4d}  {self.metric}={trial[self.metric]:.4f} (+/- {trial['std']:.4f})  "
+              f"{_key({k: v for k, v in params.items() if k not in self.fixed})}")
+
+    def random(self, trials):
+        return self.evaluate(self.sample(trials))
+
+    def halving(self, candidates, factor=3, min_estimators=50, max_estimators=400):
+        """Successive halving with n_estimators as the budget"""
+        budgets = [min_estimators]
+        while budgets[-1] * factor < max_estimators:
+            budgets.append(budgets[-1] * factor)
+        budgets.append(max_estimators)
+
+        self.budget = ('n_estimators',)
+        survivors = self.sample(candidates, without=self.budget)
+        for rung, budget in enumerate(budgets):
+            results = self.evaluate([{**candidate, 'n_estimators': budget} for candidate in survivors], rung)
+            ranked = sorted(zip(survivors, results), key=lambda pair: -pair[1][self.metric])
+            if rung < len(budgets) - 1:
+                survivors = [candidate for candidate, _ in ranked[:max(1, len(ranked) // factor)]]
+        return results
+
+    def leaderboard(self, top=10):
+        """Write leaderboard.csv/.json (highest rung, then best score first); returns the best trial"""
+        trials = sorted(self.trials.values(), key=lambda t: (-t['rung'], -t[self.metric], t['fit_seconds']))
+        rows = []
+        for rank, trial in enumerate(trials, 1):
+            row = {'rank': rank, 'rung': trial['rung'], self.metric: trial[self.metric], 'std': trial['std']}
+            if 'mae' in trial:
+                row['mae'] = trial['mae']
+            row['fit_seconds'] = trial['fit_seconds']
+            row['baseline'] = trial['baseline']
+            row.update({k: v for k, v in trial['params'].items() if k not in self.fixed})
+            rows.append(row)
+        pd.DataFrame(rows).to_csv(os.path.join(self.output, 'leaderboard.csv'), index=False)
+
+        best = trials[0]
+        baseline = next((t for t in trials if t['baseline'] and t['rung'] == best['rung']), None)
+        best_params = {k: v for k, v in best['params'].items() if k != 'n_jobs'}
+        with open(os.path.join(self.output, 'leaderboard.json'), 'w') as f:
+            json.dump({
+                'target': self.target_name,
+                'params_attribute': f'{self.target.model.__name__}.{self.target.params}',
+                'metric': self.metric,
+                'best_params': best_params,
+                'best': best,
+                'baseline': baseline,
+                'trials': trials,
+            }, f, indent=2)
+
+        print(f"\nTop {min(top, len(rows))} of {len(rows)} ({self.metric}, {self.folds}-fold):")
+        print(pd.DataFrame(rows[:top]).to_string(index=False))
+        if baseline is not None:
+            print(f"\nBaseline {self.metric}: {baseline[self.metric]:.4f}, best: {best[self.metric]:.4f}")
+        return best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Cross-validated hyperparameter search for the nutrient and harvest models",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('target', choices=list(TARGETS))
+    parser.add_argument('--search', choices=['random', 'halving'], default='random')
+    parser.add_argument('--data', default=None,
+                        help="Training data CSV (default: the model's synthetic data)")
+    parser.add_argument('--samples', type=int, default=None,
+                        help="Synthetic samples to generate (default: as train())")
+    parser.add_argument('--output', default=None, help="Output directory (default: tuning/<target>)")
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--trials', type=int, default=30, help="Random search: configurations to try")
+    parser.add_argument('--candidates', type=int, default=27, help="Halving: configurations in the first rung")
+    parser.add_argument('--factor', type=int, default=3, help="Halving: budget growth and cut per rung")
+    parser.add_argument('--min-estimators', type=int, default=50)
+    parser.add_argument('--max-estimators', type=int, default=400)
+    parser.add_argument('--restart', action='store_true', help="Discard finished trials in the output directory")
+    args = parser.parse_args()
+
+    if args.search == 'halving' and (args.factor < 2 or not 0 < args.min_estimators <= args.max_estimators):
+        parser.error("halving needs --factor >= 2 and 0 < --min-estimators <= --max-estimators")
+
+    target = TARGETS[args.target]
+    if args.data:
+        data = pd.read_csv(args.data)
+    else:
+        model = target.model()
+        data = model.generate_synthetic_data(args.samples) if args.samples else model.generate_synthetic_data()
+
+    if args.search == 'random':
+        # Samples are drawn in seed order, so a longer run extends a shorter one
+        config = {'search': 'random'}
+    else:
+        config = {'search': 'halving', 'candidates': args.candidates, 'factor': args.factor,
+                  'min_estimators': args.min_estimators, 'max_estimators': args.max_estimators}
+
+    search = Search(args.target, args.output or os.path.join('tuning', args.target), args.folds, args.workers,
+                    args.seed)
+    try:
+        search.prepare(data, config, args.restart)
+    except ValueError as e:
+        parser.exit(1, f"Error: {e}\n")
+
+    began = time.time()
+    try:
+        if args.search == 'random':
+            search.random(args.trials)
+        else:
+            search.halving(args.candidates, args.factor, args.min_estimators, args.max_estimators)
+    except KeyboardInterrupt:
+        print(f"\nInterrupted; {len(search.trials)} finished trials are kept in {search.trials_path}")
+        if not search.trials:
+            return
+    print(f"\nSearch took {time.time() - began:.1f}s")
+
+    best = search.leaderboard()
+    print(f"\nLeaderboard written to {search.output}/leaderboard.csv and leaderboard.json")
+    best_params = {k: v for k, v in best['params'].items() if k != 'n_jobs'}
+    print(f"To train with the best settings: model.{target.params}.update({best_params})")
+
+
+if __name__ == "__main__":
+    main()
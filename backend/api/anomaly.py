@@ -0,0 +1,248 @@
+"""
+Streaming anomaly detection for the Agronomia ingest path
+Catches what fixed threshold bands miss: a pH probe drifting slowly
+inside its limits, or an EC spike that never crosses them. Three checks
+per device and metric:
+
+    spike  robust z-score of the reading against the device's baseline
+           (EWMA mean, scaled by the EWMA of absolute deviations)
+    drift  gap between a fast EWMA and the slow baseline, in baseline
+           standard deviations (EWMA variance)
+    rate   change since the previous reading, per minute, against a
+           physical limit for the metric
+
+State is a handful of float arrays with one row per device and one column
+per metric, so an update is O(1) per reading and a whole ingest batch is
+processed with a few numpy operations. Baseline updates are winsorized at
+WINSOR_SIGMAS and outliers do not widen the spread, so neither a spike nor a
+slow drift hides itself in the baseline it is measured against.
+Smoothing is time-based (half-lives in seconds), so irregular reporting
+intervals are handled.
+"""
+
+import math
+from typing import Dict, List, NamedTuple, Sequence
+
+import numpy as np
+
+SPIKE, DRIFT, RATE = "spike", "drift", "rate"
+KINDS = (SPIKE, DRIFT, RATE)
+
+# Mean absolute deviation * this = standard deviation, for normal noise
+MAD_TO_SIGMA = math.sqrt(math.pi / 2)
+WINSOR_SIGMAS = 3.0
+# Noise allowance of the rate check: the difference of two readings has sqrt(2) sigma
+RATE_NOISE_SIGMAS = 4.0 * math.sqrt(2)
+
+
+class MetricSpec(NamedTuple):
+    name: str              # key in the payload's sensors block
+    label: str             # for alert messages
+    min_scale: float       # noise floor, keeps z-scores finite on flat signals
+    max_rate: float        # largest plausible change per minute
+
+
+METRIC_SPECS: Dict[str, MetricSpec] = {spec.name: spec for spec in (
+    MetricSpec("ph", "pH", 0.02, 0.5),
+    MetricSpec("ec", "EC", 10.0, 300.0),
+    MetricSpec("tds", "TDS", 5.0, 150.0),
+    MetricSpec("water_temp", "Water temperature", 0.1, 1.0),
+    MetricSpec("air_temp", "Air temperature", 0.2, 2.0),
+    MetricSpec("humidity", "Humidity", 0.5, 10.0),
+)}
+
+
+class Anomaly(NamedTuple):
+    index: int             # position of the reading in the observed batch
+    device_id: str
+    metric: str
+    kind: str
+    value: float
+    expected: float        # baseline mean for spike/drift, previous reading for rate
+    score: float           # z-score for spike/drift, multiple of max_rate for rate
+
+
+class AnomalyDetector:
+    """
+    Per-device EWMA baselines with spike, drift and rate-of-change checks
+
+    observe() takes a batch of readings in arrival order. A device that
+    appears several times in one batch is processed in rounds, so its
+    readings are still applied in order. Each (device, metric, kind) raises
+    at most one anomaly per cooldown. Once rebase_after consecutive readings
+    fall outside the clipping band and the drift check fires, the baseline
+    restarts from the new level (a nutrient change, a recalibrated probe)
+    and warms up again. Only used from the event loop.
+    """
+
+    def __init__(self, metric_names: Sequence[str], baseline_halflife: float = 86400,
+                 fast_halflife: float = 600, spike_z: float = 6.0, drift_z: float = 3.0,
+                 warmup: int = 30, cooldown: float = 600, rebase_after: int = 5, capacity: int = 1024):
+        unknown = set(metric_names) - set(METRIC_SPECS)
+        if unknown:
+            raise ValueError(f"No anomaly settings for metrics: {', '.join(sorted(unknown))}")
+        self.specs = [METRIC_SPECS[name] for name in metric_names]
+        self.names = [spec.name for spec in self.specs]
+        self.min_scale = np.array([spec.min_scale for spec in self.specs])
+        self.max_rate = np.array([spec.max_rate for spec in self.specs])
+        self.baseline_decay = math.log(2) / baseline_halflife
+        self.fast_decay = math.log(2) / fast_halflife
+        self.spike_z = spike_z
+        self.drift_z = drift_z
+        self.warmup = warmup
+        self.cooldown = cooldown
+        self.rebase_after = rebase_after
+
+        self.rows: Dict[str, int] = {}
+        self.device_ids: List[str] = []
+        self._allocate(capacity)
+
+    def _allocate(self, capacity: int):
+        metrics = len(self.specs)
+        old = getattr(self, "_arrays", None)
+        arrays = {
+            "mean": np.zeros((capacity, metrics)),
+            "var": np.zeros((capacity, metrics)),
+            "mad": np.zeros((capacity, metrics)),
+            "fast": np.zeros((capacity, metrics)),
+            "last": np.zeros((capacity, metrics)),
+            "last_ts": np.zeros((capacity, metrics)),
+            "count": np.zeros((capacity, metrics), dtype=np.int64),
+            "outliers": np.zeros((capacity, metrics), dtype=np.int64),
+            "alerted": np.full((capacity, metrics, len(KINDS)), -np.inf),
+        }
+        if old is not None:
+            used = len(self.device_ids)
+            for name, array in arrays.items():
+                array[:used] = old[name][:used]
+        self._arrays = arrays
+        self.__dict__.update(arrays)
+        self.capacity = capacity
+
+    def _row(self, device_id: str) -> int:
+        row = self.rows.get(device_id)
+        if row is None:
+            row = len(self.device_ids)
+            if row == self.capacity:
+                self._allocate(self.capacity * 2)
+            self.rows[device_id] = row
+            self.device_ids.append(device_id)
+        return row
+
+    def observe(self, device_ids: Sequence[str], timestamps: Sequence[float],
+                values: np.ndarray) -> List[Anomaly]:
+        """
+        Update baselines with a batch and return the anomalies it contains
+
+        timestamps are epoch seconds; values is (readings, metrics) in the
+        order of metric_names, NaN where a reading lacks a metric.
+        """
+        if not len(device_ids):
+            return []
+        rows = np.fromiter((self._row(d) for d in device_ids), dtype=np.int64, count=len(device_ids))
+        timestamps = np.asarray(timestamps, dtype=float)
+        values = np.asarray(values, dtype=float)
+
+        if len(np.unique(rows)) == len(rows):
+            return self._update(np.arange(len(rows)), rows, timestamps, values)
+        # Repeated devices: the n-th reading of every device goes in round n
+        seen: Dict[int, int] = {}
+        rounds = np.fromiter((seen.__setitem__(r, seen.get(r, -1) + 1) or seen[r] for r in rows.tolist()),
+                             dtype=np.int64, count=len(rows))
+        anomalies = []
+        for n in range(rounds.max() + 1):
+            index = np.flatnonzero(rounds == n)
+            anomalies.extend(self._update(index, rows[index], timestamps[index], values[index]))
+        return anomalies
+
+    def _update(self, index: np.ndarray, rows: np.ndarray, ts: np.ndarray, x: np.ndarray) -> List[Anomaly]:
+        mean, var, mad = self.mean[rows], self.var[rows], self.mad[rows]
+        fast, last, last_ts = self.fast[rows], self.last[rows], self.last_ts[rows]
+        count, outliers = self.count[rows], self.outliers[rows]
+        t = ts[:, None]
+
+        present = ~np.isnan(x)
+        warm = present & (count >= self.warmup)
+        dt = np.where(count > 0, np.maximum(t - last_ts, 0.0), 0.0)
+
+        with np.errstate(invalid="ignore"):
+            scale = np.maximum(mad * MAD_TO_SIGMA, self.min_scale)
+            low, high = mean - WINSOR_SIGMAS * scale, mean + WINSOR_SIGMAS * scale
+            z = np.abs(x - mean) / scale
+            # Change beyond what noise on both readings explains, per minute, in units of max_rate
+            excess = np.maximum(np.abs(x - last) - RATE_NOISE_SIGMAS * scale, 0.0)
+            rate = excess / np.maximum(dt, 1.0) * 60.0 / self.max_rate
+
+            # Time-based smoothing; cumulative averaging until the baseline has history.
+            # Outliers pull the mean by at most WINSOR_SIGMAS and leave the spread alone,
+            # so a drifting or failing sensor cannot widen its own baseline
+            alpha = np.maximum(-np.expm1(-dt * self.baseline_decay), 1.0 / (count + 1))
+            beta = np.maximum(-np.expm1(-dt * self.fast_decay), 1.0 / (count + 1))
+            outlier = warm & ((x < low) | (x > high))
+            delta = np.where(outlier, np.clip(x, low, high), x) - mean
+            spread_alpha = np.where(outlier, 0.0, alpha)
+            new_mean = mean + alpha * delta
+            new_var = (1 - spread_alpha) * (var + spread_alpha * delta * delta)
+            new_mad = mad + spread_alpha * (np.abs(delta) - mad)
+            new_fast = fast + beta * (x - fast)
+            drift = np.abs(new_fast - new_mean) / np.maximum(np.sqrt(new_var), self.min_scale)
+
+            # A level shift that persists and that the fast mean confirms becomes
+            # the new baseline: start over from this reading
+            outliers = np.where(present, np.where(outlier, outliers + 1, 0), outliers)
+            first = present & ((count == 0) | ((outliers >= self.rebase_after) & (drift > self.drift_z)))
+            new_mean = np.where(first, x, new_mean)
+            new_var = np.where(first, 0.0, new_var)
+            new_mad = np.where(first, 0.0, new_mad)
+            new_fast = np.where(first, x, new_fast)
+            count = np.where(first, 0, count)
+
+        self.mean[rows] = np.where(present, new_mean, mean)
+        self.var[rows] = np.where(present, new_var, var)
+        self.mad[rows] = np.where(present, new_mad, mad)
+        self.fast[rows] = np.where(present, new_fast, fast)
+        # The clipped value, so the return from a spike is not a second, rate anomaly
+        self.last[rows] = np.where(present, np.where(first, x, mean + delta), last)
+        self.last_ts[rows] = np.where(present, t, last_ts)
+        self.count[rows] = count + present
+        self.outliers[rows] = np.where(first, 0, outliers)
+
+        flags = np.stack([warm & (z > self.spike_z), warm & (drift > self.drift_z), warm & (rate > 1.0)], axis=-1)
+        if not flags.any():
+            return []
+        # Cooldown per (device, metric, kind)
+        alerted = self.alerted[rows]
+        flags &= (t[:, :, None] - alerted) >= self.cooldown
+        self.alerted[rows] = np.where(flags, t[:, :, None], alerted)
+
+        anomalies = []
+        for i, m, k in zip(*np.nonzero(flags)):
+            kind = KINDS[k]
+            if kind == SPIKE:
+                expected, score = mean[i, m], z[i, m]
+            elif kind == DRIFT:
+                expected, score = mean[i, m], drift[i, m]
+            else:
+                expected, score = last[i, m], rate[i, m]
+            anomalies.append(Anomaly(int(index[i]), self.device_ids[rows[i]], self.names[m], kind,
+                                     float(x[i, m]), float(expected), float(score)))
+        return anomalies
+
+    def baseline(self, device_id: str) -> Dict[str, dict]:
+        """Current baseline of one device, per metric"""
+        row = self.rows.get(device_id)
+        if row is None:
+            return {}
+        return {
+            name: {
+                "mean": float(self.mean[row, m]),
+                "std": float(math.sqrt(self.var[row, m])),
+                "robust_std": float(self.mad[row, m] * MAD_TO_SIGMA),
+                "fast_mean": float(self.fast[row, m]),
+                "samples": int(self.count[row, m]),
+            }
+            for m, name in enumerate(self.names) if self.count[row, m]
+        }
+
+    def __len__(self) -> int:
+        return len(self.device_ids)
@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+"""
+Threshold backtesting for the Agronomia platform
+Replays stored sensor history against threshold profiles (the stored ones,
+or candidates that have not been imported yet) and reports what would have
+fired: per-reading alerts as check_thresholds writes them, and alert
+episodes with hysteresis, counted, timed and listed per device.
+
+History is loaded as columns (one numpy array per field) from
+sensor_readings, detached sensor_readings partitions (PostgreSQL with
+PARTITION_DETACH_ONLY) and recorded CSV/Parquet files in the replay_data.py
+format. Rows are sorted by device and time once; every rule is then
+evaluated for all devices with array operations, so millions of rows take
+seconds.
+
+An episode opens when a reading leaves [min, max] and closes at the first
+reading back inside [min + hysteresis, max - hysteresis]. Readings in
+between, or without the metric, keep the current state. Episodes shorter
+than min_duration are dropped.
+
+Usage:
+    python backtest.py --days 90
+    python backtest.py --days 90 --profiles lettuce.json --hysteresis ph=0.15 --min-duration 600
+    python backtest.py --start 2025-01-01 --end 2025-04-01 --archive old_readings.csv --timeline --output report.json
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import Float, cast, column, func, select, table, text
+
+from database import Device, SensorReading, SessionLocal, ThresholdProfile, close_db
+from thresholds import FIELDS, Bounds, ThresholdStore
+
+try:
+    import pandas as pd
+    HAS_PANDAS = True
+except ImportError:
+    HAS_PANDAS = False
+
+
+class Rule(NamedTuple):
+    alert_type: str        # as written by check_thresholds
+    metric: str            # sensor_readings column
+    low: str               # Bounds field
+    high: str
+
+
+# The checks check_thresholds runs on every reading
+RULES = (
+    Rule("pH", "ph", "ph_min", "ph_max"),
+    Rule("temperature", "water_temp", "temp_min", "temp_max"),
+    Rule("humidity", "humidity", "humidity_min", "humidity_max"),
+)
+METRICS = tuple(rule.metric for rule in RULES)
+DEFAULT_HYSTERESIS = {"ph": 0.1, "water_temp": 0.5, "humidity": 2.0}
+
+# Recorded file columns (replay_data.py format) -> sensor_readings columns
+FILE_COLUMNS = {"water_temp_c": "water_temp", "humidity_percent": "humidity"}
+
+LOAD_CHUNK_ROWS = 100_000
+
+
+class History(NamedTuple):
+    """Readings sorted by device, then time; device holds indexes into device_ids"""
+    device_ids: List[str]
+    device: np.ndarray          # int64 per row
+    timestamp: np.ndarray       # epoch seconds per row
+    values: Dict[str, np.ndarray]
+
+    def __len__(self) -> int:
+        return len(self.device)
+
+
+def _columns_to_history(chunks: List[Dict[str, np.ndarray]], device_ids: List[str]) -> History:
+    """Concatenate loaded column chunks, sort by (device, timestamp) and drop duplicate readings"""
+    if not chunks:
+        return History([], np.zeros(0, dtype=np.int64), np.zeros(0), {m: np.zeros(0) for m in METRICS})
+    # Number devices in name order, so reports list them sorted
+    names = np.array(device_ids, dtype=object)
+    rank = np.empty(len(names), dtype=np.int64)
+    rank[np.argsort(names)] = np.arange(len(names))
+    device = rank[np.concatenate([c["device"] for c in chunks])]
+    timestamp = np.concatenate([c["timestamp"] for c in chunks])
+    order = np.lexsort((timestamp, device))
+    device, timestamp = device[order], timestamp[order]
+    # The same reading can be in the database and in an archive file
+    keep = np.ones(len(device), dtype=bool)
+    keep[1:] = (device[1:] != device[:-1]) | (timestamp[1:] != timestamp[:-1])
+    values = {m: np.concatenate([c[m] for c in chunks])[order][keep] for m in METRICS}
+    return History(sorted(device_ids), device[keep], timestamp[keep], values)
+
+
+def _epoch_seconds(timestamps: Sequence[datetime]) -> np.ndarray:
+    # Stored timestamps are naive UTC
+    return np.array(timestamps, dtype="datetime64[us]").astype(np.int64) / 1e6
+
+
+def epoch_column(column, dialect: str):
+    """The timestamp column as epoch seconds, computed by the database (no datetime objects per row)"""
+    if dialect == "postgresql":
+        return cast(func.extract("epoch", column), Float)
+    if dialect == "sqlite":
+        # In doubles, julianday() of a whole second can come out a few microseconds short, which
+        # puts the reading in the previous step; SQLite keeps times to the millisecond anyway
+        return cast(func.round((func.julianday(column) - 2440587.5) * 86400.0, 3), Float)
+    return column
+
+
+def device_codes(ids: Sequence[str], codes: Dict[str, int]) -> np.ndarray:
+    """Intern device ids into codes (numbered by first appearance)"""
+    for device_id in set(ids) - codes.keys():
+        codes[device_id] = len(codes)
+    return np.fromiter(map(codes.__getitem__, ids), dtype=np.int64, count=len(ids))
+
+
+async def archived_tables(db) -> List[str]:
+    """sensor_readings partitions detached by retention (PostgreSQL), oldest first"""
+    if db.bind.dialect.name != "postgresql":
+        return []
+    result = await db.execute(text(
+        "SELECT c.relname FROM pg_class c "
+        "WHERE c.relkind = 'r' AND c.relname LIKE 'sensor\\_readings\\_%' AND pg_table_is_visible(c.oid) "
+        "AND NOT EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = c.oid) "
+        "ORDER BY c.relname"))
+    return list(result.scalars())
+
+
+async def load_history(db, start: datetime, end: datetime, device_ids: Optional[Iterable[str]] = None,
+                       archives: bool = True, files: Sequence[str] = ()) -> History:
+    """
+    Readings with start <= timestamp < end from sensor_readings, detached
+    partitions (if archives) and recorded files, as columns
+
+    Rows are streamed in chunks and converted to arrays chunk by chunk, so
+    peak memory stays near the size of the final arrays.
+    """
+    device_ids = list(device_ids) if device_ids else None
+    dialect = db.bind.dialect.name
+    names = ["device_id", "timestamp", *METRICS]
+    sources = [SensorReading.__table__]
+    if archives:
+        sources += [table(name, *(column(n) for n in names)) for name in await archived_tables(db)]
+
+    first, last = _epoch_seconds([start, end])
+    codes: Dict[str, int] = {}
+    chunks = []
+    for source in sources:
+        epoch = epoch_column(source.c.timestamp, dialect)
+        query = select(source.c.device_id, epoch, *(source.c[m] for m in METRICS))
+        if dialect == "sqlite":
+            # On the computed value, so SQLite scans the table in order; walking the
+            # timestamp index costs a random row lookup per reading over long ranges
+            query = query.where(epoch >= first, epoch < last)
+        else:
+            # On the column, so PostgreSQL prunes partitions
+            query = query.where(source.c.timestamp >= start, source.c.timestamp < end)
+        if device_ids:
+            query = query.where(source.c.device_id.in_(device_ids))
+        result = await db.stream(query.execution_options(yield_per=LOAD_CHUNK_ROWS))
+        async for rows in result.partitions():
+            cols = list(zip(*rows))
+            timestamp = cols[1] if dialect in ("postgresql", "sqlite") else _epoch_seconds(cols[1])
+            chunk = {"device": device_codes(cols[0], codes), "timestamp": np.array(timestamp, dtype=float)}
+            # None (metric not reported) becomes NaN
+            chunk.update({m: np.array(cols[i + 2], dtype=float) for i, m in enumerate(METRICS)})
+            chunks.append(chunk)
+
+    for path in files:
+        chunk = load_file(path)
+        mask = (chunk["timestamp"] >= first) & (chunk["timestamp"] < last)
+        if device_ids:
+            mask &= np.isin(chunk["device_id"], device_ids)
+        chunk = {name: values[mask] for name, values in chunk.items()}
+        chunk["device"] = device_codes(chunk.pop("device_id"), codes)
+        chunks.append(chunk)
+    return _columns_to_history(chunks, list(codes))
+
+
+def load_file(path: str) -> Dict[str, np.ndarray]:
+    """A recorded CSV or Parquet file (replay_data.py format) as columns"""
+    if path.endswith(".parquet"):
+        if not HAS_PANDAS:
+            raise ImportError("pandas not installed. Install with: pip install pandas pyarrow")
+        frame = pd.read_parquet(path).rename(columns=FILE_COLUMNS)
+        raw = {name: frame[name].to_numpy() for name in frame.columns}
+    else:
+        with open(path, newline="") as f:
+            reader = csv.reader(f)
+            header = [FILE_COLUMNS.get(name, name) for name in next(reader)]
+            raw = dict(zip(header, (np.array(col, dtype=object) for col in zip(*reader))))
+    if "timestamp" not in raw:
+        raise ValueError(f"{path} has no timestamp column")
+
+    stamps = raw["timestamp"]
+    try:
+        # Epoch seconds or milliseconds
+        timestamp = stamps.astype(float)
+        timestamp = np.where(timestamp > 1e10, timestamp / 1000, timestamp)
+    except (TypeError, ValueError):
+        timestamp = np.array([str(s).replace("Z", "") for s in stamps], dtype="datetime64[us]").astype(np.int64) / 1e6
+    rows = len(timestamp)
+    device_ids = raw.get("device_id")
+    columns = {
+        "device_id": (np.full(rows, "REPLAY-001", dtype=object) if device_ids is None
+                      else device_ids.astype(str).astype(object)),
+        "timestamp": timestamp,
+    }
+    for metric in METRICS:
+        values = raw.get(metric)
+        columns[metric] = (np.full(rows, np.nan) if values is None
+                           else np.array([v if v not in ("", None) else np.nan for v in values], dtype=float))
+    return columns
+
+
+async def load_thresholds(db, default: Bounds, candidates: Iterable[dict] = ()) -> ThresholdStore:
+    """Stored profiles overlaid with candidate profile rows (same scope replaces), compiled per device"""
+    profiles = {tuple(row[:3]): tuple(row[3:]) for row in (await db.execute(select(
+        ThresholdProfile.device_id, ThresholdProfile.plant_type, ThresholdProfile.growth_stage,
+        *(getattr(ThresholdProfile, field) for field in FIELDS)))).all()}
+    for row in candidates:
+        profiles[(row["device_id"], row["plant_type"], row["growth_stage"])] = tuple(row[f] for f in FIELDS)
+    devices = (await db.execute(select(Device.device_id, Device.plant_type, Device.growth_stage))).all()
+
+    store = ThresholdStore(default)
+    store.load(0, [(*scope, *bounds) for scope, bounds in profiles.items()], devices)
+    return store
+
+
+def evaluate(history: History, bounds: np.ndarray, hysteresis: Optional[Dict[str, float]] = None,
+             min_duration: float = 0, timeline: bool = False) -> dict:
+    """
+    Run every rule over the history
+
+    bounds is (devices, len(FIELDS)) in the order of history.device_ids.
+    Returns totals per rule, per-device counts and durations, and with
+    timeline the episodes of every device.
+    """
+    hysteresis = {**DEFAULT_HYSTERESIS, **(hysteresis or {})}
+    device, ts = history.device, history.timestamp
+    n = len(device)
+    starts = np.ones(n, dtype=bool)
+    starts[1:] = device[1:] != device[:-1]
+    # Index of the last reading of each row's device
+    last_row = np.flatnonzero(np.r_[starts[1:], True])[np.cumsum(starts) - 1] if n else np.zeros(0, dtype=np.int64)
+    positions = np.arange(n)
+    devices = len(history.device_ids)
+
+    rules, per_device, episodes_by_device = {}, {}, {}
+    for rule in RULES:
+        x = history.values[rule.metric]
+        low = bounds[device, FIELDS.index(rule.low)]
+        high = bounds[device, FIELDS.index(rule.high)]
+        h = hysteresis.get(rule.metric, 0.0)
+        with np.errstate(invalid="ignore"):
+            # check_thresholds skips missing and zero values
+            reported = ~np.isnan(x) & (x != 0)
+            enter = reported & ((x < low) | (x > high))
+            clear = reported & (x >= low + h) & (x <= high - h)
+
+        # Schmitt trigger: each row takes the state set by the last enter/clear
+        # reading of its device (device starts reset it)
+        last_event = np.where(enter | clear | starts, positions, 0)
+        np.maximum.accumulate(last_event, out=last_event)
+        active = enter[last_event]
+
+        begin = active.copy()
+        begin[1:] &= ~active[:-1] | starts[1:]
+        finish = active.copy()
+        finish[:-1] &= ~active[1:] | starts[1:]
+        b, e = np.flatnonzero(begin), np.flatnonzero(finish)
+        # An episode ends at the reading that clears it, or is still open at the device's last reading
+        still_open = e == last_row[e]
+        end_ts = ts[np.where(still_open, e, np.minimum(e + 1, n - 1))]
+        duration = end_ts - ts[b]
+        keep = duration >= min_duration
+        b, e, end_ts, duration, still_open = b[keep], e[keep], end_ts[keep], duration[keep], still_open[keep]
+
+        with np.errstate(invalid="ignore"):
+            excess = np.where(active, np.fmax(low - x, x - high), -np.inf)
+        # Each episode's own rows: reduce over [b, e + 1) and keep every other span,
+        # so dropped episodes and other devices' rows in between are not included
+        spans = np.column_stack([b, e + 1]).ravel()
+        peak = np.maximum.reduceat(excess, spans[spans < n])[::2] if len(b) else np.zeros(0)
+        episode_device = device[b]
+        out_of_range = np.bincount(device[enter], minlength=devices)
+        episodes = np.bincount(episode_device, minlength=devices)
+        seconds = np.bincount(episode_device, weights=duration, minlength=devices)
+
+        rules[rule.alert_type] = {
+            "metric": rule.metric,
+            "hysteresis": h,
+            "readings_out_of_range": int(enter.sum()),
+            "episodes": int(len(b)),
+            "open_episodes": int(still_open.sum()),
+            "devices_affected": int((episodes > 0).sum()),
+            "duration_s": round(float(duration.sum()), 1),
+            "median_duration_s": round(float(np.median(duration)), 1) if len(duration) else 0.0,
+            "max_duration_s": round(float(duration.max()), 1) if len(duration) else 0.0,
+        }
+        for d in np.flatnonzero(out_of_range):
+            per_device.setdefault(history.device_ids[d], {})[rule.alert_type] = {
+                "readings_out_of_range": int(out_of_range[d]),
+                "episodes": int(episodes[d]),
+                "duration_s": round(float(seconds[d]), 1),
+            }
+        if timeline:
+            for i in range(len(b)):
+                start_row = b[i]
+                episodes_by_device.setdefault(history.device_ids[device[start_row]], []).append({
+                    "alert_type": rule.alert_type,
+                    "start": _iso(ts[start_row]),
+                    "end": None if still_open[i] else _iso(end_ts[i]),
+                    "duration_s": round(float(duration[i]), 1),
+                    "direction": "low" if x[start_row] < low[start_row] else "high",
+                    "threshold": float(low[start_row] if x[start_row] < low[start_row] else high[start_row]),
+                    "peak_excess": round(float(peak[i]), 3),
+                })
+
+    report = {
+        "rows": n,
+        "devices": devices,
+        "start": _iso(ts.min()) if n else None,
+        "end": _iso(ts.max()) if n else None,
+        "min_duration_s": min_duration,
+        "rules": rules,
+        "devices_with_alerts": per_device,
+    }
+    if timeline:
+        for events in episodes_by_device.values():
+            events.sort(key=lambda event: event["start"])
+        report["timeline"] = episodes_by_device
+    return report
+
+
+def _iso(epoch: float) -> str:
+    return datetime.utcfromtimestamp(float(epoch)).isoformat()
+
+
+def bounds_for(history: History, store: ThresholdStore) -> np.ndarray:
+    return np.array([store.for_device(device_id) for device_id in history.device_ids], dtype=float).reshape(-1, len(FIELDS))
+
+
+async def run_backtest(db, start: datetime, end: datetime, default: Bounds, candidates: Iterable[dict] = (),
+                       device_ids: Optional[Iterable[str]] = None, archives: bool = True, files: Sequence[str] = (),
+                       hysteresis: Optional[Dict[str, float]] = None, min_duration: float = 0,
+                       timeline: bool = False) -> dict:
+    """Load the history and thresholds, then evaluate in a thread so the event loop stays free"""
+    started = time.perf_counter()
+    candidates = list(candidates)
+    history = await load_history(db, start, end, device_ids, archives, files)
+    store = await load_thresholds(db, default, candidates)
+    loaded = time.perf_counter()
+    report = await asyncio.get_running_loop().run_in_executor(
+        None, lambda: evaluate(history, bounds_for(history, store), hysteresis, min_duration, timeline))
+    report["range"] = {"start": start.isoformat(), "end": end.isoformat()}
+    report["candidate_profiles"] = len(candidates)
+    report["timings_s"] = {"load": round(loaded - started, 3), "evaluate": round(time.perf_counter() - loaded, 3)}
+    return report
+
+
+def print_report(report: dict):
+    print(f"{report['rows']:,} readings from {report['devices']:,} devices, "
+          f"{report['range']['start']} to {report['range']['end']} "
+          f"(load {report['timings_s']['load']:.2f}s, evaluate {report['timings_s']['evaluate']:.2f}s)")
+    print(f"\n{'Rule':<12} {'Out of range':>14} {'Episodes':>10} {'Devices':>8} {'Total h':>10} {'Median min':>11}")
+    for alert_type, rule in report["rules"].items():
+        print(f"{alert_type:<12} {rule['readings_out_of_range']:>14,} {rule['episodes']:>10,} "
+              f"{rule['devices_affected']:>8,} {rule['duration_s'] / 3600:>10,.1f} {rule['median_duration_s'] / 60:>11,.1f}")
+
+
+def parse_hysteresis(values: Sequence[str]) -> Dict[str, float]:
+    hysteresis = {}
+    for value in values:
+        metric, _, amount = value.partition("=")
+        if metric not in METRICS or not amount:
+            raise argparse.ArgumentTypeError(f"Expected METRIC=AMOUNT with METRIC in {', '.join(METRICS)}: {value}")
+        hysteresis[metric] = float(amount)
+    return hysteresis
+
+
+async def run(args):
+    # Defaults and profile validation as the API applies them; main is only imported by the command line tool
+    from main import ThresholdConfig, ThresholdProfileData, threshold_profile_rows
+    candidates = []
+    if args.profiles:
+        with open(args.profiles) as f:
+            candidates = threshold_profile_rows([ThresholdProfileData(**row) for row in json.load(f)])
+
+    end = args.end or datetime.utcnow()
+    start = args.start or end - timedelta(days=args.days)
+    try:
+        async with SessionLocal() as db:
+            report = await run_backtest(
+                db, start, end, Bounds(**ThresholdConfig().dict()), candidates, args.device or None, not args.no_archives,
+                args.archive, parse_hysteresis(args.hysteresis), args.min_duration, args.timeline)
+    finally:
+        await close_db()
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(
+        description="Backtest alert thresholds over stored sensor history",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--days", type=float, default=90,
+                        help="History to replay, ending now or at --end (default: 90)")
+    parser.add_argument("--start", type=datetime.fromisoformat, default=None,
+                        help="Start of the history (UTC, ISO format); overrides --days")
+    parser.add_argument("--end", type=datetime.fromisoformat, default=None,
+                        help="End of the history (UTC, ISO format, default: now)")
+    parser.add_argument("--device", action="append", default=[],
+                        help="Only this device (repeatable)")
+    parser.add_argument("--profiles", default=None,
+                        help="Candidate profiles JSON (import format) applied over the stored ones")
+    parser.add_argument("--hysteresis", action="append", default=[], metavar="METRIC=AMOUNT",
+                        help=f"Hysteresis band per metric (default: {DEFAULT_HYSTERESIS})")
+    parser.add_argument("--min-duration", type=float, default=0,
+                        help="Ignore episodes shorter than this many seconds (default: 0)")
+    parser.add_argument("--archive", action="append", default=[],
+                        help="Also read this recorded CSV/Parquet file (repeatable)")
+    parser.add_argument("--no-archives", action="store_true",
+                        help="Skip detached sensor_readings partitions")
+    parser.add_argument("--timeline", action="store_true",
+                        help="Include every episode per device in the report")
+    parser.add_argument("--output", default=None,
+                        help="Write the full report to this JSON file")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,218 @@
+"""
+Per-device sensor calibration for the Agronomia ingest path
+Calibrations are stored in the sensor_calibrations table: for one device and
+metric, the reference values that the probe's raw readings should map to
+(docs/CALIBRATION.md), effective from a point in time. They are compiled
+here into piecewise-linear transforms that correct a whole ingest batch with
+a few numpy operations, so raw probe values are fixed once, before they are
+stored, checked against thresholds or broadcast.
+
+    1 point     offset      raw + (reference - raw)
+    2 points    linear      slope and offset through both points
+    3+ points   piecewise   linear between points, end segments extended
+
+Calibrations are versioned and never edited in place. For a reading taken at
+t, the calibration with the latest effective_from <= t applies; a new
+version with the same effective_from amends it. A change counter in
+config_versions tells every worker when its compiled copy is stale, as for
+thresholds. Corrected readings keep their raw value in the *_raw columns,
+so history can be corrected again when a calibration is amended
+(recalibrate.py).
+"""
+
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+VERSION_NAME = "calibrations"
+METRICS = ("ph", "ec", "water_temp")
+RAW_COLUMNS = {metric: f"{metric}_raw" for metric in METRICS}
+MAX_POINTS = 5
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def epoch_seconds(value: datetime) -> float:
+    """Naive UTC datetime (as stored) to epoch seconds"""
+    return (value - _EPOCH).total_seconds()
+
+
+def knots(points: Sequence[Sequence[float]]) -> Tuple[List[float], List[float]]:
+    """
+    Raw and reference knots for [raw, reference] calibration points
+
+    ValueError for points that do not describe an increasing transform.
+    """
+    if not 1 <= len(points) <= MAX_POINTS:
+        raise ValueError(f"A calibration needs 1 to {MAX_POINTS} points")
+    points = sorted((float(raw), float(reference)) for raw, reference in points)
+    xs, ys = [p[0] for p in points], [p[1] for p in points]
+    if not np.isfinite(xs + ys).all():
+        raise ValueError("Calibration points must be finite")
+    if len(points) == 1:
+        # Offset only: slope 1 through the single point
+        return [xs[0], xs[0] + 1], [ys[0], ys[0] + 1]
+    if any(b <= a for a, b in zip(xs, xs[1:])):
+        raise ValueError("Calibration points need distinct raw values")
+    if any(b <= a for a, b in zip(ys, ys[1:])):
+        raise ValueError("Reference values must increase with the raw values")
+    return xs, ys
+
+
+def describe(points: Sequence[Sequence[float]]) -> dict:
+    """Kind of transform, with slope and offset where it is a single line"""
+    xs, ys = knots(points)
+    if len(xs) > 2:
+        return {"kind": "piecewise"}
+    slope = (ys[1] - ys[0]) / (xs[1] - xs[0])
+    return {"kind": "offset" if len(points) == 1 else "linear", "slope": slope, "offset": ys[0] - slope * xs[0]}
+
+
+class _Compiled(NamedTuple):
+    rows: Dict[str, int]                     # device_id -> row
+    knot_x: np.ndarray                       # (transforms, MAX_POINTS), padded with +inf
+    knot_y: np.ndarray
+    knot_n: np.ndarray                       # knots used per transform
+    current: np.ndarray                      # (rows, metrics) latest transform, -1 for none
+    current_from: np.ndarray                 # (rows, metrics) its effective_from, epoch seconds
+    # (row, metric) -> (effective_from, transform) for earlier calibrations,
+    # transform -1 where a later calibration was removed
+    history: Dict[Tuple[int, int], Tuple[np.ndarray, np.ndarray]]
+    calibrations: int
+
+
+class CalibrationStore:
+    """
+    Compiled calibrations for every device
+
+    apply() corrects a batch of payloads in place. Devices without a
+    calibration are skipped after one dict lookup, and readings at or after
+    the latest calibration (nearly all of them) need no per-reading Python.
+    A load builds a new structure and swaps it in with one assignment, so
+    readers never see a half-applied update.
+    """
+
+    def __init__(self, metrics: Sequence[str] = METRICS):
+        self.metrics = tuple(metrics)
+        self.version = -1
+        self._compiled = self._compile([])
+
+    def load(self, version: int, calibrations: Iterable[tuple]):
+        """Compile (device_id, metric, version, effective_from, points) rows"""
+        self._compiled = self._compile(calibrations)
+        self.version = version
+
+    def _compile(self, calibrations: Iterable[tuple]) -> _Compiled:
+        # Per (device, metric), the highest version at each effective_from
+        timelines: Dict[Tuple[str, str], Dict[float, tuple]] = {}
+        count = 0
+        for device_id, metric, version, effective_from, points in calibrations:
+            if metric not in self.metrics:
+                continue
+            count += 1
+            starts = timelines.setdefault((device_id, metric), {})
+            start = epoch_seconds(effective_from)
+            if start not in starts or starts[start][0] < version:
+                starts[start] = (version, points)
+
+        rows: Dict[str, int] = {}
+        knot_x, knot_y, knot_n = [], [], []
+        entries = []
+        for (device_id, metric), starts in timelines.items():
+            row = rows.setdefault(device_id, len(rows))
+            ordered = sorted(starts.items())
+            ids = []
+            for start, (version, points) in ordered:
+                if not points:
+                    # Calibration removed from here on
+                    ids.append(-1)
+                    continue
+                xs, ys = knots(points)
+                pad = MAX_POINTS - len(xs)
+                knot_x.append(xs + [np.inf] * pad)
+                knot_y.append(ys + [0.0] * pad)
+                knot_n.append(len(xs))
+                ids.append(len(knot_n) - 1)
+            entries.append((row, self.metrics.index(metric), np.array([s for s, _ in ordered]), np.array(ids)))
+
+        current = np.full((len(rows), len(self.metrics)), -1, dtype=np.int64)
+        current_from = np.full((len(rows), len(self.metrics)), -np.inf)
+        history = {}
+        for row, m, starts, ids in entries:
+            current[row, m], current_from[row, m] = ids[-1], starts[-1]
+            if len(ids) > 1:
+                history[(row, m)] = (starts, ids)
+        return _Compiled(rows, np.array(knot_x).reshape(-1, MAX_POINTS), np.array(knot_y).reshape(-1, MAX_POINTS),
+                         np.array(knot_n, dtype=np.int64), current, current_from, history, count)
+
+    def transform_ids(self, device_ids: Sequence[str], timestamps: np.ndarray) -> np.ndarray:
+        """(readings, metrics) transform applying to each reading, -1 for none"""
+        compiled = self._compiled
+        result = np.full((len(device_ids), len(self.metrics)), -1, dtype=np.int64)
+        index = np.array([i for i, d in enumerate(device_ids) if d in compiled.rows], dtype=np.int64)
+        if not len(index):
+            return result
+        rows = np.array([compiled.rows[device_ids[i]] for i in index], dtype=np.int64)
+        ts = np.asarray(timestamps, dtype=float)[index][:, None]
+        ids = compiled.current[rows]
+        # Readings from before the latest calibration: look up the one in force then
+        for i, m in zip(*np.nonzero(ts < compiled.current_from[rows])):
+            starts, transforms = compiled.history.get((rows[i], m), (None, None))
+            k = np.searchsorted(starts, ts[i, 0], side="right") - 1 if starts is not None else -1
+            ids[i, m] = transforms[k] if k >= 0 else -1
+        result[index] = ids
+        return result
+
+    def correct(self, values: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        """Apply transforms ids (-1: unchanged) to values elementwise"""
+        compiled = self._compiled
+        result = np.array(values, dtype=float)
+        use = (ids >= 0) & ~np.isnan(result)
+        if not use.any():
+            return result
+        x, t = result[use], ids[use]
+        xs, ys, n = compiled.knot_x[t], compiled.knot_y[t], compiled.knot_n[t]
+        # Segment containing x; the end segments extend beyond the first and last knots
+        segment = np.clip((xs <= x[:, None]).sum(axis=1) - 1, 0, n - 2)
+        i = np.arange(len(x))
+        x0, x1, y0, y1 = xs[i, segment], xs[i, segment + 1], ys[i, segment], ys[i, segment + 1]
+        result[use] = y0 + (x - x0) * (y1 - y0) / (x1 - x0)
+        return result
+
+    def apply(self, payloads: List[dict]) -> int:
+        """
+        Correct the calibrated metrics of payloads in place; returns the number of values corrected
+
+        The raw value is kept in payload["raw"], and a payload that already has
+        one is corrected from it, so applying twice changes nothing.
+        """
+        compiled = self._compiled
+        if not compiled.rows:
+            return 0
+        payloads = [p for p in payloads if p.get("device_id") in compiled.rows and p.get("timestamp") is not None]
+        if not payloads:
+            return 0
+        timestamps = np.array([p["timestamp"] for p in payloads], dtype=float) / 1000
+        ids = self.transform_ids([p["device_id"] for p in payloads], timestamps)
+        sensors = [p.get("sensors") or {} for p in payloads]
+        raw = [p.get("raw") or {} for p in payloads]
+        values = np.array([[r.get(metric, s.get(metric)) for metric in self.metrics]
+                           for r, s in zip(raw, sensors)], dtype=float)
+        corrected = np.round(self.correct(values, ids), 4)
+
+        changed = 0
+        for i, m in zip(*np.nonzero(~np.isnan(values))):
+            payload, metric = payloads[i], self.metrics[m]
+            if ids[i, m] >= 0:
+                payload.setdefault("raw", {})[metric] = float(values[i, m])
+                payload.setdefault("sensors", {})[metric] = float(corrected[i, m])
+                changed += 1
+            elif metric in raw[i]:
+                # No longer calibrated: back to the raw value
+                payload["sensors"][metric] = raw[i].pop(metric)
+        return changed
+
+    def stats(self) -> Dict[str, int]:
+        compiled = self._compiled
+        return {"version": self.version, "calibrations": compiled.calibrations, "devices": len(compiled.rows)}
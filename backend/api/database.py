@@ -0,0 +1,586 @@
+"""
+Database layer for the Agronomia API
+Async SQLAlchemy engine and sessions (asyncpg for PostgreSQL, aiosqlite for
+SQLite), ORM models and connection pool instrumentation.
+
+File-backed SQLite runs in edge mode by default: WAL journal, one writer
+connection that every write goes through, a separate read pool, and
+periodic checkpoint / incremental vacuum.
+"""
+
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy import (BigInteger, Column, Index, Integer, Float, String, Date, DateTime, Boolean, JSON, bindparam,
+                        case, event, exc, func, insert, inspect, select, text, update)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
+
+import metrics
+
+# Plain driver names are mapped to their async drivers
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./agronomia.db")
+
+# Connection pool configuration
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# sensor_readings partition maintenance (PostgreSQL, see backend/database/init.sql)
+PARTITION_INTERVAL = os.getenv("PARTITION_INTERVAL", "month")  # month or week
+PARTITION_PREMAKE = int(os.getenv("PARTITION_PREMAKE", "3"))
+SENSOR_RETENTION_DAYS = int(os.getenv("SENSOR_RETENTION_DAYS", "0"))  # 0 keeps everything
+PARTITION_DETACH_ONLY = os.getenv("PARTITION_DETACH_ONLY", "false").lower() in ("1", "true", "yes")
+
+# SQLite edge mode (file databases only)
+SQLITE_EDGE_MODE = os.getenv("SQLITE_EDGE_MODE", "true").lower() in ("1", "true", "yes")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "16384"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_READ_POOL_SIZE = int(os.getenv("SQLITE_READ_POOL_SIZE", "4"))
+SQLITE_CHECKPOINT_MODE = os.getenv("SQLITE_CHECKPOINT_MODE", "PASSIVE").upper()
+SQLITE_VACUUM_PAGES = int(os.getenv("SQLITE_VACUUM_PAGES", "1000"))
+
+if SQLITE_SYNCHRONOUS not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+    raise ValueError(f"Invalid SQLITE_SYNCHRONOUS: {SQLITE_SYNCHRONOUS}")
+if SQLITE_CHECKPOINT_MODE not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+    raise ValueError(f"Invalid SQLITE_CHECKPOINT_MODE: {SQLITE_CHECKPOINT_MODE}")
+
+
+def async_database_url(url: str) -> str:
+    """Rewrite a sync SQLAlchemy URL to use the matching async driver"""
+    scheme, sep, rest = url.partition("://")
+    if "+" in scheme or scheme not in ASYNC_DRIVERS:
+        return url
+    return ASYNC_DRIVERS[scheme] + sep + rest
+
+
+def is_sqlite_file(url: str) -> bool:
+    return url.startswith("sqlite") and ":memory:" not in url and not url.rstrip("/").endswith(":")
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long each checkout waited for a connection"""
+
+    def _do_get(self):
+        labels = (self.logging_name or "default",)
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            metrics.DB_POOL_TIMEOUTS.inc(labels=labels)
+            raise
+        finally:
+            metrics.DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - start, labels)
+
+
+def _create_engine(url: str, name: str = "default", pool_size: int = DB_POOL_SIZE,
+                   max_overflow: int = DB_MAX_OVERFLOW):
+    url = async_database_url(url)
+    if url.startswith("sqlite") and ":memory:" in url:
+        # A single shared connection; an in-memory database is per connection
+        return create_async_engine(url, poolclass=StaticPool)
+
+    new_engine = create_async_engine(
+        url,
+        poolclass=InstrumentedPool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_logging_name=name,
+    )
+
+    labels = (name,)
+    event.listen(new_engine.sync_engine, "checkout",
+                 lambda *args: metrics.DB_POOL_CHECKOUTS.inc(labels=labels))
+    pool = new_engine.sync_engine.pool
+    metrics.DB_POOL_CHECKED_OUT.set_function(pool.checkedout, labels)
+    metrics.DB_POOL_CONNECTIONS.set_function(lambda: pool.checkedin() + pool.checkedout(), labels)
+    return new_engine
+
+
+def _configure_sqlite(target, query_only: bool = False):
+    """Apply edge-mode pragmas to every new connection of an engine"""
+
+    @event.listens_for(target.sync_engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        # Only takes effect on a new database, so it has to precede journal_mode
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        cursor.execute("PRAGMA journal_mode=WAL")
+        # NORMAL only syncs the WAL at checkpoints; a power cut can lose the
+        # last commits but never corrupts the database
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        if query_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+
+EDGE_MODE = SQLITE_EDGE_MODE and is_sqlite_file(DATABASE_URL)
+
+if EDGE_MODE:
+    # Readers never block the writer under WAL; writes are serialized through
+    # one connection instead of contending for the database lock
+    engine = _create_engine(DATABASE_URL, "read", pool_size=SQLITE_READ_POOL_SIZE, max_overflow=0)
+    write_engine = _create_engine(DATABASE_URL, "write", pool_size=1, max_overflow=0)
+    _configure_sqlite(engine, query_only=True)
+    _configure_sqlite(write_engine)
+else:
+    engine = write_engine = _create_engine(DATABASE_URL)
+
+SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+WriteSessionLocal = async_sessionmaker(write_engine, expire_on_commit=False)
+Base = declarative_base()
+
+sqlite_stats: Dict[str, Any] = {
+    "wal_frames": 0,
+    "checkpointed_frames": 0,
+    "checkpoint_busy": False,
+    "freelist_pages": 0,
+    "vacuumed_pages": 0,
+    "last_maintenance": None
+}
+metrics.SQLITE_WAL_FRAMES.set_function(lambda: sqlite_stats["wal_frames"])
+metrics.SQLITE_FREELIST_PAGES.set_function(lambda: sqlite_stats["freelist_pages"])
+
+
+# Database Models
+class SensorReading(Base):
+    # On PostgreSQL this is a range-partitioned table whose primary key is
+    # (id, timestamp); ids still come from a single sequence, so the ORM
+    # identity on id alone holds.
+    __tablename__ = "sensor_readings"
+
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, index=True)
+    device_id = Column(String, index=True)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
+    ph = Column(Float)
+    water_temp = Column(Float)
+    air_temp = Column(Float)
+    humidity = Column(Float)
+    ec = Column(Float)
+    tds = Column(Float)
+    lux = Column(Integer)
+    full_spectrum = Column(Integer)
+    infrared = Column(Integer)
+    visible = Column(Integer)
+    # Derived at ingest (derived.py)
+    vpd = Column(Float)
+    ec_25 = Column(Float)
+    tds_25 = Column(Float)
+    dli = Column(Float)
+    # Raw probe values of calibrated readings, NULL where the stored value is raw (calibration.py)
+    ph_raw = Column(Float)
+    ec_raw = Column(Float)
+    water_temp_raw = Column(Float)
+
+    __table_args__ = (
+        # A reading is identified by device and timestamp, so QoS 1 redeliveries
+        # and spool replays cannot insert it twice. Also serves history and
+        # analytics queries, which filter on both; same name as in init.sql
+        Index("uq_sensor_readings_device_timestamp", "device_id", "timestamp", unique=True),
+    )
+
+class Alert(Base):
+    __tablename__ = "alerts"
+
+    id = Column(Integer, primary_key=True, index=True)
+    device_id = Column(String, index=True)
+    timestamp = Column(DateTime, default=datetime.utcnow)
+    alert_type = Column(String)
+    severity = Column(String)  # info, warning, critical
+    message = Column(String)
+    value = Column(Float)
+    threshold = Column(Float)
+    score = Column(Float)  # anomaly score, NULL for threshold alerts
+    acknowledged = Column(Boolean, default=False)
+
+class Device(Base):
+    __tablename__ = "devices"
+
+    id = Column(Integer, primary_key=True, index=True)
+    device_id = Column(String, unique=True, index=True)
+    name = Column(String)
+    location = Column(String)
+    plant_type = Column(String)
+    growth_stage = Column(String)
+    last_seen = Column(DateTime)
+    status = Column(String)  # online, offline, warning, critical
+
+class ThresholdProfile(Base):
+    """Alert thresholds for one device, plant type / growth stage, or the fleet (see thresholds.py)"""
+    __tablename__ = "threshold_profiles"
+
+    id = Column(Integer, primary_key=True)
+    # "" means any; NULLs would make the unique scope index useless
+    device_id = Column(String, nullable=False, default="")
+    plant_type = Column(String, nullable=False, default="")
+    growth_stage = Column(String, nullable=False, default="")
+    ph_min = Column(Float, nullable=False)
+    ph_max = Column(Float, nullable=False)
+    temp_min = Column(Float, nullable=False)
+    temp_max = Column(Float, nullable=False)
+    humidity_min = Column(Float, nullable=False)
+    humidity_max = Column(Float, nullable=False)
+    ec_min = Column(Float, nullable=False)
+    ec_max = Column(Float, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("uq_threshold_profiles_scope", "device_id", "plant_type", "growth_stage", unique=True),
+    )
+
+class DailyMetrics(Base):
+    """Per-device rollup of derived metrics by photoperiod day, maintained at ingest"""
+    __tablename__ = "sensor_daily_metrics"
+
+    id = Column(Integer, primary_key=True)
+    device_id = Column(String, nullable=False)
+    day = Column(Date, nullable=False)
+    readings = Column(Integer, nullable=False, default=0)
+    # Sums and counts rather than averages, so batches add up
+    vpd_sum = Column(Float)
+    vpd_count = Column(Integer)
+    vpd_min = Column(Float)
+    vpd_max = Column(Float)
+    ec_25_sum = Column(Float)
+    ec_25_count = Column(Integer)
+    ec_25_min = Column(Float)
+    ec_25_max = Column(Float)
+    dli = Column(Float)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("uq_sensor_daily_metrics_device_day", "device_id", "day", unique=True),
+    )
+
+class Calibration(Base):
+    """One version of a device's calibration for one metric (see calibration.py)"""
+    __tablename__ = "sensor_calibrations"
+
+    id = Column(Integer, primary_key=True)
+    device_id = Column(String, nullable=False)
+    metric = Column(String, nullable=False)
+    version = Column(Integer, nullable=False)
+    effective_from = Column(DateTime, nullable=False)
+    points = Column(JSON().with_variant(postgresql.JSONB(), "postgresql"), nullable=False)  # [[raw, reference], ...]
+    note = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("uq_sensor_calibrations_version", "device_id", "metric", "version", unique=True),
+    )
+
+class Prediction(Base):
+    """One model's output for one device in a scheduled prediction cycle (see predictions.py)"""
+    __tablename__ = "predictions"
+
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    device_id = Column(String, nullable=False)
+    model = Column(String, nullable=False)
+    created_at = Column(DateTime, nullable=False)  # Start of the cycle
+    model_version = Column(String)
+    result = Column(JSON().with_variant(postgresql.JSONB(), "postgresql"), nullable=False)
+
+    __table_args__ = (
+        Index("idx_predictions_device_model_created", "device_id", "model", "created_at"),
+        Index("idx_predictions_created", "created_at"),
+    )
+
+class GrowthRecord(Base):
+    """Manual plant growth measurement of a device's crop"""
+    __tablename__ = "growth_records"
+
+    id = Column(Integer, primary_key=True)
+    device_id = Column(String, nullable=False)
+    timestamp = Column(DateTime, default=datetime.utcnow)
+    plant_height = Column(Float)  # cm
+    leaf_count = Column(Integer)
+    growth_rate = Column(Float)  # cm/day
+    notes = Column(String)
+
+    __table_args__ = (
+        Index("idx_growth_records_device_timestamp", "device_id", "timestamp"),
+    )
+
+class HarvestRecord(Base):
+    """A harvest of a device's crop; ends its growth cycle"""
+    __tablename__ = "harvest_records"
+
+    id = Column(Integer, primary_key=True)
+    device_id = Column(String, nullable=False)
+    harvest_date = Column(DateTime, nullable=False)
+    yield_amount = Column(Float)  # grams
+    quality_rating = Column(Integer)  # 1-5
+    notes = Column(String)
+
+    __table_args__ = (
+        Index("idx_harvest_records_device_date", "device_id", "harvest_date"),
+    )
+
+class ConfigVersion(Base):
+    """Change counters for configuration that workers cache in memory"""
+    __tablename__ = "config_versions"
+
+    name = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+
+async def init_db():
+    """Create tables that do not exist yet"""
+    async with write_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await _migrate_unique_readings(conn)
+        await _add_missing_columns(conn, Alert.__table__, ["score"])
+        await _add_missing_columns(conn, SensorReading.__table__, ["vpd", "ec_25", "tds_25", "dli",
+                                                                  "ph_raw", "ec_raw", "water_temp_raw"])
+        await conn.execute(_dialect_insert(ConfigVersion.__table__).on_conflict_do_nothing(),
+                           [{"name": name, "version": 0} for name in CONFIG_VERSION_NAMES])
+        # create_all skips indexes of tables that already exist
+        for index in (*SensorReading.__table__.indexes, *HarvestRecord.__table__.indexes):
+            await conn.run_sync(index.create, checkfirst=True)
+        if EDGE_MODE and await conn.scalar(text("PRAGMA auto_vacuum")) != 2:
+            print("SQLite database was created without incremental auto_vacuum; "
+                  "run 'PRAGMA auto_vacuum=INCREMENTAL; VACUUM;' once to enable it")
+
+
+async def _migrate_unique_readings(conn):
+    """
+    Prepare databases created before readings were unique on (device_id, timestamp)
+
+    Duplicate rows are deleted (the first one inserted is kept) so the unique
+    index can be built, and the plain index it replaces is dropped.
+    """
+    indexes = await conn.run_sync(
+        lambda sync_conn: {index["name"] for index in inspect(sync_conn).get_indexes("sensor_readings")})
+    if "uq_sensor_readings_device_timestamp" in indexes:
+        return
+    result = await conn.execute(text(
+        "DELETE FROM sensor_readings WHERE id NOT IN "
+        "(SELECT MIN(id) FROM sensor_readings GROUP BY device_id, timestamp)"))
+    if result.rowcount:
+        print(f"Removed {result.rowcount:,} duplicate sensor readings before adding the unique index")
+    if "idx_sensor_readings_device_timestamp" in indexes:
+        await conn.execute(text("DROP INDEX idx_sensor_readings_device_timestamp"))
+
+
+async def _add_missing_columns(conn, table, names):
+    """Add nullable columns introduced after a table was first created"""
+    existing = await conn.run_sync(
+        lambda sync_conn: {column["name"] for column in inspect(sync_conn).get_columns(table.name)})
+    for name in names:
+        if name not in existing:
+            column = table.c[name]
+            column_type = column.type.compile(dialect=conn.dialect)
+            await conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {name} {column_type}"))
+
+
+def _dialect_insert(table):
+    """INSERT with ON CONFLICT support on PostgreSQL and SQLite"""
+    dialect = write_engine.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(table)
+    if dialect == "sqlite":
+        return sqlite.insert(table)
+    raise NotImplementedError(f"ON CONFLICT is not supported on {dialect}")
+
+
+def insert_new_readings():
+    """
+    INSERT into sensor_readings that skips rows whose (device_id, timestamp)
+    already exists and returns the keys of the rows it did insert
+
+    Execute it with a list of parameter dicts; SQLAlchemy batches them into
+    multi-row INSERTs and collects the RETURNING rows of every batch.
+    """
+    table = SensorReading.__table__
+    if write_engine.dialect.name in ("postgresql", "sqlite"):
+        statement = _dialect_insert(table).on_conflict_do_nothing(index_elements=["device_id", "timestamp"])
+    else:
+        statement = insert(table)
+    return statement.returning(table.c.device_id, table.c.timestamp)
+
+
+def upsert_daily_metrics():
+    """INSERT into sensor_daily_metrics that merges a batch's increments into existing days"""
+    table = DailyMetrics.__table__
+    statement = _dialect_insert(table)
+    new = statement.excluded
+
+    def added(name):
+        return func.coalesce(table.c[name], 0) + func.coalesce(new[name], 0)
+
+    def pick(name, better):
+        # NULL on either side keeps the other value
+        return case((table.c[name].is_(None), new[name]), (new[name].is_(None), table.c[name]),
+                    (better(new[name], table.c[name]), new[name]), else_=table.c[name])
+
+    lower, higher = (lambda a, b: a < b), (lambda a, b: a > b)
+    return statement.on_conflict_do_update(
+        index_elements=["device_id", "day"],
+        set_={
+            "readings": table.c.readings + new.readings,
+            **{f"{name}_{stat}": added(f"{name}_{stat}") for name in ("vpd", "ec_25") for stat in ("sum", "count")},
+            **{f"{name}_min": pick(f"{name}_min", lower) for name in ("vpd", "ec_25")},
+            **{f"{name}_max": pick(f"{name}_max", higher) for name in ("vpd", "ec_25")},
+            # Running DLI only grows within a photoperiod
+            "dli": pick("dli", higher),
+            "updated_at": new.updated_at,
+        })
+
+
+def refresh_daily_ec_25():
+    """
+    UPDATE of one device-day's ec_25 statistics in sensor_daily_metrics from its
+    readings, after they were corrected; parameters device, period (the day),
+    start and end (its photoperiod bounds) and refreshed_at
+    """
+    readings, daily = SensorReading.__table__, DailyMetrics.__table__
+
+    def aggregate(function):
+        return select(function).where(
+            readings.c.device_id == bindparam("device"),
+            readings.c.timestamp >= bindparam("start"),
+            readings.c.timestamp < bindparam("end")).scalar_subquery()
+
+    return update(daily).where(daily.c.device_id == bindparam("device"), daily.c.day == bindparam("period")).values(
+        ec_25_sum=aggregate(func.sum(readings.c.ec_25)),
+        ec_25_count=aggregate(func.nullif(func.count(readings.c.ec_25), 0)),
+        ec_25_min=aggregate(func.min(readings.c.ec_25)),
+        ec_25_max=aggregate(func.max(readings.c.ec_25)),
+        updated_at=bindparam("refreshed_at"))
+
+
+def upsert_threshold_profiles():
+    """INSERT into threshold_profiles that replaces the bounds of profiles whose scope already exists"""
+    table = ThresholdProfile.__table__
+    statement = _dialect_insert(table)
+    scope = ["device_id", "plant_type", "growth_stage"]
+    return statement.on_conflict_do_update(
+        index_elements=scope,
+        set_={column.name: statement.excluded[column.name]
+              for column in table.columns if column.name not in scope + ["id"]})
+
+
+# Names seeded in config_versions by init_db
+CONFIG_VERSION_NAMES = ("thresholds", "calibrations")
+
+
+async def bump_config_version(db, name: str) -> int:
+    """Increment a change counter in the caller's transaction and return the new value"""
+    # The row lock also orders concurrent writers, so versions follow commit order
+    return await db.scalar(
+        update(ConfigVersion)
+        .where(ConfigVersion.name == name)
+        .values(version=ConfigVersion.version + 1)
+        .returning(ConfigVersion.version))
+
+
+async def get_config_version(db, name: str) -> int:
+    return await db.scalar(select(ConfigVersion.version).where(ConfigVersion.name == name)) or 0
+
+
+async def maintain_sqlite() -> Optional[Dict[str, Any]]:
+    """
+    Checkpoint the WAL and return free pages to the filesystem (edge mode)
+
+    Runs on the writer connection so it never competes with ingest for the
+    write lock. Returns None outside edge mode.
+    """
+    if not EDGE_MODE:
+        return None
+
+    start = time.perf_counter()
+    async with write_engine.connect() as conn:
+        busy, wal_frames, checkpointed = (
+            await conn.exec_driver_sql(f"PRAGMA wal_checkpoint({SQLITE_CHECKPOINT_MODE})")).one()
+        freelist = await conn.scalar(text("PRAGMA freelist_count"))
+        await conn.commit()
+        vacuumed = 0
+        if freelist and await conn.scalar(text("PRAGMA auto_vacuum")) == 2:
+            # Each freed page is one step of the statement and execute() only
+            # steps once, so run it as a script to let it complete
+            raw = await conn.get_raw_connection()
+            await raw.driver_connection.executescript(f"PRAGMA incremental_vacuum({SQLITE_VACUUM_PAGES});")
+            vacuumed = freelist
+            freelist = await conn.scalar(text("PRAGMA freelist_count"))
+            vacuumed -= freelist
+        await conn.commit()
+    metrics.SQLITE_MAINTENANCE_SECONDS.observe(time.perf_counter() - start)
+
+    sqlite_stats.update({
+        "wal_frames": max(wal_frames, 0),
+        "checkpointed_frames": max(checkpointed, 0),
+        "checkpoint_busy": bool(busy),
+        "freelist_pages": freelist,
+        "vacuumed_pages": sqlite_stats["vacuumed_pages"] + vacuumed,
+        "last_maintenance": datetime.utcnow().isoformat()
+    })
+    return sqlite_stats
+
+
+async def maintain_partitions() -> Optional[Dict[str, Any]]:
+    """
+    Create upcoming sensor_readings partitions and retire expired ones
+
+    Only applies to PostgreSQL databases initialized from init.sql; returns
+    None when the partition functions are not installed.
+    """
+    if engine.dialect.name != "postgresql":
+        return None
+
+    async with engine.begin() as conn:
+        installed = await conn.scalar(text("SELECT to_regproc('create_sensor_reading_partitions') IS NOT NULL"))
+        if not installed:
+            return None
+
+        created = await conn.scalar(
+            text("SELECT create_sensor_reading_partitions(:interval, :ahead)"),
+            {"interval": PARTITION_INTERVAL, "ahead": PARTITION_PREMAKE}
+        )
+        removed = []
+        if SENSOR_RETENTION_DAYS > 0:
+            cutoff = datetime.utcnow() - timedelta(days=SENSOR_RETENTION_DAYS)
+            result = await conn.execute(
+                text("SELECT drop_sensor_reading_partitions(:cutoff, :detach_only)"),
+                {"cutoff": cutoff, "detach_only": PARTITION_DETACH_ONLY}
+            )
+            removed = result.scalars().all()
+
+    return {"created": created, "removed": removed}
+
+
+async def close_db():
+    """Close all pooled connections"""
+    await engine.dispose()
+    if write_engine is not engine:
+        await write_engine.dispose()
+
+
+# Dependencies
+async def get_db():
+    async with SessionLocal() as db:
+        yield db
+
+async def get_write_db():
+    async with WriteSessionLocal() as db:
+        yield db
@@ -0,0 +1,80 @@
+"""
+Duplicate suppression for the Agronomia ingest pipeline
+MQTT QoS 1 and firmware retries deliver the same reading more than once.
+Readings are identified by (device_id, timestamp); an LRU of recently seen
+keys drops redeliveries before they are spooled, and the unique index on
+sensor_readings catches whatever falls outside the window (e.g. after a
+restart or a spool replay). Readings without a timestamp are not
+deduplicated: the server stamps them on arrival.
+
+The cache only saves work; the unique index is what keeps storage exact.
+Keys of a batch that could not be spooled or stored are forgotten, so its
+redelivery is not dropped as a duplicate of a reading that was lost.
+"""
+
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import metrics
+
+
+def reading_key(payload: dict) -> Tuple[str, Optional[int]]:
+    """Identity of a device payload: device id and timestamp in milliseconds"""
+    return payload.get("device_id"), payload.get("timestamp")
+
+
+class RecentKeys:
+    """
+    Bounded set of recently seen keys with least-recently-seen eviction
+
+    An LRU rather than a Bloom filter: a false positive here would silently
+    drop a genuine reading, and at the default capacity the exact set costs
+    a few MB. Only the ingest worker calls it, so it takes no lock.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._keys: "OrderedDict[Hashable, None]" = OrderedDict()
+        self.lookups = 0
+        self.hits = 0
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def check_and_add(self, key: Hashable) -> bool:
+        """Return True if the key was seen recently, otherwise remember it"""
+        self.lookups += 1
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            self.hits += 1
+            return True
+        self._keys[key] = None
+        if len(self._keys) > self.capacity:
+            self._keys.popitem(last=False)
+        return False
+
+    def forget(self, payloads: List[dict]):
+        """Remove the keys of payloads that were not stored, so their redelivery is accepted"""
+        for payload in payloads:
+            self._keys.pop(reading_key(payload), None)
+
+    def filter(self, payloads: List[dict]) -> List[dict]:
+        """Drop payloads whose key was seen recently (including earlier in the same list)"""
+        if self.capacity <= 0:
+            return payloads
+        fresh = [payload for payload in payloads
+                 if payload.get("timestamp") is None or not self.check_and_add(reading_key(payload))]
+        duplicates = len(payloads) - len(fresh)
+        metrics.DEDUPE_LOOKUPS.inc(len(payloads))
+        if duplicates:
+            metrics.INGEST_DUPLICATES.inc(duplicates, labels=("cache",))
+        return fresh
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "capacity": self.capacity,
+            "size": len(self._keys),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0
+        }
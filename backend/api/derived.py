@@ -0,0 +1,210 @@
+"""
+Derived agronomic metrics for the Agronomia ingest path
+Computed once per reading as it is ingested, stored with the reading and in
+the daily rollup, so dashboards and models read them instead of
+recomputing them:
+
+    vpd     Vapour pressure deficit (kPa) from air temperature and humidity,
+            Tetens formula, as IrrigationPredictor.calculate_vpd
+    ec_25   EC compensated to 25 °C with a linear coefficient (docs/CALIBRATION.md)
+    tds_25  TDS (ppm) from ec_25 with the firmware's conversion factor
+    dli     Daily light integral (mol/m²/day) accumulated so far in the
+            device's current photoperiod
+
+DLI integrates PPFD over time: the par_umol sensor where the device has
+one, otherwise lux converted with LUX_TO_PPFD. Readings are combined with
+the trapezoid rule, and gaps longer than DLI_MAX_GAP_SECONDS count only up
+to that limit, so a device that was offline is not credited for light it
+did not measure. The accumulators live in the ingesting process, like the
+anomaly baselines; after a restart the current photoperiod restarts from 0.
+"""
+
+import os
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+EC_TEMP_COEFF = float(os.getenv("EC_TEMP_COEFF", "0.02"))         # Fraction per °C
+EC_REFERENCE_TEMP = 25.0
+TDS_FACTOR = float(os.getenv("TDS_FACTOR", "0.5"))               # ppm per µS/cm, as the firmware
+LUX_TO_PPFD = float(os.getenv("LUX_TO_PPFD", "0.0185"))           # µmol/m²/s per lux (sunlight)
+# Photoperiods start at this local hour; the offset is the site's UTC offset
+PHOTOPERIOD_START_HOUR = float(os.getenv("PHOTOPERIOD_START_HOUR", "0"))
+PHOTOPERIOD_UTC_OFFSET_HOURS = float(os.getenv("PHOTOPERIOD_UTC_OFFSET_HOURS", "0"))
+DLI_MAX_GAP_SECONDS = float(os.getenv("DLI_MAX_GAP_SECONDS", "900"))
+
+DERIVED_FIELDS = ("vpd", "ec_25", "tds_25", "dli")
+
+_EPOCH = datetime(1970, 1, 1)
+_DAY_ZERO = _EPOCH.date()
+_PERIOD_SHIFT = (PHOTOPERIOD_UTC_OFFSET_HOURS - PHOTOPERIOD_START_HOUR) * 3600
+
+
+def vpd(air_temp: np.ndarray, humidity: np.ndarray) -> np.ndarray:
+    """Vapour pressure deficit in kPa"""
+    svp = 0.6108 * np.exp((17.27 * air_temp) / (air_temp + 237.3))
+    return svp * (1 - humidity / 100)
+
+
+def compensate_ec(ec: np.ndarray, water_temp: np.ndarray, coeff: float = EC_TEMP_COEFF) -> np.ndarray:
+    """EC at 25 °C; conductivity rises with temperature, so warmer readings are scaled down"""
+    return ec / (1 + coeff * (water_temp - EC_REFERENCE_TEMP))
+
+
+def photoperiod(timestamps: np.ndarray) -> np.ndarray:
+    """Photoperiod number (days since 1970-01-01 in site time, shifted by the start hour)"""
+    return np.floor((timestamps + _PERIOD_SHIFT) / 86400).astype(np.int64)
+
+
+def photoperiod_day(period: int) -> date:
+    return _DAY_ZERO + timedelta(days=int(period))
+
+
+def photoperiod_start(day: date) -> datetime:
+    """Start of a photoperiod day, as a naive UTC datetime like stored timestamps"""
+    return _EPOCH + timedelta(days=(day - _DAY_ZERO).days, seconds=-_PERIOD_SHIFT)
+
+
+def occurrence(rows: np.ndarray) -> np.ndarray:
+    """For each entry, how many earlier entries have the same value (0 for the first)"""
+    order = np.argsort(rows, kind="stable")
+    ordered = rows[order]
+    starts = np.ones(len(rows), dtype=bool)
+    starts[1:] = ordered[1:] != ordered[:-1]
+    first = np.maximum.accumulate(np.where(starts, np.arange(len(rows)), 0))
+    result = np.empty(len(rows), dtype=np.int64)
+    result[order] = np.arange(len(rows)) - first
+    return result
+
+
+class DliAccumulator:
+    """
+    Running DLI per device for the current photoperiod
+
+    update() takes a batch in arrival order; a device that appears several
+    times is processed in rounds, so its readings are integrated in order.
+    Readings older than the device's last one add nothing.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.rows: Dict[str, int] = {}
+        self.period = np.full(capacity, -1, dtype=np.int64)
+        self.dli = np.zeros(capacity)
+        self.last_ts = np.zeros(capacity)
+        self.last_ppfd = np.full(capacity, np.nan)
+
+    def _row(self, device_id: str) -> int:
+        row = self.rows.get(device_id)
+        if row is None:
+            row = self.rows[device_id] = len(self.rows)
+            if row == len(self.period):
+                grow = len(self.period)
+                self.period = np.r_[self.period, np.full(grow, -1, dtype=np.int64)]
+                self.dli = np.r_[self.dli, np.zeros(grow)]
+                self.last_ts = np.r_[self.last_ts, np.zeros(grow)]
+                self.last_ppfd = np.r_[self.last_ppfd, np.full(grow, np.nan)]
+        return row
+
+    def update(self, device_ids: Sequence[str], timestamps: np.ndarray, ppfd: np.ndarray) -> np.ndarray:
+        """DLI so far in the photoperiod of each reading (NaN without a light reading)"""
+        rows = np.fromiter((self._row(d) for d in device_ids), dtype=np.int64, count=len(device_ids))
+        periods = photoperiod(timestamps)
+        result = np.full(len(rows), np.nan)
+        rounds = occurrence(rows)
+        for n in range(rounds.max() + 1 if len(rows) else 0):
+            index = np.flatnonzero(rounds == n)
+            result[index] = self._update(rows[index], timestamps[index], periods[index], ppfd[index])
+        return result
+
+    def _update(self, rows: np.ndarray, ts: np.ndarray, periods: np.ndarray, ppfd: np.ndarray) -> np.ndarray:
+        current, dli = self.period[rows], self.dli[rows]
+        last_ts, last_ppfd = self.last_ts[rows], self.last_ppfd[rows]
+
+        lit = ~np.isnan(ppfd)
+        new_period = lit & (periods > current)
+        same = lit & (periods == current) & (ts > last_ts)
+        dt = np.minimum(ts - last_ts, DLI_MAX_GAP_SECONDS)
+        with np.errstate(invalid="ignore"):
+            added = np.where(same, (ppfd + last_ppfd) / 2 * dt / 1e6, 0.0)
+        dli = np.where(new_period, 0.0, dli + added)
+
+        advance = new_period | same
+        self.period[rows] = np.where(new_period, periods, current)
+        self.dli[rows] = dli
+        self.last_ts[rows] = np.where(advance, ts, last_ts)
+        self.last_ppfd[rows] = np.where(advance, ppfd, last_ppfd)
+        # A late reading from the current photoperiod reports the running value;
+        # one from an earlier photoperiod has none
+        return np.where(lit & (periods >= current), dli, np.nan)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+
+class DerivedMetrics:
+    """Adds a "derived" block to device payloads"""
+
+    def __init__(self):
+        self.dli = DliAccumulator()
+
+    def annotate(self, payloads: List[dict]):
+        """Set payload["derived"] on every payload with a device id and timestamp"""
+        payloads = [p for p in payloads if p.get("device_id") and p.get("timestamp") is not None]
+        if not payloads:
+            return
+        sensors = [p.get("sensors") or {} for p in payloads]
+        # None (not reported) becomes NaN, and NaN results are stored as NULL
+        columns = np.array([[s.get("air_temp"), s.get("humidity"), s.get("ec"), s.get("water_temp"),
+                             s.get("par_umol"), s.get("lux")] for s in sensors], dtype=float)
+        air_temp, humidity, ec, water_temp, par, lux = columns.T
+        with np.errstate(invalid="ignore", divide="ignore"):
+            derived = {
+                "vpd": vpd(air_temp, humidity),
+                "ec_25": compensate_ec(ec, water_temp),
+            }
+        derived["tds_25"] = derived["ec_25"] * TDS_FACTOR
+        timestamps = np.array([p["timestamp"] for p in payloads], dtype=float) / 1000
+        derived["dli"] = self.dli.update([p["device_id"] for p in payloads], timestamps,
+                                         np.where(np.isnan(par), lux * LUX_TO_PPFD, par))
+
+        rounded = {name: np.round(values, 4).tolist() for name, values in derived.items()}
+        for i, payload in enumerate(payloads):
+            payload["derived"] = {name: _finite(values[i]) for name, values in rounded.items()}
+
+
+def _finite(value: float) -> Optional[float]:
+    return value if value == value and value not in (float("inf"), float("-inf")) else None
+
+
+def daily_rollup_rows(rows: List[dict]) -> List[dict]:
+    """
+    Aggregate reading rows (with derived columns) into sensor_daily_metrics
+    increments, one per device and photoperiod day
+    """
+    groups: Dict[tuple, dict] = {}
+    for row in rows:
+        # Stored timestamps are naive UTC
+        ts = (row["timestamp"] - _EPOCH).total_seconds()
+        key = (row["device_id"], photoperiod_day((ts + _PERIOD_SHIFT) // 86400))
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {"device_id": key[0], "day": key[1], "readings": 0, "dli": None,
+                                   **{f"{name}_{stat}": None for name in ("vpd", "ec_25")
+                                      for stat in ("sum", "count", "min", "max")}}
+        group["readings"] += 1
+        for name in ("vpd", "ec_25"):
+            value = row.get(name)
+            if value is None:
+                continue
+            if group[f"{name}_count"] is None:
+                group.update({f"{name}_sum": value, f"{name}_count": 1, f"{name}_min": value, f"{name}_max": value})
+            else:
+                group[f"{name}_sum"] += value
+                group[f"{name}_count"] += 1
+                group[f"{name}_min"] = min(group[f"{name}_min"], value)
+                group[f"{name}_max"] = max(group[f"{name}_max"], value)
+        if row.get("dli") is not None and (group["dli"] is None or row["dli"] > group["dli"]):
+            group["dli"] = row["dli"]
+    return list(groups.values())
+
@@ -0,0 +1,341 @@
+"""
+Model-ready feature series for the Agronomia platform
+Turns sensor_readings into regular, gap-filled series: for a set of devices,
+`steps` evenly spaced steps of `step` seconds ending at `end`, as one
+(devices, steps, features) array. Models such as IrrigationPredictor need
+exactly this, while stored readings have gaps, bursts and repeated
+timestamps.
+
+Readings are binned by step (bins aligned to the epoch, so hourly steps
+start on the hour) and averaged, which absorbs bursts and duplicates. Empty
+steps are then filled along the time axis, for every device and feature at
+once:
+
+    linear   interpolate between the steps around a gap; gaps longer than
+             `limit` steps stay empty, the edges are held within `limit`
+    ffill    carry the last value forward for up to `limit` steps
+    nearest  take the closer neighbour, if at most `limit` steps away
+    none     leave empty steps as NaN
+
+Recent windows are cached: per (step, features), binned sums and counts of
+the last FEATURE_CACHE_STEPS steps for every device asked for. A later call
+only loads readings stored since the previous load (less
+FEATURE_LATE_SECONDS for readings that arrive late), so repeated calls over
+a sliding window query a few rows per device. Windows older or longer than
+the cache are loaded directly.
+"""
+
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select
+
+import metrics
+from backtest import device_codes, epoch_column
+from database import SensorReading
+
+FEATURE_COLUMNS = ("ph", "water_temp", "air_temp", "humidity", "ec", "tds", "lux", "vpd", "ec_25", "tds_25", "dli")
+DEFAULT_FEATURES = ("air_temp", "humidity", "lux", "water_temp", "ph", "ec", "vpd")
+METHODS = ("linear", "ffill", "nearest", "none")
+
+FEATURE_CACHE_STEPS = int(os.getenv("FEATURE_CACHE_STEPS", "48"))
+FEATURE_LATE_SECONDS = float(os.getenv("FEATURE_LATE_SECONDS", "300"))
+# Devices loaded this recently are served from the cache without a query
+FEATURE_CACHE_MAX_AGE = float(os.getenv("FEATURE_CACHE_MAX_AGE", "10"))
+# Distinct (step, features) combinations kept cached
+FEATURE_CACHE_CONFIGS = int(os.getenv("FEATURE_CACHE_CONFIGS", "4"))
+
+# Devices per query, keeps the IN list within driver limits
+QUERY_DEVICES = 500
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+class FeatureWindow(NamedTuple):
+    device_ids: List[str]
+    features: Tuple[str, ...]
+    start: float               # epoch seconds at the start of the first step
+    step: float                # seconds
+    values: np.ndarray         # (devices, steps, features), NaN where not filled
+    observed: np.ndarray       # (devices, steps, features), True where the step had readings
+
+    def timestamps(self) -> np.ndarray:
+        """Epoch seconds at the start of every step"""
+        return self.start + self.step * np.arange(self.values.shape[1])
+
+    def coverage(self) -> np.ndarray:
+        """(devices, features) share of steps with readings"""
+        return self.observed.mean(axis=1)
+
+
+def fill_gaps(values: np.ndarray, method: str = "linear", limit: Optional[int] = None) -> np.ndarray:
+    """
+    Fill NaN steps along axis 1 of a (devices, steps, features) array
+
+    limit is the longest run of empty steps that is filled (None: any).
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown fill method {method!r}, expected one of {', '.join(METHODS)}")
+    if method == "none" or not values.size:
+        return values.copy()
+    steps = values.shape[1]
+    limit = steps if limit is None else limit
+    valid = ~np.isnan(values)
+    index = np.arange(steps).reshape(1, steps, 1)
+
+    # Nearest valid step at or before / at or after every step (-1 / steps: none)
+    prev = np.maximum.accumulate(np.where(valid, index, -1), axis=1)
+    after = np.where(valid, index, steps)[:, ::-1]
+    next_ = np.minimum.accumulate(after, axis=1)[:, ::-1]
+    prev_value = np.take_along_axis(values, np.maximum(prev, 0), axis=1)
+    next_value = np.take_along_axis(values, np.minimum(next_, steps - 1), axis=1)
+    has_prev, has_next = prev >= 0, next_ < steps
+    since, until = index - prev, next_ - index
+
+    result = values.copy()
+    if method == "ffill":
+        fill = has_prev & (since <= limit)
+        result[~valid & fill] = prev_value[~valid & fill]
+        return result
+    if method == "nearest":
+        use_prev = has_prev & (~has_next | (since <= until))
+        nearest = np.where(use_prev, prev_value, next_value)
+        fill = np.where(use_prev, since, until) <= limit
+        fill &= has_prev | has_next
+        result[~valid & fill] = nearest[~valid & fill]
+        return result
+
+    # Linear inside gaps of up to limit steps; the edges are held like ffill / bfill
+    interior = has_prev & has_next & (next_ - prev - 1 <= limit)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        weight = since / (next_ - prev)
+        line = prev_value + (next_value - prev_value) * weight
+    result[~valid & interior] = line[~valid & interior]
+    tail = ~valid & has_prev & ~has_next & (since <= limit)
+    result[tail] = prev_value[tail]
+    head = ~valid & ~has_prev & has_next & (until <= limit)
+    result[head] = next_value[head]
+    return result
+
+
+def _bin_sums(rows: np.ndarray, bins: np.ndarray, values: np.ndarray, n_rows: int,
+              n_bins: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Per (row, bin, feature) sum and count of the non-NaN values, with bincount"""
+    flat = rows * n_bins + bins
+    present = ~np.isnan(values)
+    size = n_rows * n_bins
+    sums = np.empty((size, values.shape[1]))
+    counts = np.empty((size, values.shape[1]), dtype=np.int64)
+    for f in range(values.shape[1]):
+        sums[:, f] = np.bincount(flat, weights=np.where(present[:, f], values[:, f], 0.0), minlength=size)
+        counts[:, f] = np.bincount(flat, weights=present[:, f], minlength=size)
+    return sums.reshape(n_rows, n_bins, -1), counts.reshape(n_rows, n_bins, -1)
+
+
+def _means(sums: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+
+async def load_readings(db, device_ids: Sequence[str], start: float, end: float,
+                        features: Sequence[str]) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Readings of device_ids with start <= timestamp < end (epoch seconds) as
+    (device ids, device code per row, epoch seconds, (rows, features) values)
+    """
+    dialect = db.bind.dialect.name
+    table = SensorReading.__table__
+    epoch = epoch_column(table.c.timestamp, dialect)
+    first = datetime.utcfromtimestamp(start)
+    last = datetime.utcfromtimestamp(end)
+    codes: Dict[str, int] = {}
+    chunks = []
+    device_ids = list(device_ids)
+    for offset in range(0, len(device_ids), QUERY_DEVICES):
+        # On the timestamp column, so the (device_id, timestamp) index serves a few recent rows per device
+        query = select(table.c.device_id, epoch, *(table.c[name] for name in features)).where(
+            table.c.device_id.in_(device_ids[offset:offset + QUERY_DEVICES]),
+            table.c.timestamp >= first, table.c.timestamp < last)
+        rows = (await db.execute(query)).all()
+        if not rows:
+            continue
+        columns = list(zip(*rows))
+        timestamps = columns[1] if dialect in ("postgresql", "sqlite") else [
+            (ts - _EPOCH).total_seconds() for ts in columns[1]]
+        timestamps = np.array(timestamps, dtype=float)
+        # None (not reported) becomes NaN
+        values = np.array(columns[2:], dtype=float).T.reshape(len(rows), len(features))
+        # SQLite resolves timestamps to the millisecond, which can round a row onto the end bound
+        inside = (timestamps >= start) & (timestamps < end)
+        chunks.append((device_codes(columns[0], codes)[inside], timestamps[inside], values[inside]))
+    metrics.FEATURE_ROWS_LOADED.inc(sum(len(chunk[0]) for chunk in chunks))
+    if not chunks:
+        return [], np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros((0, len(features)))
+    return (list(codes), np.concatenate([c[0] for c in chunks]), np.concatenate([c[1] for c in chunks]),
+            np.concatenate([c[2] for c in chunks]))
+
+
+class _Cache:
+    """Binned sums and counts of the last `capacity` bins for every cached device"""
+
+    def __init__(self, features: Tuple[str, ...], step: float, capacity: int):
+        self.features = features
+        self.step = step
+        self.capacity = capacity
+        self.rows: Dict[str, int] = {}
+        self.head: Optional[int] = None          # absolute bin index of the last bin held
+        self.sums = np.zeros((16, capacity, len(features)))
+        self.counts = np.zeros((16, capacity, len(features)), dtype=np.int64)
+        self.loaded_at = np.full(16, -np.inf)    # wall time of each device's last load
+        self.used = time.monotonic()
+
+    def advance(self, head: int):
+        """Move the window so head is the last bin; bins that fall out are dropped"""
+        if self.head is not None:
+            shift = head - self.head
+            if shift >= self.capacity:
+                self.sums[:] = 0
+                self.counts[:] = 0
+            elif shift > 0:
+                self.sums[:, :-shift] = self.sums[:, shift:]
+                self.sums[:, -shift:] = 0
+                self.counts[:, :-shift] = self.counts[:, shift:]
+                self.counts[:, -shift:] = 0
+        self.head = head
+
+    def row_indexes(self, device_ids: Sequence[str]) -> np.ndarray:
+        for device_id in device_ids:
+            if device_id not in self.rows:
+                row = self.rows[device_id] = len(self.rows)
+                if row == len(self.loaded_at):
+                    grow = len(self.loaded_at)
+                    self.sums = np.concatenate([self.sums, np.zeros_like(self.sums[:grow])])
+                    self.counts = np.concatenate([self.counts, np.zeros_like(self.counts[:grow])])
+                    self.loaded_at = np.r_[self.loaded_at, np.full(grow, -np.inf)]
+        return np.fromiter(map(self.rows.__getitem__, device_ids), dtype=np.int64, count=len(device_ids))
+
+
+class FeatureStore:
+    """
+    Regular, gap-filled feature windows over sensor_readings, with a cache of
+    recent bins per device
+
+    session_factory opens read sessions (database.SessionLocal). Calls are
+    serialized, so concurrent requests do not load the same rows twice.
+    """
+
+    def __init__(self, session_factory, cache_steps: int = FEATURE_CACHE_STEPS,
+                 late_seconds: float = FEATURE_LATE_SECONDS, max_age: float = FEATURE_CACHE_MAX_AGE,
+                 max_configs: int = FEATURE_CACHE_CONFIGS):
+        self.session_factory = session_factory
+        self.cache_steps = cache_steps
+        self.late_seconds = late_seconds
+        self.max_age = max_age
+        self.max_configs = max_configs
+        self._caches: Dict[Tuple[float, Tuple[str, ...]], _Cache] = {}
+        self._lock = asyncio.Lock()
+
+    async def window(self, device_ids: Sequence[str], steps: int, step: float = 3600,
+                     features: Sequence[str] = DEFAULT_FEATURES, end: Optional[float] = None,
+                     method: str = "linear", limit: Optional[int] = 3) -> FeatureWindow:
+        """
+        `steps` steps of `step` seconds for device_ids, the last one containing
+        end (epoch seconds, default now); ValueError for invalid settings
+        """
+        features = tuple(features)
+        unknown = set(features) - set(FEATURE_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown features: {', '.join(sorted(unknown))}")
+        if method not in METHODS:
+            raise ValueError(f"Unknown fill method {method!r}, expected one of {', '.join(METHODS)}")
+        if steps < 1 or step <= 0 or (limit is not None and limit < 0):
+            raise ValueError("steps and step must be positive and limit not negative")
+        device_ids = list(dict.fromkeys(device_ids))
+        now = time.time()
+        end = now if end is None else end
+        last_bin = int(end // step)
+        # Steps before the window give interpolation its left neighbours
+        context = 0 if method == "none" else (limit if limit is not None else steps)
+        span = steps + context
+        now_bin = int(now // step)
+
+        async with self._lock:
+            # The cache holds the latest bins: windows ending in the current or previous step
+            if now_bin - 1 <= last_bin <= now_bin and span + now_bin - last_bin <= self.cache_steps:
+                sums, counts = await self._cached_bins(device_ids, step, features, last_bin, span, now)
+            else:
+                sums, counts = await self._load_bins(device_ids, step, features, last_bin, span)
+
+        observed = counts > 0
+        values = fill_gaps(_means(sums, counts), method, limit)
+        return FeatureWindow(device_ids, features, (last_bin - steps + 1) * step, step,
+                             values[:, -steps:], observed[:, -steps:])
+
+    async def _load_bins(self, device_ids, step, features, last_bin, span):
+        first_bin = last_bin - span + 1
+        async with self.session_factory() as db:
+            loaded, codes, timestamps, values = await load_readings(
+                db, device_ids, first_bin * step, (last_bin + 1) * step, features)
+        position = {device_id: i for i, device_id in enumerate(device_ids)}
+        rows = np.array([position[device_id] for device_id in loaded], dtype=np.int64)[codes] if len(codes) else codes
+        bins = (timestamps // step).astype(np.int64) - first_bin
+        return _bin_sums(rows, bins, values, len(device_ids), span)
+
+    def _cache(self, step: float, features: Tuple[str, ...]) -> _Cache:
+        key = (step, features)
+        cache = self._caches.get(key)
+        if cache is None:
+            if len(self._caches) >= self.max_configs:
+                del self._caches[min(self._caches, key=lambda k: self._caches[k].used)]
+            cache = self._caches[key] = _Cache(features, step, self.cache_steps)
+        cache.used = time.monotonic()
+        return cache
+
+    async def _cached_bins(self, device_ids, step, features, last_bin, span, now):
+        cache = self._cache(step, features)
+        if cache.head is None or int(now // step) > cache.head:
+            cache.advance(int(now // step))
+        head_bin = cache.head
+        stop = cache.capacity - (head_bin - last_bin)
+        if stop - span < 0:
+            # The clock went back past the cached window
+            return await self._load_bins(device_ids, step, features, last_bin, span)
+        first_cached = head_bin - cache.capacity + 1
+        rows = cache.row_indexes(device_ids)
+
+        # Reload each device from its previous load (less the late allowance), whole bins
+        stale = now - cache.loaded_at[rows] > self.max_age
+        if stale.any():
+            stale_rows = rows[stale]
+            # Devices never loaded (loaded_at -inf) start at the first cached bin
+            since = (np.maximum(cache.loaded_at[stale_rows], 0) - self.late_seconds) // step
+            since = np.maximum(since, first_cached).astype(np.int64)
+            reset = np.arange(first_cached, head_bin + 1)[None, :] >= since[:, None]
+            cache.sums[stale_rows] = np.where(reset[:, :, None], 0.0, cache.sums[stale_rows])
+            cache.counts[stale_rows] = np.where(reset[:, :, None], 0, cache.counts[stale_rows])
+
+            stale_ids = [device_ids[i] for i in np.flatnonzero(stale)]
+            async with self.session_factory() as db:
+                loaded, codes, timestamps, values = await load_readings(
+                    db, stale_ids, float(since.min() * step), (head_bin + 1) * step, features)
+            if len(codes):
+                position = {device_id: i for i, device_id in enumerate(stale_ids)}
+                by_code = np.array([position[device_id] for device_id in loaded], dtype=np.int64)[codes]
+                bins = (timestamps // step).astype(np.int64)
+                # One query from the oldest reload point; keep each device's rows from its own
+                keep = bins >= since[by_code]
+                sums, counts = _bin_sums(by_code[keep], bins[keep] - first_cached, values[keep],
+                                         len(stale_rows), cache.capacity)
+                cache.sums[stale_rows] += sums
+                cache.counts[stale_rows] += counts
+            cache.loaded_at[stale_rows] = now
+
+        return cache.sums[rows, stop - span:stop], cache.counts[rows, stop - span:stop]
+
+    def stats(self) -> Dict[str, dict]:
+        return {f"{step:g}s:{','.join(features)}": {"devices": len(cache.rows), "head": cache.head}
+                for (step, features), cache in self._caches.items()}
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Standalone MQTT ingest worker for the Agronomia platform
+Runs the API's ingest pipeline (decode, dedupe, spool, database, shared
+state) without the HTTP server, so MQTT ingestion can be spread over
+several processes or hosts. Run the API with API_MQTT_INGEST=false when
+these workers are deployed.
+
+Devices are split across workers in one of two ways:
+
+  hash    Every worker subscribes to the device topic and keeps only the
+          devices that jump-hash to its shard (shards.py). The device id is
+          read from the topic, so other shards' messages are dropped before
+          decoding. Each device is always handled by the same worker, so its
+          readings stay in order. Every worker still receives all traffic.
+  shared  MQTT v5 shared subscription ($share/<group>/<topic>). The broker
+          hands each message to one worker, so the traffic is split, not
+          copied. Brokers balance per message, so readings of one device can
+          be processed out of order (storage is unaffected: readings are
+          keyed by device and timestamp).
+
+Latest readings and WebSocket events reach the API through the state
+backend, so use STATE_BACKEND=shm or redis.
+
+Usage:
+    python ingest_worker.py --shards 4 --shard-index 0
+    python ingest_worker.py --mode shared --metrics-port 9101
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+import paho.mqtt.client as mqtt
+
+import main
+import metrics
+from shards import ShardRouter
+from state_backend import WORKER_ID
+
+INGEST_SHARDS = int(os.getenv("INGEST_SHARDS", "1"))
+INGEST_SHARD_INDEX = int(os.getenv("INGEST_SHARD_INDEX", "0"))
+INGEST_SHARD_MODE = os.getenv("INGEST_SHARD_MODE", "hash")
+MQTT_SHARE_GROUP = os.getenv("MQTT_SHARE_GROUP", "agronomia-ingest")
+INGEST_METRICS_PORT = int(os.getenv("INGEST_METRICS_PORT", "0"))
+INGEST_STATS_INTERVAL = float(os.getenv("INGEST_STATS_INTERVAL", "10"))
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """/metrics in the Prometheus text format, /stats with the ingest counters"""
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = metrics.render_latest().encode(), metrics.CONTENT_TYPE_LATEST
+        elif self.path == "/stats":
+            stats = {**main.ingest_stats, "queue_depth": main.ingest_queue.qsize(),
+                     "spool": main.spool.stats() if main.spool else None}
+            body, content_type = json.dumps(stats).encode(), "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_mqtt_client(mode: str, shard: str, router: Optional[ShardRouter] = None) -> mqtt.Client:
+    client_id = "agronomia-ingest-" + WORKER_ID.replace(":", "-")
+    if mode == "shared":
+        client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv5)
+        topic = f"$share/{MQTT_SHARE_GROUP}/{main.MQTT_TOPIC}"
+    else:
+        client = mqtt.Client(client_id=client_id)
+        topic = main.MQTT_TOPIC
+
+    def on_connect(client, userdata, flags, rc, properties=None):
+        print(f"Shard {shard}: connected to MQTT broker with result code {rc}, subscribing to {topic}")
+        client.subscribe(topic)
+
+    def on_message(client, userdata, msg):
+        if router is not None and not router.owns(msg.topic):
+            metrics.INGEST_SHARD_SKIPPED.inc(labels=(shard,))
+            return
+        metrics.INGEST_SHARD_MESSAGES.inc(labels=(shard,))
+        main.on_mqtt_message(client, userdata, msg)
+
+    client.on_connect = on_connect
+    client.on_message = on_message
+    return client
+
+
+async def report_throughput(shard: str, interval: float):
+    """Print this shard's handled/skipped message rates every interval"""
+    handled = skipped = 0.0
+    last = time.monotonic()
+    while True:
+        await asyncio.sleep(interval)
+        now = time.monotonic()
+        total_handled = metrics.INGEST_SHARD_MESSAGES.value((shard,))
+        total_skipped = metrics.INGEST_SHARD_SKIPPED.value((shard,))
+        elapsed = now - last
+        print(f"Shard {shard}: {(total_handled - handled) / elapsed:,.0f} msg/s handled, "
+              f"{(total_skipped - skipped) / elapsed:,.0f} msg/s skipped, "
+              f"persisted {main.ingest_stats['persisted']:,}, queue {main.ingest_queue.qsize():,}")
+        handled, skipped, last = total_handled, total_skipped, now
+
+
+async def run(args):
+    # Shared-subscription workers are interchangeable replicas; label them by process
+    shard = str(args.shard_index) if args.mode == "hash" else WORKER_ID
+    router = None
+    if args.mode == "hash":
+        router = ShardRouter(main.MQTT_TOPIC, args.shards, args.shard_index)
+        metrics.INGEST_SHARD_DEVICES.set_function(router.owned_devices, labels=(shard,))
+        print(f"Ingest shard {args.shard_index + 1} of {args.shards} (hash)")
+    else:
+        print(f"Ingest worker {shard} in shared subscription group {MQTT_SHARE_GROUP}")
+
+    if args.metrics_port:
+        server = ThreadingHTTPServer(("0.0.0.0", args.metrics_port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        print(f"Metrics on :{args.metrics_port}/metrics")
+
+    await main.state.open()
+    async with main.state.exclusive("init_db"):
+        await main.init_db()
+    await main.refresh_thresholds()
+    await main.refresh_calibrations()
+    await main.start_ingest()
+    tasks = [asyncio.create_task(main.config_refresh_worker()),
+             asyncio.create_task(report_throughput(shard, args.stats_interval))]
+
+    client = create_mqtt_client(args.mode, shard, router)
+    client.connect(main.MQTT_BROKER, main.MQTT_PORT, 60)
+    client.loop_start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    print(f"Shard {shard}: stopping")
+    client.loop_stop()
+    client.disconnect()
+    for task in tasks:
+        task.cancel()
+    # Persist whatever is still queued or spooled before exiting
+    await main.stop_ingest()
+    await main.state.close()
+    await main.close_db()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(
+        description="Standalone MQTT ingest worker",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--mode", choices=("hash", "shared"), default=INGEST_SHARD_MODE,
+                        help="How devices are split across workers (default: INGEST_SHARD_MODE or hash)")
+    parser.add_argument("--shards", type=int, default=INGEST_SHARDS,
+                        help="Number of hash shards (default: INGEST_SHARDS or 1)")
+    parser.add_argument("--shard-index", type=int, default=INGEST_SHARD_INDEX,
+                        help="This worker's shard, 0-based (default: INGEST_SHARD_INDEX or 0)")
+    parser.add_argument("--metrics-port", type=int, default=INGEST_METRICS_PORT,
+                        help="Serve /metrics and /stats on this port, 0 disables (default: INGEST_METRICS_PORT or 0)")
+    parser.add_argument("--stats-interval", type=float, default=INGEST_STATS_INTERVAL,
+                        help="Seconds between throughput log lines (default: 10)")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -3,28 +3,53 @@ Agronomia Backend API
 FastAPI-based REST API for hydroponic monitoring platform
 """
 
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Depends, File, UploadFile
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Depends, File, UploadFile, Request, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, PlainTextResponse
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import asyncio
-import json
 import os
-from collections import defaultdict
+import queue
+import secrets
+import time
 import io
 from PIL import Image
 import numpy as np
 
-# Database imports (using SQLAlchemy)
-from sqlalchemy import create_engine, Column, Integer, Float, String, DateTime, Boolean
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
+# Database imports (using SQLAlchemy with async drivers)
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import (
+    SessionLocal, WriteSessionLocal, SensorReading, Alert, Device, ThresholdProfile, DailyMetrics, Calibration,
+    GrowthRecord, HarvestRecord, get_db, get_write_db,
+    init_db, close_db, insert_new_readings, maintain_partitions, maintain_sqlite,
+    upsert_threshold_profiles, upsert_daily_metrics, bump_config_version, get_config_version
+)
 
 # MQTT client for receiving sensor data
 import paho.mqtt.client as mqtt
 
+# Telemetry
+import metrics
+from spool import Spool, SpoolLocked
+from dedupe import RecentKeys
+from payload_codec import decode_payload, normalize_payload, payload_format
+from presence import OFFLINE, PresenceTracker
+from state_backend import LEADER_LEASE_SECONDS, WORKER_ID, create_state_backend
+from anomaly import AnomalyDetector, METRIC_SPECS as ANOMALY_SPECS, SPIKE, RATE
+from backtest import METRICS as BACKTEST_METRICS, run_backtest
+from derived import DERIVED_FIELDS, DerivedMetrics, daily_rollup_rows
+from calibration import (METRICS as CALIBRATED_METRICS, RAW_COLUMNS, VERSION_NAME as CALIBRATIONS_VERSION,
+                         CalibrationStore, describe, epoch_seconds, knots)
+from recalibrate import recalibrate
+from features import DEFAULT_FEATURES as DEFAULT_FEATURE_COLUMNS, FeatureStore
+from predictions import PREDICTION_ACTIVE_SECONDS, PREDICTION_INTERVAL_SECONDS, PredictionScheduler
+from model_updates import MODEL_UPDATE_INTERVAL_SECONDS, ModelUpdater
+from thresholds import ANY, FIELDS as THRESHOLD_FIELDS, VERSION_NAME as THRESHOLDS_VERSION, Bounds, ThresholdStore
+from profiling import profiler, render_collapsed, tracer, trace_span, MAX_PROFILE_SECONDS, MAX_PROFILE_HZ
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Agronomia API",
@@ -44,58 +69,28 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Database setup
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./agronomia.db")
-connect_args = {"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
-engine = create_engine(DATABASE_URL, connect_args=connect_args)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
+# Route templates keyed by endpoint function, filled on first use
+_route_templates: Dict[Any, str] = {}
 
-# Database Models
-class SensorReading(Base):
-    __tablename__ = "sensor_readings"
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Record per-route request latency, and spans for routes with tracing enabled"""
+    start = time.perf_counter()
+    trace_token = tracer.start(request.method, request.url.path) if tracer.active else None
+    response = await call_next(request)
     
-    id = Column(Integer, primary_key=True, index=True)
-    device_id = Column(String, index=True)
-    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
-    ph = Column(Float)
-    water_temp = Column(Float)
-    air_temp = Column(Float)
-    humidity = Column(Float)
-    ec = Column(Float)
-    tds = Column(Float)
-    lux = Column(Integer)
-    full_spectrum = Column(Integer)
-    infrared = Column(Integer)
-    visible = Column(Integer)
-
-class Alert(Base):
-    __tablename__ = "alerts"
+    endpoint = request.scope.get("endpoint")
+    if endpoint is not None and not _route_templates:
+        _route_templates.update({route.endpoint: route.path for route in app.routes if hasattr(route, "endpoint")})
+    route = _route_templates.get(endpoint, "unmatched")
+    metrics.HTTP_REQUEST_SECONDS.observe(
+        time.perf_counter() - start, (request.method, route, str(response.status_code)))
     
-    id = Column(Integer, primary_key=True, index=True)
-    device_id = Column(String, index=True)
-    timestamp = Column(DateTime, default=datetime.utcnow)
-    alert_type = Column(String)
-    severity = Column(String)  # info, warning, critical
-    message = Column(String)
-    value = Column(Float)
-    threshold = Column(Float)
-    acknowledged = Column(Boolean, default=False)
-
-class Device(Base):
-    __tablename__ = "devices"
-    
-    id = Column(Integer, primary_key=True, index=True)
-    device_id = Column(String, unique=True, index=True)
-    name = Column(String)
-    location = Column(String)
-    plant_type = Column(String)
-    growth_stage = Column(String)
-    last_seen = Column(DateTime)
-    status = Column(String)  # online, offline, warning, critical
-
-# Create tables
-Base.metadata.create_all(bind=engine)
+    if trace_token is not None:
+        trace = tracer.finish(trace_token, route, response.status_code)
+        if trace is not None:
+            response.headers["Server-Timing"] = trace.server_timing()
+    return response
 
 # Pydantic models for API
 class SensorData(BaseModel):
@@ -119,6 +114,7 @@ class AlertCreate(BaseModel):
     message: str
     value: float
     threshold: float
+    score: Optional[float] = None
 
 class DeviceInfo(BaseModel):
     device_id: str
@@ -127,6 +123,10 @@ class DeviceInfo(BaseModel):
     plant_type: Optional[str] = None
     growth_stage: Optional[str] = None
 
+class TraceToggle(BaseModel):
+    route: str
+    enabled: bool = True
+
 class ThresholdConfig(BaseModel):
     ph_min: float = 5.5
     ph_max: float = 6.5
@@ -137,23 +137,190 @@ class ThresholdConfig(BaseModel):
     ec_min: float = 1000
     ec_max: float = 2500
 
-# In-memory storage for real-time data
-latest_readings: Dict[str, Dict] = {}
+class ThresholdProfileData(ThresholdConfig):
+    """Thresholds for one scope: a device, or a plant type and optional growth stage, or neither (fleet default)"""
+    device_id: Optional[str] = None
+    plant_type: Optional[str] = None
+    growth_stage: Optional[str] = None
+
+class CalibrationData(BaseModel):
+    """[raw, reference] points for one metric of a device from effective_from (default: now); [] ends a calibration"""
+    metric: str
+    points: List[List[float]]
+    effective_from: Optional[datetime] = None
+    note: Optional[str] = None
+
+class GrowthRecordData(BaseModel):
+    """Plant measurements of a device's crop at timestamp (default: now)"""
+    timestamp: Optional[datetime] = None
+    plant_height: Optional[float] = Field(None, ge=0)  # cm
+    leaf_count: Optional[int] = Field(None, ge=0)
+    growth_rate: Optional[float] = None  # cm/day
+    notes: Optional[str] = None
+
+class HarvestRecordData(BaseModel):
+    """A harvest of a device's crop at harvest_date (default: now); ends the growth cycle"""
+    harvest_date: Optional[datetime] = None
+    yield_amount: Optional[float] = Field(None, ge=0)  # grams
+    quality_rating: Optional[int] = Field(None, ge=1, le=5)
+    notes: Optional[str] = None
+
+class ModelActivation(BaseModel):
+    """Registry version to make active, such as v3"""
+    version: str
+
+class ThresholdBacktest(BaseModel):
+    """History range, candidate profiles (applied over the stored ones) and episode rules for a backtest"""
+    days: float = Field(90, gt=0, le=3660)
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    device_ids: Optional[List[str]] = None
+    profiles: List[ThresholdProfileData] = []
+    hysteresis: Dict[str, float] = {}
+    min_duration_s: float = Field(0, ge=0)
+    archives: bool = True
+    timeline: bool = False
+
+# Real-time state shared by all API workers (STATE_BACKEND: memory, shm or redis).
+# WebSocket clients are per worker; every worker broadcasts the events it receives.
+state = create_state_backend()
 websocket_connections: List[WebSocket] = []
-threshold_configs: Dict[str, ThresholdConfig] = defaultdict(ThresholdConfig)
+state_task: Optional[asyncio.Task] = None
 
-# Dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Alert thresholds, compiled from threshold_profiles. Reloaded when the stored
+# version moves: on "thresholds" events, and every THRESHOLD_REFRESH_SECONDS
+# in case an event was missed
+THRESHOLD_REFRESH_SECONDS = float(os.getenv("THRESHOLD_REFRESH_SECONDS", "30"))
+threshold_store = ThresholdStore(Bounds(**ThresholdConfig().dict()))
+threshold_lock = asyncio.Lock()
+config_task: Optional[asyncio.Task] = None
+
+# Per-device sensor calibrations, compiled from sensor_calibrations and applied
+# to every ingest batch; reloaded like thresholds, on "calibrations" events
+calibration_store = CalibrationStore()
+calibration_lock = asyncio.Lock()
+
+# Streaming anomaly detection on new readings (anomaly.py). Baselines live in
+# this process and are rebuilt from the stream after a restart; an empty
+# ANOMALY_METRICS disables detection
+ANOMALY_METRICS = [name for name in os.getenv("ANOMALY_METRICS", "ph,ec,water_temp").split(",") if name]
+anomaly_detector = AnomalyDetector(
+    ANOMALY_METRICS,
+    baseline_halflife=float(os.getenv("ANOMALY_BASELINE_HALFLIFE_HOURS", "24")) * 3600,
+    fast_halflife=float(os.getenv("ANOMALY_FAST_HALFLIFE_MINUTES", "10")) * 60,
+    spike_z=float(os.getenv("ANOMALY_SPIKE_Z", "6")),
+    drift_z=float(os.getenv("ANOMALY_DRIFT_Z", "3")),
+    warmup=int(os.getenv("ANOMALY_WARMUP_READINGS", "30")),
+    cooldown=float(os.getenv("ANOMALY_COOLDOWN_SECONDS", "600")),
+)
+metrics.ANOMALY_DEVICES.set_function(lambda: len(anomaly_detector))
+
+# VPD, compensated EC/TDS and running DLI, added to payloads before they are
+# spooled, stored and broadcast (derived.py)
+derived_metrics = DerivedMetrics()
+
+# Regular, gap-filled feature series over sensor_readings, with recent bins
+# cached per device (features.py)
+feature_store = FeatureStore(SessionLocal)
+
+def target_ec(device_id: str) -> float:
+    """Middle of the device's EC alert band, the target for nutrient recommendations"""
+    bounds = threshold_store.for_device(device_id)
+    return (bounds.ec_min + bounds.ec_max) / 2
+
+# Irrigation, nutrient and harvest models run for active devices every
+# PREDICTION_INTERVAL_SECONDS by the leader; every worker serves the latest
+# results from memory (predictions.py)
+prediction_scheduler = PredictionScheduler(SessionLocal, WriteSessionLocal, feature_store, target_ec)
+prediction_task: Optional[asyncio.Task] = None
+model_reload_task: Optional[asyncio.Task] = None
+
+# The leader warm-starts the harvest model on recorded harvests every
+# MODEL_UPDATE_INTERVAL_SECONDS and publishes it if it improves (model_updates.py)
+model_updater = ModelUpdater(SessionLocal, feature_store, prediction_scheduler.registry)
+model_update_task: Optional[asyncio.Task] = None
+
+# One worker holds the leader lease and runs MQTT, presence writes and maintenance
+is_leader = False
+leadership_task: Optional[asyncio.Task] = None
+
+# Ingest pipeline configuration
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "10000"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", "0.25"))
+# Recent (device_id, timestamp) keys remembered to drop QoS 1 redeliveries (0 disables)
+DEDUPE_CACHE_SIZE = int(os.getenv("DEDUPE_CACHE_SIZE", "100000"))
+
+# Device payloads waiting to be persisted, filled from the MQTT thread and HTTP ingest.
+# Items are (enqueued_at, payload) tuples so the worker can measure ingest lag.
+ingest_queue: "queue.Queue" = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+ingest_stats: Dict[str, Any] = {
+    "received": 0,
+    "processed": 0,
+    "persisted": 0,
+    "dropped": 0,
+    "batches": 0,
+    "last_batch_size": 0,
+    "last_lag_ms": 0.0,
+    "max_lag_ms": 0.0,
+    "spool_lag_ms": 0.0,
+    "spool_load_failures": 0,
+    "duplicates": 0,
+    "duplicates_db": 0,
+    "invalid": 0,
+    "spool_quarantined": 0
+}
+recent_keys = RecentKeys(DEDUPE_CACHE_SIZE)
+metrics.DEDUPE_CACHE_KEYS.set_function(lambda: len(recent_keys))
+ingest_task: Optional[asyncio.Task] = None
+
+# Write-ahead spool: readings are appended to local disk before the database,
+# so they survive database outages and restarts (empty INGEST_SPOOL_DIR disables it)
+INGEST_SPOOL_DIR = os.getenv("INGEST_SPOOL_DIR", "./spool")
+SPOOL_SEGMENT_MB = float(os.getenv("SPOOL_SEGMENT_MB", "16"))
+SPOOL_FSYNC_INTERVAL_MS = float(os.getenv("SPOOL_FSYNC_INTERVAL_MS", "200"))
+SPOOL_RETRY_MAX_SECONDS = float(os.getenv("SPOOL_RETRY_MAX_SECONDS", "30"))
+spool: Optional[Spool] = None
+spool_task: Optional[asyncio.Task] = None
+
+# Device presence: last_seen is stamped in memory on ingest and written to the
+# devices table in batches; silent devices are marked offline
+DEVICE_OFFLINE_SECONDS = float(os.getenv("DEVICE_OFFLINE_SECONDS", "300"))
+PRESENCE_TICK_SECONDS = float(os.getenv("PRESENCE_TICK_SECONDS", "1"))
+PRESENCE_FLUSH_INTERVAL = float(os.getenv("PRESENCE_FLUSH_INTERVAL", "10"))
+presence = PresenceTracker(DEVICE_OFFLINE_SECONDS, PRESENCE_TICK_SECONDS, time.time())
+presence_task: Optional[asyncio.Task] = None
+
+# Hours between sensor_readings partition maintenance runs (PostgreSQL)
+PARTITION_MAINTENANCE_HOURS = float(os.getenv("PARTITION_MAINTENANCE_HOURS", "6"))
+partition_task: Optional[asyncio.Task] = None
+
+# Seconds between WAL checkpoint / incremental vacuum runs (SQLite edge mode)
+SQLITE_MAINTENANCE_INTERVAL = float(os.getenv("SQLITE_MAINTENANCE_INTERVAL", "300"))
+sqlite_task: Optional[asyncio.Task] = None
+
+metrics.INGEST_QUEUE_DEPTH.set_function(ingest_queue.qsize)
+metrics.SPOOL_LAG_SECONDS.set_function(
+    lambda: ingest_stats["spool_lag_ms"] / 1000 if spool and spool.pending_bytes() else 0.0)
+metrics.WEBSOCKET_CLIENTS.set_function(lambda: len(websocket_connections))
+metrics.DEVICES_ONLINE.set_function(presence.online_count)
+metrics.WORKER_IS_LEADER.set_function(lambda: 1.0 if is_leader else 0.0)
+
+# Admin endpoints are disabled unless a token is configured
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_TOKEN not set)")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
 
 # MQTT Configuration
 MQTT_BROKER = os.getenv("MQTT_BROKER", "localhost")
 MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
 MQTT_TOPIC = os.getenv("MQTT_TOPIC", "agronomia/devices/+/data")
+# Set to false when standalone ingest workers (ingest_worker.py) consume MQTT
+API_MQTT_INGEST = os.getenv("API_MQTT_INGEST", "true").lower() in ("1", "true", "yes")
 
 mqtt_client = mqtt.Client()
 
@@ -163,23 +330,19 @@ def on_mqtt_connect(client, userdata, flags, rc):
 
 def on_mqtt_message(client, userdata, msg):
     """Handle incoming MQTT messages from sensors"""
+    metrics.MQTT_MESSAGES_RECEIVED.inc()
     try:
-        payload = json.loads(msg.payload.decode())
-        device_id = payload.get("device_id")
-        
-        # Store latest reading
-        latest_readings[device_id] = payload
-        
-        # Save to database
-        asyncio.create_task(save_sensor_reading(payload))
+        # Devices publish JSON or the compact binary frame (payload_codec.py)
+        payload_fmt = payload_format(msg.payload)
+        metrics.MQTT_PAYLOAD_BYTES.inc(len(msg.payload), labels=(payload_fmt,))
+        payload = decode_payload(msg.payload)
         
-        # Check thresholds and create alerts
-        asyncio.create_task(check_thresholds(device_id, payload))
-        
-        # Broadcast to WebSocket clients
-        asyncio.create_task(broadcast_to_websockets(payload))
+        # Hand off to the ingest worker; this runs on the paho network thread
+        if not enqueue_reading(payload):
+            metrics.MQTT_MESSAGES_DROPPED.inc(labels=("queue_full",))
         
     except Exception as e:
+        metrics.MQTT_MESSAGES_DROPPED.inc(labels=("decode_error",))
         print(f"Error processing MQTT message: {e}")
 
 mqtt_client.on_connect = on_mqtt_connect
@@ -187,7 +350,59 @@ mqtt_client.on_message = on_mqtt_message
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize MQTT connection on startup"""
+    """Connect shared state, create tables, start the ingest worker and take leader duties if free"""
+    global state_task, presence_task, leadership_task, config_task
+    await state.open()
+    # Workers start together; only one of them creates tables and runs migrations
+    async with state.exclusive("init_db"):
+        await init_db()
+    state_task = asyncio.create_task(state.subscribe(handle_state_event))
+    await refresh_thresholds()
+    await refresh_calibrations()
+    try:
+        await prediction_scheduler.load_cycle()
+    except Exception as e:
+        print(f"Error loading stored predictions: {e}")
+    config_task = asyncio.create_task(config_refresh_worker())
+    await load_presence()
+    await start_ingest()
+    presence_task = asyncio.create_task(presence_worker())
+    await update_leadership()
+    leadership_task = asyncio.create_task(leadership_worker())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Cleanup on shutdown"""
+    for task in (leadership_task, presence_task, config_task):
+        if task:
+            task.cancel()
+    was_leader = is_leader
+    await stop_leader_duties()
+    
+    # Persist whatever is still queued or spooled before exiting
+    await stop_ingest()
+    if was_leader:
+        await flush_presence()
+        await state.release_leadership()
+    if state_task:
+        state_task.cancel()
+        await asyncio.gather(state_task, return_exceptions=True)
+    await state.close()
+    prediction_scheduler.shutdown()
+    await close_db()
+
+async def start_leader_duties():
+    """Consume MQTT and run the maintenance tasks (leader worker only)"""
+    global is_leader, partition_task, sqlite_task, prediction_task, model_update_task
+    is_leader = True
+    print(f"Worker {WORKER_ID} is the leader")
+    partition_task = asyncio.create_task(partition_maintenance_worker())
+    sqlite_task = asyncio.create_task(sqlite_maintenance_worker())
+    prediction_task = asyncio.create_task(prediction_worker())
+    model_update_task = asyncio.create_task(model_update_worker())
+    if not API_MQTT_INGEST:
+        return
+    
     try:
         mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
         mqtt_client.loop_start()
@@ -195,11 +410,59 @@ async def startup_event():
     except Exception as e:
         print(f"Failed to connect to MQTT broker: {e}")
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    """Cleanup on shutdown"""
+async def stop_leader_duties():
+    global is_leader
+    if not is_leader:
+        return
+    is_leader = False
     mqtt_client.loop_stop()
     mqtt_client.disconnect()
+    for task in (partition_task, sqlite_task, prediction_task, model_update_task):
+        if task:
+            task.cancel()
+
+async def update_leadership():
+    """Take or renew the leader lease and start or stop leader duties to match"""
+    try:
+        leader = await state.acquire_leadership()
+    except Exception as e:
+        # Without the shared store no worker can prove it is the only leader
+        print(f"Error renewing leader lease: {e}")
+        leader = False
+    if leader and not is_leader:
+        await start_leader_duties()
+    elif not leader and is_leader:
+        print(f"Worker {WORKER_ID} lost the leader lease")
+        await stop_leader_duties()
+
+async def leadership_worker():
+    """Renew the lease well before it expires; followers take over when a leader dies"""
+    while True:
+        await asyncio.sleep(LEADER_LEASE_SECONDS / 3)
+        await update_leadership()
+
+async def handle_state_event(event: dict):
+    """Apply an event published by any worker (this one included)"""
+    global model_reload_task
+    kind = event.get("type")
+    if kind == "readings":
+        # Every worker tracks presence so any of them can serve it and take over as leader
+        now = time.time()
+        for device_id in event.get("seen", ()):
+            presence.touch(device_id, now)
+        for payload in event.get("payloads", ()):
+            await broadcast_to_websockets(payload)
+    elif kind == "device_status":
+        await broadcast_to_websockets(event)
+    elif kind == "thresholds":
+        await refresh_thresholds(event["version"])
+    elif kind == "calibrations":
+        await refresh_calibrations(event["version"])
+    elif kind == "predictions":
+        await prediction_scheduler.load_cycle(datetime.fromisoformat(event["created_at"]))
+    elif kind == "models" and is_leader:
+        # Swap in the activated version now rather than at the next cycle
+        model_reload_task = asyncio.create_task(prediction_scheduler.reload_models())
 
 # API Endpoints
 
@@ -216,35 +479,46 @@ async def root():
             "sensors": "/api/sensors",
             "devices": "/api/devices",
             "alerts": "/api/alerts",
-            "analytics": "/api/analytics"
+            "analytics": "/api/analytics",
+            "ingest": "/api/ingest",
+            "metrics": "/metrics"
         }
     }
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(content=metrics.render_latest(), headers={"Content-Type": metrics.CONTENT_TYPE_LATEST})
+
 @app.get("/api/sensors/latest")
 async def get_latest_readings():
     """Get latest sensor readings for all devices"""
-    return latest_readings
+    return await state.get_latest()
 
 @app.get("/api/sensors/latest/{device_id}")
 async def get_latest_reading(device_id: str):
     """Get latest sensor reading for a specific device"""
-    if device_id not in latest_readings:
+    reading = await state.get_latest_one(device_id)
+    if reading is None:
         raise HTTPException(status_code=404, detail="Device not found")
-    return latest_readings[device_id]
+    return reading
 
 @app.get("/api/sensors/history/{device_id}")
 async def get_sensor_history(
     device_id: str,
     hours: int = 24,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Get historical sensor data for a device"""
     start_time = datetime.utcnow() - timedelta(hours=hours)
     
-    readings = db.query(SensorReading).filter(
-        SensorReading.device_id == device_id,
-        SensorReading.timestamp >= start_time
-    ).order_by(SensorReading.timestamp.desc()).all()
+    result = await db.execute(
+        select(SensorReading).where(
+            SensorReading.device_id == device_id,
+            SensorReading.timestamp >= start_time
+        ).order_by(SensorReading.timestamp.desc())
+    )
+    readings = result.scalars().all()
     
     return [{
         "timestamp": r.timestamp.isoformat(),
@@ -254,110 +528,181 @@ async def get_sensor_history(
         "humidity": r.humidity,
         "ec": r.ec,
         "tds": r.tds,
-        "lux": r.lux
+        "lux": r.lux,
+        "vpd": r.vpd,
+        "ec_25": r.ec_25,
+        "tds_25": r.tds_25,
+        "dli": r.dli
     } for r in readings]
 
 @app.post("/api/sensors/data")
-async def post_sensor_data(data: SensorData, db: Session = Depends(get_db)):
-    """Manually post sensor data (for testing)"""
-    reading = SensorReading(**data.dict())
-    db.add(reading)
-    db.commit()
-    db.refresh(reading)
+async def post_sensor_data(data: SensorData, db: AsyncSession = Depends(get_write_db)):
+    """Manually post sensor data (for testing); stored like ingested readings, without the spool"""
+    sensors = data.dict(exclude={"device_id", "timestamp"})
+    timestamp = _naive_utc(data.timestamp)
+    payloads = [{"device_id": data.device_id, "timestamp": round(epoch_seconds(timestamp) * 1000),
+                 "sensors": sensors}]
+    # Same corrections and derived metrics as MQTT and /api/ingest readings
+    metrics.CALIBRATION_CORRECTIONS.inc(calibration_store.apply(payloads))
+    derived_metrics.annotate(payloads)
+    if not await save_sensor_readings(payloads):
+        raise HTTPException(status_code=409, detail="A reading for this device and timestamp already exists")
+    ingest_stats["persisted"] += 1
+    reading_id = await db.scalar(select(SensorReading.id).where(
+        SensorReading.device_id == data.device_id, SensorReading.timestamp == timestamp))
     
     # Update latest readings
-    latest_readings[data.device_id] = data.dict()
+    await state.set_latest({data.device_id: payloads[0]})
+    await state.publish({"type": "readings", "payloads": payloads, "seen": [data.device_id]})
     
-    return {"status": "success", "id": reading.id}
+    return {"status": "success", "id": reading_id}
+
+@app.post("/api/ingest", status_code=202)
+async def ingest_payloads(payloads: List[Dict[str, Any]]):
+    """Queue device payloads (same format as MQTT messages) for ingestion"""
+    valid = _valid_payloads(payloads)
+    accepted = sum(1 for payload in valid if enqueue_reading(payload))
+    return {"accepted": accepted, "dropped": len(valid) - accepted, "invalid": len(payloads) - len(valid)}
+
+@app.get("/api/ingest/stats")
+async def get_ingest_stats():
+    """Get ingest pipeline counters, queue depth, lag and spool state"""
+    return {
+        **ingest_stats,
+        "queue_depth": ingest_queue.qsize(),
+        "dedupe": recent_keys.stats(),
+        "spool": spool.stats() if spool else None
+    }
 
 @app.get("/api/devices")
-async def get_devices(db: Session = Depends(get_db)):
+async def get_devices(db: AsyncSession = Depends(get_db)):
     """Get all registered devices"""
-    devices = db.query(Device).all()
-    return devices
+    result = await db.execute(select(Device))
+    return result.scalars().all()
 
 @app.post("/api/devices")
-async def register_device(device: DeviceInfo, db: Session = Depends(get_db)):
+async def register_device(device: DeviceInfo, db: AsyncSession = Depends(get_write_db)):
     """Register a new device"""
     db_device = Device(**device.dict(), status="offline")
     db.add(db_device)
-    db.commit()
-    db.refresh(db_device)
+    # Plant type and growth stage select the device's threshold profile
+    version = await bump_config_version(db, THRESHOLDS_VERSION)
+    await db.commit()
+    await thresholds_changed(version)
     return db_device
 
+@app.get("/api/devices/presence")
+async def get_device_presence():
+    """Online/offline status and last reading time of every device that has sent data"""
+    return {
+        "offline_after_seconds": DEVICE_OFFLINE_SECONDS,
+        "online": presence.online_count(),
+        "devices": {
+            device_id: {**state, "last_seen": datetime.utcfromtimestamp(state["last_seen"]).isoformat()}
+            for device_id, state in presence.snapshot().items()
+        }
+    }
+
 @app.get("/api/devices/{device_id}")
-async def get_device(device_id: str, db: Session = Depends(get_db)):
+async def get_device(device_id: str, db: AsyncSession = Depends(get_db)):
     """Get device information"""
-    device = db.query(Device).filter(Device.device_id == device_id).first()
+    device = await db.scalar(select(Device).where(Device.device_id == device_id))
     if not device:
         raise HTTPException(status_code=404, detail="Device not found")
     return device
 
 @app.put("/api/devices/{device_id}")
-async def update_device(device_id: str, device: DeviceInfo, db: Session = Depends(get_db)):
+async def update_device(device_id: str, device: DeviceInfo, db: AsyncSession = Depends(get_write_db)):
     """Update device information"""
-    db_device = db.query(Device).filter(Device.device_id == device_id).first()
+    db_device = await db.scalar(select(Device).where(Device.device_id == device_id))
     if not db_device:
         raise HTTPException(status_code=404, detail="Device not found")
     
     for key, value in device.dict(exclude_unset=True).items():
         setattr(db_device, key, value)
     
-    db.commit()
-    db.refresh(db_device)
+    version = await bump_config_version(db, THRESHOLDS_VERSION)
+    await db.commit()
+    await thresholds_changed(version)
     return db_device
 
+@app.post("/api/devices/{device_id}/growth")
+async def add_growth_record(device_id: str, record: GrowthRecordData, db: AsyncSession = Depends(get_write_db)):
+    """Record plant measurements; the latest since the last harvest feeds harvest predictions"""
+    if not await db.scalar(select(Device.id).where(Device.device_id == device_id)):
+        raise HTTPException(status_code=404, detail="Device not found")
+    values = record.dict()
+    values["timestamp"] = _naive_utc(record.timestamp) if record.timestamp else datetime.utcnow()
+    row = GrowthRecord(device_id=device_id, **values)
+    db.add(row)
+    await db.commit()
+    return row
+
+@app.post("/api/devices/{device_id}/harvests")
+async def add_harvest_record(device_id: str, record: HarvestRecordData, db: AsyncSession = Depends(get_write_db)):
+    """Record a harvest; with a yield, it labels the cycle's growth records for model updates"""
+    if not await db.scalar(select(Device.id).where(Device.device_id == device_id)):
+        raise HTTPException(status_code=404, detail="Device not found")
+    values = record.dict()
+    values["harvest_date"] = _naive_utc(record.harvest_date) if record.harvest_date else datetime.utcnow()
+    row = HarvestRecord(device_id=device_id, **values)
+    db.add(row)
+    await db.commit()
+    return row
+
 @app.get("/api/alerts")
 async def get_alerts(
     device_id: Optional[str] = None,
     acknowledged: Optional[bool] = None,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Get alerts with optional filtering"""
-    query = db.query(Alert)
+    query = select(Alert)
     
     if device_id:
-        query = query.filter(Alert.device_id == device_id)
+        query = query.where(Alert.device_id == device_id)
     if acknowledged is not None:
-        query = query.filter(Alert.acknowledged == acknowledged)
+        query = query.where(Alert.acknowledged == acknowledged)
     
-    alerts = query.order_by(Alert.timestamp.desc()).limit(limit).all()
-    return alerts
+    result = await db.execute(query.order_by(Alert.timestamp.desc()).limit(limit))
+    return result.scalars().all()
 
 @app.post("/api/alerts")
-async def create_alert(alert: AlertCreate, db: Session = Depends(get_db)):
+async def create_alert(alert: AlertCreate, db: AsyncSession = Depends(get_write_db)):
     """Create a new alert"""
     db_alert = Alert(**alert.dict())
     db.add(db_alert)
-    db.commit()
-    db.refresh(db_alert)
+    await db.commit()
     return db_alert
 
 @app.put("/api/alerts/{alert_id}/acknowledge")
-async def acknowledge_alert(alert_id: int, db: Session = Depends(get_db)):
+async def acknowledge_alert(alert_id: int, db: AsyncSession = Depends(get_write_db)):
     """Acknowledge an alert"""
-    alert = db.query(Alert).filter(Alert.id == alert_id).first()
+    alert = await db.get(Alert, alert_id)
     if not alert:
         raise HTTPException(status_code=404, detail="Alert not found")
     
     alert.acknowledged = True
-    db.commit()
+    await db.commit()
     return {"status": "acknowledged"}
 
 @app.get("/api/analytics/summary/{device_id}")
 async def get_analytics_summary(
     device_id: str,
     hours: int = 24,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """Get analytics summary for a device"""
     start_time = datetime.utcnow() - timedelta(hours=hours)
     
-    readings = db.query(SensorReading).filter(
-        SensorReading.device_id == device_id,
-        SensorReading.timestamp >= start_time
-    ).all()
+    result = await db.execute(
+        select(SensorReading).where(
+            SensorReading.device_id == device_id,
+            SensorReading.timestamp >= start_time
+        )
+    )
+    readings = result.scalars().all()
     
     if not readings:
         raise HTTPException(status_code=404, detail="No data available")
@@ -388,17 +733,330 @@ async def get_analytics_summary(
         }
     }
 
+@app.get("/api/analytics/daily/{device_id}")
+async def get_daily_metrics(
+    device_id: str,
+    days: int = 30,
+    db: AsyncSession = Depends(get_db)
+):
+    """Daily VPD, compensated EC and DLI for a device, from the ingest rollup"""
+    start_day = (datetime.utcnow() - timedelta(days=days)).date()
+
+    result = await db.execute(
+        select(DailyMetrics).where(
+            DailyMetrics.device_id == device_id,
+            DailyMetrics.day >= start_day
+        ).order_by(DailyMetrics.day)
+    )
+    rows = result.scalars().all()
+
+    def stats(row, name):
+        count = getattr(row, f"{name}_count")
+        return {
+            "avg": getattr(row, f"{name}_sum") / count if count else None,
+            "min": getattr(row, f"{name}_min"),
+            "max": getattr(row, f"{name}_max")
+        }
+
+    return [{
+        "day": row.day.isoformat(),
+        "readings": row.readings,
+        "vpd": stats(row, "vpd"),
+        "ec_25": stats(row, "ec_25"),
+        "dli": row.dli
+    } for row in rows]
+
+@app.get("/api/features")
+async def get_features(
+    device_id: List[str] = Query(...),
+    steps: int = Query(24, ge=1, le=10000),
+    step_minutes: float = Query(60, gt=0),
+    features: Optional[str] = None,
+    method: str = "linear",
+    limit: int = Query(3, ge=0),
+    end: Optional[datetime] = None
+):
+    """
+    Evenly spaced, gap-filled series for one or more devices: steps averaged
+    steps of step_minutes each, the last one containing end (default now)
+    """
+    names = features.split(",") if features else DEFAULT_FEATURE_COLUMNS
+    end_ts = epoch_seconds(_naive_utc(end)) if end else None
+    try:
+        window = await feature_store.window(device_id, steps, step_minutes * 60, names, end_ts, method, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    values = np.where(np.isnan(window.values), None, np.round(window.values, 4))
+    coverage = window.coverage()
+    return {
+        "step_seconds": window.step,
+        "features": list(window.features),
+        "timestamps": [datetime.utcfromtimestamp(ts).isoformat() for ts in window.timestamps()],
+        "devices": {
+            device: {
+                "coverage": {name: round(float(coverage[d, f]), 4) for f, name in enumerate(window.features)},
+                "values": {name: values[d, :, f].tolist() for f, name in enumerate(window.features)}
+            }
+            for d, device in enumerate(window.device_ids)
+        }
+    }
+
+@app.get("/api/predictions")
+async def get_prediction_status():
+    """Models, cache size and (on the leader) the last prediction cycle"""
+    return {"leader": is_leader, "interval_seconds": PREDICTION_INTERVAL_SECONDS, **prediction_scheduler.stats()}
+
+@app.get("/api/predictions/{device_id}")
+async def get_predictions(device_id: str):
+    """Latest scheduled prediction of each model for a device (never runs a model)"""
+    predictions = await prediction_scheduler.latest(device_id)
+    if not predictions:
+        raise HTTPException(status_code=404, detail="No predictions for this device yet")
+    return {"device_id": device_id, "predictions": predictions}
+
+@app.get("/api/predictions/{device_id}/history")
+async def get_prediction_history(
+    device_id: str,
+    model: str = "irrigation",
+    hours: int = Query(24, ge=1, le=24 * 365),
+    limit: int = Query(500, ge=1, le=10000)
+):
+    """Stored predictions of one model for a device, newest first"""
+    if model not in {job.name for job in prediction_scheduler.jobs}:
+        raise HTTPException(status_code=422, detail=f"Unknown model {model!r}")
+    start = datetime.utcnow() - timedelta(hours=hours)
+    return {"device_id": device_id, "model": model,
+            "predictions": await prediction_scheduler.history(device_id, model, start, limit)}
+
+@app.get("/api/models")
+async def list_models():
+    """Registry versions of each prediction model, the active one and the one the leader runs"""
+    registry = prediction_scheduler.registry
+    loop = asyncio.get_running_loop()
+    result = {}
+    for job in prediction_scheduler.jobs:
+        versions = await loop.run_in_executor(None, registry.versions, job.name)
+        manifests = [await loop.run_in_executor(None, registry.manifest, job.name, v) for v in versions]
+        result[job.name] = {
+            "active": registry.active_version(job.name),
+            "loaded": job.version,
+            "versions": [{
+                "version": m["version"],
+                "published": m["published"],
+                "note": m.get("note"),
+                "bytes": sum(entry["bytes"] for entry in m["files"].values()),
+                "metadata": m["metadata"],
+            } for m in manifests]
+        }
+    return {"registry": registry.root, "leader": is_leader, "models": result,
+            "last_update": model_updater.last_update}
+
+@app.put("/api/admin/models/{name}/active", dependencies=[Depends(require_admin)])
+async def activate_model(name: str, activation: ModelActivation):
+    """Activate a registry version; the leader loads it without waiting for the next cycle"""
+    try:
+        # Checksums every file of the version first
+        await asyncio.get_running_loop().run_in_executor(
+            None, prediction_scheduler.registry.activate, name, activation.version)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    try:
+        await state.publish({"type": "models", "model": name, "version": activation.version})
+    except Exception as e:
+        # The leader still checks the active versions at every cycle
+        print(f"Error publishing model activation: {e}")
+    return {"model": name, "active": activation.version}
+
+@app.post("/api/admin/models/update", dependencies=[Depends(require_admin)])
+async def update_models_now(dry_run: bool = False):
+    """Update the harvest model from recorded harvests now; with dry_run, evaluate without publishing"""
+    return await run_model_update(dry_run)
+
+@app.post("/api/admin/predictions/run", dependencies=[Depends(require_admin)])
+async def run_predictions_now():
+    """Run a prediction cycle now instead of waiting for the schedule"""
+    return await run_predictions()
+
+@app.get("/api/thresholds/export")
+async def export_thresholds(
+    plant_type: Optional[str] = None,
+    growth_stage: Optional[str] = None,
+    devices: bool = False,
+    db: AsyncSession = Depends(get_db)
+):
+    """Threshold profiles by plant type and growth stage (plus device overrides if devices=true), importable as is"""
+    query = select(ThresholdProfile).order_by(
+        ThresholdProfile.plant_type, ThresholdProfile.growth_stage, ThresholdProfile.device_id)
+    if not devices:
+        query = query.where(ThresholdProfile.device_id == ANY)
+    if plant_type is not None:
+        query = query.where(ThresholdProfile.plant_type == plant_type)
+    if growth_stage is not None:
+        query = query.where(ThresholdProfile.growth_stage == growth_stage)
+    profiles = (await db.execute(query)).scalars().all()
+    return [
+        ThresholdProfileData(
+            device_id=p.device_id or None,
+            plant_type=p.plant_type or None,
+            growth_stage=p.growth_stage or None,
+            **{field: getattr(p, field) for field in THRESHOLD_FIELDS}
+        )
+        for p in profiles
+    ]
+
+def threshold_profile_rows(profiles: List[ThresholdProfileData]) -> List[Dict[str, Any]]:
+    """threshold_profiles rows for imported profiles; ValueError for a scope that cannot be resolved"""
+    now = datetime.utcnow()
+    rows = []
+    for profile in profiles:
+        if profile.device_id and (profile.plant_type or profile.growth_stage):
+            raise ValueError(f"Profile for {profile.device_id} sets both a device and a plant type or growth stage")
+        if profile.growth_stage and not profile.plant_type:
+            raise ValueError(f"Growth stage {profile.growth_stage} needs a plant type")
+        rows.append({
+            **profile.dict(),
+            "device_id": profile.device_id or ANY,
+            "plant_type": profile.plant_type or ANY,
+            "growth_stage": profile.growth_stage or ANY,
+            "updated_at": now
+        })
+    return rows
+
+@app.post("/api/thresholds/import")
+async def import_thresholds(profiles: List[ThresholdProfileData], db: AsyncSession = Depends(get_write_db)):
+    """Create or replace threshold profiles in bulk, in one transaction"""
+    try:
+        rows = threshold_profile_rows(profiles)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if not rows:
+        return {"imported": 0, "version": threshold_store.version}
+    await db.execute(upsert_threshold_profiles(), rows)
+    version = await bump_config_version(db, THRESHOLDS_VERSION)
+    await db.commit()
+    await thresholds_changed(version)
+    return {"imported": len(rows), "version": version}
+
+@app.post("/api/thresholds/backtest")
+async def backtest_thresholds(request: ThresholdBacktest, db: AsyncSession = Depends(get_db)):
+    """
+    Replay stored history against the current or candidate profiles and
+    report the alerts and alert episodes they would have produced
+    """
+    unknown = set(request.hysteresis) - set(BACKTEST_METRICS)
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"No threshold rule for {', '.join(sorted(unknown))}")
+    try:
+        candidates = threshold_profile_rows(request.profiles)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    # Stored timestamps are naive UTC
+    end = _naive_utc(request.end) if request.end else datetime.utcnow()
+    start = _naive_utc(request.start) if request.start else end - timedelta(days=request.days)
+    if start >= end:
+        raise HTTPException(status_code=422, detail="start must be before end")
+    return await run_backtest(
+        db, start, end, threshold_store.default, candidates, request.device_ids, request.archives,
+        hysteresis=request.hysteresis, min_duration=request.min_duration_s, timeline=request.timeline)
+
+def _naive_utc(value: datetime) -> datetime:
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+
 @app.get("/api/thresholds/{device_id}")
 async def get_thresholds(device_id: str):
     """Get alert thresholds for a device"""
-    return threshold_configs[device_id]
+    return ThresholdConfig(**threshold_store.for_device(device_id)._asdict())
 
 @app.put("/api/thresholds/{device_id}")
-async def update_thresholds(device_id: str, config: ThresholdConfig):
+async def update_thresholds(device_id: str, config: ThresholdConfig, db: AsyncSession = Depends(get_write_db)):
     """Update alert thresholds for a device"""
-    threshold_configs[device_id] = config
+    await db.execute(upsert_threshold_profiles(), [{
+        **config.dict(),
+        "device_id": device_id,
+        "plant_type": ANY,
+        "growth_stage": ANY,
+        "updated_at": datetime.utcnow()
+    }])
+    version = await bump_config_version(db, THRESHOLDS_VERSION)
+    await db.commit()
+    await thresholds_changed(version)
     return {"status": "updated", "config": config}
 
+def _calibration_info(row: Calibration) -> Dict[str, Any]:
+    return {
+        "metric": row.metric,
+        "version": row.version,
+        "effective_from": row.effective_from.isoformat(),
+        "points": row.points,
+        "note": row.note,
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+        **(describe(row.points) if row.points else {"kind": "none"})
+    }
+
+@app.get("/api/calibrations/{device_id}")
+async def get_calibrations(device_id: str, metric: Optional[str] = None, db: AsyncSession = Depends(get_db)):
+    """Calibration history of a device, newest first, with the one applied to new readings per metric"""
+    query = select(Calibration).where(Calibration.device_id == device_id)
+    if metric:
+        query = query.where(Calibration.metric == metric)
+    result = await db.execute(query.order_by(Calibration.effective_from.desc(), Calibration.version.desc()))
+    calibrations = result.scalars().all()
+
+    now = datetime.utcnow()
+    current = {}
+    for row in calibrations:
+        if row.effective_from <= now and row.metric not in current:
+            current[row.metric] = row.version if row.points else None
+    return {
+        "device_id": device_id,
+        "current": {name: current.get(name) for name in CALIBRATED_METRICS if not metric or name == metric},
+        "calibrations": [_calibration_info(row) for row in calibrations]
+    }
+
+@app.post("/api/calibrations/{device_id}")
+async def add_calibration(
+    device_id: str,
+    calibration: CalibrationData,
+    recorrect: bool = True,
+    db: AsyncSession = Depends(get_write_db)
+):
+    """
+    Add a calibration version for one metric of a device. With recorrect,
+    readings stored since effective_from are corrected again from their raw values
+    """
+    if calibration.metric not in CALIBRATED_METRICS:
+        raise HTTPException(status_code=422, detail=f"Calibrated metrics are {', '.join(CALIBRATED_METRICS)}")
+    if calibration.points:
+        try:
+            knots(calibration.points)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    now = datetime.utcnow()
+    effective_from = _naive_utc(calibration.effective_from) if calibration.effective_from else now
+
+    # Bumping first takes the config_versions row lock, so concurrent additions get distinct versions
+    config_version = await bump_config_version(db, CALIBRATIONS_VERSION)
+    latest = await db.scalar(select(func.max(Calibration.version)).where(
+        Calibration.device_id == device_id, Calibration.metric == calibration.metric))
+    row = Calibration(device_id=device_id, metric=calibration.metric, version=(latest or 0) + 1,
+                      effective_from=effective_from, points=calibration.points, note=calibration.note,
+                      created_at=now)
+    db.add(row)
+    await db.commit()
+    await calibrations_changed(config_version)
+
+    recorrected = None
+    if recorrect and effective_from < now:
+        recorrected = await recalibrate(calibration_store, device_id, start=effective_from)
+    return {"device_id": device_id, **_calibration_info(row), "recorrected": recorrected}
+
+@app.post("/api/calibrations/{device_id}/recorrect")
+async def recorrect_readings(device_id: str, start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """Correct a device's stored readings again with the current calibrations"""
+    return await recalibrate(calibration_store, device_id, start=_naive_utc(start) if start else None,
+                             end=_naive_utc(end) if end else None)
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     """WebSocket endpoint for real-time data streaming"""
@@ -407,7 +1065,7 @@ async def websocket_endpoint(websocket: WebSocket):
     
     try:
         # Send current data on connection
-        await websocket.send_json(latest_readings)
+        await websocket.send_json(await state.get_latest())
         
         # Keep connection alive
         while True:
@@ -419,38 +1077,484 @@ async def websocket_endpoint(websocket: WebSocket):
 
 # Helper functions
 
-async def save_sensor_reading(data: dict):
-    """Save sensor reading to database"""
-    db = SessionLocal()
+def enqueue_reading(payload: dict) -> bool:
+    """Queue a device payload for the ingest worker (safe to call from any thread)"""
+    ingest_stats["received"] += 1
     try:
-        sensors = data.get("sensors", {})
-        reading = SensorReading(
-            device_id=data.get("device_id"),
-            timestamp=datetime.fromtimestamp(data.get("timestamp", 0) / 1000),
-            ph=sensors.get("ph"),
-            water_temp=sensors.get("water_temp"),
-            air_temp=sensors.get("air_temp"),
-            humidity=sensors.get("humidity"),
-            ec=sensors.get("ec"),
-            tds=sensors.get("tds"),
-            lux=sensors.get("lux"),
-            full_spectrum=sensors.get("full_spectrum"),
-            infrared=sensors.get("infrared"),
-            visible=sensors.get("visible")
-        )
-        db.add(reading)
-        db.commit()
+        ingest_queue.put_nowait((time.monotonic(), payload))
+        return True
+    except queue.Full:
+        ingest_stats["dropped"] += 1
+        return False
+
+def _valid_payloads(payloads: List[dict]) -> List[dict]:
+    """Normalized payloads, counting those that cannot be stored as invalid"""
+    valid = [payload for payload in map(normalize_payload, payloads) if payload is not None]
+    if len(valid) < len(payloads):
+        ingest_stats["invalid"] += len(payloads) - len(valid)
+        metrics.INGEST_INVALID_PAYLOADS.inc(len(payloads) - len(valid))
+    return valid
+
+def _drain_ingest_queue(max_items: int) -> list:
+    """Take up to max_items queued entries without blocking"""
+    batch = []
+    while len(batch) < max_items:
+        try:
+            batch.append(ingest_queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+async def process_ingest_batch(batch: list):
+    """Drop redeliveries, spool (or persist) the rest, then update shared state and notify every worker"""
+    # Checked before spooling: the spool drainer retries a batch until the database takes it
+    payloads = _valid_payloads([payload for _, payload in batch])
+    # Redeliveries still show the device is alive
+    seen = {payload["device_id"] for payload in payloads}
+    unique = recent_keys.filter(payloads)
+    ingest_stats["duplicates"] += len(payloads) - len(unique)
+    payloads = unique
+    # Readings without a timestamp are stamped on arrival
+    received_ms = round(time.time() * 1000)
+    payloads = [payload if payload.get("timestamp") is not None else {**payload, "timestamp": received_ms}
+                for payload in payloads]
+    try:
+        metrics.CALIBRATION_CORRECTIONS.inc(calibration_store.apply(payloads))
+    except Exception as e:
+        print(f"Error applying calibrations: {e}")
+    try:
+        derived_metrics.annotate(payloads)
+    except Exception as e:
+        print(f"Error computing derived metrics: {e}")
+    
+    spooled = False
+    if not payloads:
+        spooled = True
+    elif spool is not None:
+        # Durable on local disk first; the spool drainer loads it into the database
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, spool.append, payloads)
+            spooled = True
+        except OSError as e:
+            print(f"Error appending to spool, writing to the database directly: {e}")
+    if not spooled:
+        try:
+            await persist_payloads(payloads)
+        except Exception as e:
+            # Lost: the redelivery must not be dropped as a duplicate
+            recent_keys.forget(payloads)
+            print(f"Error saving sensor readings: {e}")
+    
+    # Separately, so a failed latest-readings update still reaches the WebSocket clients
+    try:
+        await state.set_latest({payload.get("device_id"): payload for payload in payloads})
+    except Exception as e:
+        print(f"Error saving latest readings to shared state: {e}")
+    try:
+        await state.publish({"type": "readings", "payloads": payloads, "seen": sorted(seen)})
     except Exception as e:
-        print(f"Error saving sensor reading: {e}")
-    finally:
-        db.close()
+        print(f"Error publishing readings to shared state: {e}")
+    
+    # Lag is measured from the oldest item in the batch being queued
+    lag_ms = (time.monotonic() - batch[0][0]) * 1000
+    ingest_stats["processed"] += len(batch)
+    ingest_stats["batches"] += 1
+    ingest_stats["last_batch_size"] = len(batch)
+    ingest_stats["last_lag_ms"] = lag_ms
+    ingest_stats["max_lag_ms"] = max(ingest_stats["max_lag_ms"], lag_ms)
+
+async def ingest_worker():
+    """Drain the ingest queue in batches until cancelled"""
+    while True:
+        batch = _drain_ingest_queue(INGEST_BATCH_SIZE)
+        if not batch:
+            await asyncio.sleep(INGEST_FLUSH_INTERVAL)
+            continue
+        try:
+            await process_ingest_batch(batch)
+        except Exception as e:
+            print(f"Error processing ingest batch: {e}")
+
+async def flush_ingest_queue():
+    """Process everything currently queued (used on shutdown and by replay tooling)"""
+    while True:
+        batch = _drain_ingest_queue(INGEST_BATCH_SIZE)
+        if not batch:
+            return
+        try:
+            await process_ingest_batch(batch)
+        except Exception as e:
+            print(f"Error processing ingest batch: {e}")
+
+async def persist_payloads(payloads: List[dict]):
+    """Write readings plus the alerts they raise in one transaction"""
+    inserted = await save_sensor_readings(payloads)
+    ingest_stats["persisted"] += inserted
+    ingest_stats["duplicates_db"] += len(payloads) - inserted
+
+async def load_spool_batch(batch):
+    """Persist one batch read from the spool and acknowledge it; payloads that cannot be stored are quarantined"""
+    loop = asyncio.get_running_loop()
+    payloads = [normalize_payload(payload) for payload in batch.payloads]
+    rejected = [original for original, payload in zip(batch.payloads, payloads) if payload is None]
+    payloads = [payload for payload in payloads if payload is not None]
+    if rejected:
+        # Spooled before payloads were checked; retrying them would hold up every later reading
+        await loop.run_in_executor(None, spool.quarantine, rejected)
+        ingest_stats["spool_quarantined"] += len(rejected)
+        print(f"Spool: quarantined {len(rejected)} payloads that cannot be stored")
+    if payloads:
+        await persist_payloads(payloads)
+    await loop.run_in_executor(None, spool.ack, batch.end)
+    metrics.SPOOL_LOADED_RECORDS.inc(len(payloads))
+    ingest_stats["spool_lag_ms"] = (time.time() - batch.oldest_appended_at) * 1000
+
+async def spool_drainer():
+    """Load spooled readings into the database, backing off while it is unavailable"""
+    loop = asyncio.get_running_loop()
+    retry_delay = 1.0
+    while True:
+        batch = await loop.run_in_executor(None, spool.read, INGEST_BATCH_SIZE)
+        if not batch.payloads:
+            # Idle: release segments that were fully loaded and make sure
+            # recent appends reach the disk within the fsync interval
+            if batch.end != spool.cursor:
+                await loop.run_in_executor(None, spool.ack, batch.end)
+            await loop.run_in_executor(None, spool.sync)
+            await asyncio.sleep(INGEST_FLUSH_INTERVAL)
+            continue
+        try:
+            await load_spool_batch(batch)
+            retry_delay = 1.0
+        except Exception as e:
+            ingest_stats["spool_load_failures"] += 1
+            metrics.SPOOL_LOAD_FAILURES.inc()
+            print(f"Error loading spooled readings, retrying in {retry_delay:.0f}s: {e}")
+            await asyncio.sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, SPOOL_RETRY_MAX_SECONDS)
+
+async def drain_spool():
+    """Load everything currently spooled, stopping at the first database error"""
+    while True:
+        batch = spool.read(INGEST_BATCH_SIZE)
+        if not batch.payloads:
+            return
+        try:
+            await load_spool_batch(batch)
+        except Exception as e:
+            print(f"Error loading spooled readings, {spool.pending_bytes():,} bytes kept for next start: {e}")
+            return
 
-async def check_thresholds(device_id: str, data: dict):
-    """Check sensor values against thresholds and create alerts"""
-    db = SessionLocal()
+async def start_ingest():
+    """Open the spool (replaying anything left from a previous run) and start the ingest tasks"""
+    global spool, spool_task, ingest_task
+    if INGEST_SPOOL_DIR:
+        # Each worker needs its own spool: take the first directory no other worker
+        # holds, so a restarted set of workers replays every directory left behind
+        directory, n = INGEST_SPOOL_DIR, 0
+        while spool is None:
+            try:
+                spool = Spool(directory, int(SPOOL_SEGMENT_MB * 1024 * 1024), SPOOL_FSYNC_INTERVAL_MS / 1000)
+            except SpoolLocked:
+                n += 1
+                directory = f"{INGEST_SPOOL_DIR}.{n}"
+        if spool.replayed_bytes:
+            print(f"Spool: replaying {spool.replayed_bytes:,} bytes left from a previous run")
+        spool_task = asyncio.create_task(spool_drainer())
+    ingest_task = asyncio.create_task(ingest_worker())
+
+async def stop_ingest():
+    """Stop the ingest tasks, then persist everything still queued or spooled"""
+    tasks = [task for task in (ingest_task, spool_task) if task]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    
+    await flush_ingest_queue()
+    if spool is not None:
+        await drain_spool()
+        spool.close()
+
+async def partition_maintenance_worker():
+    """Keep sensor_readings partitions created ahead and expire old ones"""
+    while True:
+        try:
+            result = await maintain_partitions()
+            if result is None:
+                # SQLite, or a PostgreSQL schema without partitioning
+                return
+            if result["created"] or result["removed"]:
+                print(f"Partition maintenance: created {result['created']}, removed {result['removed']}")
+        except Exception as e:
+            print(f"Error maintaining sensor_readings partitions: {e}")
+        await asyncio.sleep(PARTITION_MAINTENANCE_HOURS * 3600)
+
+async def run_predictions() -> dict:
+    """Run a prediction cycle for the devices seen recently and tell the other workers"""
+    since = time.time() - PREDICTION_ACTIVE_SECONDS
+    device_ids = [device_id for device_id, seen in presence.last_seen.items() if seen >= since]
+    summary = await prediction_scheduler.run_cycle(device_ids)
+    try:
+        await state.publish({"type": "predictions", "created_at": summary["created_at"]})
+    except Exception as e:
+        # Other workers read a device's stored results when it is missing from their cache
+        print(f"Error publishing prediction cycle: {e}")
+    return summary
+
+async def prediction_worker():
+    """Run the prediction models every PREDICTION_INTERVAL_SECONDS (leader only)"""
+    if PREDICTION_INTERVAL_SECONDS <= 0:
+        return
+    # A new leader keeps the schedule of the previous one
+    await asyncio.sleep(prediction_scheduler.seconds_until_due(PREDICTION_INTERVAL_SECONDS))
+    while True:
+        try:
+            await run_predictions()
+        except Exception as e:
+            print(f"Error running predictions: {e}")
+        await asyncio.sleep(PREDICTION_INTERVAL_SECONDS)
+
+async def run_model_update(dry_run: bool = False) -> dict:
+    """Update the harvest model and, when a new version was published, tell the leader to load it"""
+    summary = await model_updater.run(dry_run)
+    if summary.get("published"):
+        try:
+            await state.publish({"type": "models", "model": summary["model"], "version": summary["published"]})
+        except Exception as e:
+            # The leader still checks the active versions at every cycle
+            print(f"Error publishing model update: {e}")
+    return summary
+
+async def model_update_worker():
+    """Update the harvest model every MODEL_UPDATE_INTERVAL_SECONDS (leader only)"""
+    if MODEL_UPDATE_INTERVAL_SECONDS <= 0:
+        return
+    # A new leader keeps the schedule recorded with the active model
+    delay = await asyncio.get_running_loop().run_in_executor(
+        None, model_updater.seconds_until_due, MODEL_UPDATE_INTERVAL_SECONDS)
+    await asyncio.sleep(delay)
+    while True:
+        try:
+            summary = await run_model_update()
+            if summary["outcome"] != "insufficient_data":
+                print(f"Harvest model update: {summary['outcome']}")
+        except Exception as e:
+            print(f"Error updating models: {e}")
+        await asyncio.sleep(MODEL_UPDATE_INTERVAL_SECONDS)
+
+async def sqlite_maintenance_worker():
+    """Periodically checkpoint the WAL and run incremental vacuum"""
+    while True:
+        await asyncio.sleep(SQLITE_MAINTENANCE_INTERVAL)
+        try:
+            if await maintain_sqlite() is None:
+                # Not running in SQLite edge mode
+                return
+        except Exception as e:
+            print(f"Error during SQLite maintenance: {e}")
+
+async def refresh_thresholds(version: Optional[int] = None):
+    """Recompile thresholds if the stored version (or the one announced) is newer than the cached one"""
+    if version is not None and version <= threshold_store.version:
+        return
+    async with threshold_lock:
+        async with WriteSessionLocal() as db:
+            current = await get_config_version(db, THRESHOLDS_VERSION)
+            if current <= threshold_store.version:
+                return
+            profiles = (await db.execute(select(
+                ThresholdProfile.device_id, ThresholdProfile.plant_type, ThresholdProfile.growth_stage,
+                *(getattr(ThresholdProfile, field) for field in THRESHOLD_FIELDS)))).all()
+            devices = (await db.execute(select(Device.device_id, Device.plant_type, Device.growth_stage))).all()
+        threshold_store.load(current, profiles, devices)
+
+async def thresholds_changed(version: int):
+    """Apply a committed threshold change here, then tell the other workers"""
+    await refresh_thresholds(version)
+    try:
+        await state.publish({"type": "thresholds", "version": version})
+    except Exception as e:
+        # The other workers pick it up on their next periodic refresh
+        print(f"Error publishing threshold change: {e}")
+
+async def refresh_calibrations(version: Optional[int] = None):
+    """Recompile calibrations if the stored version (or the one announced) is newer than the cached one"""
+    if version is not None and version <= calibration_store.version:
+        return
+    async with calibration_lock:
+        async with WriteSessionLocal() as db:
+            current = await get_config_version(db, CALIBRATIONS_VERSION)
+            if current <= calibration_store.version:
+                return
+            calibrations = (await db.execute(select(
+                Calibration.device_id, Calibration.metric, Calibration.version,
+                Calibration.effective_from, Calibration.points))).all()
+        calibration_store.load(current, calibrations)
+
+async def calibrations_changed(version: int):
+    """Apply a committed calibration change here, then tell the other workers"""
+    await refresh_calibrations(version)
+    try:
+        await state.publish({"type": "calibrations", "version": version})
+    except Exception as e:
+        print(f"Error publishing calibration change: {e}")
+
+async def config_refresh_worker():
+    """Catch threshold and calibration changes whose event this worker missed"""
+    while True:
+        await asyncio.sleep(THRESHOLD_REFRESH_SECONDS)
+        try:
+            await refresh_thresholds()
+        except Exception as e:
+            print(f"Error refreshing thresholds: {e}")
+        try:
+            await refresh_calibrations()
+        except Exception as e:
+            print(f"Error refreshing calibrations: {e}")
+
+async def load_presence():
+    """Seed the presence tracker from the devices table"""
+    async with WriteSessionLocal() as db:
+        rows = (await db.execute(select(Device.device_id, Device.last_seen, Device.status))).all()
+    presence.load(
+        (device_id, (last_seen - datetime(1970, 1, 1)).total_seconds() if last_seen else None, status)
+        for device_id, last_seen, status in rows
+    )
+
+async def flush_presence(changes=()):
+    """Write changed last_seen/status values in one statement, plus alerts for devices that went offline"""
+    dirty = presence.drain_dirty()
+    if not dirty and not changes:
+        return
+    devices = Device.__table__
+    statement = (
+        update(devices)
+        .where(devices.c.device_id == bindparam("key"))
+        .values(last_seen=bindparam("seen"), status=bindparam("state"))
+    )
+    alerts = [
+        Alert(
+            device_id=device_id,
+            alert_type="offline",
+            severity="warning",
+            message=f"No data received for {DEVICE_OFFLINE_SECONDS:.0f}s",
+            value=time.time() - presence.last_seen[device_id],
+            threshold=DEVICE_OFFLINE_SECONDS
+        )
+        for device_id, status in changes if status == OFFLINE
+    ]
+    try:
+        async with WriteSessionLocal() as db:
+            if dirty:
+                # Devices that are not registered match no row and are skipped
+                await db.execute(statement, [
+                    {"key": device_id, "seen": datetime.utcfromtimestamp(last_seen), "state": status}
+                    for device_id, last_seen, status in dirty
+                ])
+            db.add_all(alerts)
+            await db.commit()
+    except Exception:
+        # Keep the rows for the next flush
+        presence.mark_dirty(device_id for device_id, _, _ in dirty)
+        raise
+    for alert in alerts:
+        metrics.ALERT_WRITES.inc(labels=(alert.alert_type,))
+
+async def presence_worker():
+    """Expire silent devices every tick; the leader publishes status changes and flushes presence in batches"""
+    last_flush = time.monotonic()
+    while True:
+        await asyncio.sleep(PRESENCE_TICK_SECONDS)
+        presence.expire(time.time())
+        changes = presence.drain_changes()
+        if not is_leader:
+            # Followers keep the same view but leave writes and notifications to the leader
+            continue
+        for device_id, status in changes:
+            metrics.DEVICE_STATUS_CHANGES.inc(labels=(status,))
+            try:
+                await state.publish({
+                    "type": "device_status",
+                    "device_id": device_id,
+                    "status": status,
+                    "last_seen": datetime.utcfromtimestamp(presence.last_seen[device_id]).isoformat()
+                })
+            except Exception as e:
+                print(f"Error publishing device status: {e}")
+        if changes or time.monotonic() - last_flush >= PRESENCE_FLUSH_INTERVAL:
+            last_flush = time.monotonic()
+            try:
+                await flush_presence(changes)
+            except Exception as e:
+                print(f"Error saving device presence: {e}")
+
+def _reading_from_payload(data: dict) -> Dict[str, Any]:
+    """Build sensor_readings column values from a device payload"""
+    sensors = data.get("sensors", {})
+    derived = data.get("derived") or {}
+    raw = data.get("raw") or {}
+    return {
+        "device_id": data.get("device_id"),
+        "timestamp": datetime.utcfromtimestamp(data.get("timestamp", 0) / 1000),
+        "ph": sensors.get("ph"),
+        "water_temp": sensors.get("water_temp"),
+        "air_temp": sensors.get("air_temp"),
+        "humidity": sensors.get("humidity"),
+        "ec": sensors.get("ec"),
+        "tds": sensors.get("tds"),
+        "lux": sensors.get("lux"),
+        "full_spectrum": sensors.get("full_spectrum"),
+        "infrared": sensors.get("infrared"),
+        "visible": sensors.get("visible"),
+        **{name: derived.get(name) for name in DERIVED_FIELDS},
+        **{column: raw.get(metric) for metric, column in RAW_COLUMNS.items()}
+    }
+
+async def save_sensor_readings(payloads: List[dict]) -> int:
+    """
+    Save a batch of sensor readings and the alerts they raise in one transaction
+
+    Readings already stored (same device and timestamp) are skipped by the
+    database and raise no alerts. Returns the number of readings inserted.
+    """
+    start = time.perf_counter()
+    rows = [_reading_from_payload(data) for data in payloads]
+    alerts = []
+    # One commit for the whole batch (group commit through the writer connection)
+    async with WriteSessionLocal() as db:
+        result = await db.execute(insert_new_readings(), rows)
+        inserted = set(map(tuple, result.all()))
+        inserted_count = len(inserted)
+        new_payloads, new_rows = [], []
+        for payload, row in zip(payloads, rows):
+            key = (row["device_id"], row["timestamp"])
+            if key in inserted:
+                inserted.discard(key)
+                new_payloads.append(payload)
+                new_rows.append(row)
+                alerts.extend(check_thresholds(row["device_id"], payload))
+        alerts.extend(detect_anomalies(new_payloads))
+        rollup = daily_rollup_rows(new_rows)
+        if rollup:
+            now = datetime.utcnow()
+            await db.execute(upsert_daily_metrics(), [{**row, "updated_at": now} for row in rollup])
+        db.add_all(alerts)
+        await db.commit()
+    metrics.DB_FLUSH_BATCH_SIZE.observe(len(payloads))
+    metrics.DB_FLUSH_SECONDS.observe(time.perf_counter() - start)
+    if inserted_count < len(rows):
+        metrics.INGEST_DUPLICATES.inc(len(rows) - inserted_count, labels=("database",))
+    for alert in alerts:
+        metrics.ALERT_WRITES.inc(labels=(alert.alert_type,))
+    return inserted_count
+
+def check_thresholds(device_id: str, data: dict) -> List[Alert]:
+    """Check sensor values against thresholds and return the alerts to create"""
+    alerts = []
     try:
         sensors = data.get("sensors", {})
-        config = threshold_configs[device_id]
+        config = threshold_store.for_device(device_id)
+        metrics.THRESHOLD_EVALUATIONS.inc()
         
         # Check pH
         if sensors.get("ph"):
@@ -464,7 +1568,7 @@ async def check_thresholds(device_id: str, data: dict):
                     value=ph,
                     threshold=config.ph_min if ph < config.ph_min else config.ph_max
                 )
-                db.add(alert)
+                alerts.append(alert)
         
         # Check temperature
         if sensors.get("water_temp"):
@@ -478,7 +1582,7 @@ async def check_thresholds(device_id: str, data: dict):
                     value=temp,
                     threshold=config.temp_min if temp < config.temp_min else config.temp_max
                 )
-                db.add(alert)
+                alerts.append(alert)
         
         # Check humidity
         if sensors.get("humidity"):
@@ -492,13 +1596,101 @@ async def check_thresholds(device_id: str, data: dict):
                     value=humidity,
                     threshold=config.humidity_min if humidity < config.humidity_min else config.humidity_max
                 )
-                db.add(alert)
+                alerts.append(alert)
         
-        db.commit()
     except Exception as e:
         print(f"Error checking thresholds: {e}")
-    finally:
-        db.close()
+    return alerts
+
+def detect_anomalies(payloads: List[dict]) -> List[Alert]:
+    """Feed a batch of new readings to the anomaly detector and return the alerts to create"""
+    if not payloads or not ANOMALY_METRICS:
+        return []
+    try:
+        # None (metric not reported) becomes NaN and leaves that baseline untouched
+        values = np.array([[data.get("sensors", {}).get(name) for name in ANOMALY_METRICS] for data in payloads],
+                          dtype=float)
+        anomalies = anomaly_detector.observe(
+            [data.get("device_id") for data in payloads],
+            [data.get("timestamp", 0) / 1000 for data in payloads],
+            values)
+    except Exception as e:
+        print(f"Error detecting anomalies: {e}")
+        return []
+
+    alerts = []
+    for anomaly in anomalies:
+        metrics.ANOMALIES_DETECTED.inc(labels=(anomaly.metric, anomaly.kind))
+        label = ANOMALY_SPECS[anomaly.metric].label
+        if anomaly.kind == RATE:
+            message = f"{label} changed too fast: {anomaly.expected:.2f} -> {anomaly.value:.2f}"
+        elif anomaly.kind == SPIKE:
+            message = f"{label} spike: {anomaly.value:.2f}, baseline {anomaly.expected:.2f}"
+        else:
+            message = f"{label} drifting: {anomaly.value:.2f}, baseline {anomaly.expected:.2f}"
+        alerts.append(Alert(
+            device_id=anomaly.device_id,
+            alert_type=f"anomaly_{anomaly.kind}",
+            severity="warning" if anomaly.kind in (SPIKE, RATE) else "info",
+            message=message,
+            value=anomaly.value,
+            threshold=anomaly.expected,
+            score=round(anomaly.score, 2)
+        ))
+    return alerts
+
+# ============================================================================
+# ADMIN / PROFILING ENDPOINTS
+# ============================================================================
+
+@app.get("/api/admin/profile", dependencies=[Depends(require_admin)])
+async def profile_process(seconds: float = 10, hz: int = 100):
+    """
+    Sample every thread in the API process (event loop, MQTT network thread,
+    inference threads) and return the stacks in collapsed format for
+    flamegraph.pl or speedscope
+    """
+    if not 0 < seconds <= MAX_PROFILE_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be between 0 and {MAX_PROFILE_SECONDS}")
+    if not 0 < hz <= MAX_PROFILE_HZ:
+        raise HTTPException(status_code=400, detail=f"hz must be between 1 and {MAX_PROFILE_HZ}")
+    if profiler.running:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    
+    loop = asyncio.get_running_loop()
+    try:
+        result = await loop.run_in_executor(None, profiler.profile, seconds, hz)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    filename = f"agronomia-profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.folded"
+    return PlainTextResponse(
+        render_collapsed(result["stacks"]),
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Profile-Samples": str(result["samples"]),
+            "X-Profile-Duration": f"{result['duration_s']:.3f}"
+        }
+    )
+
+@app.get("/api/admin/trace", dependencies=[Depends(require_admin)])
+async def get_traced_routes():
+    """List routes with per-request tracing enabled"""
+    return {"routes": sorted(tracer.enabled_routes)}
+
+@app.put("/api/admin/trace", dependencies=[Depends(require_admin)])
+async def set_route_tracing(toggle: TraceToggle):
+    """Enable or disable per-request span tracing for a route template"""
+    known_routes = {route.path for route in app.routes}
+    if toggle.route not in known_routes:
+        raise HTTPException(status_code=404, detail=f"Unknown route: {toggle.route}")
+    tracer.set_enabled(toggle.route, toggle.enabled)
+    return {"routes": sorted(tracer.enabled_routes)}
+
+@app.get("/api/admin/traces", dependencies=[Depends(require_admin)])
+async def get_traces(route: Optional[str] = None, limit: int = 50):
+    """Most recent request traces, oldest first"""
+    return tracer.recent(route, limit)
 
 # ============================================================================
 # PLANT RECOGNITION ENDPOINTS
@@ -575,19 +1767,24 @@ async def identify_plant(file: UploadFile = File(...)):
     """
     try:
         # Read image file
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
+        with trace_span("read_upload"):
+            contents = await file.read()
         
-        # Convert to RGB if needed
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
+        with trace_span("decode_image"):
+            image = Image.open(io.BytesIO(contents))
+            
+            # Convert to RGB if needed
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
         
         # Resize and convert to array
-        image = image.resize((224, 224))
-        img_array = np.array(image)
+        with trace_span("preprocess"):
+            image = image.resize((224, 224))
+            img_array = np.array(image)
         
         # Get model
-        model = get_plant_recognition_model()
+        with trace_span("load_model"):
+            model = get_plant_recognition_model()
         
         # Check if model is in demo mode
         if isinstance(model, dict) and model.get("status") == "demo_mode":
@@ -626,7 +1823,10 @@ async def identify_plant(file: UploadFile = File(...)):
             }
         
         # Make prediction
-        result = model.predict(img_array, top_k=5)
+        with trace_span("inference"):
+            start = time.perf_counter()
+            result = model.predict(img_array, top_k=5)
+            metrics.MODEL_INFERENCE_SECONDS.observe(time.perf_counter() - start, ("plant_recognition",))
         
         return {
             "status": "success",
@@ -708,11 +1908,14 @@ async def broadcast_to_websockets(data: dict):
     """Broadcast sensor data to all connected WebSocket clients"""
     if websocket_connections:
         disconnected = []
+        metrics.WEBSOCKET_SEND_BACKLOG.inc(len(websocket_connections))
         for websocket in websocket_connections:
             try:
                 await websocket.send_json(data)
             except:
                 disconnected.append(websocket)
+            finally:
+                metrics.WEBSOCKET_SEND_BACKLOG.dec()
         
         # Remove disconnected clients
         for ws in disconnected:
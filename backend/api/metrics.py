@@ -0,0 +1,314 @@
+"""
+Prometheus-style metrics for the Agronomia API
+Counters, gauges and histograms record into per-thread shards, so the hot
+path (MQTT thread, ingest worker, request handlers) never takes a lock.
+Shards are summed only when /metrics is scraped.
+"""
+
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from sub-millisecond ingest work to slow queries
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Batch size buckets for the ingest pipeline
+BATCH_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+# Duration buckets in seconds for scheduled jobs over the whole fleet
+JOB_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value) -> str:
+    """Escape a label value for the text exposition format"""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    """Base class holding one shard per recording thread"""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[dict] = []
+        self._shards_lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            # Taken once per thread, never on subsequent recordings
+            shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+        return shard
+
+    def _snapshots(self) -> List[dict]:
+        # dict.copy() is atomic under the GIL, so concurrent writers are safe
+        return [shard.copy() for shard in list(self._shards)]
+
+    def _format_labels(self, values: LabelValues, extra: Optional[Dict[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, values)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, labels: LabelValues = ()):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0.0) + amount
+
+    def value(self, labels: LabelValues = ()) -> float:
+        return sum(s.get(labels, 0.0) for s in self._snapshots())
+
+    def samples(self) -> List[str]:
+        totals: Dict[LabelValues, float] = {}
+        for snapshot in self._snapshots():
+            for labels, value in snapshot.items():
+                totals[labels] = totals.get(labels, 0.0) + value
+        return [f"{self.name}{self._format_labels(labels)} {value}" for labels, value in sorted(totals.items())]
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down
+
+    Either incremented/decremented from the hot path, or computed at scrape
+    time from callbacks registered with set_function() (one per label set).
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._functions: Dict[LabelValues, Callable[[], float]] = {}
+
+    def inc(self, amount: float = 1.0, labels: LabelValues = ()):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, labels: LabelValues = ()):
+        self.inc(-amount, labels)
+
+    def set_function(self, function: Callable[[], float], labels: LabelValues = ()):
+        self._functions[labels] = function
+
+    def value(self, labels: LabelValues = ()) -> float:
+        if labels in self._functions:
+            return float(self._functions[labels]())
+        return sum(s.get(labels, 0.0) for s in self._snapshots())
+
+    def samples(self) -> List[str]:
+        if self._functions:
+            lines = []
+            for labels, function in sorted(self._functions.items()):
+                try:
+                    lines.append(f"{self.name}{self._format_labels(labels)} {float(function())}")
+                except Exception:
+                    pass
+            return lines
+        totals: Dict[LabelValues, float] = {}
+        for snapshot in self._snapshots():
+            for labels, value in snapshot.items():
+                totals[labels] = totals.get(labels, 0.0) + value
+        return [f"{self.name}{self._format_labels(labels)} {value}" for labels, value in sorted(totals.items())]
+
+
+class Histogram(_Metric):
+    """Bucketed distribution with sum and count"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, labels: LabelValues = ()):
+        shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            # Per-bucket counts, +Inf bucket, then the running sum
+            counts = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self) -> List[str]:
+        merged: Dict[LabelValues, list] = {}
+        for snapshot in self._snapshots():
+            for labels, counts in snapshot.items():
+                counts = list(counts)
+                if labels in merged:
+                    merged[labels] = [a + b for a, b in zip(merged[labels], counts)]
+                else:
+                    merged[labels] = counts
+
+        lines = []
+        for labels, counts in sorted(merged.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{self._format_labels(labels, {'le': le})} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(labels)} {counts[-1]}")
+            lines.append(f"{self.name}_count{self._format_labels(labels)} {cumulative}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+
+def render_latest() -> str:
+    """Text exposition format (0.0.4) for every registered metric"""
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# ============================================================================
+# API METRICS
+# ============================================================================
+
+MQTT_MESSAGES_RECEIVED = Counter(
+    "agronomia_mqtt_messages_received_total", "MQTT messages received from devices")
+MQTT_MESSAGES_DROPPED = Counter(
+    "agronomia_mqtt_messages_dropped_total", "MQTT messages dropped before ingestion", ["reason"])
+MQTT_PAYLOAD_BYTES = Counter(
+    "agronomia_mqtt_payload_bytes_total", "Bytes of MQTT payloads received, by encoding", ["format"])
+
+INGEST_SHARD_MESSAGES = Counter(
+    "agronomia_ingest_shard_messages_total", "MQTT messages handled by a standalone ingest shard", ["shard"])
+INGEST_SHARD_SKIPPED = Counter(
+    "agronomia_ingest_shard_skipped_total", "MQTT messages skipped because another shard owns the device", ["shard"])
+INGEST_SHARD_DEVICES = Gauge(
+    "agronomia_ingest_shard_devices", "Devices seen so far that this ingest shard owns", ["shard"])
+
+INGEST_INVALID_PAYLOADS = Counter(
+    "agronomia_ingest_invalid_payloads_total", "Payloads rejected before spooling because they cannot be stored")
+INGEST_QUEUE_DEPTH = Gauge(
+    "agronomia_ingest_queue_depth", "Readings waiting in the ingest queue")
+DB_FLUSH_BATCH_SIZE = Histogram(
+    "agronomia_db_flush_batch_size", "Readings written per database flush", buckets=BATCH_BUCKETS)
+DB_FLUSH_SECONDS = Histogram(
+    "agronomia_db_flush_seconds", "Time spent writing one batch of readings to the database")
+DEDUPE_LOOKUPS = Counter(
+    "agronomia_dedupe_lookups_total", "Readings checked against the recent-key cache")
+INGEST_DUPLICATES = Counter(
+    "agronomia_ingest_duplicates_total", "Duplicate readings dropped, by where they were caught", ["stage"])
+DEDUPE_CACHE_KEYS = Gauge(
+    "agronomia_dedupe_cache_keys", "Reading keys held in the recent-key cache")
+
+SPOOL_APPENDED_RECORDS = Counter(
+    "agronomia_spool_appended_records_total", "Readings appended to the ingest spool")
+SPOOL_LOADED_RECORDS = Counter(
+    "agronomia_spool_loaded_records_total", "Spooled readings loaded into the database")
+SPOOL_PENDING_BYTES = Gauge(
+    "agronomia_spool_pending_bytes", "Spooled bytes not yet loaded into the database")
+SPOOL_SEGMENTS = Gauge(
+    "agronomia_spool_segments", "Spool segment files on disk")
+SPOOL_LAG_SECONDS = Gauge(
+    "agronomia_spool_lag_seconds", "Age of the oldest reading in the last batch loaded from the spool")
+SPOOL_FSYNC_SECONDS = Histogram(
+    "agronomia_spool_fsync_seconds", "Time spent in fsync of the spool")
+SPOOL_LOAD_FAILURES = Counter(
+    "agronomia_spool_load_failures_total", "Spool batches that failed to load and will be retried")
+SPOOL_CORRUPT_RECORDS = Counter(
+    "agronomia_spool_corrupt_records_total", "Spool records skipped or truncated because of a bad checksum")
+SPOOL_QUARANTINED_RECORDS = Counter(
+    "agronomia_spool_quarantined_records_total", "Spooled payloads set aside because they cannot be loaded")
+
+DB_POOL_WAIT_SECONDS = Histogram(
+    "agronomia_db_pool_wait_seconds", "Time spent waiting to check out a pooled database connection", ["pool"])
+DB_POOL_CHECKOUTS = Counter(
+    "agronomia_db_pool_checkouts_total", "Database connections checked out from the pool", ["pool"])
+DB_POOL_TIMEOUTS = Counter(
+    "agronomia_db_pool_timeouts_total", "Checkouts that timed out waiting for a connection", ["pool"])
+DB_POOL_CHECKED_OUT = Gauge(
+    "agronomia_db_pool_checked_out", "Database connections currently checked out", ["pool"])
+DB_POOL_CONNECTIONS = Gauge(
+    "agronomia_db_pool_connections", "Database connections currently open, idle or checked out", ["pool"])
+
+SQLITE_WAL_FRAMES = Gauge(
+    "agronomia_sqlite_wal_frames", "Frames in the SQLite write-ahead log at the last checkpoint")
+SQLITE_FREELIST_PAGES = Gauge(
+    "agronomia_sqlite_freelist_pages", "Unused pages in the SQLite database file")
+SQLITE_MAINTENANCE_SECONDS = Histogram(
+    "agronomia_sqlite_maintenance_seconds", "Time spent in SQLite checkpoint and incremental vacuum")
+
+DEVICES_ONLINE = Gauge(
+    "agronomia_devices_online", "Devices that sent data within DEVICE_OFFLINE_SECONDS")
+DEVICE_STATUS_CHANGES = Counter(
+    "agronomia_device_status_changes_total", "Device online/offline transitions", ["status"])
+
+STATE_EVENTS_PUBLISHED = Counter(
+    "agronomia_state_events_published_total", "Events published to the other API workers")
+STATE_EVENTS_RECEIVED = Counter(
+    "agronomia_state_events_received_total", "Events received from the shared state backend")
+STATE_EVENTS_LOST = Counter(
+    "agronomia_state_events_lost_total", "Events overwritten in the shared-memory ring before this worker read them")
+STATE_LATEST_SKIPPED = Counter(
+    "agronomia_state_latest_skipped_total", "Latest readings not stored in shared memory because they exceed a slot")
+WORKER_IS_LEADER = Gauge(
+    "agronomia_worker_is_leader", "1 if this worker holds the leader lease (MQTT, presence, maintenance)")
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "agronomia_http_request_seconds", "HTTP request latency by route",
+    ["method", "route", "status"])
+
+WEBSOCKET_CLIENTS = Gauge(
+    "agronomia_websocket_clients", "Connected WebSocket clients")
+WEBSOCKET_SEND_BACKLOG = Gauge(
+    "agronomia_websocket_send_backlog", "WebSocket messages queued or in flight to clients")
+
+THRESHOLD_EVALUATIONS = Counter(
+    "agronomia_threshold_evaluations_total", "Readings evaluated against alert thresholds")
+ALERT_WRITES = Counter(
+    "agronomia_alert_writes_total", "Alerts written to the database", ["alert_type"])
+ANOMALIES_DETECTED = Counter(
+    "agronomia_anomalies_detected_total", "Anomalies found by the streaming detector", ["metric", "kind"])
+ANOMALY_DEVICES = Gauge(
+    "agronomia_anomaly_devices", "Devices with an anomaly baseline in this process")
+CALIBRATION_CORRECTIONS = Counter(
+    "agronomia_calibration_corrections_total", "Sensor values corrected by a device calibration at ingest")
+READINGS_RECALIBRATED = Counter(
+    "agronomia_readings_recalibrated_total", "Stored readings rewritten by a calibration re-correction")
+FEATURE_ROWS_LOADED = Counter(
+    "agronomia_feature_rows_loaded_total", "Readings loaded from the database to build feature windows")
+
+MODEL_INFERENCE_SECONDS = Histogram(
+    "agronomia_model_inference_seconds", "Model inference latency", ["model"])
+PREDICTION_CYCLE_SECONDS = Histogram(
+    "agronomia_prediction_cycle_seconds", "Scheduled prediction cycle duration, features to stored results",
+    buckets=JOB_BUCKETS)
+PREDICTION_JOB_SECONDS = Histogram(
+    "agronomia_prediction_job_seconds", "One model's batched run over all devices in a prediction cycle",
+    ["model"], buckets=JOB_BUCKETS)
+PREDICTIONS_STORED = Counter(
+    "agronomia_predictions_stored_total", "Device predictions stored by the prediction scheduler", ["model"])
+PREDICTION_JOB_FAILURES = Counter(
+    "agronomia_prediction_job_failures_total", "Scheduled model runs that failed or had no model to run",
+    ["model", "reason"])
+MODEL_UPDATES = Counter(
+    "agronomia_model_updates_total", "Incremental model update runs by outcome", ["model", "outcome"])
+MODEL_UPDATE_SECONDS = Histogram(
+    "agronomia_model_update_seconds", "Incremental model update duration, examples to published version",
+    ["model"], buckets=JOB_BUCKETS)
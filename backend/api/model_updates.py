@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+Incremental updates of the harvest model from recorded outcomes
+HarvestPredictor is trained on synthetic data. Every harvest in
+harvest_records labels the growth records of its cycle, the ones since the
+device's previous harvest: the days from each record to the harvest, and
+the harvest's yield. Once per MODEL_UPDATE_INTERVAL_SECONDS the leader
+collects the harvests recorded since the model's last update and
+warm-starts the active model on them (HarvestPredictor.update adds
+MODEL_UPDATE_STAGES boosting stages fitted to the new examples) instead of
+retraining it from scratch.
+
+Each example's inputs are built the way a prediction cycle would have built
+them at the time of its growth record: HarvestJob's climate averages over
+the 24 hours before it (features.py), the record's plant measurements and
+days since the cycle started. The device's current plant type is used.
+
+The newest MODEL_UPDATE_HOLDOUT of the harvests are held out. Each of the
+two estimators keeps its new stages only if they lower its mean absolute
+error on the held-out examples. If either improved, the model is published
+to the model registry as the new active version, which prediction cycles
+load at their next run; otherwise nothing changes. Held-out harvests are
+not marked as used, so they are training data for the next update. An
+estimator with MODEL_UPDATE_MAX_ESTIMATORS stages is no longer updated and
+needs a full retrain.
+
+NutrientOptimizer is not updated: the platform does not record which
+adjustments were made or what they did, so it has no outcomes to learn from.
+
+Usage:
+    python model_updates.py              # update now, promote if better
+    python model_updates.py --dry-run    # evaluate only
+"""
+
+import argparse
+import asyncio
+import bisect
+import copy
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select
+
+import metrics
+from calibration import epoch_seconds
+from database import Device, GrowthRecord, HarvestRecord, SessionLocal, close_db
+from features import QUERY_DEVICES, FeatureStore, FeatureWindow, fill_gaps
+from predictions import WINDOW_FEATURES, WINDOW_HOURS, DeviceInfo, HarvestJob, growth_inputs
+from model_registry import MODELS, ModelRegistry  # On sys.path via predictions
+
+MODEL_UPDATE_INTERVAL_SECONDS = float(os.getenv("MODEL_UPDATE_INTERVAL_SECONDS", "86400"))  # 0 disables
+MODEL_UPDATE_STAGES = int(os.getenv("MODEL_UPDATE_STAGES", "50"))
+MODEL_UPDATE_MAX_ESTIMATORS = int(os.getenv("MODEL_UPDATE_MAX_ESTIMATORS", "1000"))
+# Share of the harvests, newest first, held out to decide on promotion
+MODEL_UPDATE_HOLDOUT = float(os.getenv("MODEL_UPDATE_HOLDOUT", "0.25"))
+MODEL_UPDATE_MIN_HARVESTS = int(os.getenv("MODEL_UPDATE_MIN_HARVESTS", "4"))
+
+# Devices whose growth records share one feature window when building examples
+EXAMPLE_DEVICES = 50
+# How prediction cycles fill their windows (FeatureStore.window's defaults)
+FILL_METHOD = "linear"
+FILL_LIMIT = 3
+
+MODEL_NAME = "harvest"
+ESTIMATORS = ("days", "yield")
+
+
+class Examples(NamedTuple):
+    records: List[dict]            # HarvestPredictor inputs
+    days: List[float]              # Days from the growth record to the harvest
+    yields: List[float]            # Yield of the harvest, grams
+    harvests: List[int]            # Index of each example's harvest in harvested_at
+    harvested_at: List[datetime]   # Harvests with at least one example, oldest first
+
+    def take(self, indexes: Sequence[int]):
+        return ([self.records[i] for i in indexes], [self.days[i] for i in indexes],
+                [self.yields[i] for i in indexes])
+
+
+def trained_through(model) -> Optional[datetime]:
+    """Latest harvest an incremental update of the model was trained on"""
+    if not getattr(model, "updates", None):
+        return None
+    return datetime.fromisoformat(model.updates[-1]["trained_through"])
+
+
+async def load_examples(session_factory, feature_store: FeatureStore, job: HarvestJob,
+                        since: Optional[datetime] = None) -> Tuple[Examples, Dict[str, int]]:
+    """
+    Labelled examples from the harvests after since (default: all) with a
+    yield; returns them and the growth records (and harvests without any)
+    skipped, by reason
+    """
+    skipped: Dict[str, int] = {}
+    async with session_factory() as db:
+        query = (select(HarvestRecord.device_id, HarvestRecord.harvest_date, HarvestRecord.yield_amount)
+                 .where(HarvestRecord.yield_amount.isnot(None))
+                 .order_by(HarvestRecord.harvest_date, HarvestRecord.id))
+        if since is not None:
+            query = query.where(HarvestRecord.harvest_date > since)
+        harvests = (await db.execute(query)).all()
+        device_ids = sorted({device_id for device_id, _, _ in harvests})
+        devices: Dict[str, tuple] = {}
+        harvest_dates: Dict[str, List[datetime]] = {}
+        growth: Dict[str, List[tuple]] = {}
+        for i in range(0, len(device_ids), QUERY_DEVICES):
+            chunk = device_ids[i:i + QUERY_DEVICES]
+            rows = (await db.execute(select(Device.device_id, Device.plant_type, Device.growth_stage)
+                                     .where(Device.device_id.in_(chunk)))).all()
+            devices.update((row[0], tuple(row)) for row in rows)
+            # Every harvest of these devices, yield or not: each one ends a cycle
+            rows = (await db.execute(select(HarvestRecord.device_id, HarvestRecord.harvest_date)
+                                     .where(HarvestRecord.device_id.in_(chunk))
+                                     .order_by(HarvestRecord.harvest_date))).all()
+            for device_id, harvested in rows:
+                harvest_dates.setdefault(device_id, []).append(harvested)
+
+            query = (select(GrowthRecord.device_id, GrowthRecord.timestamp, GrowthRecord.plant_height,
+                            GrowthRecord.leaf_count, GrowthRecord.growth_rate)
+                     .where(GrowthRecord.device_id.in_(chunk), GrowthRecord.timestamp <= harvests[-1][1])
+                     .order_by(GrowthRecord.timestamp))
+            if since is not None:
+                # The cycles of the new harvests start at each device's last harvest up to since
+                starts = [max((d for d in harvest_dates[device_id] if d <= since), default=None)
+                          for device_id in chunk]
+                if None not in starts:
+                    query = query.where(GrowthRecord.timestamp > min(starts))
+            for device_id, *record in (await db.execute(query)).all():
+                growth.setdefault(device_id, []).append(tuple(record))
+
+    # One candidate per growth record in the cycle of each harvest
+    candidates: List[Tuple[int, DeviceInfo, datetime]] = []
+    for n, (device_id, harvested, _) in enumerate(harvests):
+        dates = harvest_dates[device_id]
+        position = bisect.bisect_left(dates, harvested)
+        previous = dates[position - 1] if position else None
+        records = growth.get(device_id, [])
+        times = [record[0] for record in records]
+        cycle = records[bisect.bisect_right(times, previous) if previous else 0:bisect.bisect_right(times, harvested)]
+        if not cycle:
+            skipped["no_growth_records"] = skipped.get("no_growth_records", 0) + 1
+            continue
+        info = devices.get(device_id, (device_id, None, None))
+        for timestamp, height, leaves, rate in cycle:
+            inputs = growth_inputs(height, leaves, rate, previous or cycle[0][0], timestamp)
+            candidates.append((n, DeviceInfo(*info, inputs), timestamp))
+
+    records = await _climate_inputs(feature_store, job, candidates, skipped)
+    examples = Examples([], [], [], [], [])
+    last = None
+    for (n, _, timestamp), record in zip(candidates, records):
+        if record is None:
+            continue
+        _, harvested, grams = harvests[n]
+        if n != last:
+            examples.harvested_at.append(harvested)
+            last = n
+        examples.records.append(record)
+        examples.days.append((harvested - timestamp).total_seconds() / 86400)
+        examples.yields.append(float(grams))
+        examples.harvests.append(len(examples.harvested_at) - 1)
+    return examples, skipped
+
+
+async def _climate_inputs(feature_store: FeatureStore, job: HarvestJob,
+                          candidates: Sequence[Tuple[int, DeviceInfo, datetime]],
+                          skipped: Dict[str, int]) -> List[Optional[dict]]:
+    """
+    HarvestJob inputs of each candidate over the WINDOW_HOURS before its
+    growth record, filled like a prediction cycle's window; None where
+    skipped. One window is loaded per EXAMPLE_DEVICES devices, spanning all
+    of their records, and each record's steps are sliced from it.
+    """
+    inputs: List[Optional[dict]] = [None] * len(candidates)
+    span = WINDOW_HOURS + FILL_LIMIT
+    device_ids = sorted({device.device_id for _, device, _ in candidates})
+    for i in range(0, len(device_ids), EXAMPLE_DEVICES):
+        batch = device_ids[i:i + EXAMPLE_DEVICES]
+        row_of = {device_id: row for row, device_id in enumerate(batch)}
+        indexes = [n for n, (_, device, _) in enumerate(candidates) if device.device_id in row_of]
+        bins = np.array([int(epoch_seconds(candidates[n][2]) // 3600) for n in indexes])
+        first_bin = int(bins.min()) - span + 1
+        window = await feature_store.window(batch, int(bins.max()) - first_bin + 1, 3600, WINDOW_FEATURES,
+                                            end=bins.max() * 3600.0, method="none")
+        rows = np.array([row_of[candidates[n][1].device_id] for n in indexes])[:, None]
+        steps = (bins - first_bin)[:, None] + np.arange(1 - span, 1)
+        values = fill_gaps(window.values[rows, steps], FILL_METHOD, FILL_LIMIT)
+        # Rows are candidates, named by their index so inputs() reports which ones it kept
+        examples = FeatureWindow([str(n) for n in indexes], window.features, window.start, window.step,
+                                 values[:, -WINDOW_HOURS:], window.observed[rows, steps][:, -WINDOW_HOURS:])
+        ids, records, reasons = job.inputs(
+            examples, [candidates[n][1]._replace(device_id=str(n)) for n in indexes], None)
+        for reason, count in reasons.items():
+            skipped[reason] = skipped.get(reason, 0) + count
+        for n, record in zip(ids, records or []):
+            inputs[int(n)] = record
+    return inputs
+
+
+def _fit(model, examples: Examples, train: List[int], holdout: List[int], stages: int,
+         max_estimators: int) -> dict:
+    """Warm-start each estimator on train, keeping it only if the holdout error drops (blocking)"""
+    before = model.evaluate(*examples.take(holdout))
+    estimators = {}
+    for name in ESTIMATORS:
+        estimator = getattr(model, f"{name}_model")
+        if estimator.n_estimators + stages > max_estimators:
+            estimators[name] = "max_estimators"
+            continue
+        original = copy.deepcopy(estimator)
+        model.update(*examples.take(train), stages=stages, models=(name,))
+        if model.evaluate(*examples.take(holdout))[f"{name}_mae"] < before[f"{name}_mae"]:
+            estimators[name] = "updated"
+        else:
+            setattr(model, f"{name}_model", original)
+            estimators[name] = "rejected"
+    after = model.evaluate(*examples.take(holdout))
+    return {"estimators": estimators,
+            "holdout_mae": {"before": {k: round(v, 4) for k, v in before.items()},
+                            "after": {k: round(v, 4) for k, v in after.items()}}}
+
+
+class ModelUpdater:
+    """Runs incremental updates of the active harvest model; one at a time"""
+
+    def __init__(self, session_factory, feature_store: FeatureStore, registry: Optional[ModelRegistry] = None,
+                 stages: int = MODEL_UPDATE_STAGES, max_estimators: int = MODEL_UPDATE_MAX_ESTIMATORS,
+                 holdout: float = MODEL_UPDATE_HOLDOUT, min_harvests: int = MODEL_UPDATE_MIN_HARVESTS):
+        self.session_factory = session_factory
+        self.feature_store = feature_store
+        self.registry = registry or ModelRegistry()
+        self.stages = stages
+        self.max_estimators = max_estimators
+        self.holdout = holdout
+        self.min_harvests = max(min_harvests, 2)
+        self.last_update: Optional[dict] = None
+        self._lock = asyncio.Lock()
+
+    async def run(self, dry_run: bool = False) -> dict:
+        """Update the active model from new harvests and publish it if it got better; returns a summary"""
+        async with self._lock:
+            began = time.perf_counter()
+            loop = asyncio.get_running_loop()
+            summary = {"model": MODEL_NAME, "started_at": datetime.utcnow().replace(microsecond=0).isoformat(),
+                       "dry_run": dry_run}
+            try:
+                # A private, writable copy: the estimators are extended in place
+                version, model = await loop.run_in_executor(
+                    None, lambda: self.registry.load(MODEL_NAME, mmap_mode=None))
+            except ValueError as e:
+                return self._finish(summary, "unavailable", began, error=str(e))
+            since = trained_through(model)
+            summary.update(version=version, since=since.isoformat() if since else None)
+
+            job = HarvestJob(self.registry)
+            job.model = model
+            examples, skipped = await load_examples(self.session_factory, self.feature_store, job, since)
+            summary.update(harvests=len(examples.harvested_at), examples=len(examples.records), skipped=skipped)
+            if len(examples.harvested_at) < self.min_harvests:
+                return self._finish(summary, "insufficient_data", began)
+
+            # Newest harvests are held out; harvests on the same date stay on one side
+            dates = examples.harvested_at
+            cut = len(dates) - max(1, round(len(dates) * self.holdout))
+            while cut > 0 and dates[cut] == dates[cut - 1]:
+                cut -= 1
+            if cut == 0:
+                return self._finish(summary, "insufficient_data", began)
+            train = [i for i, h in enumerate(examples.harvests) if h < cut]
+            holdout = [i for i, h in enumerate(examples.harvests) if h >= cut]
+            summary.update(train_examples=len(train), holdout_examples=len(holdout))
+
+            result = await loop.run_in_executor(
+                None, _fit, model, examples, train, holdout, self.stages, self.max_estimators)
+            summary.update(result)
+            if "updated" not in result["estimators"].values():
+                return self._finish(summary, "rejected", began)
+            if dry_run:
+                return self._finish(summary, "accepted", began)
+
+            model.updates.append({
+                "trained_through": dates[cut - 1].isoformat(),
+                "updated": summary["started_at"],
+                "base_version": version,
+                "harvests": cut,
+                "examples": len(train),
+                **result,
+            })
+            note = (f"Incremental update of {version} on {cut} harvests through "
+                    f"{dates[cut - 1].date().isoformat()}")
+            summary["published"] = await loop.run_in_executor(None, self._publish, model, note)
+            return self._finish(summary, "promoted", began)
+
+    def _publish(self, model, note: str) -> str:
+        with tempfile.TemporaryDirectory(prefix="model-update-") as directory:
+            path = os.path.join(directory, MODELS[MODEL_NAME].artifact)
+            model.save_models(path)
+            return self.registry.publish(MODEL_NAME, path, note=note, activate=True)
+
+    def _finish(self, summary: dict, outcome: str, began: float, error: Optional[str] = None) -> dict:
+        seconds = time.perf_counter() - began
+        summary.update(outcome=outcome, seconds=round(seconds, 3))
+        if error is not None:
+            summary["error"] = error
+        metrics.MODEL_UPDATES.inc(labels=(MODEL_NAME, outcome))
+        metrics.MODEL_UPDATE_SECONDS.observe(seconds, (MODEL_NAME,))
+        self.last_update = summary
+        return summary
+
+    def seconds_until_due(self, interval: float) -> float:
+        """Wait before the next update: interval after the last one this process or the active model records"""
+        last = None
+        if self.last_update is not None:
+            last = datetime.fromisoformat(self.last_update["started_at"])
+        try:
+            active = self.registry.active_version(MODEL_NAME)
+            updates = self.registry.manifest(MODEL_NAME, active)["metadata"].get("updates") if active else None
+        except ValueError:
+            updates = None
+        if updates:
+            recorded = datetime.fromisoformat(updates[-1]["updated"])
+            last = max(last, recorded) if last else recorded
+        if last is None:
+            return 0.0
+        return max((last + timedelta(seconds=interval) - datetime.utcnow()).total_seconds(), 0.0)
+
+
+async def run(args):
+    try:
+        updater = ModelUpdater(SessionLocal, FeatureStore(SessionLocal), stages=args.stages)
+        summary = await updater.run(dry_run=args.dry_run)
+        print(f"{summary['model']}: {summary['outcome']}"
+              + (f", published {summary['published']}" if summary.get("published") else ""))
+        for key in ("version", "since", "harvests", "examples", "skipped", "estimators", "holdout_mae", "error"):
+            if key in summary:
+                print(f"  {key}: {summary[key]}")
+    finally:
+        await close_db()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(
+        description="Update the harvest model from recorded harvests and promote it if it improves",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Evaluate the update without publishing it")
+    parser.add_argument("--stages", type=int, default=MODEL_UPDATE_STAGES,
+                        help=f"Boosting stages to add to each estimator (default: {MODEL_UPDATE_STAGES})")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main_cli()
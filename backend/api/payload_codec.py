@@ -0,0 +1,217 @@
+"""
+Compact binary encoding of device payloads
+An alternative to the firmware's JSON messages for weak greenhouse Wi-Fi:
+a fixed field table, a presence bitmask and scaled integers, packed with
+one struct call. Decoding yields the same dict as json.loads on the
+equivalent JSON message, so the rest of the ingest pipeline is unchanged.
+
+Frame layout, version 1 (little endian):
+
+    uint8   magic (0xA7, never the first byte of a JSON document)
+    uint8   version
+    uint32  field mask, bit n set = field n present
+    uint64  timestamp, ms
+    uint8   device_id length, then device_id (UTF-8)
+    values of the present fields in bit order, types and scales below
+
+Readings are rounded to each field's scale, which matches the precision
+the firmware already rounds to before publishing JSON.
+
+normalize_payload() checks a decoded payload of either encoding before it
+is spooled, so a payload that cannot be stored never reaches the database
+loader. ISO-8601 timestamps (simulate_data.py in JSON mode) become epoch
+milliseconds like the firmware's.
+"""
+
+import json
+import math
+import struct
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+MAGIC = 0xA7
+VERSION = 1
+
+FORMAT_JSON = "json"
+FORMAT_BINARY = "binary"
+
+HEADER = struct.Struct("<BBIQB")
+# Latest timestamp a datetime can hold (9999-12-31), ms
+MAX_TIMESTAMP_MS = 253402300799999
+_MAGIC_BYTE = bytes((MAGIC,))
+
+
+class Field(NamedTuple):
+    section: str   # "sensors" or "status"
+    name: str
+    code: str      # struct format character
+    scale: int     # stored value = round(value * scale)
+
+
+# Field ids are bit positions: only append, never reorder or reuse them
+FIELDS: List[Field] = [
+    Field("sensors", "ph", "H", 100),
+    Field("sensors", "water_temp", "h", 10),
+    Field("sensors", "air_temp", "h", 10),
+    Field("sensors", "humidity", "H", 10),
+    Field("sensors", "ec", "H", 1),
+    Field("sensors", "tds", "H", 1),
+    Field("sensors", "lux", "I", 1),
+    Field("sensors", "full_spectrum", "H", 1),
+    Field("sensors", "infrared", "H", 1),
+    Field("sensors", "visible", "H", 1),
+    Field("sensors", "par_umol", "H", 1),
+    Field("sensors", "co2", "H", 1),
+    Field("sensors", "water_level", "h", 10),
+    Field("sensors", "flow_rate", "H", 100),
+    Field("status", "wifi_rssi", "b", 1),
+    Field("status", "uptime", "I", 1),
+    Field("status", "battery", "B", 1),
+]
+
+_FIELD_BITS: Dict[tuple, int] = {(field.section, field.name): bit for bit, field in enumerate(FIELDS)}
+
+
+class _Layout(NamedTuple):
+    values: struct.Struct
+    sensors: Tuple[str, ...]              # names of the leading sensor values
+    status: Tuple[str, ...]               # names of the trailing status values
+    scaled: Tuple[Tuple[int, int], ...]   # (value index, scale) of non-integer fields
+
+
+# Layouts are compiled once per field mask; devices send few distinct masks
+_layouts: Dict[int, _Layout] = {}
+
+
+def _layout(mask: int) -> _Layout:
+    layout = _layouts.get(mask)
+    if layout is None:
+        if mask >> len(FIELDS):
+            raise ValueError(f"Unknown fields in mask {mask:#x}")
+        fields = [field for bit, field in enumerate(FIELDS) if mask & (1 << bit)]
+        layout = _Layout(
+            struct.Struct("<" + "".join(field.code for field in fields)),
+            tuple(field.name for field in fields if field.section == "sensors"),
+            tuple(field.name for field in fields if field.section == "status"),
+            tuple((i, field.scale) for i, field in enumerate(fields) if field.scale != 1))
+        _layouts[mask] = layout
+    return layout
+
+
+def encode_payload(payload: dict) -> bytes:
+    """
+    Encode a payload in the firmware JSON shape as a binary frame
+
+    None values are left out. Raises ValueError for fields that are not in
+    the field table or do not fit their type.
+    """
+    mask = 0
+    values = {}
+    for section in ("sensors", "status"):
+        for name, value in (payload.get(section) or {}).items():
+            if value is None:
+                continue
+            bit = _FIELD_BITS.get((section, name))
+            if bit is None:
+                raise ValueError(f"Field {section}.{name} has no binary encoding")
+            mask |= 1 << bit
+            values[bit] = round(value * FIELDS[bit].scale)
+
+    layout = _layout(mask)
+    device_id = payload["device_id"].encode()
+    try:
+        return (HEADER.pack(MAGIC, VERSION, mask, int(payload.get("timestamp", 0)), len(device_id))
+                + device_id + layout.values.pack(*(values[bit] for bit in sorted(values))))
+    except struct.error as e:
+        raise ValueError(f"Payload does not fit the binary layout: {e}") from None
+
+
+def decode_binary(data: bytes) -> dict:
+    """Decode one binary frame into a payload dict"""
+    if len(data) < HEADER.size:
+        raise ValueError("Truncated binary payload")
+    magic, version, mask, timestamp, id_length = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a binary payload")
+    if version != VERSION:
+        raise ValueError(f"Unsupported binary payload version {version}")
+
+    layout = _layout(mask)
+    offset = HEADER.size + id_length
+    if len(data) != offset + layout.values.size:
+        raise ValueError("Binary payload length does not match its field mask")
+
+    values = list(layout.values.unpack_from(data, offset))
+    for i, scale in layout.scaled:
+        values[i] /= scale
+    payload = {
+        "device_id": data[HEADER.size:offset].decode(),
+        "timestamp": timestamp,
+        "sensors": dict(zip(layout.sensors, values))
+    }
+    if layout.status:
+        payload["status"] = dict(zip(layout.status, values[len(layout.sensors):]))
+    return payload
+
+
+def payload_format(data: bytes) -> str:
+    """Detect the encoding of a raw MQTT payload"""
+    return FORMAT_BINARY if data[:1] == _MAGIC_BYTE else FORMAT_JSON
+
+
+def decode_payload(data: Union[bytes, bytearray]) -> dict:
+    """Decode a raw MQTT payload, binary or JSON"""
+    if payload_format(data) == FORMAT_BINARY:
+        return decode_binary(bytes(data))
+    return json.loads(data)
+
+
+def _timestamp_ms(value) -> Optional[float]:
+    """
+    Epoch milliseconds from a number or an ISO-8601 string, None if invalid;
+    a naive string is local time, as simulate_data.py sends it
+    """
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            try:
+                value = round(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp() * 1000)
+            except (OverflowError, OSError, ValueError):
+                return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    if not math.isfinite(value) or not 0 <= value <= MAX_TIMESTAMP_MS:
+        return None
+    return value
+
+
+def _number(value) -> bool:
+    return value is None or (isinstance(value, (int, float)) and not isinstance(value, bool)
+                             and math.isfinite(value))
+
+
+def normalize_payload(payload) -> Optional[dict]:
+    """
+    The payload ready to be stored, or None if it cannot be: no device_id,
+    a timestamp that is not epoch ms or ISO-8601, or a sensor value that is
+    not a number. A converted timestamp is returned in a copy.
+    """
+    if not isinstance(payload, dict):
+        return None
+    device_id = payload.get("device_id")
+    if not isinstance(device_id, str) or not device_id:
+        return None
+    # derived and raw are set by the ingest worker before spooling
+    for section in ("sensors", "derived", "raw"):
+        values = payload.get(section) or {}
+        if not isinstance(values, dict) or not all(map(_number, values.values())):
+            return None
+    if "timestamp" not in payload:
+        return payload
+    timestamp = _timestamp_ms(payload["timestamp"])
+    if timestamp is None:
+        return None
+    if timestamp is not payload["timestamp"]:
+        payload = {**payload, "timestamp": timestamp}
+    return payload
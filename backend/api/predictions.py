@@ -0,0 +1,482 @@
+"""
+Scheduled fleet-wide predictions for the Agronomia platform
+The leader worker runs IrrigationPredictor, NutrientOptimizer and
+HarvestPredictor (ai-ml/training) for every active device once per
+PREDICTION_INTERVAL_SECONDS. A cycle loads one feature window for all
+devices (features.py: the last 24 hourly steps, gap-filled), turns it into
+each model's inputs with numpy, and runs the three models concurrently in a
+thread pool, one batched call per model. Results are stored in the
+predictions table and kept in memory, latest per device and model, so API
+reads are a dict lookup and never run a model.
+
+Harvest predictions take the plant measurements of the device's latest
+growth record since its last harvest (growth_records), and count days since
+transplant from that harvest, or from the first growth record of the cycle.
+Inputs the sensors and records do not provide (soil moisture, and the plant
+measurements of devices without growth records) are left to the models'
+defaults. Nutrient and harvest predictions need the device's plant_type, and
+are skipped for plant types or growth stages the model was not trained on.
+
+Models come from the model registry (ai-ml/training/model_registry.py).
+Every cycle checks each model's active version and loads it in the pool
+when it changed, so activating a version swaps it in at the next cycle
+without a restart; a model without an active version is skipped.
+"""
+
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from sqlalchemy import and_, delete, func, insert, or_, select
+
+import metrics
+from database import Device, GrowthRecord, HarvestRecord, Prediction
+from derived import PHOTOPERIOD_UTC_OFFSET_HOURS, vpd
+from features import FeatureStore, FeatureWindow
+
+# The models and their registry live with the training scripts
+TRAINING_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), "../../ai-ml/training"))
+if TRAINING_DIR not in sys.path:
+    sys.path.append(TRAINING_DIR)
+from model_registry import ModelRegistry  # noqa: E402
+
+PREDICTION_INTERVAL_SECONDS = float(os.getenv("PREDICTION_INTERVAL_SECONDS", "900"))  # 0 disables
+PREDICTION_WORKERS = int(os.getenv("PREDICTION_WORKERS", "2"))
+# Devices that reported within this many seconds are predicted
+PREDICTION_ACTIVE_SECONDS = float(os.getenv("PREDICTION_ACTIVE_SECONDS", "3600"))
+PREDICTION_RETENTION_DAYS = float(os.getenv("PREDICTION_RETENTION_DAYS", "30"))
+# Fraction of the window's steps with readings a device needs for a model's key inputs
+PREDICTION_MIN_COVERAGE = float(os.getenv("PREDICTION_MIN_COVERAGE", "0.25"))
+# Mean lux above which an hourly step counts as a light hour
+PREDICTION_LIGHT_LUX = float(os.getenv("PREDICTION_LIGHT_LUX", "1000"))
+
+WINDOW_HOURS = 24
+WINDOW_FEATURES = ("air_temp", "humidity", "lux", "ph", "ec", "water_temp")
+# IrrigationPredictor encodes growth stages as numbers
+GROWTH_STAGE_CODES = {"seedling": 0, "vegetative": 1, "flowering": 2, "fruiting": 3}
+
+
+class DeviceInfo(NamedTuple):
+    device_id: str
+    plant_type: Optional[str]
+    growth_stage: Optional[str]
+    growth: Optional[Dict[str, float]] = None   # HarvestPredictor inputs from growth records
+
+
+def growth_inputs(height: Optional[float], leaf_count: Optional[int], growth_rate: Optional[float],
+                  cycle_start: datetime, at: datetime) -> Dict[str, float]:
+    """HarvestPredictor inputs from a growth record, leaving out what was not measured"""
+    inputs = {"days_since_transplant": max((at - cycle_start).total_seconds() / 86400, 0.0)}
+    for name, value in (("plant_height", height), ("leaf_count", leaf_count), ("growth_rate", growth_rate)):
+        if value is not None:
+            inputs[name] = float(value)
+    return inputs
+
+
+async def latest_growth(db, device_ids: Sequence[str], at: datetime) -> Dict[str, Dict[str, float]]:
+    """
+    growth_inputs() of each device's latest growth record since its last
+    harvest, for devices that have one
+    """
+    harvested = (select(HarvestRecord.device_id, func.max(HarvestRecord.harvest_date).label("harvested"))
+                 .where(HarvestRecord.device_id.in_(device_ids)).group_by(HarvestRecord.device_id).subquery())
+    cycle = (select(GrowthRecord.device_id, harvested.c.harvested,
+                    func.min(GrowthRecord.timestamp).label("first"), func.max(GrowthRecord.timestamp).label("last"))
+             .outerjoin(harvested, harvested.c.device_id == GrowthRecord.device_id)
+             .where(GrowthRecord.device_id.in_(device_ids),
+                    or_(harvested.c.harvested.is_(None), GrowthRecord.timestamp > harvested.c.harvested))
+             .group_by(GrowthRecord.device_id, harvested.c.harvested).subquery())
+    rows = (await db.execute(
+        select(GrowthRecord.device_id, GrowthRecord.plant_height, GrowthRecord.leaf_count, GrowthRecord.growth_rate,
+               cycle.c.harvested, cycle.c.first)
+        .join(cycle, and_(cycle.c.device_id == GrowthRecord.device_id, GrowthRecord.timestamp == cycle.c.last)))).all()
+    return {device_id: growth_inputs(height, leaves, rate, harvested or first, at)
+            for device_id, height, leaves, rate, harvested, first in rows}
+
+
+def _latest(values: np.ndarray) -> np.ndarray:
+    """Last non-NaN value along axis 1 of a (devices, steps) array, NaN where there is none"""
+    present = ~np.isnan(values)
+    last = values.shape[1] - 1 - np.argmax(present[:, ::-1], axis=1)
+    return np.where(present.any(axis=1), values[np.arange(len(values)), last], np.nan)
+
+
+def _mean(values: np.ndarray) -> np.ndarray:
+    """Mean along axis 1 ignoring NaN, NaN where there is no value"""
+    present = ~np.isnan(values)
+    counts = present.sum(axis=1)
+    return np.where(counts > 0, np.where(present, values, 0).sum(axis=1) / np.maximum(counts, 1), np.nan)
+
+
+def _fill(values: np.ndarray, default: float) -> np.ndarray:
+    """Fill NaN steps with the device's mean over the window, or default without any"""
+    means = _mean(values)
+    return np.where(np.isnan(values), np.where(np.isnan(means), default, means)[:, None], values)
+
+
+def _records(columns: Dict[str, np.ndarray], rows: np.ndarray) -> List[dict]:
+    """One dict per row, leaving out NaN values so the model's default applies"""
+    return [{name: float(values[i]) for name, values in columns.items() if values[i] == values[i]} for i in rows]
+
+
+class _Job:
+    """One model run per cycle: inputs are built on the event loop, predict() runs in the pool"""
+
+    name = ""         # Registry model name
+
+    def __init__(self, registry: ModelRegistry):
+        self.registry = registry
+        self.model = None
+        self.version: Optional[str] = None
+        self.error: Optional[str] = None
+
+    @property
+    def steps(self) -> int:
+        return WINDOW_HOURS
+
+    def ensure_loaded(self) -> bool:
+        """
+        Load the active version if it is not the one loaded (blocking, run in
+        the pool); False if there is no model to run
+        """
+        try:
+            active = self.registry.active_version(self.name)
+            if active is None:
+                self.error = "No active version in the model registry"
+                return self.model is not None
+            if active == self.version:
+                return True
+            version, model = self.registry.load(self.name, active)
+        except Exception as e:
+            # Keep running the version loaded before, if any
+            self.error = f"Error loading model: {e}"
+            return self.model is not None
+        self.model, self.version, self.error = model, version, None
+        return True
+
+    def inputs(self, window: FeatureWindow, devices: Sequence[DeviceInfo],
+               target_ec: Callable[[str], float]) -> Tuple[List[str], object, Dict[str, int]]:
+        """(device ids, model input, skipped devices by reason) for one cycle"""
+        raise NotImplementedError
+
+    def predict(self, inputs) -> List[dict]:
+        raise NotImplementedError
+
+    def _known(self, devices: Sequence[DeviceInfo], rows: np.ndarray,
+               skipped: Dict[str, int]) -> np.ndarray:
+        """Rows of devices whose plant type (required) and growth stage the model's encoders know"""
+        plants = set(self.model.plant_encoder.classes_)
+        stage_encoder = getattr(self.model, "stage_encoder", None)
+        stages = set(stage_encoder.classes_) if stage_encoder is not None else None
+        keep = []
+        for i in rows:
+            device = devices[i]
+            if not device.plant_type:
+                skipped["no_plant_type"] = skipped.get("no_plant_type", 0) + 1
+            elif device.plant_type not in plants or (
+                    stages is not None and device.growth_stage and device.growth_stage not in stages):
+                skipped["unknown_plant"] = skipped.get("unknown_plant", 0) + 1
+            else:
+                keep.append(i)
+        return np.array(keep, dtype=np.int64)
+
+
+def _covered(window: FeatureWindow, names: Sequence[str], any_of: bool = False) -> np.ndarray:
+    """Devices with PREDICTION_MIN_COVERAGE of the window for all (or any) of names"""
+    coverage = window.coverage()[:, [window.features.index(name) for name in names]] >= PREDICTION_MIN_COVERAGE
+    return coverage.any(axis=1) if any_of else coverage.all(axis=1)
+
+
+class IrrigationJob(_Job):
+    """Hours until the next irrigation and its volume, from the last sequence_length hours"""
+
+    name = "irrigation"
+
+    @property
+    def steps(self) -> int:
+        return self.model.sequence_length if self.model is not None else WINDOW_HOURS
+
+    def inputs(self, window, devices, target_ec):
+        usable = _covered(window, ("air_temp", "humidity"))
+        rows = np.flatnonzero(usable)
+        skipped = {"no_data": int((~usable).sum())} if not usable.all() else {}
+        if not len(rows):
+            return [], None, skipped
+
+        steps = self.steps
+        values = window.values[rows, -steps:]
+        column = {name: values[:, :, i] for i, name in enumerate(window.features)}
+        temperature = _fill(column["air_temp"], 23)
+        humidity = _fill(column["humidity"], 65)
+        light = _fill(column["lux"], 25000)
+        stage = np.array([GROWTH_STAGE_CODES.get(devices[i].growth_stage, 2) for i in rows], dtype=float)
+        # Local hour of each step, as the model was trained on time of day
+        hours = (window.timestamps()[-steps:] / 3600 + PHOTOPERIOD_UTC_OFFSET_HOURS) % 24
+        shape = temperature.shape
+        # Columns in IrrigationPredictor.feature_names order; no soil moisture sensor, so its default
+        tensor = np.stack([
+            temperature, humidity, light, np.broadcast_to(stage[:, None], shape),
+            np.broadcast_to(hours[None, :], shape), np.full(shape, 60.0), vpd(temperature, humidity)
+        ], axis=2)
+        return [devices[i].device_id for i in rows], tensor, skipped
+
+    def predict(self, inputs):
+        return self.model.predict_array(inputs)
+
+
+class NutrientJob(_Job):
+    """Nutrient or pH adjustment, from the latest solution readings and the device's EC target"""
+
+    name = "nutrient"
+
+    def inputs(self, window, devices, target_ec):
+        skipped: Dict[str, int] = {}
+        usable = _covered(window, ("ec", "ph"), any_of=True)
+        if not usable.all():
+            skipped["no_data"] = int((~usable).sum())
+        rows = self._known(devices, np.flatnonzero(usable), skipped)
+        if not len(rows):
+            return [], None, skipped
+
+        column = {name: window.values[:, :, i] for i, name in enumerate(window.features)}
+        records = _records({
+            "current_ec": _latest(column["ec"]),
+            "current_ph": _latest(column["ph"]),
+            "water_temp": _latest(column["water_temp"]),
+            "target_ec": np.array([target_ec(device.device_id) for device in devices]),
+        }, rows)
+        for record, i in zip(records, rows):
+            record["plant_type"] = devices[i].plant_type
+            if devices[i].growth_stage:
+                record["growth_stage"] = devices[i].growth_stage
+        return [devices[i].device_id for i in rows], records, skipped
+
+    def predict(self, inputs):
+        return self.model.predict_batch(inputs)
+
+
+class HarvestJob(_Job):
+    """Days to harvest and expected yield, from the climate over the window"""
+
+    name = "harvest"
+
+    def inputs(self, window, devices, target_ec):
+        skipped: Dict[str, int] = {}
+        usable = _covered(window, ("air_temp", "humidity"))
+        if not usable.all():
+            skipped["no_data"] = int((~usable).sum())
+        rows = self._known(devices, np.flatnonzero(usable), skipped)
+        if not len(rows):
+            return [], None, skipped
+
+        values = window.values[:, -WINDOW_HOURS:]
+        column = {name: values[:, :, i] for i, name in enumerate(window.features)}
+        lux = column["lux"]
+        # Light hours over the (hourly) window; NaN without any light reading
+        with np.errstate(invalid="ignore"):
+            light_hours = np.where((~np.isnan(lux)).any(axis=1), (lux >= PREDICTION_LIGHT_LUX).sum(axis=1), np.nan)
+        records = _records({
+            "avg_temperature": _mean(column["air_temp"]),
+            "avg_humidity": _mean(column["humidity"]),
+            "avg_ec": _mean(column["ec"]),
+            "avg_light_hours": light_hours * window.step / 3600,
+        }, rows)
+        for record, i in zip(records, rows):
+            record["plant_type"] = devices[i].plant_type
+            record.update(devices[i].growth or {})
+        return [devices[i].device_id for i in rows], records, skipped
+
+    def predict(self, inputs):
+        return self.model.predict_batch(inputs)
+
+
+class PredictionScheduler:
+    """
+    Runs the prediction jobs and serves their latest results
+
+    run_cycle() is called by the leader's timer (or an admin request) and
+    takes a lock, so cycles never overlap and a model is only swapped
+    between cycles. Other workers keep their cache in
+    step with load_cycle() when the leader announces a cycle. The cache maps
+    device_id -> model -> result; a cycle replaces the entries it produced
+    and leaves those of devices it skipped.
+    """
+
+    def __init__(self, session_factory, write_session_factory, feature_store: FeatureStore,
+                 target_ec: Callable[[str], float], registry: Optional[ModelRegistry] = None,
+                 workers: int = PREDICTION_WORKERS, retention_days: float = PREDICTION_RETENTION_DAYS):
+        self.session_factory = session_factory
+        self.write_session_factory = write_session_factory
+        self.feature_store = feature_store
+        self.target_ec = target_ec
+        self.retention = timedelta(days=retention_days)
+        self.registry = registry or ModelRegistry()
+        self.jobs: List[_Job] = [IrrigationJob(self.registry), NutrientJob(self.registry),
+                                 HarvestJob(self.registry)]
+        self.cache: Dict[str, Dict[str, dict]] = {}
+        # Devices without any stored result, so latest() does not query them again until the next cycle
+        self.misses: Set[str] = set()
+        self.cycle_at: Optional[datetime] = None
+        self.last_cycle: Optional[dict] = None
+        self._pool = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="predict")
+        self._lock = asyncio.Lock()
+
+    async def run_cycle(self, device_ids: Sequence[str]) -> dict:
+        """Predict every model for device_ids, store and cache the results; returns a summary"""
+        async with self._lock:
+            began = time.perf_counter()
+            created_at = datetime.utcnow().replace(microsecond=0)
+            loaded = await self._load_models()
+            jobs = [job for job, ok in zip(self.jobs, loaded) if ok]
+            summary = {"created_at": created_at.isoformat(), "devices": len(device_ids), "models": {}}
+            for job, ok in zip(self.jobs, loaded):
+                if not ok:
+                    metrics.PREDICTION_JOB_FAILURES.inc(labels=(job.name, "unavailable"))
+                    summary["models"][job.name] = {"status": "unavailable", "error": job.error}
+
+            devices = await self._devices(device_ids) if jobs and device_ids else []
+            rows = []
+            if devices:
+                window = await self.feature_store.window(
+                    [d.device_id for d in devices], max(job.steps for job in jobs), 3600, WINDOW_FEATURES)
+                outcomes = await asyncio.gather(*(self._run(job, window, devices) for job in jobs),
+                                                return_exceptions=True)
+                for job, outcome in zip(jobs, outcomes):
+                    if isinstance(outcome, Exception):
+                        print(f"Error running {job.name} predictions: {outcome}")
+                        metrics.PREDICTION_JOB_FAILURES.inc(labels=(job.name, "error"))
+                        summary["models"][job.name] = {"status": "error", "error": str(outcome)}
+                        continue
+                    ids, results, skipped, seconds = outcome
+                    for device_id, result in zip(ids, results):
+                        result.pop("timestamp", None)
+                        rows.append({"device_id": device_id, "model": job.name, "created_at": created_at,
+                                     "model_version": job.version, "result": result})
+                    metrics.PREDICTIONS_STORED.inc(len(ids), labels=(job.name,))
+                    summary["models"][job.name] = {"status": "ok", "predicted": len(ids), "skipped": skipped,
+                                                   "seconds": round(seconds, 3)}
+
+            async with self.write_session_factory() as db:
+                if rows:
+                    await db.execute(insert(Prediction), rows)
+                await db.execute(delete(Prediction).where(Prediction.created_at < created_at - self.retention))
+                await db.commit()
+            self._merge(rows)
+            self.misses.clear()
+            self.cycle_at = created_at
+
+            seconds = time.perf_counter() - began
+            metrics.PREDICTION_CYCLE_SECONDS.observe(seconds)
+            summary["seconds"] = round(seconds, 3)
+            self.last_cycle = summary
+            return summary
+
+    async def _load_models(self) -> List[bool]:
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(*(loop.run_in_executor(self._pool, job.ensure_loaded) for job in self.jobs))
+
+    async def reload_models(self) -> Dict[str, Optional[str]]:
+        """Load newly activated versions now instead of at the next cycle; returns the loaded versions"""
+        async with self._lock:
+            await self._load_models()
+        return {job.name: job.version for job in self.jobs}
+
+    async def _run(self, job: _Job, window: FeatureWindow, devices: List[DeviceInfo]):
+        ids, inputs, skipped = job.inputs(window, devices, self.target_ec)
+        if not ids:
+            return ids, [], skipped, 0.0
+        start = time.perf_counter()
+        results = await asyncio.get_running_loop().run_in_executor(self._pool, job.predict, inputs)
+        seconds = time.perf_counter() - start
+        metrics.PREDICTION_JOB_SECONDS.observe(seconds, (job.name,))
+        return ids, results, skipped, seconds
+
+    async def _devices(self, device_ids: Sequence[str]) -> List[DeviceInfo]:
+        """Plant type, growth stage and growth record inputs of each device (None for unregistered devices)"""
+        device_ids = list(dict.fromkeys(device_ids))
+        known = {}
+        growth = {}
+        now = datetime.utcnow()
+        async with self.session_factory() as db:
+            for i in range(0, len(device_ids), 500):
+                chunk = device_ids[i:i + 500]
+                rows = (await db.execute(select(Device.device_id, Device.plant_type, Device.growth_stage)
+                                         .where(Device.device_id.in_(chunk)))).all()
+                known.update((row[0], row) for row in rows)
+                growth.update(await latest_growth(db, chunk, now))
+        return [DeviceInfo(*known.get(d, (d, None, None)), growth.get(d)) for d in device_ids]
+
+    def _merge(self, rows: Sequence[dict]):
+        for row in rows:
+            self.cache.setdefault(row["device_id"], {})[row["model"]] = {
+                "created_at": row["created_at"].isoformat(), "model_version": row["model_version"], **row["result"]}
+
+    async def load_cycle(self, created_at: Optional[datetime] = None):
+        """Cache the results of a cycle stored by another worker (default: the latest cycle)"""
+        if created_at is not None and self.cycle_at is not None and created_at <= self.cycle_at:
+            return
+        async with self.session_factory() as db:
+            if created_at is None:
+                created_at = (await db.execute(select(func.max(Prediction.created_at)))).scalar()
+                if created_at is None:
+                    return
+            rows = (await db.execute(select(
+                Prediction.device_id, Prediction.model, Prediction.created_at, Prediction.model_version,
+                Prediction.result).where(Prediction.created_at == created_at))).mappings().all()
+        self._merge(rows)
+        self.misses.clear()
+        self.cycle_at = max(self.cycle_at or created_at, created_at)
+
+    async def latest(self, device_id: str) -> Dict[str, dict]:
+        """Latest result per model for a device; a device missing from the cache is read from the database once per cycle"""
+        cached = self.cache.get(device_id)
+        if cached is not None:
+            return cached
+        if device_id in self.misses:
+            return {}
+        rows = []
+        async with self.session_factory() as db:
+            for job in self.jobs:
+                row = (await db.execute(select(
+                    Prediction.device_id, Prediction.model, Prediction.created_at, Prediction.model_version,
+                    Prediction.result).where(Prediction.device_id == device_id, Prediction.model == job.name)
+                    .order_by(Prediction.created_at.desc()).limit(1))).mappings().first()
+                if row is not None:
+                    rows.append(row)
+        if not rows:
+            self.misses.add(device_id)
+            return {}
+        self._merge(rows)
+        return self.cache[device_id]
+
+    async def history(self, device_id: str, model: str, start: datetime, limit: int) -> List[dict]:
+        async with self.session_factory() as db:
+            rows = (await db.execute(select(Prediction.created_at, Prediction.model_version, Prediction.result).where(
+                Prediction.device_id == device_id, Prediction.model == model, Prediction.created_at >= start)
+                .order_by(Prediction.created_at.desc()).limit(limit))).all()
+        return [{"created_at": created_at.isoformat(), "model_version": version, **result}
+                for created_at, version, result in rows]
+
+    def seconds_until_due(self, interval: float) -> float:
+        """Wait before the next cycle, so a new leader keeps the previous one's schedule"""
+        if self.cycle_at is None:
+            return 0.0
+        return max(0.0, (self.cycle_at - datetime.utcnow()).total_seconds() + interval)
+
+    def stats(self) -> dict:
+        return {
+            "models": {job.name: {"loaded": job.model is not None, "version": job.version, "error": job.error}
+                       for job in self.jobs},
+            "cached_devices": len(self.cache),
+            "cached_misses": len(self.misses),
+            "cycle_at": self.cycle_at.isoformat() if self.cycle_at else None,
+            "last_cycle": self.last_cycle,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,131 @@
+"""
+Device presence tracking for the Agronomia API
+Stamps last_seen in memory on every ingested reading, marks devices offline
+after a period of silence using a hashed timer wheel, and hands out the
+changed rows so they can be written to the devices table in one batch.
+"""
+
+import math
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+ONLINE = "online"
+OFFLINE = "offline"
+
+
+class TimerWheel:
+    """
+    Hashed timing wheel with a fixed tick
+
+    schedule() and the per-key share of advance() are O(1). Deadlines past
+    the wheel's horizon are clamped to its last slot; callers re-check and
+    re-schedule on expiry.
+    """
+
+    def __init__(self, tick: float, horizon: float, now: float):
+        self.tick = tick
+        self.slots: List[Set[str]] = [set() for _ in range(int(math.ceil(horizon / tick)) + 2)]
+        self.current = int(now // tick)
+
+    def schedule(self, key: str, deadline: float):
+        target = int(deadline // self.tick)
+        target = min(max(target, self.current + 1), self.current + len(self.slots) - 1)
+        self.slots[target % len(self.slots)].add(key)
+
+    def advance(self, now: float) -> List[str]:
+        """Move the wheel to now and return the keys whose slot has passed"""
+        target = int(now // self.tick)
+        expired: List[str] = []
+        # After a long stall every slot is due, but each only needs visiting once
+        steps = min(target - self.current, len(self.slots))
+        for step in range(1, steps + 1):
+            slot = self.slots[(self.current + step) % len(self.slots)]
+            if slot:
+                expired.extend(slot)
+                slot.clear()
+        self.current = max(self.current, target)
+        return expired
+
+
+class PresenceTracker:
+    """
+    In-memory online/offline state for every device that sends data
+
+    touch() runs once per ingested reading and only writes two dicts and a
+    set. An online device sits in the timer wheel once, at the deadline
+    computed when it was scheduled; when that slot expires the device is
+    either marked offline or re-scheduled from its latest last_seen, so
+    devices that keep reporting cost one wheel operation per silence period
+    rather than one per reading.
+
+    Only used from the event loop, so it takes no lock. Times are epoch
+    seconds.
+    """
+
+    def __init__(self, offline_after: float, tick: float, now: float):
+        self.offline_after = offline_after
+        self.last_seen: Dict[str, float] = {}
+        self.status: Dict[str, str] = {}
+        self._dirty: Set[str] = set()
+        self._changes: List[Tuple[str, str]] = []
+        self._wheel = TimerWheel(tick, offline_after + tick, now)
+
+    def load(self, devices: Iterable[Tuple[str, Optional[float], Optional[str]]]):
+        """Seed state from the devices table: (device_id, last_seen, status) rows"""
+        for device_id, last_seen, status in devices:
+            if last_seen is None:
+                continue
+            self.last_seen[device_id] = last_seen
+            if status == ONLINE:
+                # Goes offline on the next tick if it has been silent too long already
+                self.status[device_id] = ONLINE
+                self._wheel.schedule(device_id, last_seen + self.offline_after)
+            else:
+                self.status[device_id] = OFFLINE
+
+    def touch(self, device_id: str, now: float):
+        """Record a reading from a device"""
+        self.last_seen[device_id] = now
+        self._dirty.add(device_id)
+        if self.status.get(device_id) != ONLINE:
+            self.status[device_id] = ONLINE
+            self._changes.append((device_id, ONLINE))
+            self._wheel.schedule(device_id, now + self.offline_after)
+
+    def expire(self, now: float) -> List[str]:
+        """Mark devices silent for offline_after seconds as offline; returns them"""
+        offline = []
+        for device_id in self._wheel.advance(now):
+            if self.status.get(device_id) != ONLINE:
+                continue
+            deadline = self.last_seen[device_id] + self.offline_after
+            if deadline <= now:
+                self.status[device_id] = OFFLINE
+                self._dirty.add(device_id)
+                self._changes.append((device_id, OFFLINE))
+                offline.append(device_id)
+            else:
+                self._wheel.schedule(device_id, deadline)
+        return offline
+
+    def drain_changes(self) -> List[Tuple[str, str]]:
+        """Status transitions since the last call, oldest first"""
+        changes, self._changes = self._changes, []
+        return changes
+
+    def drain_dirty(self) -> List[Tuple[str, float, str]]:
+        """(device_id, last_seen, status) of devices changed since the last call"""
+        dirty, self._dirty = self._dirty, set()
+        return [(device_id, self.last_seen[device_id], self.status[device_id]) for device_id in dirty]
+
+    def mark_dirty(self, device_ids: Iterable[str]):
+        """Flag devices for the next flush again (after a failed write)"""
+        self._dirty.update(device_ids)
+
+    def online_count(self) -> int:
+        return sum(1 for status in self.status.values() if status == ONLINE)
+
+    def snapshot(self) -> Dict[str, dict]:
+        return {
+            device_id: {"status": self.status[device_id], "last_seen": self.last_seen[device_id]}
+            for device_id in self.last_seen
+        }
@@ -0,0 +1,208 @@
+"""
+Runtime profiling for the Agronomia API
+A sampling profiler that walks every thread's stack (event loop, paho MQTT
+network thread, inference/executor threads) and per-request span tracing
+for selected routes.
+"""
+
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+MAX_PROFILE_SECONDS = 120
+MAX_PROFILE_HZ = 1000
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+
+
+# ============================================================================
+# SAMPLING PROFILER
+# ============================================================================
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    # ';' separates frames in the collapsed format
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all threads in the process at a fixed rate
+
+    The sampler runs in the calling thread and skips itself, so it should be
+    started from an executor thread rather than the event loop. Output is the
+    collapsed-stack format read by flamegraph.pl, speedscope and inferno:
+    one "thread;outer;...;inner count" line per unique stack.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def profile(self, seconds: float, hz: int = 100) -> Dict[str, object]:
+        """Sample for the given duration; raises RuntimeError if already running"""
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            return self._sample(seconds, hz)
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds: float, hz: int) -> Dict[str, object]:
+        own_ident = threading.get_ident()
+        interval = 1.0 / hz
+        stacks: Counter = Counter()
+        samples = 0
+
+        started = time.perf_counter()
+        deadline = started + seconds
+        next_tick = started
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            if now < next_tick:
+                time.sleep(next_tick - now)
+            next_tick += interval
+
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(ident, f"thread-{ident}").replace(";", ":"))
+                labels.reverse()
+                stacks[";".join(labels)] += 1
+            samples += 1
+
+        return {
+            "stacks": stacks,
+            "samples": samples,
+            "duration_s": time.perf_counter() - started,
+            "hz": hz
+        }
+
+
+def render_collapsed(stacks: Counter) -> str:
+    """Collapsed-stack text, heaviest stacks first"""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+profiler = SamplingProfiler()
+
+
+# ============================================================================
+# REQUEST TRACING
+# ============================================================================
+
+class RequestTrace:
+    """Spans recorded while handling a single request"""
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.route: Optional[str] = None
+        self.started_at = datetime.utcnow()
+        self.start = time.perf_counter()
+        self.spans: List[dict] = []
+        self.status_code: Optional[int] = None
+        self.duration_ms: Optional[float] = None
+
+    def finish(self, route: str, status_code: int):
+        self.route = route
+        self.status_code = status_code
+        self.duration_ms = (time.perf_counter() - self.start) * 1000
+
+    def server_timing(self) -> str:
+        """Server-Timing header value so spans show up in browser devtools"""
+        entries = [f"{span['name']};dur={span['duration_ms']:.3f}" for span in self.spans]
+        entries.append(f"total;dur={self.duration_ms:.3f}")
+        return ", ".join(entries)
+
+    def to_dict(self) -> dict:
+        return {
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status_code": self.status_code,
+            "timestamp": self.started_at.isoformat(),
+            "duration_ms": round(self.duration_ms, 3) if self.duration_ms is not None else None,
+            "spans": self.spans
+        }
+
+
+_current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar(
+    "current_trace", default=None)
+
+
+class RouteTracer:
+    """
+    Per-route request tracing switch
+
+    Routes are matched on their template (e.g. "/api/plant/identify"). While
+    no route is enabled, middleware and spans cost a single set lookup.
+    """
+
+    def __init__(self, buffer_size: int = TRACE_BUFFER_SIZE):
+        self.enabled_routes: Set[str] = set()
+        self.traces: deque = deque(maxlen=buffer_size)
+
+    @property
+    def active(self) -> bool:
+        return bool(self.enabled_routes)
+
+    def set_enabled(self, route: str, enabled: bool):
+        if enabled:
+            self.enabled_routes.add(route)
+        else:
+            self.enabled_routes.discard(route)
+
+    def start(self, method: str, path: str) -> contextvars.Token:
+        return _current_trace.set(RequestTrace(method, path))
+
+    def finish(self, token: contextvars.Token, route: str, status_code: int) -> Optional[RequestTrace]:
+        """Close the current trace; it is kept only if its route is enabled"""
+        trace = _current_trace.get()
+        _current_trace.reset(token)
+        if trace is None or route not in self.enabled_routes:
+            return None
+        trace.finish(route, status_code)
+        self.traces.append(trace)
+        return trace
+
+    def recent(self, route: Optional[str] = None, limit: int = 50) -> List[dict]:
+        traces = [t for t in self.traces if route is None or t.route == route]
+        return [t.to_dict() for t in traces[-limit:]]
+
+
+@contextmanager
+def trace_span(name: str):
+    """Record a named stage of the current request, if it is being traced"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        trace.spans.append({
+            "name": name,
+            "offset_ms": round((start - trace.start) * 1000, 3),
+            "duration_ms": round((end - start) * 1000, 3)
+        })
+
+
+tracer = RouteTracer()
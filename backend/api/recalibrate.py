@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Bulk re-correction of stored readings for the Agronomia platform
+When a calibration is added with an effective_from in the past, or amended,
+readings already stored were corrected with the old one (or not at all).
+This job recomputes them from their raw values with the current
+calibrations: the calibrated columns, their *_raw columns, the compensated
+EC/TDS derived from them, and the ec_25 statistics of the affected days in
+sensor_daily_metrics.
+
+The raw value is the *_raw column where set, else the stored value (readings
+that were never corrected), so the job can run any number of times.
+Readings are read and rewritten in chunks of RECALIBRATE_CHUNK_SIZE by
+device and timestamp, one transaction each, so ingest is never held up for
+long. Alerts raised from the old values are left as they are.
+
+Usage:
+    python recalibrate.py --device ESP32-001
+    python recalibrate.py --device ESP32-001 --start 2025-03-01 --end 2025-04-01
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+import numpy as np
+from sqlalchemy import and_, bindparam, select, update
+
+import metrics
+from calibration import METRICS, RAW_COLUMNS, CalibrationStore, epoch_seconds
+from database import Calibration, SensorReading, WriteSessionLocal, close_db, refresh_daily_ec_25
+from derived import TDS_FACTOR, compensate_ec, photoperiod, photoperiod_day, photoperiod_start
+
+RECALIBRATE_CHUNK_SIZE = int(os.getenv("RECALIBRATE_CHUNK_SIZE", "5000"))
+
+# Rewritten per reading: calibrated values, their raw values and what derives from them
+COLUMNS = (*METRICS, *RAW_COLUMNS.values(), "ec_25", "tds_25")
+
+
+async def load_calibrations(db, device_ids: Optional[Iterable[str]] = None) -> CalibrationStore:
+    """Compile the stored calibrations (of some devices)"""
+    query = select(Calibration.device_id, Calibration.metric, Calibration.version,
+                   Calibration.effective_from, Calibration.points)
+    if device_ids is not None:
+        query = query.where(Calibration.device_id.in_(list(device_ids)))
+    store = CalibrationStore()
+    store.load(0, (await db.execute(query)).all())
+    return store
+
+
+def _as_array(values) -> np.ndarray:
+    return np.array([np.nan if v is None else v for v in values], dtype=float)
+
+
+def _as_values(array: np.ndarray) -> list:
+    return [None if np.isnan(v) else v for v in array.tolist()]
+
+
+async def recalibrate(store: CalibrationStore, device_id: str, start: Optional[datetime] = None,
+                      end: Optional[datetime] = None, chunk_size: int = RECALIBRATE_CHUNK_SIZE) -> dict:
+    """Re-correct one device's readings in [start, end) with store's calibrations"""
+    table = SensorReading.__table__
+    query = select(table.c.timestamp, *(table.c[name] for name in METRICS),
+                   *(table.c[RAW_COLUMNS[name]] for name in METRICS), table.c.ec_25).where(
+        table.c.device_id == device_id).order_by(table.c.timestamp).limit(chunk_size)
+    if end is not None:
+        query = query.where(table.c.timestamp < end)
+    statement = update(table).where(and_(table.c.device_id == device_id,
+                                         table.c.timestamp == bindparam("reading_timestamp")))
+
+    began = time.perf_counter()
+    scanned = updated = 0
+    days = set()
+    chunk_query = query if start is None else query.where(table.c.timestamp >= start)
+    while True:
+        async with WriteSessionLocal() as db:
+            rows = (await db.execute(chunk_query)).all()
+            if not rows:
+                break
+            columns = list(zip(*rows))
+            timestamps = columns[0]
+            stored = np.stack([_as_array(c) for c in columns[1:1 + len(METRICS)]], axis=1)
+            raw_stored = np.stack([_as_array(c) for c in columns[1 + len(METRICS):1 + 2 * len(METRICS)]], axis=1)
+            old_ec_25 = _as_array(columns[-1])
+
+            epoch = np.array([epoch_seconds(ts) for ts in timestamps])
+            raw = np.where(np.isnan(raw_stored), stored, raw_stored)
+            ids = store.transform_ids([device_id] * len(rows), epoch)
+            values = np.round(store.correct(raw, ids), 4)
+            new_raw = np.where(ids >= 0, raw, np.nan)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                ec_25 = np.round(compensate_ec(values[:, METRICS.index("ec")], values[:, METRICS.index("water_temp")]), 4)
+            tds_25 = np.round(ec_25 * TDS_FACTOR, 4)
+
+            def differs(a, b):
+                return ~((a == b) | (np.isnan(a) & np.isnan(b)))
+
+            changed = (differs(values, stored).any(axis=1) | differs(new_raw, raw_stored).any(axis=1)
+                       | differs(ec_25, old_ec_25))
+            index = np.flatnonzero(changed)
+            if len(index):
+                new_columns = [*(values[:, m] for m in range(len(METRICS))),
+                               *(new_raw[:, m] for m in range(len(METRICS))), ec_25, tds_25]
+                new_columns = [_as_values(column[index]) for column in new_columns]
+                params = [{"reading_timestamp": timestamps[i], **dict(zip(COLUMNS, values_row))}
+                          for i, values_row in zip(index.tolist(), zip(*new_columns))]
+                await db.execute(statement, params)
+                await db.commit()
+                days.update(photoperiod(epoch[index[differs(ec_25[index], old_ec_25[index])]]).tolist())
+            scanned += len(rows)
+            updated += len(index)
+        if len(rows) < chunk_size:
+            break
+        chunk_query = query.where(table.c.timestamp > timestamps[-1])
+
+    if days:
+        now = datetime.utcnow()
+        params = []
+        for period in sorted(days):
+            day = photoperiod_day(period)
+            params.append({"device": device_id, "period": day, "start": photoperiod_start(day),
+                           "end": photoperiod_start(day + timedelta(days=1)), "refreshed_at": now})
+        async with WriteSessionLocal() as db:
+            await db.execute(refresh_daily_ec_25(), params)
+            await db.commit()
+
+    metrics.READINGS_RECALIBRATED.inc(updated)
+    return {"device_id": device_id, "scanned": scanned, "updated": updated, "days_refreshed": len(days),
+            "seconds": round(time.perf_counter() - began, 3)}
+
+
+async def run(args):
+    try:
+        async with WriteSessionLocal() as db:
+            store = await load_calibrations(db, args.device)
+        for device_id in args.device:
+            result = await recalibrate(store, device_id, args.start, args.end, args.chunk_size)
+            print(f"{device_id}: {result['updated']:,} of {result['scanned']:,} readings corrected, "
+                  f"{result['days_refreshed']} days refreshed in {result['seconds']:.1f}s")
+    finally:
+        await close_db()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(
+        description="Re-correct stored readings with the current calibrations",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--device", action="append", required=True,
+                        help="Device to re-correct (repeatable)")
+    parser.add_argument("--start", type=datetime.fromisoformat, default=None,
+                        help="First reading to re-correct (UTC, ISO format, default: the oldest)")
+    parser.add_argument("--end", type=datetime.fromisoformat, default=None,
+                        help="Re-correct readings before this time (UTC, ISO format, default: all)")
+    parser.add_argument("--chunk-size", type=int, default=RECALIBRATE_CHUNK_SIZE,
+                        help=f"Readings per transaction (default: {RECALIBRATE_CHUNK_SIZE})")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main_cli()
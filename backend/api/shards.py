@@ -0,0 +1,65 @@
+"""
+Device sharding for standalone ingest workers
+Assigns every device to one of N ingest shards with jump consistent
+hashing (Lamping & Veach, 2014): no lookup table, an even spread, and
+going from N to N+1 shards moves only 1/(N+1) of the devices. A device
+always lands on the same shard, so its readings are handled in order by
+one process.
+"""
+
+import zlib
+from typing import Dict, Optional
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Bucket in [0, buckets) for a 64-bit key"""
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b
+
+
+def shard_for(device_id: str, shards: int) -> int:
+    # crc32 is stable across processes, unlike hash() on str
+    encoded = device_id.encode()
+    return jump_hash(zlib.crc32(encoded) << 32 | zlib.crc32(encoded[::-1]), shards)
+
+
+class ShardRouter:
+    """
+    Decides whether this shard handles a device, from the MQTT topic alone
+
+    The device id is read from the topic level matching the "+" of the
+    subscription (agronomia/devices/+/data), so messages for other shards
+    are skipped without decoding their payload. Decisions are cached per
+    device.
+    """
+
+    def __init__(self, topic_filter: str, shards: int, index: int):
+        if not 0 <= index < shards:
+            raise ValueError(f"Shard index {index} is outside 0..{shards - 1}")
+        levels = topic_filter.split("/")
+        if "+" not in levels:
+            raise ValueError(f"Topic filter {topic_filter!r} has no '+' level to take the device id from")
+        self.level = levels.index("+")
+        self.shards = shards
+        self.index = index
+        self._owned: Dict[str, bool] = {}
+
+    def device_from_topic(self, topic: str) -> Optional[str]:
+        levels = topic.split("/")
+        return levels[self.level] if len(levels) > self.level else None
+
+    def owns(self, topic: str) -> bool:
+        device_id = self.device_from_topic(topic)
+        if device_id is None:
+            return False
+        owned = self._owned.get(device_id)
+        if owned is None:
+            owned = self._owned[device_id] = shard_for(device_id, self.shards) == self.index
+        return owned
+
+    def owned_devices(self) -> int:
+        return sum(self._owned.values())
@@ -0,0 +1,265 @@
+"""
+Write-ahead spool for the Agronomia ingest pipeline
+Device payloads are appended to a segmented, checksummed log on local disk
+before they reach the database, so readings survive database outages and
+API restarts. A drainer reads records back in order, bulk-loads them and
+acknowledges them; fully acknowledged segments are deleted.
+
+Record layout (little endian):
+    uint32 length | uint32 crc32(body) | float64 appended_at | body (UTF-8 JSON)
+"""
+
+import fcntl
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, List, NamedTuple, Optional
+
+import metrics
+
+RECORD_HEADER = struct.Struct("<IId")
+SEGMENT_PREFIX = "segment-"
+LOCK_NAME = "spool.lock"
+SEGMENT_SUFFIX = ".log"
+CURSOR_FILE = "cursor.json"
+QUARANTINE_FILE = "quarantine.jsonl"
+
+
+class SpoolPosition(NamedTuple):
+    segment: int
+    offset: int
+
+
+class SpoolLocked(Exception):
+    """The spool directory is held by another process"""
+
+
+class SpoolBatch(NamedTuple):
+    payloads: List[dict]
+    end: SpoolPosition
+    oldest_appended_at: Optional[float]
+
+
+def encode_record(payload: dict, appended_at: float) -> bytes:
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    return RECORD_HEADER.pack(len(body), zlib.crc32(body), appended_at) + body
+
+
+class Spool:
+    """
+    Segmented append-only log with batched fsync
+
+    append() is called by the ingest worker, read()/ack() by the drainer;
+    both may run in executor threads. Records are durable once fsynced, at
+    most fsync_interval seconds after they were appended (0 syncs on every
+    append). Delivery is at-least-once: records read but not yet
+    acknowledged when the process stops are read again on the next start.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 16 * 1024 * 1024,
+                 fsync_interval: float = 0.2):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._lock_fd = os.open(os.path.join(directory, LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(self._lock_fd)
+            raise SpoolLocked(f"Spool directory {directory} is in use by another process") from None
+        self.cursor = self._load_cursor()
+
+        # Segment sequence number -> bytes of valid records
+        self._sizes: Dict[int, int] = {}
+        for seq in self._list_segments():
+            if seq < self.cursor.segment:
+                os.remove(self._segment_path(seq))
+            else:
+                self._sizes[seq] = self._recover(seq)
+        if self.cursor.segment not in self._sizes:
+            first = min(self._sizes) if self._sizes else 0
+            self.cursor = SpoolPosition(first, 0)
+
+        self.replayed_bytes = self.pending_bytes()
+
+        # New writes always start a fresh segment
+        self._active = max(self._sizes, default=-1) + 1
+        self._file = open(self._segment_path(self._active), "ab")
+        self._sizes[self._active] = 0
+        self._unsynced = False
+        self._last_fsync = time.monotonic()
+
+        metrics.SPOOL_PENDING_BYTES.set_function(self.pending_bytes)
+        metrics.SPOOL_SEGMENTS.set_function(lambda: len(self._sizes))
+
+    # ------------------------------------------------------------------
+    # Files
+    # ------------------------------------------------------------------
+
+    def _segment_path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{seq:012d}{SEGMENT_SUFFIX}")
+
+    def _list_segments(self) -> List[int]:
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                segments.append(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+        return sorted(segments)
+
+    def _load_cursor(self) -> SpoolPosition:
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE)) as f:
+                data = json.load(f)
+            return SpoolPosition(int(data["segment"]), int(data["offset"]))
+        except (OSError, ValueError, KeyError):
+            return SpoolPosition(0, 0)
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, CURSOR_FILE)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"segment": self.cursor.segment, "offset": self.cursor.offset}, f)
+        os.replace(tmp, path)
+
+    def _recover(self, seq: int) -> int:
+        """Validate a segment and cut off a torn or corrupt tail; returns its valid size"""
+        path = self._segment_path(seq)
+        valid = 0
+        with open(path, "rb") as f:
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                length, crc, _ = RECORD_HEADER.unpack(header)
+                body = f.read(length)
+                if len(body) < length or zlib.crc32(body) != crc:
+                    metrics.SPOOL_CORRUPT_RECORDS.inc()
+                    break
+                valid += RECORD_HEADER.size + length
+        if valid < os.path.getsize(path):
+            print(f"Spool: truncating {path} to {valid} bytes (torn or corrupt tail)")
+            with open(path, "r+b") as f:
+                f.truncate(valid)
+        return valid
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+
+    def append(self, payloads: List[dict]) -> int:
+        """Append payloads; returns bytes written"""
+        now = time.time()
+        data = b"".join(encode_record(payload, now) for payload in payloads)
+        with self._lock:
+            if self._sizes[self._active] and self._sizes[self._active] + len(data) > self.segment_bytes:
+                self._rotate()
+            self._file.write(data)
+            # Flush to the OS so the drainer's own file handle can read it
+            self._file.flush()
+            self._sizes[self._active] += len(data)
+            self._unsynced = True
+            if time.monotonic() - self._last_fsync >= self.fsync_interval:
+                self._fsync()
+        metrics.SPOOL_APPENDED_RECORDS.inc(len(payloads))
+        return len(data)
+
+    def sync(self):
+        """fsync appended records if the interval has elapsed (call periodically)"""
+        with self._lock:
+            if self._unsynced and time.monotonic() - self._last_fsync >= self.fsync_interval:
+                self._fsync()
+
+    def _fsync(self):
+        start = time.perf_counter()
+        os.fsync(self._file.fileno())
+        metrics.SPOOL_FSYNC_SECONDS.observe(time.perf_counter() - start)
+        self._unsynced = False
+        self._last_fsync = time.monotonic()
+
+    def _rotate(self):
+        self._fsync()
+        self._file.close()
+        self._active += 1
+        self._file = open(self._segment_path(self._active), "ab")
+        self._sizes[self._active] = 0
+
+    # ------------------------------------------------------------------
+    # Draining
+    # ------------------------------------------------------------------
+
+    def read(self, max_records: int) -> SpoolBatch:
+        """Read up to max_records unacknowledged payloads, oldest first"""
+        with self._lock:
+            sizes = dict(self._sizes)
+        position = self.cursor
+        payloads: List[dict] = []
+        oldest = None
+
+        for seq in sorted(s for s in sizes if s >= position.segment):
+            offset = position.offset if seq == position.segment else 0
+            end = sizes[seq]
+            if offset < end:
+                with open(self._segment_path(seq), "rb") as f:
+                    f.seek(offset)
+                    while offset < end and len(payloads) < max_records:
+                        length, crc, appended_at = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                        body = f.read(length)
+                        offset += RECORD_HEADER.size + length
+                        if zlib.crc32(body) != crc:
+                            # Only possible on disk corruption after the segment was validated
+                            metrics.SPOOL_CORRUPT_RECORDS.inc()
+                            continue
+                        payloads.append(json.loads(body))
+                        if oldest is None:
+                            oldest = appended_at
+            position = SpoolPosition(seq, offset)
+            if len(payloads) >= max_records or offset < end:
+                break
+            if seq != max(sizes):
+                # Segment fully consumed, continue at the start of the next one
+                position = SpoolPosition(seq + 1, 0)
+
+        return SpoolBatch(payloads, position, oldest)
+
+    def ack(self, position: SpoolPosition):
+        """Mark everything before position as loaded and delete finished segments"""
+        with self._lock:
+            self.cursor = position
+            for seq in [s for s in self._sizes if s < position.segment and s != self._active]:
+                os.remove(self._segment_path(seq))
+                del self._sizes[seq]
+            self._save_cursor()
+
+    def quarantine(self, payloads: List[dict]):
+        """Set aside payloads that cannot be loaded, one JSON line each in quarantine.jsonl"""
+        with open(os.path.join(self.directory, QUARANTINE_FILE), "a") as f:
+            f.writelines(json.dumps(payload, separators=(",", ":"), default=str) + "\n" for payload in payloads)
+            f.flush()
+            os.fsync(f.fileno())
+        metrics.SPOOL_QUARANTINED_RECORDS.inc(len(payloads))
+
+    def pending_bytes(self) -> int:
+        sizes = dict(self._sizes)
+        return sum(size for seq, size in sizes.items() if seq >= self.cursor.segment) - self.cursor.offset
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending_bytes": self.pending_bytes(),
+            "segments": len(self._sizes),
+            "active_segment": self._active,
+            "cursor_segment": self.cursor.segment,
+            "cursor_offset": self.cursor.offset
+        }
+
+    def close(self):
+        with self._lock:
+            if self._unsynced:
+                self._fsync()
+            self._file.close()
+            os.close(self._lock_fd)
@@ -0,0 +1,581 @@
+"""
+Shared state for running the Agronomia API with several uvicorn workers
+Latest readings, cross-worker events (readings for the WebSocket hub,
+device status, threshold changes) and a leader lease, so that exactly one
+worker consumes MQTT and runs the maintenance tasks.
+
+Backends (STATE_BACKEND):
+  - memory: module-level dicts, events delivered in-process. One worker only.
+  - shm:    shared-memory segments on one host. Latest readings live in
+            a seqlock-protected slot table, events in a byte ring polled
+            by every worker; file locks serialize writers and elect the
+            leader.
+  - redis:  any Redis-protocol server (the compose file ships Redis).
+            A hash for latest readings, PUBLISH/SUBSCRIBE for events and a
+            SET NX PX lease for leadership. Works across hosts.
+"""
+
+import asyncio
+import fcntl
+import json
+import os
+import socket
+import struct
+import tempfile
+import zlib
+from contextlib import asynccontextmanager
+from multiprocessing import resource_tracker, shared_memory
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import redis.asyncio as aioredis
+    HAS_REDIS = True
+except ImportError:
+    HAS_REDIS = False
+
+import metrics
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_REDIS_URL = os.getenv("STATE_REDIS_URL", "redis://localhost:6379/0")
+STATE_KEY_PREFIX = os.getenv("STATE_KEY_PREFIX", "agronomia")
+STATE_SHM_DEVICES = int(os.getenv("STATE_SHM_DEVICES", "16384"))
+STATE_SHM_SLOT_BYTES = int(os.getenv("STATE_SHM_SLOT_BYTES", "1024"))
+STATE_SHM_EVENTS_MB = float(os.getenv("STATE_SHM_EVENTS_MB", "16"))
+STATE_SHM_POLL_MS = float(os.getenv("STATE_SHM_POLL_MS", "20"))
+LEADER_LEASE_SECONDS = float(os.getenv("LEADER_LEASE_SECONDS", "15"))
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+EventHandler = Callable[[dict], Awaitable[None]]
+
+
+def _encode(value) -> bytes:
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+class StateBackend:
+    """Interface shared by all backends; every method is called from the event loop"""
+
+    name = "base"
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def set_latest(self, readings: Dict[str, dict]):
+        """Store the newest payload of each device"""
+        raise NotImplementedError
+
+    async def get_latest(self) -> Dict[str, dict]:
+        raise NotImplementedError
+
+    async def get_latest_one(self, device_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def publish(self, message: dict):
+        """Deliver a JSON-serializable event to every worker, this one included"""
+        raise NotImplementedError
+
+    async def subscribe(self, handler: EventHandler):
+        """Call handler for every published event; runs until cancelled"""
+        raise NotImplementedError
+
+    async def acquire_leadership(self) -> bool:
+        """Take or renew the leader lease; True while this worker holds it"""
+        raise NotImplementedError
+
+    async def release_leadership(self):
+        pass
+
+    @asynccontextmanager
+    async def exclusive(self, name: str):
+        """Run a block in one worker at a time (e.g. creating tables at startup)"""
+        yield
+
+
+# ============================================================================
+# IN-PROCESS
+# ============================================================================
+
+class MemoryStateBackend(StateBackend):
+    """Plain dicts; the behaviour of a single-process API"""
+
+    name = "memory"
+
+    def __init__(self):
+        self.latest: Dict[str, dict] = {}
+        self._handler: Optional[EventHandler] = None
+
+    async def set_latest(self, readings: Dict[str, dict]):
+        self.latest.update(readings)
+
+    async def get_latest(self) -> Dict[str, dict]:
+        return self.latest
+
+    async def get_latest_one(self, device_id: str) -> Optional[dict]:
+        return self.latest.get(device_id)
+
+    async def publish(self, message: dict):
+        metrics.STATE_EVENTS_PUBLISHED.inc()
+        if self._handler is not None:
+            metrics.STATE_EVENTS_RECEIVED.inc()
+            await self._handler(message)
+
+    async def subscribe(self, handler: EventHandler):
+        self._handler = handler
+        try:
+            await asyncio.Event().wait()
+        finally:
+            self._handler = None
+
+    async def acquire_leadership(self) -> bool:
+        return True
+
+
+# ============================================================================
+# SHARED MEMORY (one host)
+# ============================================================================
+
+class _FileLock:
+    """flock-based lock between processes; released by the kernel if the holder dies"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def _attach_segment(name: str, size: int) -> Tuple[shared_memory.SharedMemory, bool]:
+    """Create or attach a named segment; returns (segment, created)"""
+    try:
+        segment, created = shared_memory.SharedMemory(name=name, create=True, size=size), True
+    except FileExistsError:
+        segment, created = shared_memory.SharedMemory(name=name), False
+    # Segments outlive any single worker: keep the resource tracker from
+    # unlinking them when the process that created (or attached) them exits
+    try:
+        resource_tracker.unregister(segment._name, "shared_memory")
+    except Exception:
+        pass
+    if segment.size < size:
+        raise RuntimeError(f"Shared memory segment {name} is smaller than configured; "
+                           f"remove /dev/shm/{name} after stopping all workers")
+    return segment, created
+
+
+class _SlotTable:
+    """
+    Fixed-capacity key -> bytes map in shared memory
+
+    Slots are allocated in order and never move, so readers can cache a
+    key's slot. An open-addressing index (crc32 of the key) maps keys to
+    slots. Each slot is guarded by a sequence counter that is odd while
+    it is being written: readers copy the slot and retry if the counter
+    changed (seqlock), so reads never block. Writers must hold the
+    backend's write lock. A writer that died mid-write leaves its slot's
+    counter odd: readers give up on the slot after READ_ATTEMPTS and treat
+    it as empty, and the next write of the key starts from an even counter.
+    """
+
+    MAGIC = 0xA6A6_0001
+    HEADER = struct.Struct("<IIIII")      # magic, layout version, capacity, slot bytes, slots used
+    HEADER_BYTES = 64
+    SLOT = struct.Struct("<IHI")          # sequence, key length, data length
+    KEY_BYTES = 64
+    INDEX = struct.Struct("<I")           # slot + 1, 0 = empty
+    READ_ATTEMPTS = 1000
+
+    def __init__(self, name: str, capacity: int, slot_bytes: int):
+        self.capacity = capacity
+        self.slot_bytes = slot_bytes
+        self.max_data = slot_bytes - self.SLOT.size - self.KEY_BYTES
+        self.index_size = capacity * 2
+        self._slots_offset = self.HEADER_BYTES + self.index_size * self.INDEX.size
+        self.segment, created = _attach_segment(name, self._slots_offset + capacity * slot_bytes)
+        self.buf = self.segment.buf
+        if created:
+            self.HEADER.pack_into(self.buf, 0, self.MAGIC, 1, capacity, slot_bytes, 0)
+        else:
+            magic, _, seg_capacity, seg_slot_bytes, _ = self.HEADER.unpack_from(self.buf)
+            if (magic, seg_capacity, seg_slot_bytes) != (self.MAGIC, capacity, slot_bytes):
+                raise RuntimeError(f"Shared memory segment {name} has a different layout; "
+                                   f"remove /dev/shm/{name} after stopping all workers")
+        self._slot_cache: Dict[str, int] = {}
+
+    @property
+    def used(self) -> int:
+        return self.HEADER.unpack_from(self.buf)[4]
+
+    def _slot_offset(self, slot: int) -> int:
+        return self._slots_offset + slot * self.slot_bytes
+
+    def _slot_key(self, slot: int) -> bytes:
+        offset = self._slot_offset(slot)
+        key_length = self.SLOT.unpack_from(self.buf, offset)[1]
+        start = offset + self.SLOT.size
+        return bytes(self.buf[start:start + key_length])
+
+    def _find(self, key: str, create: bool) -> Optional[int]:
+        slot = self._slot_cache.get(key)
+        if slot is not None:
+            return slot
+        encoded = key.encode()
+        position = zlib.crc32(encoded) % self.index_size
+        while True:
+            entry = self.INDEX.unpack_from(self.buf, self.HEADER_BYTES + position * self.INDEX.size)[0]
+            if entry == 0:
+                if not create:
+                    return None
+                return self._allocate(encoded, position, key)
+            if self._slot_key(entry - 1) == encoded:
+                self._slot_cache[key] = entry - 1
+                return entry - 1
+            position = (position + 1) % self.index_size
+
+    def _allocate(self, encoded: bytes, position: int, key: str) -> int:
+        if len(encoded) > self.KEY_BYTES:
+            raise ValueError(f"Key longer than {self.KEY_BYTES} bytes: {key!r}")
+        slot = self.used
+        if slot >= self.capacity:
+            raise ValueError(f"Shared state table is full ({self.capacity} keys)")
+        offset = self._slot_offset(slot)
+        # Key first, then the index entry, then the used count: readers only
+        # reach the slot through the index or the count
+        self.SLOT.pack_into(self.buf, offset, 0, len(encoded), 0)
+        self.buf[offset + self.SLOT.size:offset + self.SLOT.size + len(encoded)] = encoded
+        self.INDEX.pack_into(self.buf, self.HEADER_BYTES + position * self.INDEX.size, slot + 1)
+        struct.pack_into("<I", self.buf, 16, slot + 1)
+        self._slot_cache[key] = slot
+        return slot
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.max_data:
+            raise ValueError(f"Value for {key!r} is {len(data)} bytes, slots hold {self.max_data}")
+        slot = self._find(key, create=True)
+        offset = self._slot_offset(slot)
+        sequence, key_length, _ = self.SLOT.unpack_from(self.buf, offset)
+        # Odd only if a writer died mid-write; the write lock rules out a live one
+        sequence += sequence & 1
+        self.SLOT.pack_into(self.buf, offset, sequence + 1, key_length, len(data))
+        start = offset + self.SLOT.size + self.KEY_BYTES
+        self.buf[start:start + len(data)] = data
+        self.SLOT.pack_into(self.buf, offset, sequence + 2, key_length, len(data))
+
+    def _read(self, slot: int) -> Optional[bytes]:
+        offset = self._slot_offset(slot)
+        start = offset + self.SLOT.size + self.KEY_BYTES
+        for _ in range(self.READ_ATTEMPTS):
+            sequence, _, length = self.SLOT.unpack_from(self.buf, offset)
+            if sequence & 1:
+                continue
+            data = bytes(self.buf[start:start + length])
+            if self.SLOT.unpack_from(self.buf, offset)[0] == sequence:
+                return data if sequence else None
+        return None
+
+    def get(self, key: str) -> Optional[bytes]:
+        slot = self._find(key, create=False)
+        return None if slot is None else self._read(slot)
+
+    def items(self) -> Iterator[Tuple[str, bytes]]:
+        for slot in range(self.used):
+            data = self._read(slot)
+            if data is not None:
+                yield self._slot_key(slot).decode(), data
+
+    def close(self):
+        self.buf = None
+        self.segment.close()
+
+
+class _EventRing:
+    """
+    Multi-reader byte ring of length-prefixed messages in shared memory
+
+    The header holds a monotonically increasing write position; each reader
+    keeps its own cursor and polls it. A reader that falls more than the
+    ring size behind skips ahead and counts the messages as lost. Writers
+    must hold the backend's write lock.
+    """
+
+    MAGIC = 0xA6A6_0002
+    HEADER = struct.Struct("<IIQQ")       # magic, layout version, ring bytes, write position
+    HEADER_BYTES = 64
+    LENGTH = struct.Struct("<I")
+
+    def __init__(self, name: str, size: int):
+        self.size = size
+        # A message copied by a reader must not be overwritten while it is
+        # copied, so a reader stays this far behind the writer at most
+        self.max_message = size // 4
+        self.segment, created = _attach_segment(name, self.HEADER_BYTES + size)
+        self.buf = self.segment.buf
+        if created:
+            self.HEADER.pack_into(self.buf, 0, self.MAGIC, 1, size, 0)
+        elif self.HEADER.unpack_from(self.buf)[:3] != (self.MAGIC, 1, size):
+            raise RuntimeError(f"Shared memory segment {name} has a different layout; "
+                               f"remove /dev/shm/{name} after stopping all workers")
+
+    @property
+    def write_position(self) -> int:
+        return self.HEADER.unpack_from(self.buf)[3]
+
+    def _write(self, position: int, data: bytes):
+        start = position % self.size
+        first = min(len(data), self.size - start)
+        base = self.HEADER_BYTES
+        self.buf[base + start:base + start + first] = data[:first]
+        if first < len(data):
+            self.buf[base:base + len(data) - first] = data[first:]
+
+    def _copy(self, position: int, length: int) -> bytes:
+        start = position % self.size
+        first = min(length, self.size - start)
+        base = self.HEADER_BYTES
+        data = bytes(self.buf[base + start:base + start + first])
+        if first < length:
+            data += bytes(self.buf[base:base + length - first])
+        return data
+
+    def append(self, data: bytes):
+        if len(data) + self.LENGTH.size > self.max_message:
+            raise ValueError(f"Event of {len(data)} bytes exceeds the ring limit of {self.max_message}")
+        position = self.write_position
+        self._write(position, self.LENGTH.pack(len(data)) + data)
+        struct.pack_into("<Q", self.buf, 16, position + self.LENGTH.size + len(data))
+
+    def read(self, cursor: int) -> Tuple[List[bytes], int, int]:
+        """Messages after cursor; returns (messages, new cursor, messages lost)"""
+        end = self.write_position
+        if end - cursor > self.size - self.max_message:
+            return [], end, 1
+        messages = []
+        position = cursor
+        while position < end:
+            length = self.LENGTH.unpack(self._copy(position, self.LENGTH.size))[0]
+            messages.append(self._copy(position + self.LENGTH.size, length))
+            position += self.LENGTH.size + length
+        if self.write_position - cursor > self.size - self.max_message:
+            # Overwritten while copying
+            return [], self.write_position, len(messages)
+        return messages, position, 0
+
+    def close(self):
+        self.buf = None
+        self.segment.close()
+
+
+class SharedMemoryStateBackend(StateBackend):
+    """State shared by the workers of one host through /dev/shm"""
+
+    name = "shm"
+
+    def __init__(self, prefix: str = STATE_KEY_PREFIX, devices: int = STATE_SHM_DEVICES,
+                 slot_bytes: int = STATE_SHM_SLOT_BYTES, events_bytes: int = int(STATE_SHM_EVENTS_MB * 1024 * 1024),
+                 poll_interval: float = STATE_SHM_POLL_MS / 1000):
+        self.prefix = prefix
+        self.devices = devices
+        self.slot_bytes = slot_bytes
+        self.events_bytes = events_bytes
+        self.poll_interval = poll_interval
+        lock_dir = tempfile.gettempdir()
+        self._write_lock = _FileLock(os.path.join(lock_dir, f"{prefix}-state.lock"))
+        self._leader_lock = _FileLock(os.path.join(lock_dir, f"{prefix}-leader.lock"))
+        self._lock_dir = lock_dir
+
+    async def open(self):
+        # Segment creation and layout checks are serialized by the write lock
+        with self._write_lock:
+            self.latest = _SlotTable(f"{self.prefix}-latest", self.devices, self.slot_bytes)
+            self.events = _EventRing(f"{self.prefix}-events", self.events_bytes)
+
+    async def close(self):
+        self._leader_lock.release()
+        for segment in (self.latest, self.events):
+            segment.close()
+
+    async def set_latest(self, readings: Dict[str, dict]):
+        encoded = []
+        for device_id, payload in readings.items():
+            data = _encode(payload)
+            if len(data) > self.latest.max_data:
+                # One large payload must not cost the rest of the batch its update
+                metrics.STATE_LATEST_SKIPPED.inc()
+                continue
+            encoded.append((device_id, data))
+        with self._write_lock:
+            for device_id, data in encoded:
+                self.latest.put(device_id, data)
+
+    async def get_latest(self) -> Dict[str, dict]:
+        return {device_id: json.loads(data) for device_id, data in self.latest.items()}
+
+    async def get_latest_one(self, device_id: str) -> Optional[dict]:
+        data = self.latest.get(device_id)
+        return json.loads(data) if data is not None else None
+
+    async def publish(self, message: dict):
+        data = _encode(message)
+        with self._write_lock:
+            self.events.append(data)
+        metrics.STATE_EVENTS_PUBLISHED.inc()
+
+    async def subscribe(self, handler: EventHandler):
+        cursor = self.events.write_position
+        while True:
+            messages, cursor, lost = self.events.read(cursor)
+            if lost:
+                metrics.STATE_EVENTS_LOST.inc(lost)
+            for data in messages:
+                metrics.STATE_EVENTS_RECEIVED.inc()
+                try:
+                    await handler(json.loads(data))
+                except Exception as e:
+                    print(f"Error handling state event: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def acquire_leadership(self) -> bool:
+        # The kernel drops the lock if the leader dies, and a waiting worker takes over
+        return self._leader_lock.held or self._leader_lock.acquire(blocking=False)
+
+    async def release_leadership(self):
+        self._leader_lock.release()
+
+    @asynccontextmanager
+    async def exclusive(self, name: str):
+        lock = _FileLock(os.path.join(self._lock_dir, f"{self.prefix}-{name}.lock"))
+        await asyncio.get_running_loop().run_in_executor(None, lock.acquire)
+        try:
+            yield
+        finally:
+            lock.release()
+
+
+# ============================================================================
+# REDIS PROTOCOL
+# ============================================================================
+
+# Renew or release the lease only if this worker still owns it
+_RENEW_LEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end"
+_RELEASE_LEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+EXCLUSIVE_TIMEOUT_MS = 300_000
+
+
+class RedisStateBackend(StateBackend):
+    """State in a Redis-protocol server, shared by workers on any number of hosts"""
+
+    name = "redis"
+
+    def __init__(self, url: str = STATE_REDIS_URL, prefix: str = STATE_KEY_PREFIX,
+                 lease_seconds: float = LEADER_LEASE_SECONDS):
+        if not HAS_REDIS:
+            raise ImportError("STATE_BACKEND=redis needs the redis package: pip install redis")
+        self.url = url
+        self.lease_ms = int(lease_seconds * 1000)
+        self.latest_key = f"{prefix}:latest"
+        self.channel = f"{prefix}:events"
+        self.leader_key = f"{prefix}:leader"
+        self.lock_prefix = f"{prefix}:lock:"
+
+    async def open(self):
+        self.redis = aioredis.from_url(self.url)
+        await self.redis.ping()
+
+    async def close(self):
+        await self.redis.aclose()
+
+    async def set_latest(self, readings: Dict[str, dict]):
+        if readings:
+            await self.redis.hset(self.latest_key, mapping={k: _encode(v) for k, v in readings.items()})
+
+    async def get_latest(self) -> Dict[str, dict]:
+        return {k.decode(): json.loads(v) for k, v in (await self.redis.hgetall(self.latest_key)).items()}
+
+    async def get_latest_one(self, device_id: str) -> Optional[dict]:
+        data = await self.redis.hget(self.latest_key, device_id)
+        return json.loads(data) if data is not None else None
+
+    async def publish(self, message: dict):
+        await self.redis.publish(self.channel, _encode(message))
+        metrics.STATE_EVENTS_PUBLISHED.inc()
+
+    async def subscribe(self, handler: EventHandler):
+        retry_delay = 1.0
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.channel)
+                retry_delay = 1.0
+                async for message in pubsub.listen():
+                    metrics.STATE_EVENTS_RECEIVED.inc()
+                    try:
+                        await handler(json.loads(message["data"]))
+                    except Exception as e:
+                        print(f"Error handling state event: {e}")
+            except aioredis.ConnectionError as e:
+                # Events published while disconnected are lost (Redis pub/sub is fire-and-forget)
+                print(f"State subscription lost, reconnecting in {retry_delay:.0f}s: {e}")
+                await asyncio.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 30)
+            finally:
+                await pubsub.aclose()
+
+    async def acquire_leadership(self) -> bool:
+        if await self.redis.set(self.leader_key, WORKER_ID, nx=True, px=self.lease_ms):
+            return True
+        return bool(await self.redis.eval(_RENEW_LEASE, 1, self.leader_key, WORKER_ID, self.lease_ms))
+
+    async def release_leadership(self):
+        await self.redis.eval(_RELEASE_LEASE, 1, self.leader_key, WORKER_ID)
+
+    @asynccontextmanager
+    async def exclusive(self, name: str):
+        # Same compare-and-delete as the lease; expires if the holder dies mid-block
+        key = self.lock_prefix + name
+        while not await self.redis.set(key, WORKER_ID, nx=True, px=EXCLUSIVE_TIMEOUT_MS):
+            await asyncio.sleep(0.1)
+        try:
+            yield
+        finally:
+            await self.redis.eval(_RELEASE_LEASE, 1, key, WORKER_ID)
+
+
+BACKENDS = {
+    "memory": MemoryStateBackend,
+    "shm": SharedMemoryStateBackend,
+    "redis": RedisStateBackend,
+}
+
+
+def create_state_backend(name: str = STATE_BACKEND) -> StateBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown STATE_BACKEND {name!r}, expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[name]()
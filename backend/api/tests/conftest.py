@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Modules import each other by name from backend/api, as when the API is run from there
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# One in-memory database for the test session instead of ./agronomia.db
+os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
+os.environ.setdefault("API_MQTT_INGEST", "false")
@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+from anomaly import DRIFT, RATE, SPIKE, AnomalyDetector
+
+MINUTE = 60.0
+
+
+def steady(detector, device="a", readings=200, level=6.0, noise=0.02, seed=1):
+    """Feed one reading a minute of noise around level; returns the last timestamp"""
+    rng = np.random.default_rng(seed)
+    anomalies = []
+    for i in range(readings):
+        anomalies += detector.observe([device], [i * MINUTE], [[level + rng.normal(0, noise)]])
+    assert anomalies == []
+    return (readings - 1) * MINUTE
+
+
+def kinds(anomalies):
+    return {anomaly.kind for anomaly in anomalies}
+
+
+def test_noise_raises_nothing():
+    detector = AnomalyDetector(["ph"])
+    steady(detector, readings=1000)
+    baseline = detector.baseline("a")["ph"]
+    assert baseline["mean"] == pytest.approx(6.0, abs=0.01)
+    assert baseline["robust_std"] == pytest.approx(0.02, rel=0.3)
+    assert baseline["samples"] == 1000
+
+
+def test_spike():
+    detector = AnomalyDetector(["ph"])
+    t = steady(detector)
+    # Far from the baseline, but over an hour: not a rate anomaly
+    (anomaly,) = [a for a in detector.observe(["a"], [t + 3600], [[6.5]]) if a.kind != DRIFT]
+    assert (anomaly.kind, anomaly.metric, anomaly.value) == (SPIKE, "ph", 6.5)
+    assert anomaly.expected == pytest.approx(6.0, abs=0.01)
+    assert anomaly.score > 6
+    # The clipped spike leaves the spread alone
+    assert detector.baseline("a")["ph"]["robust_std"] == pytest.approx(0.02, rel=0.3)
+
+
+def test_rate_depends_on_the_time_between_readings():
+    detector = AnomalyDetector(["ph"])
+    t = steady(detector)
+    previous = detector.last[detector.rows["a"], 0]
+    (anomaly,) = [a for a in detector.observe(["a"], [t + MINUTE], [[7.0]]) if a.kind == RATE]
+    assert anomaly.expected == previous
+    assert anomaly.score > 1
+
+
+def test_slow_drift_inside_the_noise_band():
+    detector = AnomalyDetector(["ph"])
+    t = steady(detector)
+    rng = np.random.default_rng(2)
+    anomalies = []
+    for i in range(1, 400):
+        anomalies += detector.observe(["a"], [t + i * MINUTE], [[6.0 + 0.001 * i + rng.normal(0, 0.02)]])
+    assert kinds(anomalies) == {DRIFT}
+    assert anomalies[0].value > anomalies[0].expected
+
+
+def test_no_anomalies_during_warmup():
+    detector = AnomalyDetector(["ph"], warmup=30)
+    steady(detector, readings=10)
+    assert detector.observe(["a"], [10 * MINUTE], [[9.0]]) == []
+
+
+def test_cooldown_limits_repeated_alerts():
+    detector = AnomalyDetector(["ph"], cooldown=600)
+    t = steady(detector)
+    spikes = [a for i in range(1, 4) for a in detector.observe(["a"], [t + i * 3600 / 100], [[6.5]])
+              if a.kind == SPIKE]
+    assert len(spikes) == 1
+
+
+def test_missing_metrics_leave_the_baseline_alone():
+    detector = AnomalyDetector(["ph", "ec"])
+    detector.observe(["a"], [0.0], [[6.0, np.nan]])
+    assert set(detector.baseline("a")) == {"ph"}
+
+
+def test_repeated_devices_in_a_batch_are_applied_in_order():
+    one_by_one, batched = AnomalyDetector(["ph"]), AnomalyDetector(["ph"])
+    t = steady(one_by_one)
+    steady(batched)
+    readings = [("a", t + MINUTE, 6.01), ("b", t + MINUTE, 5.0), ("a", t + 2 * MINUTE, 6.9)]
+    expected = [a for d, ts, x in readings for a in one_by_one.observe([d], [ts], [[x]])]
+    got = batched.observe(*zip(*[(d, ts, [x]) for d, ts, x in readings]))
+    assert [(a.device_id, a.kind, a.index) for a in got] == [(a.device_id, a.kind, 2) for a in expected]
+    assert batched.baseline("a") == one_by_one.baseline("a")
+
+
+def test_state_grows_with_devices():
+    detector = AnomalyDetector(["ph"], capacity=2)
+    detector.observe([f"d{i}" for i in range(5)], [0.0] * 5, [[6.0 + i] for i in range(5)])
+    assert len(detector) == 5 and detector.capacity >= 5
+    assert detector.baseline("d3")["ph"]["mean"] == 9.0
+
+
+def test_unknown_metric():
+    with pytest.raises(ValueError, match="nitrate"):
+        AnomalyDetector(["ph", "nitrate"])
@@ -0,0 +1,41 @@
+import numpy as np
+
+from backtest import History, evaluate
+from thresholds import Bounds
+
+BOUNDS = Bounds(5.5, 6.5, 18.0, 26.0, 40.0, 80.0, 800.0, 2000.0)
+
+
+def history(rows):
+    """History from (device index, epoch seconds, ph) rows sorted by device and time"""
+    device, timestamp, ph = (np.array(column) for column in zip(*rows))
+    nan = np.full(len(rows), np.nan)
+    return History(["a", "b"], device.astype(np.int64), timestamp.astype(float),
+                   {"ph": ph.astype(float), "water_temp": nan, "humidity": nan})
+
+
+def test_episodes_report_their_own_peak():
+    rows = [
+        (0, 0, 7.0), (0, 200, 7.0), (0, 400, 6.0),
+        # Shorter than min_duration: dropped, and its peak must not leak into a's episode
+        (1, 0, 9.0), (1, 10, 6.0),
+        (1, 1000, 4.0), (1, 1200, 4.5), (1, 1400, 6.0),
+    ]
+    report = evaluate(history(rows), np.array([BOUNDS] * 2), min_duration=100, timeline=True)
+
+    ph = report["rules"]["pH"]
+    assert (ph["readings_out_of_range"], ph["episodes"], ph["duration_s"]) == (5, 2, 800.0)
+    (a,), (b,) = report["timeline"]["a"], report["timeline"]["b"]
+    assert (a["direction"], a["duration_s"], a["peak_excess"]) == ("high", 400.0, 0.5)
+    assert (b["direction"], b["duration_s"], b["peak_excess"]) == ("low", 400.0, 1.5)
+    assert report["devices_with_alerts"]["b"]["pH"] == {"readings_out_of_range": 3, "episodes": 1,
+                                                        "duration_s": 400.0}
+
+
+def test_open_episode_at_the_end_of_the_history():
+    rows = [(0, 0, 6.0), (1, 0, 6.0), (1, 60, 7.5), (1, 120, 8.0)]
+    report = evaluate(history(rows), np.array([BOUNDS] * 2), timeline=True)
+
+    assert report["rules"]["pH"]["open_episodes"] == 1
+    (b,) = report["timeline"]["b"]
+    assert (b["end"], b["duration_s"], b["peak_excess"]) == (None, 60.0, 1.5)
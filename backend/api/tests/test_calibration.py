@@ -0,0 +1,83 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from calibration import CalibrationStore, describe, epoch_seconds, knots
+
+JAN, FEB, MAR = datetime(2026, 1, 1), datetime(2026, 2, 1), datetime(2026, 3, 1)
+
+
+def ms(value: datetime) -> int:
+    return round(epoch_seconds(value) * 1000)
+
+
+def reading(device_id: str, timestamp: datetime, **sensors) -> dict:
+    return {"device_id": device_id, "timestamp": ms(timestamp), "sensors": sensors}
+
+
+def store(*calibrations) -> CalibrationStore:
+    compiled = CalibrationStore()
+    compiled.load(1, calibrations)
+    return compiled
+
+
+def test_piecewise_interpolation_and_extension():
+    calibrations = store(("a", "ph", 1, JAN, [[4.1, 4.0], [7.2, 7.0], [10.1, 10.0]]))
+    payloads = [reading("a", FEB, ph=value) for value in (4.1, 5.65, 8.65, 11.55, 2.55)]
+    assert calibrations.apply(payloads) == 5
+    assert [p["sensors"]["ph"] for p in payloads] == [4.0, 5.5, 8.5, 11.5, 2.5]
+    assert [p["raw"]["ph"] for p in payloads] == [4.1, 5.65, 8.65, 11.55, 2.55]
+
+
+def test_offset_and_linear_calibrations():
+    calibrations = store(("a", "water_temp", 1, JAN, [[20.0, 21.0]]),
+                         ("a", "ec", 1, JAN, [[0, 0], [1000, 1100]]))
+    payloads = [reading("a", FEB, water_temp=25.0, ec=500, ph=6.0)]
+    assert calibrations.apply(payloads) == 2
+    assert payloads[0]["sensors"] == {"water_temp": 26.0, "ec": 550.0, "ph": 6.0}
+    assert describe([[20.0, 21.0]]) == {"kind": "offset", "slope": 1.0, "offset": 1.0}
+    assert describe([[0, 0], [1000, 1100]])["slope"] == pytest.approx(1.1)
+
+
+def test_calibration_in_force_at_the_reading_time_applies():
+    calibrations = store(("a", "ph", 1, JAN, [[6.0, 6.1]]),
+                         ("a", "ph", 2, MAR, [[6.0, 6.3]]),
+                         # Amends the January calibration
+                         ("a", "ph", 3, JAN, [[6.0, 6.2]]))
+    payloads = [reading("a", when, ph=6.0) for when in (datetime(2025, 12, 31), JAN, FEB, MAR, datetime(2026, 4, 1))]
+    assert calibrations.apply(payloads) == 4
+    assert [p["sensors"]["ph"] for p in payloads] == [6.0, 6.2, 6.2, 6.3, 6.3]
+
+
+def test_removed_calibration_restores_raw_values():
+    calibrations = store(("a", "ph", 1, JAN, [[6.0, 6.5]]), ("a", "ph", 2, MAR, []))
+    payloads = [reading("a", FEB, ph=6.0), reading("a", MAR, ph=6.0)]
+    calibrations.apply(payloads)
+    assert [p["sensors"]["ph"] for p in payloads] == [6.5, 6.0]
+    # Re-applied after the removal, the corrected reading goes back to its raw value
+    calibrations.load(2, [("a", "ph", 2, JAN, [])])
+    assert calibrations.apply(payloads) == 0
+    assert payloads[0]["sensors"]["ph"] == 6.0 and payloads[0]["raw"] == {}
+
+
+def test_applying_twice_changes_nothing():
+    calibrations = store(("a", "ph", 1, JAN, [[6.0, 6.5]]))
+    payloads = [reading("a", FEB, ph=6.0)]
+    calibrations.apply(payloads)
+    calibrations.apply(payloads)
+    assert (payloads[0]["sensors"]["ph"], payloads[0]["raw"]["ph"]) == (6.5, 6.0)
+
+
+def test_other_devices_and_missing_values_are_untouched():
+    calibrations = store(("a", "ph", 1, JAN, [[6.0, 6.5]]))
+    payloads = [reading("b", FEB, ph=6.0), reading("a", FEB, ec=1.8), {"device_id": "a", "sensors": {"ph": 6.0}}]
+    assert calibrations.apply(payloads) == 0
+    assert all("raw" not in p for p in payloads)
+    assert np.isnan(calibrations.correct(np.array([[np.nan]]), np.array([[0]]))).all()
+
+
+def test_invalid_points():
+    for points in ([], [[1, 1]] * 6, [[1, 2], [1, 3]], [[1, 3], [2, 2]], [[1, float("nan")]]):
+        with pytest.raises(ValueError):
+            knots(points)
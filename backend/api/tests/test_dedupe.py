@@ -0,0 +1,52 @@
+from dedupe import RecentKeys, reading_key
+
+
+def reading(device_id: str, timestamp: int) -> dict:
+    return {"device_id": device_id, "timestamp": timestamp, "sensors": {"ph": 6.0}}
+
+
+def test_redeliveries_are_dropped():
+    keys = RecentKeys(10)
+    first = [reading("a", 1), reading("b", 1), reading("a", 1)]
+    assert keys.filter(first) == first[:2]
+    assert keys.filter([reading("a", 1), reading("a", 2)]) == [reading("a", 2)]
+    assert keys.stats() == {"capacity": 10, "size": 3, "lookups": 5, "hits": 2, "hit_rate": 0.4}
+
+
+def test_least_recently_seen_key_is_evicted():
+    keys = RecentKeys(2)
+    assert not keys.check_and_add(("a", 1))
+    assert not keys.check_and_add(("b", 1))
+    # A hit makes ("a", 1) the most recent, so ("b", 1) goes first
+    assert keys.check_and_add(("a", 1))
+    assert not keys.check_and_add(("c", 1))
+    assert len(keys) == 2
+    assert keys.check_and_add(("a", 1))
+    assert not keys.check_and_add(("b", 1))
+
+
+def test_zero_capacity_keeps_everything():
+    keys = RecentKeys(0)
+    payloads = [reading("a", 1), reading("a", 1)]
+    assert keys.filter(payloads) == payloads
+    assert len(keys) == 0
+
+
+def test_reading_key():
+    assert reading_key(reading("a", 5)) == ("a", 5)
+    assert reading_key({"device_id": "a"}) == ("a", None)
+
+
+def test_readings_without_timestamp_are_not_deduplicated():
+    keys = RecentKeys(10)
+    payloads = [{"device_id": "a", "sensors": {"ph": 6.0}}, {"device_id": "a", "sensors": {"ph": 6.1}}]
+    assert keys.filter(payloads) == payloads
+    assert len(keys) == 0
+
+
+def test_forgotten_keys_are_accepted_again():
+    keys = RecentKeys(10)
+    lost = [reading("a", 1), reading("b", 1)]
+    keys.filter(lost)
+    keys.forget(lost + [reading("c", 1)])
+    assert keys.filter(lost) == lost
@@ -0,0 +1,58 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import insert
+
+from database import Base, SensorReading, SessionLocal, engine
+from features import FeatureStore, load_readings
+
+START = datetime(2026, 3, 1)
+START_EPOCH = (START - datetime(1970, 1, 1)).total_seconds()
+
+
+def run_with_readings(hours, test):
+    """Run test() against hourly air_temp readings of dev-1 from START, on a fresh database"""
+    async def run():
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+                await conn.execute(insert(SensorReading.__table__), [
+                    {"device_id": "dev-1", "timestamp": START + timedelta(hours=h), "air_temp": float(h)}
+                    for h in range(hours)])
+            return await test()
+        finally:
+            # Drops the in-memory database; the connection belongs to this event loop
+            await engine.dispose()
+    return asyncio.run(run())
+
+
+def test_load_readings_on_the_hour_are_whole_seconds():
+    async def test():
+        async with SessionLocal() as db:
+            return await load_readings(db, ["dev-1"], START_EPOCH, START_EPOCH + 24 * 3600, ["air_temp"])
+
+    _, _, timestamps, values = run_with_readings(24, test)
+    order = np.argsort(timestamps)
+    np.testing.assert_array_equal(timestamps[order], START_EPOCH + 3600 * np.arange(24.0))
+    np.testing.assert_array_equal(values[order, 0], np.arange(24.0))
+
+
+def test_window_puts_readings_on_the_hour_in_their_own_step():
+    async def test():
+        return await FeatureStore(SessionLocal).window(["dev-1"], 24, 3600, ["air_temp"],
+                                                       end=START_EPOCH + 23.5 * 3600, method="none")
+
+    window = run_with_readings(24, test)
+    assert window.start == START_EPOCH
+    assert window.observed[0, :, 0].all()
+    np.testing.assert_array_equal(window.values[0, :, 0], np.arange(24.0))
+
+
+def test_load_readings_excludes_the_end_bound():
+    async def test():
+        async with SessionLocal() as db:
+            return await load_readings(db, ["dev-1"], START_EPOCH + 3600, START_EPOCH + 3 * 3600, ["air_temp"])
+
+    _, _, timestamps, _ = run_with_readings(24, test)
+    np.testing.assert_array_equal(np.sort(timestamps), START_EPOCH + 3600 * np.arange(1.0, 3.0))
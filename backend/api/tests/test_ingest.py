@@ -0,0 +1,134 @@
+import asyncio
+import json
+import os
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import func, select
+
+import main
+from calibration import CalibrationStore
+from database import Base, DailyMetrics, SensorReading, SessionLocal, engine
+from spool import QUARANTINE_FILE, Spool
+
+GOOD = {"device_id": "dev-1", "timestamp": 1772323200000, "sensors": {"ph": 6.1, "air_temp": 23.5}}
+# Spooled before payloads were checked on the way in
+LEGACY = {"device_id": "dev-2", "timestamp": "not a time", "sensors": {"ph": 6.0}}
+
+
+@pytest.fixture
+def spool(tmp_path, monkeypatch):
+    spool = Spool(str(tmp_path / "spool"), fsync_interval=0)
+    monkeypatch.setattr(main, "spool", spool)
+    yield spool
+    spool.close()
+
+
+def run(coroutine_function):
+    async def wrapper():
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            await main.refresh_thresholds()
+            await main.refresh_calibrations()
+            return await coroutine_function()
+        finally:
+            await engine.dispose()
+    return asyncio.run(wrapper())
+
+
+async def _stored():
+    async with SessionLocal() as db:
+        return await db.scalar(select(func.count()).select_from(SensorReading))
+
+
+def test_spool_drainer_quarantines_payloads_it_cannot_store(spool):
+    spool.append([LEGACY, GOOD])
+
+    async def test():
+        await main.load_spool_batch(spool.read(100))
+        return await _stored()
+
+    assert run(test) == 1
+    assert spool.pending_bytes() == 0
+    with open(os.path.join(spool.directory, QUARANTINE_FILE)) as f:
+        assert [json.loads(line) for line in f] == [LEGACY]
+
+
+def test_invalid_payloads_are_not_spooled(spool):
+    iso = {**GOOD, "device_id": "dev-3", "timestamp": "2026-03-01T00:00:00+00:00"}
+    batch = [(0.0, LEGACY), (0.0, iso), (0.0, {**GOOD, "sensors": {"ph": "high"}})]
+    invalid = main.ingest_stats["invalid"]
+
+    async def test():
+        await main.process_ingest_batch(batch)
+        loaded = spool.read(100)
+        await main.load_spool_batch(loaded)
+        return loaded.payloads, await _stored()
+
+    payloads, stored = run(test)
+    assert main.ingest_stats["invalid"] - invalid == 2
+    assert [p["timestamp"] for p in payloads] == [1772323200000]
+    assert stored == 1
+
+
+def test_posted_sensor_data_is_stored_like_ingested_readings(monkeypatch):
+    calibrations = CalibrationStore()
+    calibrations.load(1, [("dev-1", "ph", 1, datetime(2026, 1, 1), [[6.0, 6.5]])])
+    monkeypatch.setattr(main, "calibration_store", calibrations)
+    data = main.SensorData(device_id="dev-1", timestamp=datetime(2026, 3, 1, 12, tzinfo=timezone.utc), ph=6.1,
+                           water_temp=21.0, air_temp=24.0, humidity=60.0, ec=1.8, tds=900.0, lux=20000)
+
+    async def test():
+        async with SessionLocal() as db:
+            await main.post_sensor_data(data, db)
+            with pytest.raises(HTTPException) as duplicate:
+                await main.post_sensor_data(data, db)
+            reading = await db.scalar(select(SensorReading))
+            rollup = await db.scalar(select(DailyMetrics))
+        return reading, rollup, duplicate.value.status_code
+
+    reading, rollup, status = run(test)
+    assert (reading.ph, reading.ph_raw) == (6.6, 6.1)
+    assert reading.vpd is not None and reading.ec_25 is not None
+    assert (rollup.device_id, rollup.readings) == ("dev-1", 1)
+    assert status == 409
+
+
+def test_redelivery_of_a_lost_batch_is_stored(monkeypatch):
+    monkeypatch.setattr(main, "spool", None)
+    reading = {**GOOD, "device_id": "dev-4"}
+    fail = True
+    save = main.save_sensor_readings
+
+    async def save_sensor_readings(payloads):
+        if fail:
+            raise ConnectionError("database unavailable")
+        return await save(payloads)
+
+    monkeypatch.setattr(main, "save_sensor_readings", save_sensor_readings)
+
+    async def test():
+        nonlocal fail
+        await main.process_ingest_batch([(0.0, reading)])
+        fail = False
+        await main.process_ingest_batch([(0.0, reading)])
+        async with SessionLocal() as db:
+            return await db.scalar(select(func.count()).where(SensorReading.device_id == "dev-4"))
+
+    assert run(test) == 1
+
+
+def test_readings_without_timestamp_are_stamped_on_arrival(monkeypatch):
+    monkeypatch.setattr(main, "spool", None)
+    reading = {"device_id": "dev-5", "sensors": {"ph": 6.2}}
+    before = datetime.utcnow().replace(microsecond=0)
+
+    async def test():
+        await main.process_ingest_batch([(0.0, reading)])
+        async with SessionLocal() as db:
+            return (await db.scalars(select(SensorReading.timestamp).where(SensorReading.device_id == "dev-5"))).all()
+
+    (timestamp,) = run(test)
+    assert timestamp >= before
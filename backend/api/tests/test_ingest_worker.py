@@ -0,0 +1,92 @@
+import asyncio
+import json
+import queue
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+
+import ingest_worker
+import main
+from database import Base, SensorReading, SessionLocal, engine
+from shards import ShardRouter
+from spool import Spool
+
+DEVICES = [f"worker-{i}" for i in range(20)]
+
+
+@pytest.fixture
+def spool(tmp_path, monkeypatch):
+    spool = Spool(str(tmp_path / "spool"), fsync_interval=0)
+    monkeypatch.setattr(main, "spool", spool)
+    yield spool
+    spool.close()
+
+
+def message(device_id: str, timestamp: int) -> SimpleNamespace:
+    payload = {"device_id": device_id, "timestamp": timestamp, "sensors": {"ph": 6.0 + timestamp % 10 / 10}}
+    return SimpleNamespace(topic=f"agronomia/devices/{device_id}/data", payload=json.dumps(payload).encode())
+
+
+def workers(shards: int):
+    """on_message of each hash shard's MQTT client"""
+    return [ingest_worker.create_mqtt_client("hash", str(index), ShardRouter(main.MQTT_TOPIC, shards, index)).on_message
+            for index in range(shards)]
+
+
+def drain() -> list:
+    batch = []
+    while True:
+        try:
+            batch.append(main.ingest_queue.get_nowait())
+        except queue.Empty:
+            return batch
+
+
+def test_hash_workers_only_ingest_their_own_devices():
+    on_messages = workers(3)
+    handled = []
+    for on_message in on_messages:
+        for device in DEVICES:
+            on_message(None, None, message(device, 1772323200000))
+        handled.append({payload["device_id"] for _, payload in drain()})
+
+    assert set().union(*handled) == set(DEVICES)
+    assert sum(map(len, handled)) == len(DEVICES)
+
+
+def test_sharded_readings_are_stored_once_in_order(spool):
+    on_messages = workers(2)
+    timestamps = [1772409600000 + minute * 60000 for minute in range(5)]
+
+    async def test():
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            await main.refresh_thresholds()
+            await main.refresh_calibrations()
+            batches = []
+            for on_message in on_messages:
+                for timestamp in timestamps:
+                    for device in DEVICES:
+                        on_message(None, None, message(device, timestamp))
+                batch = drain()
+                batches.append(batch)
+                await main.process_ingest_batch(batch)
+                await main.load_spool_batch(spool.read(1000))
+            async with SessionLocal() as db:
+                stored = (await db.execute(select(SensorReading.device_id, SensorReading.timestamp)
+                                           .where(SensorReading.device_id.in_(DEVICES)))).all()
+            return batches, stored
+        finally:
+            await engine.dispose()
+
+    batches, stored = asyncio.run(test())
+    assert all(batches)
+    for batch in batches:
+        order = {}
+        for _, payload in batch:
+            order.setdefault(payload["device_id"], []).append(payload["timestamp"])
+        # Each worker sees its devices' readings in the order they were published
+        assert all(received == timestamps for received in order.values())
+    assert len(stored) == len(set(stored)) == len(DEVICES) * len(timestamps)
@@ -0,0 +1,78 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import insert
+
+from database import Base, Device, GrowthRecord, HarvestRecord, SensorReading, SessionLocal, engine
+from features import FeatureStore
+from model_updates import load_examples, trained_through
+from predictions import HarvestJob
+
+START = datetime(2026, 3, 1)
+
+
+def _growth(device_id, day, height):
+    return {"device_id": device_id, "timestamp": START + timedelta(days=day), "plant_height": height,
+            "leaf_count": None, "growth_rate": None}
+
+
+def _harvest(device_id, day, grams):
+    return {"device_id": device_id, "harvest_date": START + timedelta(days=day), "yield_amount": grams}
+
+
+def load(since=None):
+    job = HarvestJob(registry=None)
+    # Only the plant encoder is used to build inputs
+    job.model = SimpleNamespace(plant_encoder=SimpleNamespace(classes_=["tomato"]))
+
+    async def run():
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+                await conn.execute(insert(Device.__table__), [
+                    {"device_id": d, "name": d, "plant_type": "tomato", "growth_stage": "fruiting"}
+                    for d in ("dev-1", "dev-2")])
+                # Hourly climate for dev-1 only
+                await conn.execute(insert(SensorReading.__table__), [
+                    {"device_id": "dev-1", "timestamp": START + timedelta(hours=h), "air_temp": 24.0,
+                     "humidity": 65.0} for h in range(24 * 40)])
+                await conn.execute(insert(GrowthRecord.__table__), [
+                    _growth("dev-1", 5, 10.0), _growth("dev-1", 15, 40.0),
+                    _growth("dev-1", 25, 8.0), _growth("dev-1", 35, 30.0),
+                    _growth("dev-2", 12, 20.0)])
+                await conn.execute(insert(HarvestRecord.__table__), [
+                    _harvest("dev-1", 20, 900.0), _harvest("dev-1", 38, 700.0), _harvest("dev-2", 30, 500.0)])
+            return await load_examples(SessionLocal, FeatureStore(SessionLocal), job, since)
+        finally:
+            await engine.dispose()
+    return asyncio.run(run())
+
+
+def test_examples_are_the_growth_records_of_each_cycle():
+    examples, skipped = load()
+    assert examples.harvested_at == [START + timedelta(days=20), START + timedelta(days=38)]
+    assert examples.harvests == [0, 0, 1, 1]
+    assert examples.days == [15.0, 5.0, 13.0, 3.0]
+    assert examples.yields == [900.0, 900.0, 700.0, 700.0]
+    assert [r["plant_height"] for r in examples.records] == [10.0, 40.0, 8.0, 30.0]
+    # The second cycle starts at the first harvest
+    assert [r["days_since_transplant"] for r in examples.records] == [0.0, 10.0, 5.0, 15.0]
+    assert examples.records[0]["avg_temperature"] == pytest.approx(24.0)
+    # dev-2 has no readings
+    assert skipped == {"no_data": 1}
+
+
+def test_examples_since_only_include_later_harvests():
+    examples, _ = load(since=START + timedelta(days=20))
+    assert examples.harvested_at == [START + timedelta(days=38)]
+    assert examples.days == [13.0, 3.0]
+    assert [r["days_since_transplant"] for r in examples.records] == [5.0, 15.0]
+
+
+def test_trained_through_is_the_last_update():
+    assert trained_through(SimpleNamespace(updates=[])) is None
+    model = SimpleNamespace(updates=[{"trained_through": "2026-03-01T00:00:00"},
+                                     {"trained_through": "2026-04-01T00:00:00"}])
+    assert trained_through(model) == datetime(2026, 4, 1)
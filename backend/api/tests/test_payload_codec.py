@@ -0,0 +1,107 @@
+import json
+import struct
+from datetime import datetime
+
+import pytest
+
+from payload_codec import (FORMAT_BINARY, FORMAT_JSON, HEADER, decode_binary, decode_payload, encode_payload,
+                           normalize_payload, payload_format)
+
+PAYLOAD = {"device_id": "dev-1", "timestamp": 1772323200000, "sensors": {"ph": 6.1, "ec": None}}
+
+
+def test_normalize_keeps_valid_payloads():
+    assert normalize_payload(PAYLOAD) is PAYLOAD
+    assert normalize_payload({"device_id": "dev-1", "sensors": {}}) is not None
+
+
+def test_normalize_converts_iso_timestamps():
+    assert normalize_payload({**PAYLOAD, "timestamp": "2026-03-01T00:00:00Z"})["timestamp"] == 1772323200000
+    assert normalize_payload({**PAYLOAD, "timestamp": "2026-03-01T01:00:00+01:00"})["timestamp"] == 1772323200000
+    # Naive: local time, like the simulator's datetime.now().isoformat()
+    local = datetime(2026, 3, 1, 12, 30)
+    assert normalize_payload({**PAYLOAD, "timestamp": local.isoformat()})["timestamp"] == round(
+        local.timestamp() * 1000)
+    assert normalize_payload({**PAYLOAD, "timestamp": "1772323200000"})["timestamp"] == 1772323200000
+
+
+def test_normalize_rejects_payloads_that_cannot_be_stored():
+    for payload in (
+        None,
+        ["dev-1"],
+        {**PAYLOAD, "device_id": ""},
+        {**PAYLOAD, "device_id": 7},
+        {**PAYLOAD, "timestamp": "yesterday"},
+        {**PAYLOAD, "timestamp": True},
+        {**PAYLOAD, "timestamp": -1},
+        {**PAYLOAD, "timestamp": 1e20},
+        {**PAYLOAD, "timestamp": float("nan")},
+        {**PAYLOAD, "sensors": {"ph": "6.1"}},
+        {**PAYLOAD, "sensors": {"ph": float("inf")}},
+        {**PAYLOAD, "sensors": [6.1]},
+        {**PAYLOAD, "raw": "x"},
+    ):
+        assert normalize_payload(payload) is None, payload
+
+
+READING = {"device_id": "greenhouse-a", "timestamp": 1772323200123,
+           "sensors": {"ph": 6.12, "water_temp": -1.5, "humidity": 61.3, "ec": 1850, "lux": 70000},
+           "status": {"wifi_rssi": -67, "uptime": 86400}}
+
+
+def test_binary_round_trip():
+    frame = encode_payload(READING)
+    assert payload_format(frame) == FORMAT_BINARY
+    assert decode_payload(frame) == READING
+    assert decode_payload(bytearray(frame)) == READING
+    assert len(frame) < len(json.dumps(READING))
+
+
+def test_json_payloads_pass_through():
+    data = json.dumps(READING).encode()
+    assert payload_format(data) == FORMAT_JSON
+    assert decode_payload(data) == READING
+
+
+def test_values_are_rounded_to_the_field_scale():
+    decoded = decode_binary(encode_payload({**READING, "sensors": {"ph": 6.126, "ec": None}}))
+    assert decoded["sensors"] == {"ph": 6.13}
+    assert "status" in decoded
+
+
+def test_truncated_frames_are_rejected():
+    frame = encode_payload(READING)
+    with pytest.raises(ValueError, match="Truncated"):
+        decode_binary(frame[:HEADER.size - 1])
+    with pytest.raises(ValueError, match="length"):
+        decode_binary(frame[:-1])
+    with pytest.raises(ValueError, match="length"):
+        decode_binary(frame + b"\x00")
+
+
+def test_unsupported_version_is_rejected():
+    frame = bytearray(encode_payload(READING))
+    frame[1] = 2
+    with pytest.raises(ValueError, match="version 2"):
+        decode_binary(bytes(frame))
+
+
+def test_corrupt_headers_are_rejected():
+    # Frames carry no checksum; a damaged header shows up as an unknown field or a length mismatch
+    frame = bytearray(encode_payload(READING))
+    struct.pack_into("<I", frame, 2, 1 << 31)
+    with pytest.raises(ValueError, match="Unknown fields"):
+        decode_binary(bytes(frame))
+    frame = bytearray(encode_payload(READING))
+    frame[HEADER.size - 1] += 1
+    with pytest.raises(ValueError, match="length"):
+        decode_binary(bytes(frame))
+    with pytest.raises(ValueError, match="Not a binary"):
+        decode_binary(b"\x00" + bytes(frame[1:]))
+
+
+def test_unencodable_payloads_are_rejected():
+    with pytest.raises(ValueError, match="no binary encoding"):
+        encode_payload({**READING, "sensors": {"nitrate": 12}})
+    with pytest.raises(ValueError, match="does not fit"):
+        encode_payload({**READING, "sensors": {"ph": 1000}})
@@ -0,0 +1,73 @@
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import event, insert
+
+from database import Base, GrowthRecord, HarvestRecord, SessionLocal, engine
+from predictions import PredictionScheduler, latest_growth
+
+
+def run_on_fresh_database(test):
+    async def run():
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            return await test()
+        finally:
+            await engine.dispose()
+    return asyncio.run(run())
+
+
+def _growth(device_id, timestamp, height=None, leaves=None, rate=None):
+    return {"device_id": device_id, "timestamp": timestamp, "plant_height": height, "leaf_count": leaves,
+            "growth_rate": rate}
+
+
+def test_latest_growth_uses_the_latest_record_of_the_current_cycle():
+    async def test():
+        async with engine.begin() as conn:
+            await conn.execute(insert(HarvestRecord.__table__), [
+                {"device_id": "dev-1", "harvest_date": datetime(2026, 3, 10), "yield_amount": 900.0}])
+            await conn.execute(insert(GrowthRecord.__table__), [
+                _growth("dev-1", datetime(2026, 3, 5), 90.0, 30),    # Previous cycle
+                _growth("dev-1", datetime(2026, 3, 12), 5.0, 4),
+                _growth("dev-1", datetime(2026, 3, 15), 12.0, 8, 2.5),
+                # No harvest yet: the cycle starts at the first record
+                _growth("dev-2", datetime(2026, 3, 1), 3.0),
+                _growth("dev-2", datetime(2026, 3, 11), 20.0),
+            ])
+        async with SessionLocal() as db:
+            return await latest_growth(db, ["dev-1", "dev-2", "dev-3"], datetime(2026, 3, 20))
+
+    growth = run_on_fresh_database(test)
+    assert growth == {
+        "dev-1": {"days_since_transplant": 10.0, "plant_height": 12.0, "leaf_count": 8.0, "growth_rate": 2.5},
+        "dev-2": {"days_since_transplant": 19.0, "plant_height": 20.0},
+    }
+
+
+def test_latest_remembers_devices_without_results_until_the_next_cycle():
+    scheduler = PredictionScheduler(SessionLocal, SessionLocal, None, lambda device_id: 2000.0)
+    queries = []
+
+    async def test():
+        def count(*args):
+            queries.append(args)
+        event.listen(engine.sync_engine, "before_cursor_execute", count)
+        try:
+            first = await scheduler.latest("dev-9")
+            second = await scheduler.latest("dev-9")
+            after_first = len(queries)
+            await scheduler.load_cycle()
+            await scheduler.latest("dev-9")
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", count)
+        return first, second, after_first
+
+    try:
+        first, second, after_first = run_on_fresh_database(test)
+    finally:
+        scheduler.shutdown()
+    assert first == second == {}
+    assert after_first == len(scheduler.jobs)
+    assert len(queries) > after_first
@@ -0,0 +1,71 @@
+from presence import OFFLINE, ONLINE, PresenceTracker, TimerWheel
+
+
+def test_wheel_expires_keys_when_their_slot_passes():
+    wheel = TimerWheel(tick=10, horizon=100, now=0)
+    wheel.schedule("a", 25)
+    wheel.schedule("b", 45)
+    assert wheel.advance(19) == []
+    assert wheel.advance(30) == ["a"]
+    assert wheel.advance(30) == []
+    assert wheel.advance(50) == ["b"]
+
+
+def test_wheel_clamps_deadlines_to_its_range():
+    wheel = TimerWheel(tick=10, horizon=100, now=0)
+    wheel.schedule("past", -50)
+    wheel.schedule("far", 10000)
+    assert wheel.advance(10) == ["past"]
+    # Clamped to the last slot; the caller re-schedules it
+    assert wheel.advance(130) == ["far"]
+
+
+def test_wheel_catches_up_after_a_stall():
+    wheel = TimerWheel(tick=1, horizon=10, now=0)
+    for i in range(10):
+        wheel.schedule(str(i), i + 1)
+    assert sorted(wheel.advance(1000), key=int) == [str(i) for i in range(10)]
+    assert wheel.current == 1000
+
+
+def test_silent_device_goes_offline():
+    tracker = PresenceTracker(offline_after=60, tick=5, now=0)
+    tracker.touch("a", 0)
+    assert tracker.expire(55) == []
+    assert tracker.expire(65) == ["a"]
+    assert tracker.status["a"] == OFFLINE
+    assert tracker.drain_changes() == [("a", ONLINE), ("a", OFFLINE)]
+    assert tracker.drain_dirty() == [("a", 0, OFFLINE)]
+    assert tracker.drain_dirty() == []
+
+
+def test_touch_pushes_the_deadline_back():
+    tracker = PresenceTracker(offline_after=60, tick=5, now=0)
+    tracker.touch("a", 0)
+    tracker.touch("a", 50)
+    # The first deadline passes, and the device is re-scheduled from its last reading
+    assert tracker.expire(70) == []
+    assert tracker.status["a"] == ONLINE
+    assert tracker.expire(105) == []
+    assert tracker.expire(115) == ["a"]
+    assert tracker.drain_changes() == [("a", ONLINE), ("a", OFFLINE)]
+
+
+def test_device_comes_back_online():
+    tracker = PresenceTracker(offline_after=60, tick=5, now=0)
+    tracker.touch("a", 0)
+    tracker.expire(100)
+    tracker.drain_changes()
+    tracker.touch("a", 120)
+    assert tracker.status["a"] == ONLINE
+    assert tracker.drain_changes() == [("a", ONLINE)]
+    assert tracker.expire(185) == ["a"]
+
+
+def test_loaded_devices_expire_from_their_last_reading():
+    tracker = PresenceTracker(offline_after=60, tick=5, now=100)
+    tracker.load([("stale", 10, ONLINE), ("recent", 90, ONLINE), ("off", 95, OFFLINE), ("never", None, None)])
+    assert tracker.online_count() == 2
+    assert tracker.expire(110) == ["stale"]
+    assert tracker.expire(155) == ["recent"]
+    assert set(tracker.snapshot()) == {"stale", "recent", "off"}
@@ -0,0 +1,44 @@
+from collections import Counter
+
+import pytest
+
+from shards import ShardRouter, jump_hash, shard_for
+
+TOPIC = "agronomia/devices/+/data"
+DEVICES = [f"device-{i:05d}" for i in range(10000)]
+
+
+def test_jump_hash_is_stable():
+    # Pinned: workers on different versions must agree on every device's shard
+    assert [jump_hash(key, 1000) for key in (0, 1, 0xDEADBEEF, 2 ** 64 - 1)] == [0, 549, 285, 313]
+    assert [shard_for(device, 16) for device in ("device-00042", "greenhouse-a")] == [10, 0]
+    assert all(jump_hash(key, 1) == 0 for key in range(100))
+
+
+def test_devices_spread_evenly_over_shards():
+    counts = Counter(shard_for(device, 8) for device in DEVICES)
+    assert sorted(counts) == list(range(8))
+    assert max(counts.values()) < 1.1 * len(DEVICES) / 8
+    assert min(counts.values()) > 0.9 * len(DEVICES) / 8
+
+
+def test_adding_a_shard_only_moves_devices_to_it():
+    moved = [device for device in DEVICES if shard_for(device, 5) != shard_for(device, 4)]
+    assert all(shard_for(device, 5) == 4 for device in moved)
+    assert 0.15 < len(moved) / len(DEVICES) < 0.25
+
+
+def test_each_device_is_owned_by_one_router():
+    routers = [ShardRouter(TOPIC, 3, index) for index in range(3)]
+    for device in DEVICES[:500]:
+        topic = f"agronomia/devices/{device}/data"
+        assert sum(router.owns(topic) for router in routers) == 1
+    assert sum(router.owned_devices() for router in routers) == 500
+    assert not routers[0].owns("agronomia/devices")
+
+
+def test_router_rejects_bad_configuration():
+    with pytest.raises(ValueError):
+        ShardRouter(TOPIC, 2, 2)
+    with pytest.raises(ValueError):
+        ShardRouter("agronomia/devices/#", 2, 0)
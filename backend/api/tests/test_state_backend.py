@@ -0,0 +1,77 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+
+from state_backend import SharedMemoryStateBackend, _SlotTable
+
+
+def _unlink(name):
+    try:
+        os.unlink(f"/dev/shm/{name}")
+    except FileNotFoundError:
+        pass
+
+
+@pytest.fixture
+def table():
+    name = f"agronomia-test-{uuid.uuid4().hex[:8]}"
+    table = _SlotTable(name, capacity=8, slot_bytes=256)
+    yield table
+    table.close()
+    _unlink(name)
+
+
+def _crash_mid_write(table, key):
+    """Leave key's slot as a writer that died between the two counter updates would"""
+    slot = table._find(key, create=False)
+    offset = table._slot_offset(slot)
+    sequence, key_length, length = table.SLOT.unpack_from(table.buf, offset)
+    table.SLOT.pack_into(table.buf, offset, sequence + 1, key_length, length)
+
+
+def test_put_and_get(table):
+    table.put("dev-1", b"one")
+    table.put("dev-2", b"two")
+    table.put("dev-1", b"uno")
+    assert table.get("dev-1") == b"uno"
+    assert table.get("dev-3") is None
+    assert dict(table.items()) == {"dev-1": b"uno", "dev-2": b"two"}
+
+
+def test_reads_give_up_on_a_slot_left_mid_write(table):
+    table.put("dev-1", b"one")
+    table.put("dev-2", b"two")
+    _crash_mid_write(table, "dev-1")
+    assert table.get("dev-1") is None
+    assert dict(table.items()) == {"dev-2": b"two"}
+
+
+def test_next_write_repairs_a_slot_left_mid_write(table):
+    table.put("dev-1", b"one")
+    _crash_mid_write(table, "dev-1")
+    table.put("dev-1", b"again")
+    assert table.get("dev-1") == b"again"
+    sequence = table.SLOT.unpack_from(table.buf, table._slot_offset(table._find("dev-1", create=False)))[0]
+    assert sequence % 2 == 0
+    table.put("dev-1", b"and again")
+    assert table.get("dev-1") == b"and again"
+
+
+def test_oversized_readings_are_skipped_per_device():
+    prefix = f"agronomia-test-{uuid.uuid4().hex[:8]}"
+    backend = SharedMemoryStateBackend(prefix, devices=8, slot_bytes=256, events_bytes=64 * 1024)
+
+    async def run():
+        await backend.open()
+        try:
+            await backend.set_latest({"dev-1": {"ph": 6.1}, "dev-2": {"notes": "x" * 1000}})
+            return await backend.get_latest()
+        finally:
+            await backend.close()
+    try:
+        assert asyncio.run(run()) == {"dev-1": {"ph": 6.1}}
+    finally:
+        _unlink(f"{prefix}-latest")
+        _unlink(f"{prefix}-events")
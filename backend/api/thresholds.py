@@ -0,0 +1,98 @@
+"""
+Compiled alert thresholds for the Agronomia API
+Threshold profiles are stored in the threshold_profiles table and compiled
+here into one bounds tuple per device, so evaluating a reading never
+touches the database. A change counter in config_versions tells every
+worker when its compiled copy is stale.
+
+Profiles apply at four levels, most specific first:
+
+    device_id set                      one device
+    plant_type and growth_stage set    devices growing that plant at that stage
+    plant_type set                     devices growing that plant, any stage
+    nothing set                        the fleet default
+
+Unset scope columns are stored as "" so the scope can be unique and upserted.
+"""
+
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+ANY = ""
+VERSION_NAME = "thresholds"
+
+Scope = Tuple[str, str, str]   # (device_id, plant_type, growth_stage)
+
+
+class Bounds(NamedTuple):
+    ph_min: float
+    ph_max: float
+    temp_min: float
+    temp_max: float
+    humidity_min: float
+    humidity_max: float
+    ec_min: float
+    ec_max: float
+
+
+FIELDS = Bounds._fields
+
+
+class _Compiled(NamedTuple):
+    profiles: Dict[Scope, Bounds]
+    devices: Dict[str, Tuple[Bounds, Scope]]
+    fallback: Tuple[Bounds, Optional[Scope]]
+
+
+class ThresholdStore:
+    """
+    Per-device thresholds resolved from profiles and device metadata
+
+    load() resolves every registered device once; for_device() is then a
+    single dict lookup. Unregistered devices get the fleet default. A load
+    builds a new structure and swaps it in with one assignment, so readers
+    never see a half-applied update.
+    """
+
+    def __init__(self, default: Bounds):
+        self.default = default
+        self.version = -1
+        self._compiled = _Compiled({}, {}, (default, None))
+
+    def load(self, version: int, profiles: Iterable[tuple], devices: Iterable[Tuple[str, Optional[str], Optional[str]]]):
+        """
+        Compile (device_id, plant_type, growth_stage, *bounds) profile rows
+        for the (device_id, plant_type, growth_stage) rows of the devices table
+        """
+        by_scope = {tuple(row[:3]): Bounds(*row[3:]) for row in profiles}
+        fallback_scope = (ANY, ANY, ANY) if (ANY, ANY, ANY) in by_scope else None
+        fallback = (by_scope.get((ANY, ANY, ANY), self.default), fallback_scope)
+
+        resolved: Dict[str, Tuple[Bounds, Scope]] = {}
+        for device_id, plant_type, growth_stage in devices:
+            plant_type, growth_stage = plant_type or ANY, growth_stage or ANY
+            for scope in ((device_id, ANY, ANY), (ANY, plant_type, growth_stage), (ANY, plant_type, ANY)):
+                if scope in by_scope and (scope[0] or scope[1]):
+                    resolved[device_id] = (by_scope[scope], scope)
+                    break
+        # Device profiles also apply before the device is registered
+        for scope, bounds in by_scope.items():
+            if scope[0] and scope[0] not in resolved:
+                resolved[scope[0]] = (bounds, scope)
+
+        self._compiled = _Compiled(by_scope, resolved, fallback)
+        self.version = version
+
+    def for_device(self, device_id: str) -> Bounds:
+        compiled = self._compiled
+        entry = compiled.devices.get(device_id)
+        return entry[0] if entry is not None else compiled.fallback[0]
+
+    def source(self, device_id: str) -> Optional[Scope]:
+        """Scope of the profile that applies to a device, None for the built-in defaults"""
+        compiled = self._compiled
+        entry = compiled.devices.get(device_id)
+        return entry[1] if entry is not None else compiled.fallback[1]
+
+    def stats(self) -> Dict[str, int]:
+        compiled = self._compiled
+        return {"version": self.version, "profiles": len(compiled.profiles), "devices": len(compiled.devices)}
@@ -14,11 +14,15 @@ CREATE TABLE IF NOT EXISTS devices (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
--- Create sensor_readings table
+-- Create sensor_readings table, range-partitioned on timestamp (UTC)
+-- The primary key has to include the partition key. device_id has no foreign
+-- key so inserts do not look up devices; partitions are created ahead of time
+-- by create_sensor_reading_partitions() and retired by
+-- drop_sensor_reading_partitions() (both defined below, run by the API).
 CREATE TABLE IF NOT EXISTS sensor_readings (
-    id SERIAL PRIMARY KEY,
+    id BIGSERIAL,
     device_id VARCHAR(50) NOT NULL,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    timestamp TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
     ph FLOAT,
     water_temp FLOAT,
     air_temp FLOAT,
@@ -29,8 +33,98 @@ CREATE TABLE IF NOT EXISTS sensor_readings (
     full_spectrum INTEGER,
     infrared INTEGER,
     visible INTEGER,
-    FOREIGN KEY (device_id) REFERENCES devices(device_id)
-);
+    -- Derived at ingest (backend/api/derived.py)
+    vpd FLOAT,
+    ec_25 FLOAT,
+    tds_25 FLOAT,
+    dli FLOAT,
+    -- Raw probe values of calibrated readings, NULL where the stored value is raw
+    -- (backend/api/calibration.py)
+    ph_raw FLOAT,
+    ec_raw FLOAT,
+    water_temp_raw FLOAT,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Catch-all for readings outside the prepared range (e.g. devices whose clock is unset)
+CREATE TABLE IF NOT EXISTS sensor_readings_default PARTITION OF sensor_readings DEFAULT;
+
+-- Create partitions for p_ahead periods after the one containing p_from.
+-- p_interval is 'month' or 'week'; pick one per deployment, ranges must not overlap.
+-- Rows already sitting in the default partition for a new range are moved into it.
+CREATE OR REPLACE FUNCTION create_sensor_reading_partitions(
+    p_interval TEXT DEFAULT 'month',
+    p_ahead INTEGER DEFAULT 3,
+    p_from TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')
+) RETURNS INTEGER AS $$
+DECLARE
+    step INTERVAL;
+    period_start TIMESTAMP;
+    period_end TIMESTAMP;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    IF p_interval NOT IN ('month', 'week') THEN
+        RAISE EXCEPTION 'Unsupported partition interval: %', p_interval;
+    END IF;
+    step := ('1 ' || p_interval)::INTERVAL;
+    period_start := date_trunc(p_interval, p_from);
+
+    FOR i IN 0..p_ahead LOOP
+        period_end := period_start + step;
+        partition_name := 'sensor_readings_p' ||
+            to_char(period_start, CASE WHEN p_interval = 'month' THEN 'YYYYMM' ELSE 'YYYYMMDD' END);
+
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I (LIKE sensor_readings INCLUDING DEFAULTS)', partition_name);
+            EXECUTE format(
+                'WITH moved AS (DELETE FROM sensor_readings_default WHERE timestamp >= %L AND timestamp < %L RETURNING *) '
+                'INSERT INTO %I SELECT * FROM moved',
+                period_start, period_end, partition_name);
+            EXECUTE format('ALTER TABLE sensor_readings ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                partition_name, period_start, period_end);
+            created := created + 1;
+        END IF;
+
+        period_start := period_end;
+    END LOOP;
+
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Detach (and unless p_detach_only, drop) partitions whose range ends on or
+-- before p_older_than. Both are metadata-only operations, independent of the
+-- number of rows. Returns the names of the partitions removed.
+CREATE OR REPLACE FUNCTION drop_sensor_reading_partitions(
+    p_older_than TIMESTAMP,
+    p_detach_only BOOLEAN DEFAULT FALSE
+) RETURNS SETOF TEXT AS $$
+DECLARE
+    part RECORD;
+BEGIN
+    FOR part IN
+        SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'sensor_readings'::regclass
+          AND c.relname <> 'sensor_readings_default'
+        ORDER BY c.relname
+    LOOP
+        -- bound: FOR VALUES FROM ('2025-01-01 00:00:00') TO ('2025-02-01 00:00:00')
+        IF substring(part.bound FROM 'TO \(''([^'']+)''\)')::TIMESTAMP <= p_older_than THEN
+            EXECUTE format('ALTER TABLE sensor_readings DETACH PARTITION %I', part.name);
+            IF NOT p_detach_only THEN
+                EXECUTE format('DROP TABLE %I', part.name);
+            END IF;
+            RETURN NEXT part.name;
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Partitions for last month through three months ahead
+SELECT create_sensor_reading_partitions('month', 4, (now() AT TIME ZONE 'utc') - INTERVAL '1 month');
 
 -- Create alerts table
 CREATE TABLE IF NOT EXISTS alerts (
@@ -42,6 +136,7 @@ CREATE TABLE IF NOT EXISTS alerts (
     message TEXT,
     value FLOAT,
     threshold FLOAT,
+    score FLOAT,
     acknowledged BOOLEAN DEFAULT FALSE,
     acknowledged_at TIMESTAMP,
     FOREIGN KEY (device_id) REFERENCES devices(device_id)
@@ -64,17 +159,93 @@ CREATE TABLE IF NOT EXISTS harvest_records (
     id SERIAL PRIMARY KEY,
     device_id VARCHAR(50) NOT NULL,
     harvest_date TIMESTAMP NOT NULL,
-    yield_amount FLOAT,
+    yield_amount FLOAT,  -- grams
     quality_rating INTEGER CHECK (quality_rating >= 1 AND quality_rating <= 5),
     notes TEXT,
     FOREIGN KEY (device_id) REFERENCES devices(device_id)
 );
 
+-- Create threshold_profiles table: alert thresholds per device, per plant type and
+-- growth stage, per plant type, or fleet-wide. '' means any, so the scope is unique
+CREATE TABLE IF NOT EXISTS threshold_profiles (
+    id SERIAL PRIMARY KEY,
+    device_id VARCHAR(50) NOT NULL DEFAULT '',
+    plant_type VARCHAR(50) NOT NULL DEFAULT '',
+    growth_stage VARCHAR(50) NOT NULL DEFAULT '',
+    ph_min FLOAT NOT NULL,
+    ph_max FLOAT NOT NULL,
+    temp_min FLOAT NOT NULL,
+    temp_max FLOAT NOT NULL,
+    humidity_min FLOAT NOT NULL,
+    humidity_max FLOAT NOT NULL,
+    ec_min FLOAT NOT NULL,
+    ec_max FLOAT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Daily rollup of derived metrics per device and photoperiod day, merged at ingest
+CREATE TABLE IF NOT EXISTS sensor_daily_metrics (
+    id SERIAL PRIMARY KEY,
+    device_id VARCHAR(50) NOT NULL,
+    day DATE NOT NULL,
+    readings INTEGER NOT NULL DEFAULT 0,
+    vpd_sum FLOAT,
+    vpd_count INTEGER,
+    vpd_min FLOAT,
+    vpd_max FLOAT,
+    ec_25_sum FLOAT,
+    ec_25_count INTEGER,
+    ec_25_min FLOAT,
+    ec_25_max FLOAT,
+    dli FLOAT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Per-device sensor calibrations: [raw, reference] points, versioned, each
+-- effective from a point in time. Empty points end the previous calibration
+CREATE TABLE IF NOT EXISTS sensor_calibrations (
+    id SERIAL PRIMARY KEY,
+    device_id VARCHAR(50) NOT NULL,
+    metric VARCHAR(20) NOT NULL,
+    version INTEGER NOT NULL,
+    effective_from TIMESTAMP NOT NULL,
+    points JSONB NOT NULL,
+    note TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Scheduled model outputs, one row per device, model and prediction cycle
+CREATE TABLE IF NOT EXISTS predictions (
+    id BIGSERIAL PRIMARY KEY,
+    device_id VARCHAR(50) NOT NULL,
+    model VARCHAR(50) NOT NULL,
+    created_at TIMESTAMP NOT NULL,
+    model_version VARCHAR(50),
+    result JSONB NOT NULL
+);
+
+-- Change counters for configuration the API caches in memory; bumped in the
+-- same transaction as the change so workers know when to reload
+CREATE TABLE IF NOT EXISTS config_versions (
+    name VARCHAR(50) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+INSERT INTO config_versions (name, version) VALUES ('thresholds', 0), ('calibrations', 0) ON CONFLICT (name) DO NOTHING;
+
 -- Create indexes for better query performance
-CREATE INDEX idx_sensor_readings_device_timestamp ON sensor_readings(device_id, timestamp DESC);
+-- (indexes on sensor_readings are created on every partition, current and future)
+-- Unique so QoS 1 redeliveries and spool replays are skipped by INSERT ... ON CONFLICT DO NOTHING
+-- (allowed on the partitioned table because it includes the partition key)
+CREATE UNIQUE INDEX uq_sensor_readings_device_timestamp ON sensor_readings(device_id, timestamp DESC);
 CREATE INDEX idx_alerts_device_timestamp ON alerts(device_id, timestamp DESC);
 CREATE INDEX idx_alerts_acknowledged ON alerts(acknowledged);
 CREATE INDEX idx_growth_records_device_timestamp ON growth_records(device_id, timestamp DESC);
+CREATE INDEX idx_harvest_records_device_date ON harvest_records(device_id, harvest_date DESC);
+CREATE UNIQUE INDEX uq_sensor_daily_metrics_device_day ON sensor_daily_metrics(device_id, day);
+CREATE UNIQUE INDEX uq_threshold_profiles_scope ON threshold_profiles(device_id, plant_type, growth_stage);
+CREATE UNIQUE INDEX uq_sensor_calibrations_version ON sensor_calibrations(device_id, metric, version);
+CREATE INDEX idx_predictions_device_model_created ON predictions(device_id, model, created_at DESC);
+CREATE INDEX idx_predictions_created ON predictions(created_at);
 
 -- Insert sample device
 INSERT INTO devices (device_id, name, location, plant_type, growth_stage, status) 
@@ -82,10 +253,18 @@ VALUES ('ESP32-001', 'Greenhouse A - Bay 1', 'Greenhouse A', 'tomato', 'vegetati
 ON CONFLICT (device_id) DO NOTHING;
 
 -- Create view for latest sensor readings
+-- One index probe per registered device (newest partition first) instead of
+-- a DISTINCT ON over every partition
 CREATE OR REPLACE VIEW latest_sensor_readings AS
-SELECT DISTINCT ON (device_id) *
-FROM sensor_readings
-ORDER BY device_id, timestamp DESC;
+SELECT r.*
+FROM devices d
+CROSS JOIN LATERAL (
+    SELECT *
+    FROM sensor_readings s
+    WHERE s.device_id = d.device_id
+    ORDER BY s.timestamp DESC
+    LIMIT 1
+) r;
 
 -- Create view for unacknowledged alerts
 CREATE OR REPLACE VIEW active_alerts AS
@@ -95,7 +274,10 @@ WHERE acknowledged = FALSE
 ORDER BY timestamp DESC;
 
 COMMENT ON TABLE devices IS 'Registered IoT devices and their configurations';
-COMMENT ON TABLE sensor_readings IS 'Time-series sensor data from all devices';
+COMMENT ON TABLE sensor_readings IS 'Time-series sensor data from all devices, partitioned by timestamp';
 COMMENT ON TABLE alerts IS 'System alerts and notifications';
+COMMENT ON TABLE threshold_profiles IS 'Alert thresholds by device, plant type and growth stage';
+COMMENT ON TABLE sensor_calibrations IS 'Versioned per-device sensor calibrations applied at ingest';
+COMMENT ON TABLE predictions IS 'Irrigation, nutrient and harvest predictions from the scheduled model runs';
 COMMENT ON TABLE growth_records IS 'Manual plant growth measurements';
 COMMENT ON TABLE harvest_records IS 'Harvest data for yield analysis';
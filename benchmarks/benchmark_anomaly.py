@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Streaming anomaly detection benchmark
+Measures how many readings per second backend/api/anomaly.py can evaluate
+inline in the ingest path, at ingest batch sizes and fleet sizes, and checks
+that injected faults are found.
+
+Readings are generated per device around a stable operating point with
+sensor noise. After the warm-up, a known number of single-reading faults
+(pH +1.2, EC +600 uS/cm) are injected. The detector should flag them and
+nothing else; a fault that repeats on the same device within the alert
+cooldown is not reported again.
+
+Only numpy is needed.
+
+Usage:
+    python benchmarks/benchmark_anomaly.py
+    python benchmarks/benchmark_anomaly.py --devices 10000 --batch 500 --output anomaly.json
+    python benchmarks/benchmark_anomaly.py --compare baseline.json
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from common import (REPO_ROOT, environment_info, write_results, load_results,
+                    compare_results, print_comparison)
+
+sys.path.insert(0, os.path.join(REPO_ROOT, 'backend', 'api'))
+from anomaly import AnomalyDetector  # noqa: E402
+
+METRICS = ['ph', 'ec', 'water_temp']
+CENTER = np.array([6.0, 1800.0, 22.0])
+NOISE = np.array([0.03, 15.0, 0.1])
+
+
+def generate(devices, rounds, interval, faults, rng):
+    """Readings in arrival order: every device reports once per round"""
+    device_ids = np.array([f'ESP32-GROW-{i:05d}' for i in range(devices)])
+    offsets = rng.normal(0, 1, (devices, 3)) * NOISE * 5
+    values = CENTER + offsets + rng.normal(0, 1, (rounds, devices, 3)) * NOISE
+    timestamps = np.arange(rounds)[:, None] * interval + rng.uniform(0, interval, devices)
+
+    # Faults land after the warm-up rounds, one per (device, round)
+    cells = rng.choice(devices * (rounds - 40), faults, replace=False)
+    fault_rounds, fault_devices = cells // devices + 40, cells % devices
+    kinds = rng.integers(0, 2, faults)
+    values[fault_rounds[kinds == 0], fault_devices[kinds == 0], 0] += 1.2
+    values[fault_rounds[kinds == 1], fault_devices[kinds == 1], 1] += 600
+    faulty = set(zip(fault_rounds.tolist(), fault_devices.tolist()))
+
+    return (np.tile(device_ids, rounds).tolist(), timestamps.reshape(-1), values.reshape(-1, 3), faulty)
+
+
+def run(device_ids, timestamps, values, batch):
+    detector = AnomalyDetector(METRICS, warmup=30)
+    anomalies = []
+    start = time.perf_counter()
+    for offset in range(0, len(device_ids), batch):
+        found = detector.observe(device_ids[offset:offset + batch], timestamps[offset:offset + batch],
+                                 values[offset:offset + batch])
+        anomalies.extend(a._replace(index=a.index + offset) for a in found)
+    return time.perf_counter() - start, anomalies
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Streaming anomaly detection benchmark",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--devices', type=int, default=1000,
+                        help='Devices in the fleet (default: 1000)')
+    parser.add_argument('--readings', type=int, default=200000,
+                        help='Readings evaluated per run (default: 200000)')
+    parser.add_argument('--batch', type=int, default=500,
+                        help='Readings per observe() call, as INGEST_BATCH_SIZE (default: 500)')
+    parser.add_argument('--interval', type=float, default=10,
+                        help='Device publish interval in seconds (default: 10)')
+    parser.add_argument('--faults', type=int, default=200,
+                        help='Injected pH spikes and EC steps (default: 200)')
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='Timed runs, best is kept (default: 3)')
+    parser.add_argument('--output', default=None,
+                        help='Write results to this JSON file')
+    parser.add_argument('--compare', default=None,
+                        help='Baseline results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Relative change counted as a regression (default: 0.10)')
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("AGRONOMIA STREAMING ANOMALY DETECTION BENCHMARK")
+    print("=" * 70)
+
+    rounds = max(args.readings // args.devices, 50)
+    rng = np.random.default_rng(42)
+    device_ids, timestamps, values, faulty = generate(args.devices, rounds, args.interval, args.faults, rng)
+
+    best, anomalies = None, []
+    for _ in range(args.repeats):
+        elapsed, anomalies = run(device_ids, timestamps, values, args.batch)
+        best = elapsed if best is None else min(best, elapsed)
+
+    # An anomaly is a hit when its reading is one of the injected faults
+    flagged = {(a.index // args.devices, a.index % args.devices) for a in anomalies}
+    hits = len(flagged & faulty)
+    false_alarms = len(flagged - faulty)
+
+    results = {
+        'detector': {
+            'readings_per_s': round(len(device_ids) / best, 1),
+            'batch_ms': round(best / (len(device_ids) / args.batch) * 1e3, 3),
+            'state_bytes': args.devices * len(METRICS) * (8 + 3) * 8,
+            'recall_pct': round(100 * hits / len(faulty), 1),
+            'false_alarms': false_alarms
+        }
+    }
+    detector = results['detector']
+    print(f"\n▶ {len(device_ids):,} readings from {args.devices:,} devices in batches of {args.batch}")
+    print(f"  Throughput: {detector['readings_per_s']:>12,.0f} readings/s ({detector['batch_ms']:.2f} ms/batch)")
+    print(f"  State:      {detector['state_bytes'] / 1024:>12,.0f} KB")
+    print(f"  Faults:     {hits}/{len(faulty)} found, {false_alarms} false alarms")
+
+    output = {
+        'benchmark': 'anomaly',
+        'meta': {**environment_info(),
+                 'config': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')}},
+        'results': results
+    }
+
+    if args.output:
+        write_results(args.output, output)
+
+    if args.compare:
+        baseline = load_results(args.compare)
+        rows = compare_results(baseline, output, args.threshold)
+        regressions = print_comparison(rows, baseline.get('meta'), output['meta'])
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+"""
+End-to-end ingest and query benchmark for the Agronomia backend
+Boots backend/api/main.py under uvicorn against SQLite and (optionally) a local
+PostgreSQL, then measures:
+
+  - sustained ingest rate for a synthetic fleet at increasing offered rates
+  - /api/sensors/history and /api/analytics/summary latency over 1 day,
+    30 days and 1 year of seeded history
+  - WebSocket fan-out latency from ingest to connected clients
+  - API process memory growth across the run
+
+Dependencies:
+    pip install -r backend/api/requirements.txt
+    pip install psycopg2-binary      # Only for the postgres target
+
+Usage:
+    python benchmarks/benchmark_backend.py                          # SQLite only
+    python benchmarks/benchmark_backend.py --postgres-url postgresql://agronomia:pw@localhost:5432/bench
+    python benchmarks/benchmark_backend.py --quick --output results.json
+    python benchmarks/benchmark_backend.py --compare baseline.json --output results.json
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from common import (REPO_ROOT, environment_info, latency_summary, rss_mb, write_results,
+                    load_results, compare_results, print_comparison)
+
+try:
+    from sqlalchemy import create_engine, text
+    HAS_SQLALCHEMY = True
+except ImportError:
+    HAS_SQLALCHEMY = False
+
+try:
+    from websockets.sync.client import connect as ws_connect
+    HAS_WEBSOCKETS = True
+except ImportError:
+    HAS_WEBSOCKETS = False
+
+BACKEND_API_DIR = os.path.join(REPO_ROOT, 'backend', 'api')
+HISTORY_DEVICE = 'BENCH-HISTORY-001'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class APIServer:
+    """Runs the backend API in a uvicorn subprocess for the duration of a target"""
+
+    def __init__(self, database_url, port=None, log_path=None):
+        self.database_url = database_url
+        self.port = port or free_port()
+        self.spool_dir = tempfile.mkdtemp(prefix='agronomia-bench-spool-')
+        self.log_path = log_path or os.path.join(tempfile.gettempdir(), f'agronomia-bench-{self.port}.log')
+        self.process = None
+
+    def start(self, timeout=60):
+        env = dict(os.environ)
+        env.update({
+            'DATABASE_URL': self.database_url,
+            'INGEST_SPOOL_DIR': self.spool_dir,
+            # Nothing listens here, so the API starts without an MQTT broker
+            'MQTT_BROKER': '127.0.0.1',
+            'MQTT_PORT': str(free_port())
+        })
+        self.log = open(self.log_path, 'w')
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'main:app',
+             '--host', '127.0.0.1', '--port', str(self.port), '--log-level', 'warning'],
+            cwd=BACKEND_API_DIR, env=env, stdout=self.log, stderr=subprocess.STDOUT
+        )
+
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"API exited during startup, see {self.log_path}")
+            try:
+                status, _ = HTTPClient(self.port).get('/')
+                if status == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.2)
+        raise TimeoutError(f"API did not start within {timeout}s, see {self.log_path}")
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process else None
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self.process:
+            self.log.close()
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+
+class HTTPClient:
+    """Minimal keep-alive JSON client (one per thread)"""
+
+    def __init__(self, port, host='127.0.0.1', timeout=60):
+        self.conn = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def request(self, method, path, body=None):
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.conn.request(method, path, body=data, headers=headers)
+            response = self.conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            # Reconnect once on a dropped keep-alive connection
+            self.conn.close()
+            self.conn.request(method, path, body=data, headers=headers)
+            response = self.conn.getresponse()
+        raw = response.read()
+        return response.status, json.loads(raw) if raw else None
+
+    def get(self, path):
+        return self.request('GET', path)
+
+    def post(self, path, body):
+        return self.request('POST', path, body)
+
+
+def synthetic_payload(device_id, ts_ms, rng):
+    """One device payload in the firmware MQTT format"""
+    return {
+        'device_id': device_id,
+        'timestamp': ts_ms,
+        'sensors': {
+            'ph': round(rng.gauss(6.0, 0.3), 2),
+            'water_temp': round(rng.gauss(22, 1.5), 1),
+            'air_temp': round(rng.gauss(24, 2), 1),
+            'humidity': round(rng.gauss(65, 5), 1),
+            'ec': round(rng.gauss(1800, 200)),
+            'tds': round(rng.gauss(900, 100)),
+            'lux': max(0, int(rng.gauss(20000, 5000)))
+        }
+    }
+
+
+def seed_history(database_url, days, interval_s=300, chunk=5000):
+    """Insert `days` of readings for HISTORY_DEVICE ending now; returns rows inserted"""
+    engine = create_engine(database_url)
+    rng = random.Random(42)
+    end = datetime.utcnow()
+    total = int(days * 86400 / interval_s)
+    statement = text(
+        "INSERT INTO sensor_readings (device_id, timestamp, ph, water_temp, air_temp, humidity, ec, tds, lux) "
+        "VALUES (:device_id, :timestamp, :ph, :water_temp, :air_temp, :humidity, :ec, :tds, :lux)"
+    )
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM sensor_readings WHERE device_id = :d"), {'d': HISTORY_DEVICE})
+        for start in range(0, total, chunk):
+            rows = []
+            for i in range(start, min(start + chunk, total)):
+                payload = synthetic_payload(HISTORY_DEVICE, 0, rng)
+                rows.append({
+                    'device_id': HISTORY_DEVICE,
+                    'timestamp': end - timedelta(seconds=(total - i) * interval_s),
+                    **payload['sensors']
+                })
+            conn.execute(statement, rows)
+    engine.dispose()
+    return total
+
+
+def stored_count(stats):
+    """Readings written to the database (revisions without the spool only report 'processed')"""
+    return stats.get('persisted', stats['processed'])
+
+
+def wait_for_drain(client, target_stored, timeout):
+    """Poll ingest stats until `target_stored` readings are in the database; returns samples"""
+    samples = []
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        _, stats = client.get('/api/ingest/stats')
+        samples.append(stats)
+        if stored_count(stats) >= target_stored:
+            break
+        time.sleep(0.1)
+    return samples
+
+
+def next_timestamp(last_ts, device_id):
+    """Current time in ms, bumped so a device never repeats a timestamp (the API drops duplicates)"""
+    ts_ms = max(int(time.time() * 1000), last_ts.get(device_id, 0) + 1)
+    last_ts[device_id] = ts_ms
+    return ts_ms
+
+
+def run_ingest_step(port, rate, duration, devices, batch_size, workers, rng, last_ts):
+    """Offer `rate` readings/s for `duration` seconds and measure what the API sustains"""
+    stats_client = HTTPClient(port)
+    _, before = stats_client.get('/api/ingest/stats')
+
+    local = threading.local()
+    post_latencies = []
+    accepted = [0]
+    lock = threading.Lock()
+
+    def post(batch):
+        if not hasattr(local, 'client'):
+            local.client = HTTPClient(port)
+        t0 = time.perf_counter()
+        status, body = local.client.post('/api/ingest', batch)
+        elapsed = (time.perf_counter() - t0) * 1000
+        with lock:
+            post_latencies.append(elapsed)
+            if status == 202:
+                accepted[0] += body['accepted']
+
+    device_ids = [f'BENCH-FLEET-{i:04d}' for i in range(devices)]
+    total = int(rate * duration)
+    n_batches = max(1, total // batch_size)
+    interval = batch_size / rate
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for b in range(n_batches):
+            due = start + b * interval
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            batch = []
+            for i in range(batch_size):
+                device_id = device_ids[(b * batch_size + i) % devices]
+                batch.append(synthetic_payload(device_id, next_timestamp(last_ts, device_id), rng))
+            pool.submit(post, batch)
+    send_done = time.time()
+
+    samples = wait_for_drain(stats_client, stored_count(before) + accepted[0],
+                             timeout=max(30, duration * 3))
+    end = time.time()
+    after = samples[-1] if samples else before
+
+    stored = stored_count(after) - stored_count(before)
+    return {
+        'offered_rate': rate,
+        'sent': n_batches * batch_size,
+        'accepted': accepted[0],
+        'dropped': after['dropped'] - before['dropped'],
+        'send_s': round(send_done - start, 3),
+        'drain_s': round(end - send_done, 3),
+        'achieved_per_s': round(stored / (end - start), 1),
+        'max_queue_depth': max((s['queue_depth'] for s in samples), default=0),
+        'max_lag_ms': round(max((s['last_lag_ms'] for s in samples), default=0.0), 1),
+        'max_spool_lag_ms': round(max((s.get('spool_lag_ms', 0.0) for s in samples), default=0.0), 1),
+        'post_latency': latency_summary(post_latencies)
+    }
+
+
+def run_query_benchmarks(port, history_days, repeats):
+    """Latency of history and analytics queries over increasing windows"""
+    client = HTTPClient(port, timeout=300)
+    results = {}
+    for days in history_days:
+        hours = int(days * 24)
+        for name, path in (('history', f'/api/sensors/history/{HISTORY_DEVICE}?hours={hours}'),
+                           ('summary', f'/api/analytics/summary/{HISTORY_DEVICE}?hours={hours}')):
+            client.get(path)  # Warm caches once
+            latencies = []
+            rows = None
+            for _ in range(repeats):
+                t0 = time.perf_counter()
+                status, body = client.get(path)
+                latencies.append((time.perf_counter() - t0) * 1000)
+                if status == 200:
+                    rows = len(body) if isinstance(body, list) else body.get('total_readings')
+            results.setdefault(name, {})[f'days_{days:g}'] = {**latency_summary(latencies), 'rows': rows}
+    return results
+
+
+def run_websocket_fanout(port, clients, messages, interval):
+    """Latency from POST /api/ingest to delivery on every connected WebSocket client"""
+    if not HAS_WEBSOCKETS:
+        print("  ⚠️  websockets not installed, skipping fan-out benchmark")
+        return None
+
+    latencies = []
+    lock = threading.Lock()
+    stop = threading.Event()
+    connected = threading.Barrier(clients + 1)
+
+    def listen():
+        with ws_connect(f'ws://127.0.0.1:{port}/ws', open_timeout=10) as ws:
+            ws.recv(timeout=10)  # Snapshot of latest readings sent on connect
+            connected.wait()
+            while not stop.is_set():
+                try:
+                    message = json.loads(ws.recv(timeout=0.5))
+                except TimeoutError:
+                    continue
+                sent_at = message.get('bench_sent_at') if isinstance(message, dict) else None
+                if sent_at:
+                    with lock:
+                        latencies.append((time.time() - sent_at) * 1000)
+
+    threads = [threading.Thread(target=listen, daemon=True) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    connected.wait(timeout=30)
+
+    client = HTTPClient(port)
+    rng = random.Random(7)
+    for i in range(messages):
+        payload = synthetic_payload('BENCH-WS-001', int(time.time() * 1000), rng)
+        payload['bench_sent_at'] = time.time()
+        client.post('/api/ingest', [payload])
+        time.sleep(interval)
+
+    deadline = time.time() + 10
+    while time.time() < deadline and len(latencies) < clients * messages:
+        time.sleep(0.1)
+    stop.set()
+    for t in threads:
+        t.join(timeout=2)
+
+    return {
+        'clients': clients,
+        'messages': messages,
+        'delivered': len(latencies),
+        'delivery_ratio': round(len(latencies) / (clients * messages), 4),
+        **latency_summary(latencies)
+    }
+
+
+def benchmark_target(name, database_url, args):
+    """Run every benchmark against one database target"""
+    print(f"\n{'=' * 70}\nTarget: {name} ({database_url.split('@')[-1]})\n{'=' * 70}")
+    server = APIServer(database_url)
+    server.start()
+    rng = random.Random(1)
+    result = {'memory': {}}
+
+    try:
+        result['memory']['boot_rss_mb'] = round(rss_mb(server.pid) or 0, 1)
+
+        print(f"\nSeeding {max(args.history_days):g} days of history...")
+        t0 = time.time()
+        rows = seed_history(database_url, max(args.history_days))
+        result['seed'] = {'rows': rows, 'seed_s': round(time.time() - t0, 2)}
+        print(f"  {rows:,} rows in {result['seed']['seed_s']}s")
+
+        print("\nIngest ramp:")
+        result['ingest'] = {}
+        last_ts = {}
+        for rate in args.rates:
+            step = run_ingest_step(server.port, rate, args.step_seconds, args.devices,
+                                   args.batch_size, args.workers, rng, last_ts)
+            result['ingest'][f'rate_{rate}'] = step
+            print(f"  offered {rate:>7,}/s → achieved {step['achieved_per_s']:>9,.1f}/s | "
+                  f"max queue {step['max_queue_depth']:>6,} | max lag {step['max_lag_ms']:>8,.1f} ms | "
+                  f"dropped {step['dropped']:,}")
+        result['memory']['after_ingest_rss_mb'] = round(rss_mb(server.pid) or 0, 1)
+
+        print("\nQuery latency:")
+        result['queries'] = run_query_benchmarks(server.port, args.history_days, args.repeats)
+        for query, windows in result['queries'].items():
+            for window, stats in windows.items():
+                print(f"  {query:<8} {window:<9} p50 {stats['p50_ms']:>9.1f} ms | "
+                      f"p95 {stats['p95_ms']:>9.1f} ms | rows {stats['rows']}")
+        result['memory']['after_queries_rss_mb'] = round(rss_mb(server.pid) or 0, 1)
+
+        print("\nWebSocket fan-out:")
+        fanout = run_websocket_fanout(server.port, args.ws_clients, args.ws_messages, args.ws_interval)
+        if fanout:
+            result['websocket'] = fanout
+            print(f"  {fanout['clients']} clients | delivered {fanout['delivery_ratio']:.1%} | "
+                  f"p50 {fanout['p50_ms']} ms | p95 {fanout['p95_ms']} ms")
+
+        end_rss = round(rss_mb(server.pid) or 0, 1)
+        result['memory']['end_rss_mb'] = end_rss
+        result['memory']['growth_mb'] = round(end_rss - result['memory']['boot_rss_mb'], 1)
+        print(f"\nMemory: {result['memory']['boot_rss_mb']} MB → {end_rss} MB")
+    finally:
+        server.stop()
+    return result
+
+
+def parse_list(cast):
+    return lambda value: [cast(v) for v in value.split(',') if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="End-to-end ingest and query benchmark for the Agronomia API",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--sqlite-path', default=None,
+                        help='SQLite database file (default: temporary file)')
+    parser.add_argument('--postgres-url', default=os.getenv('BENCH_POSTGRES_URL'),
+                        help='PostgreSQL URL for a scratch database (default: $BENCH_POSTGRES_URL)')
+    parser.add_argument('--rates', type=parse_list(int), default=[100, 500, 1000, 2000, 5000],
+                        help='Offered ingest rates in readings/s (default: 100,500,1000,2000,5000)')
+    parser.add_argument('--step-seconds', type=float, default=10,
+                        help='Duration of each ingest rate step (default: 10)')
+    parser.add_argument('--devices', type=int, default=100,
+                        help='Synthetic fleet size (default: 100)')
+    parser.add_argument('--batch-size', type=int, default=50,
+                        help='Payloads per ingest request (default: 50)')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='Concurrent ingest HTTP clients (default: 8)')
+    parser.add_argument('--history-days', type=parse_list(float), default=[1, 30, 365],
+                        help='Query windows in days (default: 1,30,365)')
+    parser.add_argument('--repeats', type=int, default=5,
+                        help='Timed repetitions per query (default: 5)')
+    parser.add_argument('--ws-clients', type=int, default=20,
+                        help='WebSocket clients for fan-out (default: 20)')
+    parser.add_argument('--ws-messages', type=int, default=50,
+                        help='Messages broadcast during fan-out (default: 50)')
+    parser.add_argument('--ws-interval', type=float, default=0.1,
+                        help='Seconds between fan-out messages (default: 0.1)')
+    parser.add_argument('--quick', action='store_true',
+                        help='Small smoke-test configuration')
+    parser.add_argument('--output', default=None,
+                        help='Write results to this JSON file')
+    parser.add_argument('--compare', default=None,
+                        help='Baseline results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Relative change counted as a regression (default: 0.10)')
+    args = parser.parse_args()
+
+    if args.quick:
+        args.rates = [100, 500]
+        args.step_seconds = 3
+        args.history_days = [1, 30]
+        args.repeats = 3
+        args.ws_clients = 5
+        args.ws_messages = 10
+
+    if not HAS_SQLALCHEMY:
+        print("✗ sqlalchemy not installed. Install with: pip install -r backend/api/requirements.txt")
+        sys.exit(1)
+
+    print("=" * 70)
+    print("AGRONOMIA BACKEND BENCHMARK")
+    print("=" * 70)
+
+    targets = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite_path = os.path.abspath(args.sqlite_path or os.path.join(tmp, 'bench.db'))
+        targets['sqlite'] = benchmark_target('sqlite', f'sqlite:///{sqlite_path}', args)
+
+    if args.postgres_url:
+        targets['postgres'] = benchmark_target('postgres', args.postgres_url, args)
+    else:
+        print("\n⚠️  No --postgres-url / BENCH_POSTGRES_URL given, skipping the postgres target")
+
+    results = {
+        'benchmark': 'backend',
+        'meta': {**environment_info(), 'config': {k: v for k, v in vars(args).items()
+                                                  if k not in ('output', 'compare', 'postgres_url')}},
+        'results': targets
+    }
+
+    if args.output:
+        write_results(args.output, results)
+
+    if args.compare:
+        baseline = load_results(args.compare)
+        rows = compare_results(baseline, results, args.threshold)
+        regressions = print_comparison(rows, baseline.get('meta'), results['meta'])
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
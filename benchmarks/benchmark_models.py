@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Inference benchmark for the Agronomia AI/ML models
+Loads IrrigationPredictor, NutrientOptimizer, HarvestPredictor and
+PlantRecognitionModel from their saved artifacts and measures, per model and
+thread count:
+
+  - artifact load time and resident memory added by the model
+  - single-item latency through predict()
+  - batched throughput through predict_batch() at several batch sizes
+
+Each (model, thread count) combination runs in a fresh subprocess so load
+time and memory are not skewed by models loaded earlier.
+
+Dependencies:
+    pip install -r ai-ml/training/requirements.txt
+
+Usage:
+    python benchmarks/benchmark_models.py                            # All models
+    python benchmarks/benchmark_models.py --models nutrient,harvest  # Subset
+    python benchmarks/benchmark_models.py --threads 1,4 --batch-sizes 1,32,256
+    python benchmarks/benchmark_models.py --compare baseline.json --output results.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+from common import (REPO_ROOT, environment_info, latency_summary, rss_mb, write_results,
+                    load_results, compare_results, print_comparison)
+
+TRAINING_DIR = os.path.join(REPO_ROOT, 'ai-ml', 'training')
+MODELS = ['irrigation', 'nutrient', 'harvest', 'plant']
+RESULT_PREFIX = 'BENCHMARK_RESULT '
+
+# Training scripts save into ai-ml/training/models/ (run from ai-ml/training);
+# the plant recognition model saves into ai-ml/models/plant_recognition/
+DEFAULT_ARTIFACTS = {
+    'irrigation': os.path.join(TRAINING_DIR, 'models', 'irrigation_model'),
+    'nutrient': os.path.join(TRAINING_DIR, 'models', 'nutrient_optimizer'),
+    'harvest': os.path.join(TRAINING_DIR, 'models', 'harvest_predictor'),
+    'plant': os.path.join(REPO_ROOT, 'ai-ml', 'models', 'plant_recognition'),
+}
+
+# File whose presence means the artifact set was saved
+ARTIFACT_MARKERS = {
+    'irrigation': '{path}.h5',
+    'nutrient': '{path}_action_model.pkl',
+    'harvest': '{path}_days_model.pkl',
+    'plant': '{path}/plant_recognition_metadata.json',
+}
+
+TRAIN_HINTS = {
+    'irrigation': 'cd ai-ml/training && python train_irrigation_model.py',
+    'nutrient': 'cd ai-ml/training && python train_nutrient_model.py',
+    'harvest': 'cd ai-ml/training && python train_harvest_model.py',
+    'plant': 'cd ai-ml/training && python train_plant_recognition_model.py',
+}
+
+
+# ----------------------------------------------------------------------------
+# Worker side: runs inside the per-configuration subprocess
+# ----------------------------------------------------------------------------
+
+def load_model(name, path, threads):
+    """Import and load one predictor from its saved artifacts"""
+    if TRAINING_DIR not in sys.path:
+        sys.path.insert(0, TRAINING_DIR)
+
+    if name in ('irrigation', 'plant'):
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(threads)
+
+    if name == 'irrigation':
+        from train_irrigation_model import IrrigationPredictor
+        model = IrrigationPredictor()
+        load = lambda: model.load_model(path)
+    elif name == 'nutrient':
+        from train_nutrient_model import NutrientOptimizer
+        model = NutrientOptimizer()
+        load = lambda: model.load_models(path)
+    elif name == 'harvest':
+        from train_harvest_model import HarvestPredictor
+        model = HarvestPredictor()
+        load = lambda: model.load_models(path)
+    else:
+        from train_plant_recognition_model import PlantRecognitionModel
+        model = PlantRecognitionModel()
+        load = lambda: model.load_model(path)
+
+    import_rss = rss_mb()
+    t0 = time.perf_counter()
+    # Loaders print progress; keep stdout clean for the result line
+    with contextlib.redirect_stdout(sys.stderr):
+        load()
+    load_s = time.perf_counter() - t0
+
+    if name == 'nutrient':
+        # Random forests parallelise prediction across trees
+        model.action_model.set_params(n_jobs=threads)
+        model.amount_model.set_params(n_jobs=threads)
+
+    return model, load_s, import_rss
+
+
+def make_inputs(name, model, count, rng):
+    """Synthetic inputs in the format each predictor's predict() accepts"""
+    if name == 'irrigation':
+        return [[{
+            'temperature': rng.gauss(23, 2),
+            'humidity': rng.gauss(65, 5),
+            'light_intensity': 25000 if 6 <= hour <= 18 else 0,
+            'growth_stage': 2,
+            'time_of_day': hour,
+            'soil_moisture': rng.gauss(60, 5)
+        } for hour in range(model.sequence_length)] for _ in range(count)]
+
+    if name == 'nutrient':
+        plants = list(model.plant_encoder.classes_)
+        stages = list(model.stage_encoder.classes_)
+        return [{
+            'current_ec': rng.gauss(1800, 300),
+            'current_ph': rng.gauss(6.0, 0.5),
+            'plant_type': rng.choice(plants),
+            'growth_stage': rng.choice(stages),
+            'water_temp': rng.gauss(22, 2),
+            'days_since_transplant': rng.randint(1, 90),
+            'target_ec': rng.choice([1200, 1800, 2500])
+        } for _ in range(count)]
+
+    if name == 'harvest':
+        plants = list(model.plant_encoder.classes_)
+        return [{
+            'plant_type': rng.choice(plants),
+            'days_since_transplant': rng.randint(10, 80),
+            'avg_temperature': rng.gauss(23, 2),
+            'avg_light_hours': rng.gauss(14, 2),
+            'avg_humidity': rng.gauss(65, 5),
+            'avg_ec': rng.gauss(1500, 300),
+            'growth_rate': rng.gauss(0.5, 0.2),
+            'plant_height': rng.uniform(10, 120),
+            'leaf_count': rng.randint(4, 30)
+        } for _ in range(count)]
+
+    import numpy as np
+    images = np.random.default_rng(rng.randint(0, 2 ** 31)).integers(
+        0, 256, size=(count, model.img_size, model.img_size, 3))
+    return images.astype('float32')
+
+
+def time_batches(call, duration, min_iterations=3):
+    """Run call() repeatedly for about `duration` seconds; returns per-call ms"""
+    samples = []
+    start = time.perf_counter()
+    while len(samples) < min_iterations or time.perf_counter() - start < duration:
+        t0 = time.perf_counter()
+        call()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+
+def run_worker(args):
+    """Benchmark one model at one thread count and print the result as JSON"""
+    rng = random.Random(42)
+    baseline_rss = rss_mb()
+    model, load_s, import_rss = load_model(args.worker, args.artifact, args.worker_threads)
+    loaded_rss = rss_mb()
+
+    with contextlib.redirect_stdout(sys.stderr):
+        single_inputs = make_inputs(args.worker, model, 1, rng)
+        single_item = single_inputs[0]
+        for _ in range(3):
+            model.predict(single_item)
+        single = time_batches(lambda: model.predict(single_item),
+                              args.duration, min_iterations=args.single_iterations)
+
+        batches = {}
+        for batch_size in args.batch_sizes:
+            inputs = make_inputs(args.worker, model, batch_size, rng)
+            model.predict_batch(inputs)  # Warm-up
+            samples = time_batches(lambda: model.predict_batch(inputs), args.duration)
+            total_s = sum(samples) / 1000
+            batches[f'batch_{batch_size}'] = {
+                'items_per_s': round(batch_size * len(samples) / total_s, 1),
+                **latency_summary(samples)
+            }
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result = {
+        'load_s': round(load_s, 3),
+        'import_rss_mb': round(import_rss - baseline_rss, 1),
+        'model_rss_mb': round(loaded_rss - import_rss, 1),
+        'peak_rss_mb': round(peak_kb / 1024, 1),
+        'single': latency_summary(single),
+        'batched': batches
+    }
+    print(RESULT_PREFIX + json.dumps(result))
+
+
+# ----------------------------------------------------------------------------
+# Driver side
+# ----------------------------------------------------------------------------
+
+def run_configuration(name, artifact, threads, args):
+    """Launch a worker subprocess for one (model, threads) configuration"""
+    env = dict(os.environ)
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS'):
+        env[var] = str(threads)
+    env.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+
+    command = [sys.executable, os.path.abspath(__file__),
+               '--worker', name, '--artifact', artifact, '--worker-threads', str(threads),
+               '--batch-sizes', ','.join(str(b) for b in args.batch_sizes),
+               '--duration', str(args.duration),
+               '--single-iterations', str(args.single_iterations)]
+    process = subprocess.run(command, env=env, capture_output=True, text=True)
+    for line in process.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(process.stderr.strip().splitlines()[-1] if process.stderr.strip()
+                       else f"worker exited with status {process.returncode}")
+
+
+def print_report(results):
+    print(f"\n{'Model':<12} {'Thr':>3} {'Load s':>8} {'RSS MB':>8} {'1-item p50':>11} "
+          f"{'Batch':>7} {'items/s':>11} {'batch p50':>10}")
+    print("-" * 78)
+    for name, by_threads in results.items():
+        if 'skipped' in by_threads:
+            print(f"{name:<12} skipped: {by_threads['skipped']}")
+            continue
+        for threads_key, r in by_threads.items():
+            threads = threads_key.split('_')[1]
+            first = True
+            for batch_key, b in r['batched'].items():
+                prefix = (f"{name:<12} {threads:>3} {r['load_s']:>8.2f} {r['model_rss_mb']:>8.1f} "
+                          f"{r['single']['p50_ms']:>9.2f}ms") if first else " " * 47
+                print(f"{prefix} {batch_key.split('_')[1]:>7} {b['items_per_s']:>11,.1f} "
+                      f"{b['p50_ms']:>8.2f}ms")
+                first = False
+
+
+def parse_list(cast):
+    return lambda value: [cast(v) for v in value.split(',') if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Inference benchmark for the Agronomia AI/ML models",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--models', type=parse_list(str), default=MODELS,
+                        help='Models to benchmark (default: irrigation,nutrient,harvest,plant)')
+    for name in MODELS:
+        parser.add_argument(f'--{name}-path', default=DEFAULT_ARTIFACTS[name],
+                            help=f'Saved {name} artifacts (default: {os.path.relpath(DEFAULT_ARTIFACTS[name], REPO_ROOT)})')
+    parser.add_argument('--threads', type=parse_list(int), default=[1, 2, 4],
+                        help='Thread counts to test (default: 1,2,4)')
+    parser.add_argument('--batch-sizes', type=parse_list(int), default=[1, 8, 32, 128],
+                        help='Batch sizes for predict_batch (default: 1,8,32,128)')
+    parser.add_argument('--duration', type=float, default=2.0,
+                        help='Seconds spent timing each measurement (default: 2)')
+    parser.add_argument('--single-iterations', type=int, default=20,
+                        help='Minimum single-item predictions timed (default: 20)')
+    parser.add_argument('--output', default=None,
+                        help='Write results to this JSON file')
+    parser.add_argument('--compare', default=None,
+                        help='Baseline results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Relative change counted as a regression (default: 0.10)')
+    # Internal: run a single configuration inside a subprocess
+    parser.add_argument('--worker', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--artifact', default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--worker-threads', type=int, default=1, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    print("=" * 70)
+    print("AGRONOMIA MODEL INFERENCE BENCHMARK")
+    print("=" * 70)
+
+    results = {}
+    for name in args.models:
+        artifact = getattr(args, f'{name}_path')
+        if not os.path.exists(ARTIFACT_MARKERS[name].format(path=artifact)):
+            results[name] = {'skipped': f"no artifacts at {artifact} (train with: {TRAIN_HINTS[name]})"}
+            print(f"\n⚠️  {name}: {results[name]['skipped']}")
+            continue
+
+        results[name] = {}
+        for threads in args.threads:
+            print(f"\nBenchmarking {name} with {threads} thread(s)...")
+            try:
+                results[name][f'threads_{threads}'] = run_configuration(name, artifact, threads, args)
+            except RuntimeError as e:
+                print(f"  ✗ {e}")
+                results[name] = {'skipped': str(e)}
+                break
+
+    print_report(results)
+
+    output = {
+        'benchmark': 'models',
+        'meta': {**environment_info(), 'config': {
+            'threads': args.threads, 'batch_sizes': args.batch_sizes, 'duration': args.duration}},
+        'results': results
+    }
+
+    if args.output:
+        write_results(args.output, output)
+
+    if args.compare:
+        baseline = load_results(args.compare)
+        rows = compare_results(baseline, output, args.threshold)
+        regressions = print_comparison(rows, baseline.get('meta'), output['meta'])
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
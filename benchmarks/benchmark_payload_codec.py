@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+MQTT payload encoding benchmark
+Compares the firmware's JSON messages with the compact binary frames of
+backend/api/payload_codec.py on the two costs that matter for a greenhouse
+fleet: bytes on the (often weak) Wi-Fi link and server CPU spent decoding in
+the MQTT callback.
+
+Payloads are generated in the firmware shape (all sensor channels plus the
+status block, serialized without whitespace like ArduinoJson does), and each
+encoding is decoded with the function the backend uses for it.
+
+Only the standard library is needed.
+
+Usage:
+    python benchmarks/benchmark_payload_codec.py
+    python benchmarks/benchmark_payload_codec.py --messages 200000 --output codec.json
+    python benchmarks/benchmark_payload_codec.py --compare baseline.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from common import (REPO_ROOT, environment_info, write_results, load_results,
+                    compare_results, print_comparison)
+
+sys.path.insert(0, os.path.join(REPO_ROOT, 'backend', 'api'))
+from payload_codec import decode_payload, encode_payload  # noqa: E402
+
+
+def firmware_payload(device_id, ts_ms, rng):
+    """One reading as published by firmware/esp32/agronomia_esp32.ino"""
+    return {
+        'device_id': device_id,
+        'timestamp': ts_ms,
+        'sensors': {
+            'ph': round(rng.gauss(6.0, 0.3), 2),
+            'water_temp': round(rng.gauss(22, 1.5), 1),
+            'air_temp': round(rng.gauss(24, 2), 1),
+            'humidity': round(rng.gauss(65, 5), 1),
+            'ec': round(rng.gauss(1800, 200)),
+            'tds': round(rng.gauss(900, 100)),
+            'lux': max(0, int(rng.gauss(20000, 5000))),
+            'full_spectrum': rng.randint(1000, 50000),
+            'infrared': rng.randint(100, 10000),
+            'visible': rng.randint(1000, 40000)
+        },
+        'status': {
+            'wifi_rssi': rng.randint(-80, -40),
+            'uptime': rng.randint(0, 10 ** 6)
+        }
+    }
+
+
+def time_decode(decode, messages, repeats):
+    """Best-of-N decode throughput in messages per second"""
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for message in messages:
+            decode(message)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(messages) / best
+
+
+def time_encode(encode, payloads, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for payload in payloads:
+            encode(payload)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(payloads) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="MQTT payload encoding benchmark",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--messages', type=int, default=50000,
+                        help='Payloads encoded and decoded per run (default: 50000)')
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='Timed runs per encoding, best is kept (default: 3)')
+    parser.add_argument('--interval', type=float, default=10,
+                        help='Device publish interval in seconds, for daily traffic (default: 10)')
+    parser.add_argument('--output', default=None,
+                        help='Write results to this JSON file')
+    parser.add_argument('--compare', default=None,
+                        help='Baseline results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Relative change counted as a regression (default: 0.10)')
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("AGRONOMIA PAYLOAD ENCODING BENCHMARK")
+    print("=" * 70)
+
+    rng = random.Random(42)
+    now_ms = int(time.time() * 1000)
+    payloads = [firmware_payload(f'ESP32-GROW-{i % 50:03d}', now_ms + i, rng) for i in range(args.messages)]
+
+    encoders = {
+        'json': lambda payload: json.dumps(payload, separators=(',', ':')).encode(),
+        'binary': encode_payload
+    }
+    # What on_mqtt_message ran before the binary format, and what it runs now
+    decoders = {
+        'json': lambda message: json.loads(message.decode()),
+        'binary': decode_payload
+    }
+
+    results = {}
+    messages_per_day = 86400 / args.interval
+    for name, encode in encoders.items():
+        messages = [encode(payload) for payload in payloads]
+        mean_bytes = sum(len(m) for m in messages) / len(messages)
+        assert decoders[name](messages[0]) == payloads[0]
+
+        results[name] = {
+            'mean_bytes': round(mean_bytes, 1),
+            'device_day_kb': round(mean_bytes * messages_per_day / 1024, 1),
+            'encode_per_s': round(time_encode(encode, payloads, args.repeats), 1),
+            'decode_per_s': round(time_decode(decoders[name], messages, args.repeats), 1)
+        }
+        print(f"\n▶ {name}")
+        print(f"  Size:   {mean_bytes:,.1f} bytes/message, "
+              f"{results[name]['device_day_kb']:,.1f} KB/device/day at {args.interval:g}s")
+        print(f"  Encode: {results[name]['encode_per_s']:>12,.0f} messages/s")
+        print(f"  Decode: {results[name]['decode_per_s']:>12,.0f} messages/s")
+
+    json_result, binary_result = results['json'], results['binary']
+    print(f"\nBinary is {binary_result['mean_bytes'] / json_result['mean_bytes']:.0%} of the JSON size "
+          f"and decodes {binary_result['decode_per_s'] / json_result['decode_per_s']:.1f}x as fast")
+
+    output = {
+        'benchmark': 'payload_codec',
+        'meta': {**environment_info(),
+                 'config': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')}},
+        'results': results
+    }
+
+    if args.output:
+        write_results(args.output, output)
+
+    if args.compare:
+        baseline = load_results(args.compare)
+        rows = compare_results(baseline, output, args.threshold)
+        regressions = print_comparison(rows, baseline.get('meta'), output['meta'])
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+SQLite edge-mode storage benchmark
+Replays the API's SQLite write pattern on a single machine (the target is a
+Raspberry Pi running a small greenhouse) and compares storage configurations:
+
+  - legacy:       rollback journal, synchronous=FULL, one commit per reading
+                  (the API before edge mode)
+  - wal_per_row:  WAL, synchronous=NORMAL, one commit per reading
+  - edge:         WAL, synchronous=NORMAL, mmap, one writer committing
+                  batches of readings (group commit), as in backend/api/database.py
+
+Each configuration seeds the same history, then writes readings as fast as
+possible while reader threads run the /api/sensors/history query. Reported:
+write throughput, commit latency, read latency and throughput, lock errors,
+file sizes, and the cost of a checkpoint plus incremental vacuum.
+
+Only the standard library is needed.
+
+Usage:
+    python benchmarks/benchmark_sqlite_edge.py
+    python benchmarks/benchmark_sqlite_edge.py --quick
+    python benchmarks/benchmark_sqlite_edge.py --modes legacy,edge --rows 50000 --output edge.json
+    python benchmarks/benchmark_sqlite_edge.py --compare baseline.json
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from common import (environment_info, latency_summary, write_results, load_results,
+                    compare_results, print_comparison)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sensor_readings (
+    id INTEGER PRIMARY KEY,
+    device_id VARCHAR,
+    timestamp DATETIME,
+    ph FLOAT, water_temp FLOAT, air_temp FLOAT, humidity FLOAT,
+    ec FLOAT, tds FLOAT, lux INTEGER, full_spectrum INTEGER, infrared INTEGER, visible INTEGER
+);
+CREATE INDEX IF NOT EXISTS ix_sensor_readings_device_id ON sensor_readings (device_id);
+CREATE INDEX IF NOT EXISTS ix_sensor_readings_timestamp ON sensor_readings (timestamp);
+CREATE INDEX IF NOT EXISTS idx_sensor_readings_device_timestamp ON sensor_readings (device_id, timestamp);
+"""
+
+INSERT = ("INSERT INTO sensor_readings (device_id, timestamp, ph, water_temp, air_temp, humidity, "
+          "ec, tds, lux, full_spectrum, infrared, visible) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+
+HISTORY_QUERY = ("SELECT timestamp, ph, water_temp, air_temp, humidity, ec, tds, lux FROM sensor_readings "
+                 "WHERE device_id = ? AND timestamp >= ? ORDER BY timestamp DESC")
+
+MODES = {
+    'legacy': {
+        'pragmas': ['PRAGMA journal_mode=DELETE', 'PRAGMA synchronous=FULL'],
+        'batch': 1
+    },
+    'wal_per_row': {
+        'pragmas': ['PRAGMA journal_mode=WAL', 'PRAGMA synchronous=NORMAL'],
+        'batch': 1
+    },
+    'edge': {
+        'pragmas': ['PRAGMA auto_vacuum=INCREMENTAL', 'PRAGMA journal_mode=WAL', 'PRAGMA synchronous=NORMAL',
+                    f'PRAGMA mmap_size={256 * 1024 * 1024}', 'PRAGMA cache_size=-16384',
+                    'PRAGMA temp_store=MEMORY'],
+        'batch': None  # --batch-size
+    }
+}
+
+
+def connect(path, pragmas, busy_timeout_ms):
+    conn = sqlite3.connect(path, timeout=busy_timeout_ms / 1000, check_same_thread=False)
+    for pragma in pragmas:
+        conn.execute(pragma)
+    return conn
+
+
+def reading_row(device_id, ts):
+    return (device_id, ts.strftime('%Y-%m-%d %H:%M:%S.%f'),
+            round(random.gauss(6.0, 0.3), 2), round(random.gauss(22, 1), 1),
+            round(random.gauss(24, 2), 1), round(random.gauss(65, 5), 1),
+            round(random.gauss(1.8, 0.2), 2), round(random.gauss(900, 80), 0),
+            random.randint(5000, 30000), random.randint(1000, 50000),
+            random.randint(100, 10000), random.randint(1000, 40000))
+
+
+def seed_history(conn, devices, days, interval_s):
+    """One reading per device every interval_s over the last N days"""
+    now = datetime.utcnow()
+    steps = int(days * 86400 / interval_s)
+    rows = []
+    for step in range(steps):
+        ts = now - timedelta(seconds=(steps - step) * interval_s)
+        for device in devices:
+            rows.append(reading_row(device, ts))
+        if len(rows) >= 20000:
+            conn.executemany(INSERT, rows)
+            rows = []
+    if rows:
+        conn.executemany(INSERT, rows)
+    conn.commit()
+    return steps * len(devices)
+
+
+def file_mb(path):
+    return os.path.getsize(path) / (1024 * 1024) if os.path.exists(path) else 0.0
+
+
+def run_mode(name, args, tmp):
+    config = MODES[name]
+    batch_size = config['batch'] or args.batch_size
+    path = os.path.join(tmp, f'{name}.db')
+    devices = [f'EDGE-{i:03d}' for i in range(args.devices)]
+
+    print(f"\n▶ {name}: batch={batch_size}")
+    writer = connect(path, config['pragmas'], args.busy_timeout_ms)
+    writer.executescript(SCHEMA)
+    seeded = seed_history(writer, devices, args.seed_days, args.seed_interval)
+    print(f"  Seeded {seeded:,} readings")
+
+    stop = threading.Event()
+    read_latencies = []
+    read_errors = [0]
+    lock = threading.Lock()
+
+    def reader():
+        conn = connect(path, config['pragmas'], args.busy_timeout_ms)
+        local = []
+        errors = 0
+        while not stop.is_set():
+            since = (datetime.utcnow() - timedelta(hours=args.query_hours)).strftime('%Y-%m-%d %H:%M:%S.%f')
+            start = time.perf_counter()
+            try:
+                conn.execute(HISTORY_QUERY, (random.choice(devices), since)).fetchall()
+                local.append((time.perf_counter() - start) * 1000)
+            except sqlite3.OperationalError:
+                errors += 1
+        conn.close()
+        with lock:
+            read_latencies.extend(local)
+            read_errors[0] += errors
+
+    readers = [threading.Thread(target=reader, daemon=True) for _ in range(args.readers)]
+    for thread in readers:
+        thread.start()
+
+    commit_latencies = []
+    write_errors = 0
+    written = 0
+    start = time.perf_counter()
+    while written < args.rows:
+        now = datetime.utcnow()
+        rows = [reading_row(devices[(written + i) % len(devices)], now)
+                for i in range(min(batch_size, args.rows - written))]
+        t0 = time.perf_counter()
+        try:
+            writer.executemany(INSERT, rows)
+            writer.commit()
+            written += len(rows)
+        except sqlite3.OperationalError:
+            writer.rollback()
+            write_errors += 1
+        commit_latencies.append((time.perf_counter() - t0) * 1000)
+    write_elapsed = time.perf_counter() - start
+
+    stop.set()
+    for thread in readers:
+        thread.join()
+
+    wal_mb = file_mb(path + '-wal')
+    db_mb = file_mb(path)
+
+    # Maintenance: drop the oldest half of the seeded history, then checkpoint and vacuum
+    cutoff = (datetime.utcnow() - timedelta(days=args.seed_days / 2)).strftime('%Y-%m-%d %H:%M:%S.%f')
+    writer.execute("DELETE FROM sensor_readings WHERE timestamp < ?", (cutoff,))
+    writer.commit()
+    t0 = time.perf_counter()
+    if name == 'edge':
+        writer.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        writer.executescript("PRAGMA incremental_vacuum;")
+    maintenance_ms = (time.perf_counter() - t0) * 1000
+    writer.close()
+
+    result = {
+        'batch_size': batch_size,
+        'write': {
+            'rows_per_s': round(written / write_elapsed, 1),
+            'commit': latency_summary(commit_latencies),
+            'lock_errors': write_errors
+        },
+        'read': {
+            'queries_per_s': round(len(read_latencies) / write_elapsed, 1),
+            'latency': latency_summary(read_latencies),
+            'lock_errors': read_errors[0]
+        },
+        'files': {
+            'db_mb': round(db_mb, 2),
+            'wal_mb': round(wal_mb, 2),
+            'after_maintenance_db_mb': round(file_mb(path), 2)
+        },
+        'maintenance_ms': round(maintenance_ms, 2)
+    }
+    print(f"  Writes: {result['write']['rows_per_s']:,.0f} rows/s, "
+          f"commit p95 {result['write']['commit']['p95_ms']} ms, {write_errors} lock errors")
+    print(f"  Reads:  {result['read']['queries_per_s']:,.1f} queries/s, "
+          f"p95 {result['read']['latency']['p95_ms']} ms, {read_errors[0]} lock errors")
+    print(f"  Files:  db {db_mb:.1f} MB, wal {wal_mb:.1f} MB, "
+          f"after cleanup {result['files']['after_maintenance_db_mb']:.1f} MB")
+    return result
+
+
+def parse_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="SQLite edge-mode storage benchmark",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--modes', type=parse_list, default=list(MODES),
+                        help=f"Configurations to run (default: {','.join(MODES)})")
+    parser.add_argument('--devices', type=int, default=20,
+                        help='Devices in the greenhouse (default: 20)')
+    parser.add_argument('--seed-days', type=float, default=30,
+                        help='Days of history seeded before writing (default: 30)')
+    parser.add_argument('--seed-interval', type=float, default=60,
+                        help='Seconds between seeded readings per device (default: 60)')
+    parser.add_argument('--rows', type=int, default=20000,
+                        help='Readings written during the timed phase (default: 20000)')
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help='Readings per commit in edge mode, as INGEST_BATCH_SIZE (default: 500)')
+    parser.add_argument('--readers', type=int, default=2,
+                        help='Concurrent history-query threads (default: 2)')
+    parser.add_argument('--query-hours', type=float, default=24,
+                        help='History window queried by readers (default: 24)')
+    parser.add_argument('--busy-timeout-ms', type=int, default=5000,
+                        help='SQLite busy timeout (default: 5000)')
+    parser.add_argument('--db-dir', default=None,
+                        help='Directory for the database files, e.g. the SD card (default: temp dir)')
+    parser.add_argument('--quick', action='store_true',
+                        help='Small smoke-test configuration')
+    parser.add_argument('--output', default=None,
+                        help='Write results to this JSON file')
+    parser.add_argument('--compare', default=None,
+                        help='Baseline results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='Relative change counted as a regression (default: 0.10)')
+    args = parser.parse_args()
+
+    if args.quick:
+        args.seed_days = 2
+        args.rows = 3000
+
+    unknown = set(args.modes) - set(MODES)
+    if unknown:
+        parser.error(f"Unknown modes: {', '.join(sorted(unknown))}")
+
+    print("=" * 70)
+    print("AGRONOMIA SQLITE EDGE-MODE BENCHMARK")
+    print("=" * 70)
+    print(f"SQLite {sqlite3.sqlite_version}, {args.devices} devices, {args.readers} readers")
+
+    random.seed(42)
+    with tempfile.TemporaryDirectory(dir=args.db_dir) as tmp:
+        modes = {name: run_mode(name, args, tmp) for name in args.modes}
+
+    results = {
+        'benchmark': 'sqlite_edge',
+        'meta': {**environment_info(), 'sqlite': sqlite3.sqlite_version,
+                 'config': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')}},
+        'results': modes
+    }
+
+    if args.output:
+        write_results(args.output, results)
+
+    if args.compare:
+        baseline = load_results(args.compare)
+        rows = compare_results(baseline, results, args.threshold)
+        regressions = print_comparison(rows, baseline.get('meta'), results['meta'])
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Shared helpers for the Agronomia benchmark scripts
+Result files, environment metadata, percentiles, RSS sampling and the
+regression comparison used by --compare.
+"""
+
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Metric name suffix -> whether larger values are better
+HIGHER_IS_BETTER = ('_per_s', '_rps')
+LOWER_IS_BETTER = ('_ms', '_mb', '_s', '_bytes', '_kb')
+
+
+def git_revision():
+    """Current commit hash (with -dirty suffix), or None outside a git checkout"""
+    try:
+        rev = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                      cwd=REPO_ROOT, stderr=subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.call(['git', 'diff', '--quiet', 'HEAD'],
+                                cwd=REPO_ROOT, stderr=subprocess.DEVNULL) != 0
+        return rev + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment_info():
+    """Metadata recorded with every result file so runs can be compared fairly"""
+    return {
+        'git_revision': git_revision(),
+        'created': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def percentile(values, pct):
+    """Linear-interpolated percentile of a list of numbers (pct in 0-100)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+def latency_summary(samples_ms):
+    """p50/p95/max summary of latency samples in milliseconds"""
+    return {
+        'count': len(samples_ms),
+        'p50_ms': round(percentile(samples_ms, 50), 3) if samples_ms else None,
+        'p95_ms': round(percentile(samples_ms, 95), 3) if samples_ms else None,
+        'max_ms': round(max(samples_ms), 3) if samples_ms else None
+    }
+
+
+def rss_mb(pid=None):
+    """Resident set size of a process in MB (Linux /proc, falling back to psutil)"""
+    pid = pid or os.getpid()
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss / (1024 * 1024)
+    except Exception:
+        return None
+
+
+def write_results(path, results):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"\nResults written to {path}")
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def flatten_metrics(tree, prefix=''):
+    """Flatten nested result dicts into {'a.b.c_ms': value} for numeric leaves"""
+    flat = {}
+    for key, value in tree.items():
+        name = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(value, dict):
+            flat.update(flatten_metrics(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def metric_direction(name):
+    """+1 if higher is better, -1 if lower is better, 0 if not comparable"""
+    leaf = name.rsplit('.', 1)[-1]
+    if leaf.endswith(HIGHER_IS_BETTER):
+        return 1
+    if leaf.endswith(LOWER_IS_BETTER):
+        return -1
+    return 0
+
+
+def compare_results(baseline, current, threshold=0.10):
+    """
+    Compare two result files metric by metric
+
+    Returns a list of (metric, baseline, current, change, status) rows where
+    change is the relative difference and status is 'regression',
+    'improvement' or 'ok' given the relative threshold.
+    """
+    base = flatten_metrics(baseline.get('results', {}))
+    cur = flatten_metrics(current.get('results', {}))
+
+    rows = []
+    for name in sorted(set(base) & set(cur)):
+        direction = metric_direction(name)
+        if direction == 0 or not base[name]:
+            continue
+        change = (cur[name] - base[name]) / abs(base[name])
+        if change * direction < -threshold:
+            status = 'regression'
+        elif change * direction > threshold:
+            status = 'improvement'
+        else:
+            status = 'ok'
+        rows.append((name, base[name], cur[name], change, status))
+    return rows
+
+
+def print_comparison(rows, baseline_meta=None, current_meta=None):
+    """Print a comparison table and return the number of regressions"""
+    if baseline_meta or current_meta:
+        print(f"\nBaseline: {(baseline_meta or {}).get('git_revision')}  "
+              f"Current: {(current_meta or {}).get('git_revision')}")
+    print(f"\n{'Metric':<60} {'Baseline':>12} {'Current':>12} {'Change':>9}")
+    print("-" * 96)
+    regressions = 0
+    for name, base, cur, change, status in rows:
+        marker = {'regression': '  ✗', 'improvement': '  ✓'}.get(status, '')
+        print(f"{name:<60} {base:>12.3f} {cur:>12.3f} {change:>+8.1%}{marker}")
+        regressions += status == 'regression'
+    print("-" * 96)
+    print(f"{regressions} regression(s) out of {len(rows)} compared metrics")
+    return regressions
@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+"""
+Replay recorded sensor datasets into the Agronomia pipeline
+Reproduces incidents and load-tests the backend with real recorded data
+(e.g. data/greenhouse_1_month.csv) instead of random simulated values.
+
+Dependencies:
+    pip install paho-mqtt requests  # For MQTT and HTTP modes
+    pip install pandas pyarrow      # For Parquet input files
+
+Usage:
+    python replay_data.py data/greenhouse_1_month.csv                  # MQTT, real time
+    python replay_data.py data/greenhouse_1_month.csv --speed 100      # 100x faster
+    python replay_data.py data/greenhouse_1_month.csv --speed max      # As fast as possible
+    python replay_data.py data/greenhouse_1_month.csv --mode http       # POST /api/ingest
+    python replay_data.py data/greenhouse_1_month.csv --mode direct     # In-process ingest queue
+    python replay_data.py data/greenhouse_1_month.csv --devices 50      # Fan out to 50 devices
+    python replay_data.py --help                                        # Show all options
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+from datetime import datetime, timezone
+
+try:
+    import requests
+    HAS_REQUESTS = True
+except ImportError:
+    HAS_REQUESTS = False
+
+try:
+    import pandas as pd
+    HAS_PANDAS = True
+except ImportError:
+    HAS_PANDAS = False
+
+BACKEND_API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend', 'api')
+
+# Recorded column name -> key inside the device payload "sensors" object.
+# Columns already using the device names (ph, water_temp, ...) pass through unchanged.
+COLUMN_MAP = {
+    'air_temp_c': 'air_temp',
+    'water_temp_c': 'water_temp',
+    'humidity_percent': 'humidity',
+    'ec_us_cm': 'ec',
+    'tds_ppm': 'tds',
+    'light_lux': 'lux',
+}
+
+# Columns that describe the record rather than a sensor value
+META_COLUMNS = {'timestamp', 'device_id', 'location', 'plant_type'}
+
+
+def parse_timestamp(value):
+    """Parse an ISO date string or epoch (seconds or milliseconds) into epoch seconds"""
+    if isinstance(value, datetime):
+        dt = value
+    else:
+        text = str(value).strip()
+        try:
+            number = float(text)
+            # Heuristic: anything past year 2286 in seconds is really milliseconds
+            return number / 1000 if number > 1e10 else number
+        except ValueError:
+            dt = datetime.fromisoformat(text)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def to_number(value):
+    """Convert a recorded cell to int/float, or None when empty"""
+    if value is None or value == '':
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    if number != number:  # NaN from Parquet/pandas
+        return None
+    return int(number) if number.is_integer() else number
+
+
+class RecordedDataset:
+    """Loads a recorded CSV or Parquet file as time-ordered device payloads"""
+
+    def __init__(self, path, device_filter=None):
+        self.path = path
+        self.device_filter = device_filter
+        self.rows = self._load_rows()
+        self.rows.sort(key=lambda row: row[0])
+
+    def _read_raw_rows(self):
+        if self.path.endswith('.parquet'):
+            if not HAS_PANDAS:
+                raise ImportError("pandas not installed. Install with: pip install pandas pyarrow")
+            return pd.read_parquet(self.path).to_dict('records')
+        with open(self.path, newline='') as f:
+            return list(csv.DictReader(f))
+
+    def _load_rows(self):
+        rows = []
+        for raw in self._read_raw_rows():
+            device_id = str(raw.get('device_id') or 'REPLAY-001')
+            if self.device_filter and device_id != self.device_filter:
+                continue
+
+            sensors = {}
+            for column, value in raw.items():
+                if column in META_COLUMNS:
+                    continue
+                number = to_number(value)
+                if number is not None:
+                    sensors[COLUMN_MAP.get(column, column)] = number
+
+            rows.append((parse_timestamp(raw['timestamp']), device_id, sensors))
+        return rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def duration(self):
+        """Recorded time span in seconds"""
+        if not self.rows:
+            return 0
+        return self.rows[-1][0] - self.rows[0][0]
+
+    @property
+    def devices(self):
+        return sorted({device_id for _, device_id, _ in self.rows})
+
+
+class ReplayPlanner:
+    """Turns recorded rows into paced, fanned-out device payloads"""
+
+    def __init__(self, dataset, speed=1.0, virtual_devices=1, retime=False):
+        self.dataset = dataset
+        self.speed = speed  # None = as fast as possible
+        self.virtual_devices = virtual_devices
+        self.retime = retime
+
+    def virtual_ids(self, device_id):
+        if self.virtual_devices <= 1:
+            return [device_id]
+        return [f"{device_id}-V{i:03d}" for i in range(1, self.virtual_devices + 1)]
+
+    def batches(self):
+        """
+        Yield (due_offset_seconds, payloads) groups sharing one recorded timestamp
+
+        due_offset is relative to the start of the replay in wall-clock time,
+        or None when replaying as fast as possible.
+        """
+        if not self.dataset.rows:
+            return
+        t0 = self.dataset.rows[0][0]
+        # Retimed replays land the first record at "now" and keep recorded spacing
+        shift = (time.time() - t0) if self.retime else 0
+
+        group, group_ts = [], None
+        for ts, device_id, sensors in self.dataset.rows:
+            if group and ts != group_ts:
+                yield self._due(group_ts, t0), group
+                group = []
+            group_ts = ts
+            for virtual_id in self.virtual_ids(device_id):
+                group.append({
+                    'device_id': virtual_id,
+                    'timestamp': int((ts + shift) * 1000),
+                    'sensors': dict(sensors)
+                })
+        if group:
+            yield self._due(group_ts, t0), group
+
+    def _due(self, ts, t0):
+        if self.speed is None:
+            return None
+        return (ts - t0) / self.speed
+
+
+class MQTTSink:
+    """Publishes payloads to the device data topics via MQTT"""
+
+    name = 'mqtt'
+
+    def __init__(self, broker, port):
+        from simulate_data import MQTTSimulator
+        self.publisher = MQTTSimulator(broker=broker, port=port)
+        if not self.publisher.connect():
+            raise ConnectionError(f"Could not connect to MQTT broker at {broker}:{port}")
+
+    def publish(self, payloads):
+        return sum(1 for payload in payloads if self.publisher.publish(payload['device_id'], payload))
+
+    def close(self):
+        self.publisher.disconnect()
+
+
+class HTTPSink:
+    """Posts payloads to the backend HTTP ingest endpoint in batches"""
+
+    name = 'http'
+
+    def __init__(self, api_url, batch_size=100):
+        if not HAS_REQUESTS:
+            raise ImportError("requests not installed. Install with: pip install requests")
+        self.endpoint = f"{api_url.rstrip('/')}/api/ingest"
+        self.batch_size = batch_size
+        self.session = requests.Session()
+
+    def publish(self, payloads):
+        sent = 0
+        for i in range(0, len(payloads), self.batch_size):
+            chunk = payloads[i:i + self.batch_size]
+            try:
+                response = self.session.post(self.endpoint, json=chunk, timeout=10)
+                if response.status_code in (200, 202):
+                    sent += response.json().get('accepted', len(chunk))
+                else:
+                    print(f"✗ API returned status {response.status_code}")
+            except requests.exceptions.RequestException as e:
+                print(f"✗ HTTP request failed: {e}")
+        return sent
+
+    def close(self):
+        self.session.close()
+
+
+class DirectSink:
+    """
+    Feeds payloads straight into the backend ingest queue in-process
+
+    Runs the backend ingest pipeline (worker and spool drainer) on its own
+    event loop thread, the same way the API drains readings queued by the MQTT
+    thread. Uses DATABASE_URL and INGEST_SPOOL_DIR from the environment like
+    the API does.
+    """
+
+    name = 'direct'
+
+    def __init__(self):
+        if BACKEND_API_DIR not in sys.path:
+            sys.path.insert(0, BACKEND_API_DIR)
+        import main as backend
+        self.backend = backend
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run_loop, daemon=True)
+        self.thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.backend.init_db())
+        self.loop.run_until_complete(self.backend.start_ingest())
+        self.loop.run_forever()
+
+    def publish(self, payloads):
+        sent = 0
+        for payload in payloads:
+            # Apply backpressure instead of letting the bounded queue drop readings
+            while self.backend.ingest_queue.full():
+                time.sleep(0.001)
+            if self.backend.enqueue_reading(payload):
+                sent += 1
+        return sent
+
+    async def _stop_pipeline(self):
+        # Persists anything still spooled before closing the database
+        await self.backend.stop_ingest()
+        await self.backend.close_db()
+
+    def stats(self):
+        return {**self.backend.ingest_stats, 'queue_depth': self.backend.ingest_queue.qsize()}
+
+    def close(self, timeout=60):
+        """Wait for the queue to drain, then stop the pipeline and its loop"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            stats = self.stats()
+            if stats['processed'] + stats['dropped'] >= stats['received']:
+                break
+            time.sleep(0.05)
+        asyncio.run_coroutine_threadsafe(self._stop_pipeline(), self.loop).result(timeout=timeout)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+
+
+class ThroughputMonitor:
+    """Tracks replay send rate and backend ingest throughput and lag"""
+
+    def __init__(self, stats_source=None, interval=5.0):
+        self.stats_source = stats_source
+        self.interval = interval
+        self.start = time.time()
+        self.sent = 0
+        self.samples = []
+        self._last_report = self.start
+        self._last_sent = 0
+        self._last_processed = None
+
+    def fetch_backend_stats(self):
+        if self.stats_source is None:
+            return None
+        try:
+            return self.stats_source()
+        except Exception as e:
+            print(f"✗ Could not read backend ingest stats ({e}); disabling lag reporting")
+            self.stats_source = None
+            return None
+
+    def record_sent(self, count):
+        self.sent += count
+        now = time.time()
+        if now - self._last_report >= self.interval:
+            self.report(now)
+
+    def report(self, now=None):
+        now = now or time.time()
+        elapsed = max(now - self._last_report, 1e-9)
+        send_rate = (self.sent - self._last_sent) / elapsed
+        line = f"[{datetime.now().strftime('%H:%M:%S')}] sent {self.sent:,} ({send_rate:,.0f} msg/s)"
+
+        sample = {'elapsed_s': round(now - self.start, 2), 'sent': self.sent, 'send_rate': round(send_rate, 1)}
+        stats = self.fetch_backend_stats()
+        if stats:
+            processed = stats.get('processed', 0)
+            ingest_rate = 0.0
+            if self._last_processed is not None:
+                ingest_rate = (processed - self._last_processed) / elapsed
+            self._last_processed = processed
+            sample.update({
+                'processed': processed,
+                'ingest_rate': round(ingest_rate, 1),
+                'queue_depth': stats.get('queue_depth', 0),
+                'dropped': stats.get('dropped', 0),
+                'lag_ms': round(stats.get('last_lag_ms', 0.0), 1)
+            })
+            line += (f" | backend {ingest_rate:,.0f} msg/s | queue {sample['queue_depth']:,}"
+                     f" | lag {sample['lag_ms']:,.0f} ms | dropped {sample['dropped']:,}")
+
+        self.samples.append(sample)
+        print(line)
+        self._last_report = now
+        self._last_sent = self.sent
+
+    def summary(self):
+        duration = time.time() - self.start
+        result = {
+            'sent': self.sent,
+            'duration_s': round(duration, 2),
+            'avg_send_rate': round(self.sent / duration, 1) if duration else 0.0,
+            'samples': self.samples
+        }
+        ingest_rates = [s['ingest_rate'] for s in self.samples if s.get('ingest_rate')]
+        lags = [s['lag_ms'] for s in self.samples if 'lag_ms' in s]
+        if ingest_rates:
+            result['peak_ingest_rate'] = max(ingest_rates)
+        if lags:
+            result['max_lag_ms'] = max(lags)
+        return result
+
+
+def http_stats_source(api_url):
+    """Build a callable reading /api/ingest/stats from a running API"""
+    url = f"{api_url.rstrip('/')}/api/ingest/stats"
+
+    def fetch():
+        with urllib.request.urlopen(url, timeout=2) as response:
+            return json.loads(response.read().decode())
+    return fetch
+
+
+def parse_speed(value):
+    """argparse type for --speed: a multiplier, or 'max' for no pacing"""
+    if value.lower() in ('max', 'inf', '0'):
+        return None
+    speed = float(value)
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("speed must be positive or 'max'")
+    return speed
+
+
+def run_replay(planner, sink, monitor, max_batch=500):
+    """Publish planned batches, sleeping so each lands at its due time"""
+    start = time.time()
+    pending = []
+    for due, payloads in planner.batches():
+        if due is None:
+            # Unpaced replay: coalesce small groups so sinks can batch their writes
+            pending.extend(payloads)
+            if len(pending) >= max_batch:
+                monitor.record_sent(sink.publish(pending))
+                pending = []
+            continue
+        delay = start + due - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        monitor.record_sent(sink.publish(payloads))
+    if pending:
+        monitor.record_sent(sink.publish(pending))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay recorded sensor data into Agronomia",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python replay_data.py data/greenhouse_1_month.csv --speed 100
+  python replay_data.py data/greenhouse_1_month.csv --speed max --mode http
+  python replay_data.py data/greenhouse_1_month.csv --mode direct --devices 200
+  python replay_data.py recording.parquet --device GREENHOUSE-MAIN-01 --retime
+        """
+    )
+
+    parser.add_argument('file', help='Recorded CSV or Parquet file')
+    parser.add_argument('--mode', choices=['mqtt', 'http', 'direct'], default='mqtt',
+                        help='Where to send readings (default: mqtt)')
+    parser.add_argument('--speed', type=parse_speed, default=1.0,
+                        help="Replay speed multiplier, or 'max' (default: 1)")
+    parser.add_argument('--devices', type=int, default=1,
+                        help='Virtual devices to fan each recorded device out to (default: 1)')
+    parser.add_argument('--device', default=None,
+                        help='Only replay this recorded device ID')
+    parser.add_argument('--retime', action='store_true',
+                        help='Shift timestamps so the first record is "now"')
+    parser.add_argument('--broker', default='localhost',
+                        help='MQTT broker address (default: localhost)')
+    parser.add_argument('--port', type=int, default=1883,
+                        help='MQTT broker port (default: 1883)')
+    parser.add_argument('--api-url', default='http://localhost:8000',
+                        help='HTTP API URL for http mode and stats (default: http://localhost:8000)')
+    parser.add_argument('--http-batch', type=int, default=100,
+                        help='Payloads per HTTP ingest request (default: 100)')
+    parser.add_argument('--no-stats', action='store_true',
+                        help='Do not poll backend ingest stats')
+    parser.add_argument('--report-interval', type=float, default=5.0,
+                        help='Seconds between progress reports (default: 5)')
+    parser.add_argument('--output', default=None,
+                        help='Write the throughput summary to this JSON file')
+
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("AGRONOMIA DATA REPLAY")
+    print("=" * 70)
+
+    dataset = RecordedDataset(args.file, device_filter=args.device)
+    if not len(dataset):
+        print(f"\n✗ No records to replay in {args.file}")
+        sys.exit(1)
+
+    planner = ReplayPlanner(dataset, speed=args.speed,
+                            virtual_devices=args.devices, retime=args.retime)
+
+    speed_label = 'max' if args.speed is None else f"{args.speed:g}x"
+    print(f"\nFile: {args.file}")
+    print(f"Records: {len(dataset):,} over {dataset.duration / 3600:.1f} h")
+    print(f"Devices: {', '.join(dataset.devices)} (x{args.devices} virtual)")
+    print(f"Mode: {args.mode.upper()}")
+    print(f"Speed: {speed_label}")
+
+    try:
+        if args.mode == 'mqtt':
+            sink = MQTTSink(args.broker, args.port)
+        elif args.mode == 'http':
+            sink = HTTPSink(args.api_url, batch_size=args.http_batch)
+        else:
+            sink = DirectSink()
+    except (ImportError, ConnectionError) as e:
+        print(f"\n✗ {e}")
+        sys.exit(1)
+
+    stats_source = None
+    if not args.no_stats:
+        stats_source = sink.stats if args.mode == 'direct' else http_stats_source(args.api_url)
+    monitor = ThroughputMonitor(stats_source, interval=args.report_interval)
+
+    print("\n" + "=" * 70)
+    print("Replay running... Press Ctrl+C to stop")
+    print("=" * 70 + "\n")
+
+    try:
+        run_replay(planner, sink, monitor)
+    except KeyboardInterrupt:
+        print("\nReplay interrupted")
+    finally:
+        sink.close()
+        monitor.report()
+
+    summary = monitor.summary()
+    print("\n" + "=" * 70)
+    print(f"Replay finished. Sent {summary['sent']:,} readings in {summary['duration_s']:.1f}s "
+          f"({summary['avg_send_rate']:,.0f} msg/s)")
+    if 'peak_ingest_rate' in summary:
+        print(f"Peak backend ingest: {summary['peak_ingest_rate']:,.0f} msg/s")
+    if 'max_lag_ms' in summary:
+        print(f"Max ingest lag: {summary['max_lag_ms']:,.0f} ms")
+    print("=" * 70)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"Summary written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,16 +9,40 @@ Dependencies:
 Usage:
     python simulate_data.py              # MQTT simulation
     python simulate_data.py --mode http  # HTTP API simulation
+    python simulate_data.py --format binary  # Compact binary MQTT payloads
     python simulate_data.py --help       # Show all options
 """
 
 import json
+import os
 import time
 import random
 import argparse
 from datetime import datetime
 import sys
 
+BACKEND_API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend', 'api')
+
+# Simulator sensor names -> field names of the firmware payload (binary format)
+FIRMWARE_SENSOR_FIELDS = {
+    "air_temp_c": "air_temp",
+    "water_temp_c": "water_temp",
+    "humidity_percent": "humidity",
+    "ph": "ph",
+    "ec_us_cm": "ec",
+    "tds_ppm": "tds",
+    "light_lux": "lux",
+    "par_umol": "par_umol",
+    "co2_ppm": "co2",
+    "water_level_cm": "water_level",
+    "flow_rate_lpm": "flow_rate"
+}
+FIRMWARE_STATUS_FIELDS = {
+    "battery_percent": "battery",
+    "wifi_rssi": "wifi_rssi",
+    "uptime_seconds": "uptime"
+}
+
 try:
     import requests
     HAS_REQUESTS = True
@@ -118,16 +142,33 @@ class SensorSimulator:
         }
 
 
+def to_firmware_payload(data):
+    """Simulator reading in the firmware payload shape (epoch ms timestamp, firmware field names)"""
+    return {
+        "device_id": data["device_id"],
+        "timestamp": int(datetime.fromisoformat(data["timestamp"]).timestamp() * 1000),
+        "sensors": {FIRMWARE_SENSOR_FIELDS[k]: v for k, v in data["sensors"].items()},
+        "status": {FIRMWARE_STATUS_FIELDS[k]: v for k, v in data["status"].items()}
+    }
+
+
 class MQTTSimulator:
     """Publishes simulated data via MQTT"""
     
-    def __init__(self, broker="localhost", port=1883, topic_prefix="agronomia"):
+    def __init__(self, broker="localhost", port=1883, topic_prefix="agronomia", payload_format="json"):
         if not HAS_MQTT:
             raise ImportError("paho-mqtt not installed. Install with: pip install paho-mqtt")
         
         self.broker = broker
         self.port = port
         self.topic_prefix = topic_prefix
+        self.encode = json.dumps
+        if payload_format == "binary":
+            # Same codec the backend decodes with
+            if BACKEND_API_DIR not in sys.path:
+                sys.path.insert(0, BACKEND_API_DIR)
+            from payload_codec import encode_payload
+            self.encode = lambda data: encode_payload(to_firmware_payload(data))
         self.client = mqtt.Client()
         self.connected = False
         
@@ -164,7 +205,7 @@ class MQTTSimulator:
     def publish(self, device_id, data):
         """Publish sensor data to MQTT topic"""
         topic = f"{self.topic_prefix}/devices/{device_id}/data"
-        payload = json.dumps(data)
+        payload = self.encode(data)
         
         result = self.client.publish(topic, payload, qos=1)
         if result.rc == mqtt.MQTT_ERR_SUCCESS:
@@ -221,6 +262,7 @@ Examples:
   python simulate_data.py --interval 5           # Publish every 5 seconds
   python simulate_data.py --broker 192.168.1.10  # Custom MQTT broker
   python simulate_data.py --device ESP32-GROW-01 # Custom device ID
+  python simulate_data.py --format binary        # Compact binary payloads (MQTT)
         """
     )
     
@@ -238,6 +280,8 @@ Examples:
                         help='MQTT broker port (default: 1883)')
     parser.add_argument('--api-url', default='http://localhost:8000',
                         help='HTTP API URL (default: http://localhost:8000)')
+    parser.add_argument('--format', choices=['json', 'binary'], default='json',
+                        help='MQTT payload encoding (default: json)')
     parser.add_argument('--count', type=int, default=0,
                         help='Number of messages to send (0 = infinite)')
     
@@ -258,7 +302,8 @@ Examples:
     publisher = None
     if args.mode == 'mqtt':
         print(f"MQTT Broker: {args.broker}:{args.port}")
-        publisher = MQTTSimulator(broker=args.broker, port=args.port)
+        print(f"Payload format: {args.format}")
+        publisher = MQTTSimulator(broker=args.broker, port=args.port, payload_format=args.format)
         if not publisher.connect():
             print("\n✗ Failed to connect to MQTT broker")
             print("  Make sure the MQTT broker is running:")